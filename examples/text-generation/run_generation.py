@@ -21,9 +21,9 @@ Conditional text generation on Habana Gaudi/Gaudi2.
 import argparse
 import json
 import logging
-import math
 import os
 import struct
+import time
 from itertools import cycle
 from pathlib import Path
 
@@ -33,6 +33,7 @@ from utils import (
     adjust_batch,
     count_hpu_graphs,
     finalize_quantization,
+    get_warmup_prompt_lengths,
     initialize_model,
     save_model,
 )
@@ -227,6 +228,20 @@ def setup_parser(parser):
             then we use `shape = prompt_length + max_new_tokens`. If a positive number is passed \
             we increase the bucket in steps of `bucket_size` instead of allocating to max (`prompt_length + max_new_tokens`).",
     )
+    parser.add_argument(
+        "--bucket_plan",
+        default="linear",
+        choices=["linear", "optimal", "quantile", "geometric"],
+        help="How to choose the buckets when `--bucket_size` > 0 and `--simulate_dyn_prompt` is used. `linear` grows in \
+            steps of `bucket_size`, the other strategies plan at most `--max_buckets` non-uniform buckets (multiples of \
+            `bucket_size`) from the histogram of the prompt lengths and `--max_new_tokens` to reduce padding.",
+    )
+    parser.add_argument(
+        "--max_buckets",
+        default=8,
+        type=int,
+        help="Maximum number of buckets, i.e. of compiled shapes, planned with `--bucket_plan`.",
+    )
     parser.add_argument(
         "--bucket_internal",
         action="store_true",
@@ -344,6 +359,30 @@ def setup_parser(parser):
         default="none",
         help="Run multi card with the specified parallel strategy. Choices are 'tp' for Tensor Parallel Strategy or 'ep' for Expert Parallel Strategy or 'none'.",
     )
+    parser.add_argument(
+        "--ep_dispatch",
+        type=str,
+        choices=["all_reduce", "all_to_all"],
+        default="all_reduce",
+        help="How MoE blocks exchange tokens with --parallel_strategy ep: 'all_reduce' computes every token on every rank and all-reduces the outputs, 'all_to_all' only sends every token to the ranks owning its experts.",
+    )
+    parser.add_argument(
+        "--moe_capacity_factor",
+        type=float,
+        default=2.0,
+        help="Capacity of the experts relative to a balanced routing with --ep_dispatch all_to_all, tokens beyond it are dropped.",
+    )
+    parser.add_argument(
+        "--moe_expert_load_stats",
+        action="store_true",
+        help="Whether to record and log the number of tokens routed to every expert of the MoE blocks.",
+    )
+    parser.add_argument(
+        "--moe_num_replicas_per_rank",
+        type=int,
+        default=0,
+        help="Number of the most loaded experts every rank replicates after the warmup with --ep_dispatch all_to_all, chosen from the expert load during the warmup.",
+    )
     parser.add_argument(
         "--input_embeds",
         action="store_true",
@@ -425,6 +464,100 @@ def setup_parser(parser):
         type=int,
         help="Specify the batch size split for attention and mlp layers. 1 for no split. This is enabled only for prompt.",
     )
+    parser.add_argument(
+        "--kv_cache_block_size",
+        default=None,
+        type=int,
+        help="Store the KV cache in a pool of blocks of this many tokens handed out on demand. Requires --reuse_cache.",
+    )
+    parser.add_argument(
+        "--kv_cache_num_blocks",
+        default=None,
+        type=int,
+        help="Maximum number of blocks in the paged KV cache pool. Defaults to a pool for the prompts and half of the new tokens, which grows when needed.",
+    )
+    parser.add_argument(
+        "--kv_cache_dtype",
+        default=None,
+        type=str,
+        choices=["int8", "fp8"],
+        help="Store the KV cache quantized to this dtype with its scales, which halves its memory. Requires --reuse_cache.",
+    )
+    parser.add_argument(
+        "--kv_cache_scale_granularity",
+        default="token",
+        type=str,
+        choices=["head", "token"],
+        help="Granularity of the scales of the quantized KV cache: one per head of every token or of every sequence.",
+    )
+    parser.add_argument(
+        "--kv_cache_window",
+        default=None,
+        type=int,
+        help="Only keep the KV cache of the last this many tokens in a ring buffer. Requires --reuse_cache.",
+    )
+    parser.add_argument(
+        "--kv_cache_sink_tokens",
+        default=0,
+        type=int,
+        help="Number of tokens at the start of the sequences always kept in the KV cache with --kv_cache_window.",
+    )
+    parser.add_argument(
+        "--use_prefix_cache",
+        action="store_true",
+        help="Keep the KV cache of prompt prefixes across generate calls and skip their prefill. Requires --reuse_cache.",
+    )
+    parser.add_argument(
+        "--prefix_cache_chunk_size",
+        default=128,
+        type=int,
+        help="Number of tokens per chunk of the prefix cache.",
+    )
+    parser.add_argument(
+        "--prefix_cache_max_memory_mb",
+        default=1024,
+        type=int,
+        help="Memory budget of the prefix cache in MiB, least recently used prefixes are evicted beyond it.",
+    )
+    parser.add_argument(
+        "--prefill_chunk_size",
+        default=None,
+        type=int,
+        help="Run the prompt through the model in chunks of this many tokens to bound memory. Requires --reuse_cache.",
+    )
+    parser.add_argument(
+        "--use_fused_sampler",
+        action="store_true",
+        help="Sample from the top-k logits only, with a Gumbel-max draw instead of a full-vocabulary softmax.",
+    )
+    parser.add_argument(
+        "--decode_steps_per_sync",
+        default=None,
+        type=int,
+        help="Number of decoding steps run before checking on the host whether all sequences are finished.",
+    )
+    parser.add_argument(
+        "--static_speculative_decoding",
+        action="store_true",
+        help="Run assisted generation in static shapes for the whole batch. Requires --assistant_model and --reuse_cache.",
+    )
+    parser.add_argument(
+        "--num_assistant_tokens",
+        default=None,
+        type=int,
+        help="Number of tokens drafted by the assistant model per round of assisted generation.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the output of the first sequence as it is generated, and report the time to first streamed text.",
+    )
+    parser.add_argument(
+        "--stream_sync_interval",
+        default=4,
+        type=int,
+        help="Number of decoding steps whose tokens are copied to the host together when streaming.",
+    )
     parser.add_argument(
         "--regional_compile",
         action="store_true",
@@ -501,6 +634,27 @@ def prepare_generation_embedding(model, model_name, input_tokens):
     return {"inputs_embeds": inputs_embeds, "attention_mask": attention_mask}
 
 
+def rebalance_moe_experts(args, model):
+    if args.moe_num_replicas_per_rank == 0 and not args.moe_expert_load_stats:
+        return
+    from optimum.habana.distributed.expert_parallel import get_expert_load_stats, rebalance_experts
+
+    if args.moe_num_replicas_per_rank > 0:
+        # Replicate the experts that were the most loaded during the warmup
+        rebalance_experts(model)
+    for expert_load_stats in get_expert_load_stats(model).values():
+        expert_load_stats.reset()
+
+
+def log_expert_load_stats(args, model):
+    if not args.moe_expert_load_stats:
+        return
+    from optimum.habana.distributed.expert_parallel import get_expert_load_stats
+
+    for name, expert_load_stats in get_expert_load_stats(model).items():
+        logger.info(f"Expert load stats of {name} = {expert_load_stats.to_dict()}")
+
+
 def main():
     parser = argparse.ArgumentParser()
     args = setup_parser(parser)
@@ -514,6 +668,7 @@ def main():
 
     import habana_frameworks.torch.hpu as torch_hpu
 
+    from optimum.habana.transformers.generation import GaudiTextIteratorStreamer
     from optimum.habana.utils import HabanaGenerationTime, HabanaProfile, get_hpu_memory_stats
 
     if args.sdp_on_bf16:
@@ -612,22 +767,14 @@ def main():
                     generate(input_sentences[0], dyn_prompt_lens[0], args.reduce_recompile, disable_profiling=True)
         else:
             if args.bucket_size > 0:
-                mn = min(dyn_prompt_lens)
-                mx = max(dyn_prompt_lens)
-
-                def rounder(x):
-                    return int(math.ceil(x / args.bucket_size) * args.bucket_size)
-
-                min_prompt_len = rounder(mn)
-                max_sentence_len = rounder(mx)
                 for _ in range(args.warmup):
-                    lst = list(range(min_prompt_len, max_sentence_len + 1, args.bucket_size))
-                    for sz in lst:
-                        print("Warming up for shape,", sz - 1, flush=True)
-                        generate(input_sentences[0], sz - 1, args.reduce_recompile, disable_profiling=True)
+                    for prompt_len in get_warmup_prompt_lengths(dyn_prompt_lens, generation_config):
+                        print("Warming up for shape,", prompt_len, flush=True)
+                        generate(input_sentences[0], prompt_len, args.reduce_recompile, disable_profiling=True)
         torch_hpu.synchronize()
         timer.step()
         compilation_duration = timer.last_duration
+        rebalance_moe_experts(args, model)
         total_new_tokens_generated = 0
         logger.info("Running generate...")
         timer.step()
@@ -688,6 +835,7 @@ def main():
 
         stats = f"Throughput (including tokenization) = {throughput} tokens/second"
         stats = stats + f"\nNumber of HPU graphs                = {count_hpu_graphs()}"
+        log_expert_load_stats(args, model)
         separator = "-" * len(stats)
         print()
         print("Stats:")
@@ -828,17 +976,41 @@ def main():
                 input_data.update(input_tokens)
 
             iteration_times = []
-            outputs = model.generate(
-                **input_data,
-                generation_config=generation_config,
-                assistant_model=assistant_model,
-                lazy_mode=use_lazy_mode,
-                hpu_graphs=args.use_hpu_graphs,
-                ignore_eos=args.ignore_eos,
-                iteration_times=iteration_times,
-                profiler=profiler,
-            ).cpu()
+            generate_kwargs = {
+                "generation_config": generation_config,
+                "assistant_model": assistant_model,
+                "lazy_mode": use_lazy_mode,
+                "hpu_graphs": args.use_hpu_graphs,
+                "ignore_eos": args.ignore_eos,
+                "iteration_times": iteration_times,
+                "profiler": profiler,
+            }
+            if args.stream and not disable_profiling:
+                streamer = GaudiTextIteratorStreamer(
+                    tokenizer,
+                    eos_token_id=[] if args.ignore_eos else None,
+                    sync_interval=args.stream_sync_interval,
+                    skip_special_tokens=True,
+                )
+                stream = model.generate_stream(**input_data, streamer=streamer, **generate_kwargs)
+                first_text_time = None
+                while True:
+                    try:
+                        texts = next(stream)
+                    except StopIteration as e:
+                        outputs = e.value.cpu()
+                        break
+                    if first_text_time is None and texts[0]:
+                        first_text_time = time.perf_counter() - timer.start_time
+                    print(texts[0], end="", flush=True)
+                print()
+                if first_text_time is not None:
+                    logger.info(f"Time to first streamed text = {(first_text_time + encode_duration) * 1000}ms")
+            else:
+                outputs = model.generate(**input_data, **generate_kwargs).cpu()
             timer.step()
+            if args.static_speculative_decoding and not disable_profiling:
+                logger.info(f"Speculative decoding stats = {model.speculative_decoding_stats.to_dict()}")
             first_token_time = iteration_times[0] + encode_duration
             rest_token_time = sum(iteration_times[1:]) / (len(iteration_times) - 1) if len(iteration_times) > 1 else 0
             e2e_latency = timer.total_time()
@@ -868,22 +1040,14 @@ def main():
                     generate(dyn_prompt_lens[0], args.reduce_recompile, disable_profiling=True)
         else:
             if args.bucket_size > 0:
-                mn = min(dyn_prompt_lens)
-                mx = max(dyn_prompt_lens)
-
-                def rounder(x):
-                    return int(math.ceil(x / args.bucket_size) * args.bucket_size)
-
-                min_prompt_len = rounder(mn)
-                max_sentence_len = rounder(mx)
                 for i in range(args.warmup):
-                    lst = list(range(min_prompt_len, max_sentence_len + 1, args.bucket_size))
-                    for sz in lst:
-                        print(f"Warming up for shape {sz - 1} iteration {i + 1}/{args.warmup}", flush=True)
-                        generate(sz - 1, args.reduce_recompile, disable_profiling=True)
+                    for prompt_len in get_warmup_prompt_lengths(dyn_prompt_lens, generation_config):
+                        print(f"Warming up for shape {prompt_len} iteration {i + 1}/{args.warmup}", flush=True)
+                        generate(prompt_len, args.reduce_recompile, disable_profiling=True)
         torch_hpu.synchronize()
         timer.step()
         compilation_duration = timer.last_duration
+        rebalance_moe_experts(args, model)
         total_new_tokens_generated = 0
         logger.info("Running generate...")
         first_token_latencies = []
@@ -957,6 +1121,7 @@ def main():
         stats = stats + f"\nAverage end to end latency          = {avg_e2e_latency * 1000} ms"
         if args.show_graphs_count:
             stats = stats + f"\nNumber of HPU graphs                = {count_hpu_graphs()}"
+        log_expert_load_stats(args, model)
         separator = "-" * len(stats)
         print()
         print("Stats:")
@@ -1078,6 +1243,7 @@ def main():
         torch_hpu.synchronize()
         timer.step()
         compilation_duration = timer.last_duration
+        rebalance_moe_experts(args, model)
 
         total_new_tokens_generated = 0
         duration = 0
@@ -1109,6 +1275,7 @@ def main():
         # Print Stats
 
         stats = f"Throughput (including tokenization) = {throughput} tokens/second"
+        log_expert_load_stats(args, model)
         separator = "-" * len(stats)
         print()
         print("Stats:")
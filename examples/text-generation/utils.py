@@ -20,6 +20,7 @@
 import argparse
 import copy
 import glob
+import math
 import os
 import shutil
 import tempfile
@@ -462,7 +463,14 @@ def setup_distributed_model_ep(args, model_dtype, model_kwargs, logger):
     torch._C._distributed_c10d._register_process_group("default", dist.group.WORLD)
     logger.info("Creating Model")
     config = AutoConfig.from_pretrained(args.model_name_or_path, torch_dtype=model_dtype, **model_kwargs)
-    config.update({"ep_size": args.world_size})
+    config.update(
+        {
+            "ep_size": args.world_size,
+            "ep_dispatch": args.ep_dispatch,
+            "moe_capacity_factor": args.moe_capacity_factor,
+            "moe_num_replicas_per_rank": args.moe_num_replicas_per_rank,
+        }
+    )
 
     model = AutoModelForCausalLM.from_pretrained(
         args.model_name_or_path,
@@ -747,10 +755,56 @@ def setup_generation_config(args, model, assistant_model, tokenizer):
     generation_config.trust_remote_code = args.trust_remote_code
     generation_config.valid_sequence_lengths = None
     generation_config.attn_batch_split = args.attn_batch_split
+    generation_config.kv_cache_block_size = args.kv_cache_block_size
+    generation_config.kv_cache_num_blocks = args.kv_cache_num_blocks
+    generation_config.kv_cache_dtype = args.kv_cache_dtype
+    generation_config.kv_cache_scale_granularity = args.kv_cache_scale_granularity
+    generation_config.kv_cache_window = args.kv_cache_window
+    generation_config.kv_cache_sink_tokens = args.kv_cache_sink_tokens
+    generation_config.use_prefix_cache = args.use_prefix_cache
+    generation_config.prefix_cache_chunk_size = args.prefix_cache_chunk_size
+    generation_config.prefix_cache_max_memory_mb = args.prefix_cache_max_memory_mb
+    generation_config.prefill_chunk_size = args.prefill_chunk_size
+    generation_config.static_speculative_decoding = args.static_speculative_decoding
+    generation_config.decode_steps_per_sync = args.decode_steps_per_sync
+    generation_config.use_fused_sampler = args.use_fused_sampler
+    if args.num_assistant_tokens is not None:
+        generation_config.num_assistant_tokens = args.num_assistant_tokens
+    if generation_config.bucket_size > 0 and args.bucket_plan != "linear" and args.simulate_dyn_prompt:
+        from optimum.habana.transformers.generation import length_histogram, plan_buckets
+
+        histogram = length_histogram(args.simulate_dyn_prompt, [args.max_new_tokens] * len(args.simulate_dyn_prompt))
+        generation_config.buckets = plan_buckets(
+            histogram, args.max_buckets, strategy=args.bucket_plan, multiple_of=generation_config.bucket_size
+        )
 
     return generation_config
 
 
+def get_warmup_prompt_lengths(dyn_prompt_lens, generation_config):
+    """
+    Returns the prompt lengths to warm up with so that the static shapes of all the prompts of `dyn_prompt_lens` are
+    compiled, i.e. one prompt per bucket that these prompts start in.
+    """
+    bucket_size = generation_config.bucket_size
+    mn = min(dyn_prompt_lens)
+    mx = max(dyn_prompt_lens)
+    if generation_config.buckets:
+        from optimum.habana.transformers.generation.bucketing import next_bucket
+
+        buckets = generation_config.buckets
+        first_bucket = next_bucket(buckets, mn + 1, bucket_size)
+        last_bucket = next_bucket(buckets, mx + 1, bucket_size)
+        return [bucket - 1 for bucket in buckets if first_bucket <= bucket <= last_bucket]
+
+    def rounder(x):
+        return int(math.ceil(x / bucket_size) * bucket_size)
+
+    min_prompt_len = rounder(mn)
+    max_sentence_len = rounder(mx)
+    return [sz - 1 for sz in range(min_prompt_len, max_sentence_len + 1, bucket_size)]
+
+
 def exclude_hpu_graph_configs(args):
     # Excluded configs for batch size 1 for hpu graph
     if args.batch_size == 1 and args.limit_hpu_graphs:
@@ -826,6 +880,11 @@ def initialize_model(args, logger):
         setup_const_serialization(args.const_serialization_path)
     if args.quant_config or args.load_quantized_model_with_inc or args.local_quantized_inc_model_path:
         model = setup_inference(args, model)
+    if args.moe_expert_load_stats or args.moe_num_replicas_per_rank > 0:
+        from optimum.habana.distributed.expert_parallel import enable_expert_load_stats
+
+        # Before the warmup so that the statistics are recorded in HPU graphs
+        enable_expert_load_stats(model)
     timer.step()
     logger.info(f"Args: {args}")
     logger.info(f"device: {args.device}, n_hpu: {args.world_size}, bf16: {model_dtype == torch.bfloat16}")
@@ -16,6 +16,7 @@
 from __future__ import annotations
 
 import contextlib
+import functools
 import os
 
 import accelerate
@@ -26,6 +27,7 @@ from accelerate.logging import get_logger
 from accelerate.utils import DistributedType, PrecisionType
 
 from ..distributed import parallel_state
+from .data_loader import DevicePrefetchDataLoader, slice_sequence_parallel
 from .utils.dataclasses import GaudiTERecipeKwargs
 from .utils.transformer_engine import convert_model, get_fp8_recipe
 
@@ -62,6 +64,7 @@ class GaudiAccelerator(Accelerator):
         force_autocast: bool = False,
         distribution_strategy: str = None,
         compiled_autograd_enabled: bool = False,
+        dataloader_prefetch_batches: int = 0,
         **kwargs,
     ):
         # This is to trigger the creation of te_recipe_handler when the env var is set to fp8 (even with deepspeed)
@@ -71,6 +74,8 @@ class GaudiAccelerator(Accelerator):
         self.distribution_strategy = distribution_strategy
         self.force_autocast = force_autocast
         self.mpu = parallel_state
+        self.dataloader_prefetch_batches = dataloader_prefetch_batches
+        self._prefetch_data_loaders = []
 
         # this is what will be used by the FP8ContextWrapper, avoiding recreating the recipe
         # we can clean this up later when the upstream accelerate is fixed
@@ -179,4 +184,27 @@ class GaudiAccelerator(Accelerator):
             torch_device_mesh=self.state.torch_tp_plugin.torch_device_mesh if self.state.torch_tp_plugin else None,
         )
         self._dataloaders.append(prepared_data_loader)
+
+        if self.dataloader_prefetch_batches > 0 and device_placement:
+            slice_fn = None
+            if (
+                parallel_state.sequence_parallel_is_initialized()
+                and parallel_state.get_sequence_parallel_world_size() > 1
+            ):
+                slice_fn = functools.partial(
+                    slice_sequence_parallel,
+                    world_size=parallel_state.get_sequence_parallel_world_size(),
+                    rank=parallel_state.get_sequence_parallel_rank(),
+                )
+            prepared_data_loader = DevicePrefetchDataLoader(
+                prepared_data_loader, self.dataloader_prefetch_batches, slice_fn=slice_fn
+            )
+            self._prefetch_data_loaders.append(prepared_data_loader)
         return prepared_data_loader
+
+    def pop_data_wait_time(self) -> float:
+        """
+        Returns the time spent waiting for batches of the data loaders prefetching to the device since the last call,
+        in seconds.
+        """
+        return sum(data_loader.pop_wait_time() for data_loader in self._prefetch_data_loaders)
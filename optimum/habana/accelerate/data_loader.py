@@ -0,0 +1,125 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import copy
+import time
+from collections.abc import Mapping
+from typing import Any, Callable, Optional
+
+import torch
+from accelerate.data_loader import skip_first_batches
+
+
+def slice_sequence_parallel(data: Any, world_size: int, rank: int) -> Any:
+    """
+    Keeps the part of the sequence dimension, i.e. the second one, of every tensor of `data` that the sequence
+    parallel `rank` processes. The sliced tensors have their `is_sequence_parallel_slice` attribute set to `True`.
+    """
+    if isinstance(data, Mapping):
+        return type(data)({k: slice_sequence_parallel(v, world_size, rank) for k, v in data.items()})
+    elif isinstance(data, (tuple, list)):
+        return type(data)(slice_sequence_parallel(v, world_size, rank) for v in data)
+    elif isinstance(data, torch.Tensor):
+        sub_seq_length = int(data.size()[1] / world_size)
+        data = data[:, rank * sub_seq_length : (rank + 1) * sub_seq_length]
+        # So that they are not sliced again, e.g. by `GaudiTrainer._prepare_input`
+        data.is_sequence_parallel_slice = True
+    return data
+
+
+class DevicePrefetchDataLoader:
+    """
+    Wraps a data loader prepared by `GaudiAccelerator` to keep the next `num_batches` batches already sent to the
+    device, and sliced with `slice_fn` if any, while the current one is used. Since the host-to-device copies are
+    asynchronous, they then run while the device computes the previous steps.
+
+    The attributes of the wrapped data loader are available on the wrapper. Its `end_of_dataloader` flag, which
+    drives gradient synchronization with gradient accumulation, is set according to the batch being used rather
+    than the last one fetched.
+
+    Args:
+        data_loader (`torch.utils.data.DataLoader`):
+            The prepared data loader.
+        num_batches (`int`):
+            The number of batches fetched ahead.
+        slice_fn (`Callable`, *optional*):
+            A function applied to every batch once on the device.
+    """
+
+    def __init__(self, data_loader, num_batches: int, slice_fn: Optional[Callable[[Any], Any]] = None):
+        if num_batches < 1:
+            raise ValueError(f"`num_batches` must be strictly positive but is {num_batches}.")
+        self.data_loader = data_loader
+        self.num_batches = num_batches
+        self.slice_fn = slice_fn
+        # Shared with the data loaders returned by `skip_first_batches`
+        self._stats = {"wait_time": 0.0}
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __getattr__(self, name):
+        # Only called for the attributes not defined by the wrapper
+        if name == "data_loader":
+            raise AttributeError(name)
+        return getattr(self.data_loader, name)
+
+    def __iter__(self):
+        iterator = iter(self.data_loader)
+        queue = collections.deque()
+        exhausted = False
+        start = time.perf_counter()
+        while True:
+            while not exhausted and len(queue) <= self.num_batches:
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if self.slice_fn is not None:
+                    batch = self.slice_fn(batch)
+                # Fetching the next batch would end the iteration of the data loader before its last batch is used
+                is_last = getattr(self.data_loader, "end_of_dataloader", False)
+                exhausted = is_last
+                queue.append((batch, is_last))
+            if not queue:
+                break
+
+            batch, is_last = queue.popleft()
+            if hasattr(self.data_loader, "end_of_dataloader"):
+                self.data_loader.end_of_dataloader = is_last
+            self._stats["wait_time"] += time.perf_counter() - start
+            yield batch
+            start = time.perf_counter()
+
+        # Lets the data loader finish its iteration
+        for _ in iterator:
+            pass
+
+    def skip_first_batches(self, num_batches: int = 0) -> "DevicePrefetchDataLoader":
+        """Same as `accelerate.skip_first_batches` for the wrapped data loader."""
+        data_loader = copy.copy(self)
+        data_loader.data_loader = skip_first_batches(self.data_loader, num_batches)
+        return data_loader
+
+    @property
+    def wait_time(self) -> float:
+        """Time spent waiting for batches since the last `pop_wait_time`, in seconds."""
+        return self._stats["wait_time"]
+
+    def pop_wait_time(self) -> float:
+        wait_time, self._stats["wait_time"] = self._stats["wait_time"], 0.0
+        return wait_time
@@ -0,0 +1,182 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+import torch
+from diffusers.models.modeling_outputs import Transformer2DModelOutput
+from diffusers.utils import USE_PEFT_BACKEND, logging, scale_lora_layers, unscale_lora_layers
+
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+
+def gaudi_flux_transformer_2d_model_forward(
+    self,
+    hidden_states: torch.Tensor,
+    encoder_hidden_states: torch.Tensor = None,
+    pooled_projections: torch.Tensor = None,
+    timestep: torch.LongTensor = None,
+    img_ids: torch.Tensor = None,
+    txt_ids: torch.Tensor = None,
+    guidance: torch.Tensor = None,
+    joint_attention_kwargs: Optional[Dict[str, Any]] = None,
+    controlnet_block_samples=None,
+    controlnet_single_block_samples=None,
+    return_dict: bool = True,
+    controlnet_blocks_repeat: bool = False,
+    deep_cache_depth: Optional[int] = None,
+    deep_cache_features: Optional[torch.Tensor] = None,
+) -> Union[torch.Tensor, Transformer2DModelOutput]:
+    r"""
+    Adapted from: https://github.com/huggingface/diffusers/blob/v0.35.1/src/diffusers/models/transformers/transformer_flux.py#L631
+
+    Changes:
+      - Adds `deep_cache_depth` and `deep_cache_features` to reuse the output of the deep blocks of a previous
+        timestep. The dual-stream blocks followed by the single-stream blocks are considered as one sequence of blocks.
+        With `deep_cache_depth=d`, the residual added by all the blocks but the first `d` and the last `d` ones, with
+        the text tokens first, is returned as second output. If `deep_cache_features` is given, it is added instead of
+        computing these blocks.
+    """
+    transformer_blocks = list(self.transformer_blocks) + list(self.single_transformer_blocks)
+    if deep_cache_depth is not None:
+        if not 0 < 2 * deep_cache_depth < len(transformer_blocks):
+            raise ValueError(
+                f"`deep_cache_depth` must be between 1 and {(len(transformer_blocks) - 1) // 2} but is {deep_cache_depth}."
+            )
+        if return_dict:
+            raise ValueError("`return_dict` must be False when `deep_cache_depth` is set.")
+    use_deep_cache = deep_cache_depth is not None and deep_cache_features is not None
+
+    if joint_attention_kwargs is not None:
+        joint_attention_kwargs = joint_attention_kwargs.copy()
+        lora_scale = joint_attention_kwargs.pop("scale", 1.0)
+    else:
+        lora_scale = 1.0
+
+    if USE_PEFT_BACKEND:
+        # weight the lora layers by setting `lora_scale` for each PEFT layer
+        scale_lora_layers(self, lora_scale)
+    else:
+        if joint_attention_kwargs is not None and joint_attention_kwargs.get("scale", None) is not None:
+            logger.warning(
+                "Passing `scale` via `joint_attention_kwargs` when not using the PEFT backend is ineffective."
+            )
+
+    hidden_states = self.x_embedder(hidden_states)
+
+    timestep = timestep.to(hidden_states.dtype) * 1000
+    if guidance is not None:
+        guidance = guidance.to(hidden_states.dtype) * 1000
+
+    temb = (
+        self.time_text_embed(timestep, pooled_projections)
+        if guidance is None
+        else self.time_text_embed(timestep, guidance, pooled_projections)
+    )
+    encoder_hidden_states = self.context_embedder(encoder_hidden_states)
+
+    if txt_ids.ndim == 3:
+        logger.warning(
+            "Passing `txt_ids` 3d torch.Tensor is deprecated."
+            "Please remove the batch dimension and pass it as a 2d torch Tensor"
+        )
+        txt_ids = txt_ids[0]
+    if img_ids.ndim == 3:
+        logger.warning(
+            "Passing `img_ids` 3d torch.Tensor is deprecated."
+            "Please remove the batch dimension and pass it as a 2d torch Tensor"
+        )
+        img_ids = img_ids[0]
+
+    ids = torch.cat((txt_ids, img_ids), dim=0)
+    image_rotary_emb = self.pos_embed(ids)
+
+    if joint_attention_kwargs is not None and "ip_adapter_image_embeds" in joint_attention_kwargs:
+        ip_adapter_image_embeds = joint_attention_kwargs.pop("ip_adapter_image_embeds")
+        ip_hidden_states = self.encoder_hid_proj(ip_adapter_image_embeds)
+        joint_attention_kwargs.update({"ip_hidden_states": ip_hidden_states})
+
+    num_dual_blocks = len(self.transformer_blocks)
+    for index, block in enumerate(transformer_blocks):
+        if deep_cache_depth is not None and index == deep_cache_depth:
+            text_seq_len = encoder_hidden_states.shape[1]
+            if use_deep_cache:
+                encoder_hidden_states = encoder_hidden_states + deep_cache_features[:, :text_seq_len]
+                hidden_states = hidden_states + deep_cache_features[:, text_seq_len:]
+            else:
+                deep_cache_inputs = torch.cat([encoder_hidden_states, hidden_states], dim=1)
+
+        # The deep blocks are skipped when their output is cached
+        if use_deep_cache and deep_cache_depth <= index < len(transformer_blocks) - deep_cache_depth:
+            continue
+
+        if torch.is_grad_enabled() and self.gradient_checkpointing:
+            encoder_hidden_states, hidden_states = self._gradient_checkpointing_func(
+                block,
+                hidden_states,
+                encoder_hidden_states,
+                temb,
+                image_rotary_emb,
+                joint_attention_kwargs,
+            )
+
+        else:
+            encoder_hidden_states, hidden_states = block(
+                hidden_states=hidden_states,
+                encoder_hidden_states=encoder_hidden_states,
+                temb=temb,
+                image_rotary_emb=image_rotary_emb,
+                joint_attention_kwargs=joint_attention_kwargs,
+            )
+
+        # controlnet residual
+        if index < num_dual_blocks and controlnet_block_samples is not None:
+            interval_control = len(self.transformer_blocks) / len(controlnet_block_samples)
+            interval_control = int(np.ceil(interval_control))
+            # For Xlabs ControlNet.
+            if controlnet_blocks_repeat:
+                hidden_states = hidden_states + controlnet_block_samples[index % len(controlnet_block_samples)]
+            else:
+                hidden_states = hidden_states + controlnet_block_samples[index // interval_control]
+        elif index >= num_dual_blocks and controlnet_single_block_samples is not None:
+            interval_control = len(self.single_transformer_blocks) / len(controlnet_single_block_samples)
+            interval_control = int(np.ceil(interval_control))
+            hidden_states = (
+                hidden_states + controlnet_single_block_samples[(index - num_dual_blocks) // interval_control]
+            )
+
+        if (
+            deep_cache_depth is not None
+            and not use_deep_cache
+            and index == len(transformer_blocks) - deep_cache_depth - 1
+        ):
+            deep_cache_features = torch.cat([encoder_hidden_states, hidden_states], dim=1) - deep_cache_inputs
+
+    hidden_states = self.norm_out(hidden_states, temb)
+    output = self.proj_out(hidden_states)
+
+    if USE_PEFT_BACKEND:
+        # remove `lora_scale` from each PEFT layer
+        unscale_lora_layers(self, lora_scale)
+
+    if deep_cache_depth is not None:
+        return (output, deep_cache_features)
+
+    if not return_dict:
+        return (output,)
+
+    return Transformer2DModelOutput(sample=output)
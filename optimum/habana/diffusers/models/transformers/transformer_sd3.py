@@ -0,0 +1,149 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+from diffusers.models.modeling_outputs import Transformer2DModelOutput
+from diffusers.utils import USE_PEFT_BACKEND, logging, scale_lora_layers, unscale_lora_layers
+
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+
+def gaudi_sd3_transformer_2d_model_forward(
+    self,
+    hidden_states: torch.Tensor,
+    encoder_hidden_states: torch.Tensor = None,
+    pooled_projections: torch.Tensor = None,
+    timestep: torch.LongTensor = None,
+    block_controlnet_hidden_states: List = None,
+    joint_attention_kwargs: Optional[Dict[str, Any]] = None,
+    return_dict: bool = True,
+    skip_layers: Optional[List[int]] = None,
+    deep_cache_depth: Optional[int] = None,
+    deep_cache_features: Optional[torch.Tensor] = None,
+) -> Union[torch.Tensor, Transformer2DModelOutput]:
+    r"""
+    Adapted from: https://github.com/huggingface/diffusers/blob/v0.35.1/src/diffusers/models/transformers/transformer_sd3.py#L317
+
+    Changes:
+      - Adds `deep_cache_depth` and `deep_cache_features` to reuse the output of the deep blocks of a previous
+        timestep. With `deep_cache_depth=d`, the residual added by all the blocks but the first `d` and the last `d`
+        ones, with the text tokens first, is returned as second output. If `deep_cache_features` is given, it is added
+        instead of computing these blocks.
+    """
+    num_blocks = len(self.transformer_blocks)
+    if deep_cache_depth is not None:
+        if not 0 < 2 * deep_cache_depth < num_blocks:
+            raise ValueError(
+                f"`deep_cache_depth` must be between 1 and {(num_blocks - 1) // 2} but is {deep_cache_depth}."
+            )
+        if return_dict:
+            raise ValueError("`return_dict` must be False when `deep_cache_depth` is set.")
+    use_deep_cache = deep_cache_depth is not None and deep_cache_features is not None
+
+    if joint_attention_kwargs is not None:
+        joint_attention_kwargs = joint_attention_kwargs.copy()
+        lora_scale = joint_attention_kwargs.pop("scale", 1.0)
+    else:
+        lora_scale = 1.0
+
+    if USE_PEFT_BACKEND:
+        # weight the lora layers by setting `lora_scale` for each PEFT layer
+        scale_lora_layers(self, lora_scale)
+    else:
+        if joint_attention_kwargs is not None and joint_attention_kwargs.get("scale", None) is not None:
+            logger.warning(
+                "Passing `scale` via `joint_attention_kwargs` when not using the PEFT backend is ineffective."
+            )
+
+    height, width = hidden_states.shape[-2:]
+
+    hidden_states = self.pos_embed(hidden_states)  # takes care of adding positional embeddings too.
+    temb = self.time_text_embed(timestep, pooled_projections)
+    encoder_hidden_states = self.context_embedder(encoder_hidden_states)
+
+    if joint_attention_kwargs is not None and "ip_adapter_image_embeds" in joint_attention_kwargs:
+        ip_adapter_image_embeds = joint_attention_kwargs.pop("ip_adapter_image_embeds")
+        ip_hidden_states, ip_temb = self.image_proj(ip_adapter_image_embeds, timestep)
+
+        joint_attention_kwargs.update(ip_hidden_states=ip_hidden_states, temb=ip_temb)
+
+    for index_block, block in enumerate(self.transformer_blocks):
+        if deep_cache_depth is not None and index_block == deep_cache_depth:
+            text_seq_len = encoder_hidden_states.shape[1]
+            if use_deep_cache:
+                encoder_hidden_states = encoder_hidden_states + deep_cache_features[:, :text_seq_len]
+                hidden_states = hidden_states + deep_cache_features[:, text_seq_len:]
+            else:
+                deep_cache_inputs = torch.cat([encoder_hidden_states, hidden_states], dim=1)
+
+        # Skip specified layers, and the deep blocks when their output is cached
+        is_skip = True if skip_layers is not None and index_block in skip_layers else False
+        if use_deep_cache and deep_cache_depth <= index_block < num_blocks - deep_cache_depth:
+            continue
+
+        if torch.is_grad_enabled() and self.gradient_checkpointing and not is_skip:
+            encoder_hidden_states, hidden_states = self._gradient_checkpointing_func(
+                block,
+                hidden_states,
+                encoder_hidden_states,
+                temb,
+                joint_attention_kwargs,
+            )
+        elif not is_skip:
+            encoder_hidden_states, hidden_states = block(
+                hidden_states=hidden_states,
+                encoder_hidden_states=encoder_hidden_states,
+                temb=temb,
+                joint_attention_kwargs=joint_attention_kwargs,
+            )
+
+        # controlnet residual
+        if block_controlnet_hidden_states is not None and block.context_pre_only is False:
+            interval_control = len(self.transformer_blocks) / len(block_controlnet_hidden_states)
+            hidden_states = hidden_states + block_controlnet_hidden_states[int(index_block / interval_control)]
+
+        if deep_cache_depth is not None and not use_deep_cache and index_block == num_blocks - deep_cache_depth - 1:
+            deep_cache_features = torch.cat([encoder_hidden_states, hidden_states], dim=1) - deep_cache_inputs
+
+    hidden_states = self.norm_out(hidden_states, temb)
+    hidden_states = self.proj_out(hidden_states)
+
+    # unpatchify
+    patch_size = self.config.patch_size
+    height = height // patch_size
+    width = width // patch_size
+
+    hidden_states = hidden_states.reshape(
+        shape=(hidden_states.shape[0], height, width, patch_size, patch_size, self.out_channels)
+    )
+    hidden_states = torch.einsum("nhwpqc->nchpwq", hidden_states)
+    output = hidden_states.reshape(
+        shape=(hidden_states.shape[0], self.out_channels, height * patch_size, width * patch_size)
+    )
+
+    if USE_PEFT_BACKEND:
+        # remove `lora_scale` from each PEFT layer
+        unscale_lora_layers(self, lora_scale)
+
+    if deep_cache_depth is not None:
+        return (output, deep_cache_features)
+
+    if not return_dict:
+        return (output,)
+
+    return Transformer2DModelOutput(sample=output)
@@ -32,6 +32,8 @@ def gaudi_unet_2d_condition_model_forward(
     down_intrablock_additional_residuals: Optional[Tuple[torch.Tensor]] = None,
     encoder_attention_mask: Optional[torch.Tensor] = None,
     return_dict: bool = True,
+    deep_cache_depth: Optional[int] = None,
+    deep_cache_features: Optional[torch.Tensor] = None,
 ) -> Union[UNet2DConditionOutput, Tuple]:
     r"""
     Copied from: https://github.com/huggingface/diffusers/blob/v0.26.3/src/diffusers/models/unets/unet_2d_condition.py#L843
@@ -39,7 +41,20 @@ def gaudi_unet_2d_condition_model_forward(
     Changes:
       - Adds a workaround to be able to compute `conv_in` with Torch Autocast and full bf16 precision.
       - Added mark_step in unet forward
+      - Adds `deep_cache_depth` and `deep_cache_features` to reuse the deep features of a previous timestep as in
+        DeepCache (https://arxiv.org/abs/2312.00858). With `deep_cache_depth=d`, the input of the `d`-th up block
+        from the end is returned as second output. If `deep_cache_features` is given, it replaces this input and
+        only `conv_in`, the first `d` down blocks and the last `d` up blocks are computed.
     """
+    if deep_cache_depth is not None:
+        if not 0 < deep_cache_depth < len(self.up_blocks):
+            raise ValueError(
+                f"`deep_cache_depth` must be between 1 and {len(self.up_blocks) - 1} but is {deep_cache_depth}."
+            )
+        if return_dict:
+            raise ValueError("`return_dict` must be False when `deep_cache_depth` is set.")
+    use_deep_cache = deep_cache_depth is not None and deep_cache_features is not None
+
     # By default samples have to be AT least a multiple of the overall upsampling factor.
     # The overall upsampling factor is equal to 2 ** (# num of upsampling layers).
     # However, the upsampling interpolation output size can be forced to fit any upsampling size
@@ -256,7 +271,9 @@ def gaudi_unet_2d_condition_model_forward(
         is_adapter = True
 
     down_block_res_samples = (sample,)
-    for downsample_block in self.down_blocks:
+    # The deep blocks are skipped when their output is cached
+    down_blocks = self.down_blocks[:deep_cache_depth] if use_deep_cache else self.down_blocks
+    for downsample_block in down_blocks:
         if hasattr(downsample_block, "has_cross_attention") and downsample_block.has_cross_attention:
             # For t2i-adapter CrossAttnDownBlock2D
             additional_residuals = {}
@@ -291,7 +308,12 @@ def gaudi_unet_2d_condition_model_forward(
         down_block_res_samples = new_down_block_res_samples
 
     # 4. mid
-    if self.mid_block is not None:
+    if use_deep_cache:
+        # Only keep the residuals consumed by the shallow up blocks
+        num_res_samples = sum(len(block.resnets) for block in self.up_blocks[-deep_cache_depth:])
+        down_block_res_samples = down_block_res_samples[:num_res_samples]
+        sample = deep_cache_features
+    elif self.mid_block is not None:
         if hasattr(self.mid_block, "has_cross_attention") and self.mid_block.has_cross_attention:
             sample = self.mid_block(
                 sample,
@@ -312,13 +334,17 @@ def gaudi_unet_2d_condition_model_forward(
         ):
             sample += down_intrablock_additional_residuals.pop(0)
 
-    if is_controlnet:
+    if is_controlnet and not use_deep_cache:
         sample = sample + mid_block_additional_residual
 
     # 5. up
-    for i, upsample_block in enumerate(self.up_blocks):
+    first_up_block = len(self.up_blocks) - deep_cache_depth if use_deep_cache else 0
+    for i, upsample_block in enumerate(self.up_blocks[first_up_block:], start=first_up_block):
         is_final_block = i == len(self.up_blocks) - 1
 
+        if deep_cache_depth is not None and i == len(self.up_blocks) - deep_cache_depth:
+            deep_cache_features = sample
+
         res_samples = down_block_res_samples[-len(upsample_block.resnets) :]
         down_block_res_samples = down_block_res_samples[: -len(upsample_block.resnets)]
 
@@ -359,6 +385,9 @@ def gaudi_unet_2d_condition_model_forward(
 
     torch_utils.fourier_filter = orig_fourier_filter
 
+    if deep_cache_depth is not None:
+        return (sample, deep_cache_features)
+
     if not return_dict:
         return (sample,)
 
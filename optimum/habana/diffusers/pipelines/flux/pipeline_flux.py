@@ -37,8 +37,9 @@ from transformers import (
 from ....transformers.gaudi_configuration import GaudiConfig
 from ....utils import HabanaProfile, speed_metrics, warmup_inference_steps_time_adjustment
 from ...models.attention_processor import GaudiFluxAttnProcessor2_0
+from ...models.transformers.transformer_flux import gaudi_flux_transformer_2d_model_forward
 from ...schedulers import GaudiFlowMatchEulerDiscreteScheduler
-from ..pipeline_utils import GaudiDiffusionPipeline
+from ..pipeline_utils import GaudiDiffusionPipeline, PipelinedDecoder, get_deep_cache_schedule
 
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
@@ -168,6 +169,8 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
             block.attn.processor = GaudiFluxAttnProcessor2_0(is_training)
         for block in self.transformer.transformer_blocks:
             block.attn.processor = GaudiFluxAttnProcessor2_0(is_training)
+        # Gaudi forward supporting deep feature caching, to set before wrapping in HPU graphs
+        FluxTransformer2DModel.forward = gaudi_flux_transformer_2d_model_forward
 
         self.to(self._device)
         if use_hpu_graphs:
@@ -256,6 +259,10 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
         max_sequence_length: int = 512,
         profiling_warmup_steps: Optional[int] = 0,
         profiling_steps: Optional[int] = 0,
+        pipelined_decode: bool = False,
+        deep_cache_interval: int = 1,
+        deep_cache_depth: int = 1,
+        deep_cache_refresh_steps: Optional[List[int]] = None,
         **kwargs,
     ):
         r"""
@@ -324,6 +331,18 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
                 Number of steps to ignore for profling.
             profiling_steps (`int`, *optional*):
                 Number of steps to be captured when enabling profiling.
+            pipelined_decode (`bool`, *optional*, defaults to `False`):
+                Whether to decode and post-process each batch in a background thread, on a separate stream, while the
+                next batches are denoised.
+            deep_cache_interval (`int`, *optional*, defaults to 1):
+                Number of consecutive denoising steps sharing the output of the deep blocks of the transformer, which
+                is only computed at the first one. The default value disables feature caching.
+            deep_cache_depth (`int`, *optional*, defaults to 1):
+                Number of first and last blocks of the transformer that are still computed at every step when the
+                output of the deep blocks is cached.
+            deep_cache_refresh_steps (`List[int]`, *optional*):
+                Indices of the denoising steps computing the deep blocks of the transformer, which replaces
+                `deep_cache_interval`.
 
         Examples:
 
@@ -486,6 +505,16 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
             "images": [],
         }
 
+        if pipelined_decode:
+            decoder = PipelinedDecoder(self._decode_batch, use_habana=True)
+
+        use_deep_cache = deep_cache_interval > 1 or deep_cache_refresh_steps is not None
+        if use_deep_cache:
+            deep_cache_schedule = get_deep_cache_schedule(
+                len(timesteps), deep_cache_interval, deep_cache_refresh_steps
+            )
+            deep_cache_features = None
+
         # 6. Denoising loop
         for j in range(num_batches):
             # The throughput is calculated from the 4th iteration
@@ -529,9 +558,14 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
                 # broadcast to batch dimension in a way that's compatible with ONNX/Core ML
                 timestep = timestep.expand(latents_batch.shape[0]).to(latents_batch.dtype)
 
+                deep_cache_kwargs = {}
+                if use_deep_cache:
+                    deep_cache_kwargs["deep_cache_depth"] = deep_cache_depth
+                    deep_cache_kwargs["deep_cache_features"] = None if deep_cache_schedule[i] else deep_cache_features
+
                 if quant_mode == "quantize-mixed" and i >= quant_mixed_step:
                     # Mixed quantization
-                    noise_pred = transformer_bf16(
+                    transformer_outputs = transformer_bf16(
                         hidden_states=latents_batch,
                         timestep=timestep / 1000,
                         guidance=guidance_batch,
@@ -541,9 +575,10 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
                         img_ids=latent_image_ids,
                         joint_attention_kwargs=self.joint_attention_kwargs,
                         return_dict=False,
-                    )[0]
+                        **deep_cache_kwargs,
+                    )
                 else:
-                    noise_pred = self.transformer(
+                    transformer_outputs = self.transformer(
                         hidden_states=latents_batch,
                         timestep=timestep / 1000,
                         guidance=guidance_batch,
@@ -553,7 +588,11 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
                         img_ids=latent_image_ids,
                         joint_attention_kwargs=self.joint_attention_kwargs,
                         return_dict=False,
-                    )[0]
+                        **deep_cache_kwargs,
+                    )
+                noise_pred = transformer_outputs[0]
+                if use_deep_cache and deep_cache_schedule[i]:
+                    deep_cache_features = transformer_outputs[1]
 
                 # compute the previous noisy sample x_t -> x_t-1
                 latents_batch = self.scheduler.step(noise_pred, timestep, latents_batch, return_dict=False)[0]
@@ -563,17 +602,16 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
                 if num_batches > throughput_warmup_steps:
                     ht.hpu.synchronize()
 
-            if not output_type == "latent":
-                latents_batch = self._unpack_latents(latents_batch, height, width, self.vae_scale_factor)
-                latents_batch = (latents_batch / self.vae.config.scaling_factor) + self.vae.config.shift_factor
-                image = self.vae.decode(latents_batch, return_dict=False)[0]
-                image = self.image_processor.postprocess(image, output_type=output_type)
+            if pipelined_decode:
+                num_samples = batch_size - num_dummy_samples if j == num_batches - 1 else batch_size
+                decoder.submit(latents_batch, height, width, output_type, num_samples)
             else:
-                image = latents_batch
-
-            outputs["images"].append(image)
+                outputs["images"].append(self._decode_batch(latents_batch, height, width, output_type))
             # htcore.mark_step(sync=True)
 
+        if pipelined_decode:
+            outputs["images"] = decoder.gather()
+
         # 7. Stage after denoising
         hb_profiler.stop()
 
@@ -600,7 +638,7 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
         logger.info(f"Speed metrics: {speed_measures}")
 
         # 8 Output Images
-        if num_dummy_samples > 0:
+        if num_dummy_samples > 0 and not pipelined_decode:
             # Remove dummy generations if needed
             outputs["images"][-1] = outputs["images"][-1][:-num_dummy_samples]
 
@@ -632,3 +670,13 @@ class GaudiFluxPipeline(GaudiDiffusionPipeline, FluxPipeline):
             images=outputs["images"],
             throughput=speed_measures[f"{speed_metrics_prefix}_samples_per_second"],
         )
+
+    def _decode_batch(self, latents_batch, height, width, output_type, num_samples=None):
+        """Decodes and post-processes the first `num_samples` samples of a batch of denoised latents."""
+        latents_batch = latents_batch[:num_samples]
+        if output_type == "latent":
+            return latents_batch
+        latents_batch = self._unpack_latents(latents_batch, height, width, self.vae_scale_factor)
+        latents_batch = (latents_batch / self.vae.config.scaling_factor) + self.vae.config.shift_factor
+        image = self.vae.decode(latents_batch, return_dict=False)[0]
+        return self.image_processor.postprocess(image, output_type=output_type)
@@ -19,7 +19,8 @@ import importlib
 import inspect
 import os
 import sys
-from typing import Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Union
 
 import torch
 from diffusers.pipelines import DiffusionPipeline
@@ -31,6 +32,7 @@ from optimum.utils import logging
 
 from ...transformers.gaudi_configuration import GaudiConfig
 from ...utils import to_device_dtype
+from .prompt_embeds_cache import PromptEmbedsCache
 
 
 logger = logging.get_logger(__name__)
@@ -95,6 +97,108 @@ def _fetch_class_library_tuple(module):
     return (library, class_name)
 
 
+def get_deep_cache_schedule(
+    num_inference_steps: int, interval: int = 1, refresh_steps: Optional[List[int]] = None
+) -> List[bool]:
+    """
+    Returns for every denoising step whether the denoiser computes all its blocks (`True`) or reuses the deep features
+    of the last step that did (`False`). The features are refreshed at `refresh_steps` if given, every `interval` steps
+    otherwise, and always at the first step.
+    """
+    if interval < 1:
+        raise ValueError(f"`interval` must be strictly positive but is {interval}.")
+    if refresh_steps is None:
+        refresh_steps = range(0, num_inference_steps, interval)
+    refresh_steps = set(refresh_steps) | {0}
+    return [step in refresh_steps for step in range(num_inference_steps)]
+
+
+def get_cfg_truncation_step(num_inference_steps: int, fraction: Optional[float] = None) -> int:
+    """
+    Returns the index of the first denoising step computed without the unconditional branch of classifier-free
+    guidance, which is dropped after `fraction` of the steps, or `num_inference_steps` if it is never dropped.
+    """
+    if fraction is None:
+        return num_inference_steps
+    if not 0 <= fraction <= 1:
+        raise ValueError(f"`fraction` must be between 0 and 1 but is {fraction}.")
+    return int(num_inference_steps * fraction)
+
+
+def has_cfg_converged(noise_pred_uncond: torch.Tensor, noise_pred_text: torch.Tensor, threshold: float) -> bool:
+    """
+    Returns whether the conditional and unconditional predictions of every sample of a batch differ by less than
+    `threshold` relative to the norm of the conditional one, so that guidance barely changes the next steps. This
+    waits for the predictions to be computed.
+    """
+    noise_pred_uncond, noise_pred_text = noise_pred_uncond.float(), noise_pred_text.float()
+    difference = (noise_pred_text - noise_pred_uncond).flatten(1).norm(dim=1)
+    norm = noise_pred_text.flatten(1).norm(dim=1)
+    return bool((difference <= threshold * norm).all())
+
+
+class PipelinedDecoder:
+    """
+    Decodes the latents of finished batches in a background thread so that decoding batch `j` overlaps with the
+    denoising of batch `j+1`. On Gaudi, the decoding runs on a separate stream that waits for the latents to be
+    computed on the current one.
+
+    Args:
+        decode_fn (`Callable`):
+            Called with the arguments given to `submit`, it returns the decoded (and post-processed) batch.
+        use_habana (`bool`, defaults to `False`):
+            Whether the latents are on Gaudi.
+        use_torch_autocast (`bool`, defaults to `False`):
+            Whether to decode with bf16 autocast, which is not inherited from the thread calling `submit`.
+    """
+
+    def __init__(self, decode_fn: Callable[..., Any], use_habana: bool = False, use_torch_autocast: bool = False):
+        self.decode_fn = decode_fn
+        self.use_torch_autocast = use_torch_autocast
+        self.stream = None
+        if use_habana:
+            import habana_frameworks.torch as ht
+            import habana_frameworks.torch.core as htcore
+
+            self.ht = ht
+            self.htcore = htcore
+            self.stream = ht.hpu.Stream()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+
+    def submit(self, *args):
+        """Queues a batch, whose tensors must not be modified in place afterwards."""
+        event = None
+        if self.stream is not None:
+            # Makes the latents available to the stream of the decoder
+            self.htcore.mark_step()
+            event = self.ht.hpu.Event()
+            event.record()
+        self._futures.append(self._executor.submit(self._decode, event, *args))
+
+    @torch.no_grad()
+    def _decode(self, event, *args):
+        autocast = torch.autocast(device_type="hpu", dtype=torch.bfloat16, enabled=self.use_torch_autocast)
+        if self.stream is None:
+            with autocast:
+                return self.decode_fn(*args)
+        with self.ht.hpu.stream(self.stream), autocast:
+            self.stream.wait_event(event)
+            outputs = self.decode_fn(*args)
+            self.htcore.mark_step()
+        # Outputs left on the device must be ready for the default stream
+        self.stream.synchronize()
+        return outputs
+
+    def gather(self) -> List[Any]:
+        """Waits for all the queued batches and returns their decoded outputs in order."""
+        try:
+            return [future.result() for future in self._futures]
+        finally:
+            self._futures = []
+            self._executor.shutdown()
+
+
 class GaudiDiffusionPipeline(DiffusionPipeline):
     """
     Extends the [`DiffusionPipeline`](https://huggingface.co/docs/diffusers/api/diffusion_pipeline) class:
@@ -208,6 +312,8 @@ class GaudiDiffusionPipeline(DiffusionPipeline):
             logger.info("Running on CPU.")
             self._device = torch.device("cpu")
 
+        self.prompt_embeds_cache = None
+
     def register_modules(self, **kwargs):
         for name, module in kwargs.items():
             # retrieve library
@@ -343,6 +449,38 @@ class GaudiDiffusionPipeline(DiffusionPipeline):
                 create_pr=create_pr,
             )
 
+    def enable_prompt_embeds_cache(
+        self, max_memory: int = 2**30, cache_dir: Optional[Union[str, os.PathLike]] = None
+    ) -> PromptEmbedsCache:
+        """
+        Caches the outputs of the text encoders of the pipeline for the prompts seen recently, so that prompts used
+        again, like negative prompts, are not encoded at every call. See [`PromptEmbedsCache`].
+
+        Args:
+            max_memory (`int`, *optional*, defaults to 1 GiB):
+                Maximum size in bytes of the cached embeddings. The least recently used ones are evicted beyond it.
+            cache_dir (`str` or `os.PathLike`, *optional*):
+                Directory where the embeddings are also saved, to be reused after eviction or by other processes.
+
+        Returns:
+            [`PromptEmbedsCache`]: the cache, which also counts its hits and misses.
+        """
+        self.disable_prompt_embeds_cache()
+        self.prompt_embeds_cache = PromptEmbedsCache(max_memory=max_memory, cache_dir=cache_dir)
+        for name, component in self.components.items():
+            if name.startswith("text_encoder") and isinstance(component, torch.nn.Module):
+                self.prompt_embeds_cache.wrap(name, component)
+        return self.prompt_embeds_cache
+
+    def disable_prompt_embeds_cache(self):
+        """
+        Disables the cache enabled with `enable_prompt_embeds_cache` and frees its embeddings.
+        """
+        if getattr(self, "prompt_embeds_cache", None) is not None:
+            self.prompt_embeds_cache.unwrap()
+            self.prompt_embeds_cache.clear()
+            self.prompt_embeds_cache = None
+
     def to(self, *args, **kwargs):
         """
         Intercept to() method and disable gpu-hpu migration before sending to diffusers
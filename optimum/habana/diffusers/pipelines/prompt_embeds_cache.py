@@ -0,0 +1,171 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from transformers.utils import ModelOutput
+
+
+def _get_lora_state(text_encoder: torch.nn.Module) -> Optional[Tuple]:
+    """
+    Returns the active LoRA adapters of a text encoder with their current scaling, which changes with the LoRA scale
+    given to the pipeline, or `None` if it has no adapter.
+    """
+    if getattr(text_encoder, "peft_config", None) is None:
+        return None
+    for module in text_encoder.modules():
+        scaling = getattr(module, "scaling", None)
+        if isinstance(scaling, dict):
+            return (
+                tuple(module.active_adapters),
+                tuple(sorted(scaling.items())),
+                getattr(module, "disable_adapters", False),
+            )
+    return None
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    size = 0
+    for value in entry.values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            size += tensor.numel() * tensor.element_size()
+    return size
+
+
+class PromptEmbedsCache:
+    """
+    LRU cache of the outputs of the text encoders of a pipeline, so that the prompts seen recently are not encoded
+    again. Every prompt of a batch is a separate entry keyed by the text encoder, its dtype and LoRA state, and the
+    tokenized prompt. The hidden states of all the layers are cached when requested, so that an entry is valid for any
+    `clip_skip`. A batch is only encoded if one of its prompts is missing, and all its prompts are then cached.
+
+    Args:
+        max_memory (`int`, *optional*, defaults to 1 GiB):
+            Maximum size in bytes of the cached tensors, which stay on the device of the text encoders. The least
+            recently used entries are evicted beyond it.
+        cache_dir (`str`, *optional*):
+            Directory where every entry is also saved, to be reloaded when it is evicted or by another process.
+    """
+
+    def __init__(self, max_memory: int = 2**30, cache_dir: Optional[str] = None):
+        self.max_memory = max_memory
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self._forwards = {}
+
+    def wrap(self, name: str, text_encoder: torch.nn.Module):
+        """Makes the calls of `text_encoder` go through the cache."""
+        if name in self._forwards:
+            return
+        forward = text_encoder.forward
+        self._forwards[name] = (text_encoder, forward)
+
+        def cached_forward(input_ids=None, attention_mask=None, **kwargs):
+            # Other outputs or inputs than the hidden states are not cached
+            if input_ids is None or set(kwargs) - {"output_hidden_states"}:
+                return forward(input_ids, attention_mask=attention_mask, **kwargs)
+            return self._cached_forward(name, text_encoder, forward, input_ids, attention_mask, **kwargs)
+
+        text_encoder.forward = cached_forward
+
+    def unwrap(self):
+        """Restores the original forward of the text encoders."""
+        for text_encoder, forward in self._forwards.values():
+            text_encoder.forward = forward
+        self._forwards = {}
+
+    def clear(self):
+        """Removes all the entries from memory, but not from `cache_dir`."""
+        self.entries.clear()
+        self.memory = 0
+
+    def _cached_forward(self, name, text_encoder, forward, input_ids, attention_mask, output_hidden_states=None):
+        identity = (
+            name,
+            text_encoder.__class__.__name__,
+            getattr(text_encoder.config, "_name_or_path", ""),
+            str(text_encoder.dtype),
+            _get_lora_state(text_encoder),
+            bool(output_hidden_states),
+        )
+        rows = input_ids.tolist()
+        masks = attention_mask.tolist() if attention_mask is not None else [None] * len(rows)
+        keys = [identity + (tuple(row), tuple(mask) if mask is not None else None) for row, mask in zip(rows, masks)]
+
+        entries = [self._get(key, input_ids.device) for key in keys]
+        if any(entry is None for entry in entries):
+            # Encode the whole batch to keep its shape static
+            self.misses += sum(entry is None for entry in entries)
+            outputs = forward(input_ids, attention_mask=attention_mask, output_hidden_states=output_hidden_states)
+            for i, key in enumerate(keys):
+                if entries[i] is not None or key in self.entries:
+                    continue
+                entry = {}
+                for field, value in outputs.items():
+                    if isinstance(value, tuple):
+                        entry[field] = tuple(tensor[i : i + 1].clone() for tensor in value)
+                    else:
+                        entry[field] = value[i : i + 1].clone()
+                self._put(key, entry)
+            return outputs
+
+        self.hits += len(keys)
+        fields = {}
+        for field, value in entries[0].items():
+            if isinstance(value, tuple):
+                fields[field] = tuple(torch.cat([entry[field][j] for entry in entries]) for j in range(len(value)))
+            else:
+                fields[field] = torch.cat([entry[field] for entry in entries])
+        # Same fields and indexing as the output of the text encoder
+        return ModelOutput(**fields)
+
+    def _path(self, key: Tuple) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(repr(key).encode()).hexdigest() + ".pt")
+
+    def _get(self, key: Tuple, device: torch.device) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            entry = torch.load(self._path(key), map_location=device, weights_only=True)
+            self._put(key, entry, save=False)
+        return entry
+
+    def _put(self, key: Tuple, entry: Dict[str, Any], save: bool = True):
+        if self.cache_dir is not None and save:
+            cpu_entry = {
+                field: tuple(tensor.cpu() for tensor in value) if isinstance(value, tuple) else value.cpu()
+                for field, value in entry.items()
+            }
+            torch.save(cpu_entry, self._path(key))
+
+        size = _entry_size(entry)
+        if size > self.max_memory:
+            return
+        self.entries[key] = entry
+        self.memory += size
+        while self.memory > self.max_memory:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory -= _entry_size(evicted)
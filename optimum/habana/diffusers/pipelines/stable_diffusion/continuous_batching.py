@@ -0,0 +1,330 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+import torch
+from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion import rescale_noise_cfg
+
+from .pipeline_stable_diffusion import retrieve_timesteps
+
+
+if TYPE_CHECKING:
+    from .pipeline_stable_diffusion import GaudiStableDiffusionPipeline
+
+
+@dataclass
+class ImageGenerationRequest:
+    """A prompt submitted to a [`StableDiffusionContinuousBatchingEngine`] and the state of its denoising."""
+
+    request_id: int
+    prompt_embeds: Optional[torch.Tensor]
+    negative_prompt_embeds: Optional[torch.Tensor]
+    latents: Optional[torch.Tensor]
+    step: int = 0
+    slot: Optional[int] = None
+    finished: bool = False
+
+
+@dataclass
+class ImageGenerationOutput:
+    """An image generated by a [`StableDiffusionContinuousBatchingEngine`]."""
+
+    request_id: int
+    image: Any
+    nsfw_content_detected: Optional[bool]
+
+
+class StableDiffusionContinuousBatchingEngine:
+    """
+    Serves image generation requests with timestep-level continuous batching on top of a
+    [`GaudiStableDiffusionPipeline`].
+
+    The engine owns `batch_size` slots making up the static batch of the UNet. Every slot holds a different request
+    that can be at a different denoising step: the UNet is called with one timestep per sample and the scheduler uses
+    the time-dependent parameters of every sample's step (see `set_sample_step_indices` in [`GaudiDDIMScheduler`] and
+    [`GaudiEulerDiscreteScheduler`]). As soon as a request has gone through all the timesteps, its latents are decoded
+    and its slot is given to the next queued request. Shapes never change, so the UNet graph is compiled once and no
+    dummy samples are needed when the number of requests is not a multiple of `batch_size`.
+
+    All the requests share the denoising settings given to the engine, and each of them generates one image. The engine
+    uses its own copy of the pipeline's scheduler, so the pipeline can still be called meanwhile.
+
+    Args:
+        pipeline ([`GaudiStableDiffusionPipeline`]):
+            The pipeline whose models are used.
+        batch_size (`int`):
+            Number of slots, i.e. static batch size of the UNet without classifier-free guidance.
+        num_inference_steps (`int`, *optional*, defaults to 50):
+            The number of denoising steps.
+        guidance_scale (`float`, *optional*, defaults to 7.5):
+            Guidance scale of classifier-free guidance, which is enabled when `guidance_scale > 1`.
+        height (`int`, *optional*, defaults to `pipeline.unet.config.sample_size * pipeline.vae_scale_factor`):
+            The height in pixels of the generated images.
+        width (`int`, *optional*, defaults to `pipeline.unet.config.sample_size * pipeline.vae_scale_factor`):
+            The width in pixels of the generated images.
+        eta (`float`, *optional*, defaults to 0.0):
+            Corresponds to parameter eta (η) from the [DDIM](https://arxiv.org/abs/2010.02502) paper. Only applies
+            to [`GaudiDDIMScheduler`].
+        guidance_rescale (`float`, *optional*, defaults to 0.0):
+            Guidance rescale factor from [Common Diffusion Noise Schedules and Sample Steps are
+            Flawed](https://arxiv.org/pdf/2305.08891.pdf).
+        output_type (`str`, *optional*, defaults to `"pil"`):
+            The output format of the generated images, `"pil"`, `"np"`, `"pt"` or `"latent"`.
+        cross_attention_kwargs (`dict`, *optional*):
+            A kwargs dictionary passed along to the attention processors.
+        clip_skip (`int`, *optional*):
+            Number of layers to be skipped from CLIP while computing the prompt embeddings.
+
+    Example:
+
+    ```python
+    >>> engine = StableDiffusionContinuousBatchingEngine(pipeline, batch_size=8, num_inference_steps=30)
+    >>> request_id = engine.submit("An astronaut riding a horse")
+    >>> for output in engine.stream():
+    ...     output.image.save(f"{output.request_id}.png")
+    ```
+    """
+
+    def __init__(
+        self,
+        pipeline: "GaudiStableDiffusionPipeline",
+        batch_size: int,
+        num_inference_steps: int = 50,
+        guidance_scale: float = 7.5,
+        height: Optional[int] = None,
+        width: Optional[int] = None,
+        eta: float = 0.0,
+        guidance_rescale: float = 0.0,
+        output_type: str = "pil",
+        cross_attention_kwargs: Optional[Dict[str, Any]] = None,
+        clip_skip: Optional[int] = None,
+    ):
+        if pipeline.unet.config.time_cond_proj_dim is not None:
+            raise ValueError("StableDiffusionContinuousBatchingEngine does not support guidance scale embeddings.")
+        scheduler = pipeline.scheduler.__class__.from_config(pipeline.scheduler.config)
+        if not hasattr(scheduler, "set_sample_step_indices"):
+            raise ValueError(
+                f"StableDiffusionContinuousBatchingEngine does not support {scheduler.__class__.__name__}, please use"
+                " `GaudiDDIMScheduler` or `GaudiEulerDiscreteScheduler`."
+            )
+
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+        self.guidance_scale = guidance_scale
+        self.guidance_rescale = guidance_rescale
+        self.do_classifier_free_guidance = guidance_scale > 1
+        self.height = height or pipeline.unet.config.sample_size * pipeline.vae_scale_factor
+        self.width = width or pipeline.unet.config.sample_size * pipeline.vae_scale_factor
+        self.output_type = output_type
+        self.cross_attention_kwargs = cross_attention_kwargs
+        self.clip_skip = clip_skip
+        self.extra_step_kwargs = pipeline.prepare_extra_step_kwargs(None, eta)
+        self.device = pipeline._execution_device
+        self.timesteps, self.num_inference_steps = retrieve_timesteps(scheduler, num_inference_steps, self.device)
+        self.use_torch_autocast = pipeline.use_habana and pipeline.gaudi_config.use_torch_autocast
+
+        # Allocated at the first admission since their dtype and shape depend on the prompt embeddings
+        self.latents = None
+        self.encoder_hidden_states = None
+        self.slots: List[Optional[ImageGenerationRequest]] = [None] * batch_size
+        self.queue: deque[ImageGenerationRequest] = deque()
+        self.requests: Dict[int, ImageGenerationRequest] = {}
+        self._request_ids = itertools.count()
+        self.stats = {"denoising_steps": 0, "active_slot_steps": 0}
+
+    @property
+    def num_active(self) -> int:
+        return sum(request is not None for request in self.slots)
+
+    def has_unfinished_requests(self) -> bool:
+        return self.num_active > 0 or len(self.queue) > 0
+
+    def slot_utilization(self) -> float:
+        """Fraction of the slot-steps run so far that were spent on actual requests rather than on empty slots."""
+        total = self.stats["denoising_steps"] * self.batch_size
+        return self.stats["active_slot_steps"] / total if total else 0.0
+
+    @torch.no_grad()
+    def submit(
+        self,
+        prompt: Optional[str] = None,
+        negative_prompt: Optional[str] = None,
+        prompt_embeds: Optional[torch.Tensor] = None,
+        negative_prompt_embeds: Optional[torch.Tensor] = None,
+        latents: Optional[torch.Tensor] = None,
+        generator: Optional[torch.Generator] = None,
+    ) -> int:
+        """
+        Encodes a prompt, samples its initial latents unless they are given and queues it. Returns its request id.
+        """
+        if prompt is None and prompt_embeds is None:
+            raise ValueError("Provide either `prompt` or `prompt_embeds`.")
+        if prompt is not None and not isinstance(prompt, str):
+            raise ValueError(f"`prompt` has to be a string but is {type(prompt)}, submit one request per prompt.")
+
+        with torch.autocast(device_type="hpu", dtype=torch.bfloat16, enabled=self.use_torch_autocast):
+            lora_scale = (
+                self.cross_attention_kwargs.get("scale", None) if self.cross_attention_kwargs is not None else None
+            )
+            prompt_embeds, negative_prompt_embeds = self.pipeline.encode_prompt(
+                prompt,
+                self.device,
+                1,
+                self.do_classifier_free_guidance,
+                negative_prompt,
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                lora_scale=lora_scale,
+                clip_skip=self.clip_skip,
+            )
+        if prompt_embeds.shape[0] != 1:
+            raise ValueError(f"Got {prompt_embeds.shape[0]} prompt embeddings, submit one request per prompt.")
+
+        shape = (
+            1,
+            self.pipeline.unet.config.in_channels,
+            self.height // self.pipeline.vae_scale_factor,
+            self.width // self.pipeline.vae_scale_factor,
+        )
+        if latents is None:
+            # torch.randn is broken on HPU so running it on CPU
+            rand_device = "cpu" if self.device.type == "hpu" else self.device
+            latents = torch.randn(shape, generator=generator, device=rand_device, dtype=prompt_embeds.dtype)
+        elif latents.shape != shape:
+            raise ValueError(f"Unexpected latents shape, got {latents.shape}, expected {shape}")
+        latents = latents.to(self.device) * self.scheduler.init_noise_sigma
+
+        request = ImageGenerationRequest(next(self._request_ids), prompt_embeds, negative_prompt_embeds, latents)
+        self.requests[request.request_id] = request
+        self.queue.append(request)
+        return request.request_id
+
+    def _admit(self):
+        free_slots = [slot for slot, request in enumerate(self.slots) if request is None]
+        while free_slots and self.queue:
+            request = self.queue.popleft()
+            slot = free_slots.pop(0)
+            if self.latents is None:
+                self.latents = request.latents.new_zeros((self.batch_size, *request.latents.shape[1:]))
+                num_embeddings = 2 * self.batch_size if self.do_classifier_free_guidance else self.batch_size
+                self.encoder_hidden_states = request.prompt_embeds.new_zeros(
+                    (num_embeddings, *request.prompt_embeds.shape[1:])
+                )
+
+            self.latents[slot] = request.latents[0]
+            if self.do_classifier_free_guidance:
+                # Same layout as the pipeline: unconditional embeddings first
+                self.encoder_hidden_states[slot] = request.negative_prompt_embeds[0]
+                self.encoder_hidden_states[self.batch_size + slot] = request.prompt_embeds[0]
+            else:
+                self.encoder_hidden_states[slot] = request.prompt_embeds[0]
+            request.prompt_embeds = request.negative_prompt_embeds = request.latents = None
+            request.slot = slot
+            self.slots[slot] = request
+
+    def _denoise(self):
+        step_indices = torch.tensor(
+            [request.step if request is not None else 0 for request in self.slots], device=self.device
+        )
+        timesteps = self.timesteps[step_indices]
+        self.scheduler.set_sample_step_indices(step_indices)
+
+        latent_model_input = self.scheduler.scale_model_input(self.latents, timesteps).to(self.latents.dtype)
+        timestep_model_input = timesteps
+        if self.do_classifier_free_guidance:
+            latent_model_input = torch.cat([latent_model_input] * 2)
+            timestep_model_input = torch.cat([timesteps] * 2)
+
+        noise_pred = self.pipeline.unet_hpu(
+            latent_model_input,
+            timestep_model_input,
+            self.encoder_hidden_states,
+            None,
+            self.cross_attention_kwargs,
+            None,
+        )
+
+        if self.do_classifier_free_guidance:
+            noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+            noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
+            if self.guidance_rescale > 0.0:
+                noise_pred = rescale_noise_cfg(noise_pred, noise_pred_text, guidance_rescale=self.guidance_rescale)
+
+        latents = self.scheduler.step(noise_pred, timesteps, self.latents, **self.extra_step_kwargs, return_dict=False)
+        self.latents = latents[0].to(self.latents.dtype)
+        self.scheduler.set_sample_step_indices(None)
+
+        if self.pipeline.use_habana and not self.pipeline.use_hpu_graphs:
+            self.pipeline.htcore.mark_step()
+
+    def _decode(self, latents: torch.Tensor):
+        """Decodes the latents of one finished request, one at a time so that the VAE graph is static too."""
+        if self.output_type == "latent":
+            return latents[0].clone(), None
+
+        image = self.pipeline.vae.decode(latents / self.pipeline.vae.config.scaling_factor, return_dict=False)[0]
+        image, has_nsfw_concept = self.pipeline.run_safety_checker(
+            image, self.device, self.encoder_hidden_states.dtype
+        )
+        do_denormalize = [True] if has_nsfw_concept is None else [not has_nsfw_concept[0]]
+        image = self.pipeline.image_processor.postprocess(
+            image, output_type=self.output_type, do_denormalize=do_denormalize
+        )
+        return image[0], has_nsfw_concept[0] if has_nsfw_concept is not None else None
+
+    @torch.no_grad()
+    def step(self) -> List[ImageGenerationOutput]:
+        """
+        Runs one scheduling iteration: admits queued requests into free slots, then runs one denoising step for all
+        the slots and decodes the requests that went through all the timesteps. Returns their images.
+        """
+        self._admit()
+        if self.num_active == 0:
+            return []
+
+        with torch.autocast(device_type="hpu", dtype=torch.bfloat16, enabled=self.use_torch_autocast):
+            self._denoise()
+            self.stats["denoising_steps"] += 1
+            self.stats["active_slot_steps"] += self.num_active
+
+            outputs = []
+            for slot, request in enumerate(self.slots):
+                if request is None:
+                    continue
+                request.step += 1
+                if request.step < self.num_inference_steps:
+                    continue
+                image, has_nsfw_concept = self._decode(self.latents[slot : slot + 1])
+                outputs.append(ImageGenerationOutput(request.request_id, image, has_nsfw_concept))
+                request.finished = True
+                request.slot = None
+                self.slots[slot] = None
+                # Empty slots are denoised like the dummy samples of the pipeline
+                self.latents[slot] = 0
+        return outputs
+
+    def stream(self) -> Iterator[ImageGenerationOutput]:
+        """Runs the engine until all the submitted requests are finished, yielding images as they are generated."""
+        while self.has_unfinished_requests():
+            yield from self.step()
+
+    def run(self) -> Dict[int, ImageGenerationOutput]:
+        """Runs the engine until all the submitted requests are finished and returns their outputs by request id."""
+        return {output.request_id: output for output in self.stream()}
@@ -32,8 +32,14 @@ from transformers import CLIPImageProcessor, CLIPTextModel, CLIPTokenizer, CLIPV
 
 from ....transformers.gaudi_configuration import GaudiConfig
 from ....utils import HabanaProfile, speed_metrics, warmup_inference_steps_time_adjustment
-from ...models.unet_2d_condition import set_default_attn_processor_hpu
-from ..pipeline_utils import GaudiDiffusionPipeline
+from ...models.unet_2d_condition import gaudi_unet_2d_condition_model_forward, set_default_attn_processor_hpu
+from ..pipeline_utils import (
+    GaudiDiffusionPipeline,
+    PipelinedDecoder,
+    get_cfg_truncation_step,
+    get_deep_cache_schedule,
+    has_cfg_converged,
+)
 
 
 logger = logging.get_logger(__name__)
@@ -281,6 +287,12 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
         callback_on_step_end_tensor_inputs: List[str] = ["latents"],
         profiling_warmup_steps: Optional[int] = 0,
         profiling_steps: Optional[int] = 0,
+        pipelined_decode: bool = False,
+        deep_cache_interval: int = 1,
+        deep_cache_depth: int = 1,
+        deep_cache_refresh_steps: Optional[List[int]] = None,
+        cfg_truncation_fraction: Optional[float] = None,
+        cfg_truncation_threshold: Optional[float] = None,
         **kwargs,
     ):
         r"""
@@ -355,6 +367,25 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
                 Number of steps to ignore for profling.
             profiling_steps (`int`, *optional*):
                 Number of steps to be captured when enabling profiling.
+            pipelined_decode (`bool`, *optional*, defaults to `False`):
+                Whether to decode, check and post-process each batch in a background thread, on a separate stream on
+                Gaudi, while the next batches are denoised.
+            deep_cache_interval (`int`, *optional*, defaults to 1):
+                Number of consecutive denoising steps sharing the deep features of the UNet, which are only computed
+                at the first one. The default value disables feature caching.
+            deep_cache_depth (`int`, *optional*, defaults to 1):
+                Number of down and up blocks of the UNet that are still computed at every step when the deep features
+                are cached.
+            deep_cache_refresh_steps (`List[int]`, *optional*):
+                Indices of the denoising steps computing the deep features of the UNet, which replaces
+                `deep_cache_interval`.
+            cfg_truncation_fraction (`float`, *optional*):
+                Fraction of the denoising steps after which classifier-free guidance is dropped, the UNet then only
+                predicting the noise of the conditional half of the batch.
+            cfg_truncation_threshold (`float`, *optional*):
+                Classifier-free guidance is dropped for the remaining steps of a batch once the conditional and
+                unconditional noise predictions differ by less than this value relative to the norm of the conditional
+                one. This requires a host-device synchronization at every guided step.
 
         Returns:
             [`~diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.GaudiStableDiffusionPipelineOutput`] or `tuple`:
@@ -497,12 +528,36 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
             )
             hb_profiler.start()
 
+            if pipelined_decode:
+
+                def decode_batch(latents_batch, num_samples):
+                    if not output_type == "latent":
+                        image = self.vae.decode(
+                            latents_batch / self.vae.config.scaling_factor, return_dict=False, generator=generator
+                        )[0]
+                    else:
+                        image = latents_batch
+                    return self._postprocess_batch(image[:num_samples], output_type, device, prompt_embeds.dtype)
+
+                decoder = PipelinedDecoder(
+                    decode_batch, use_habana=self.use_habana, use_torch_autocast=self.gaudi_config.use_torch_autocast
+                )
+
             # 8. Denoising loop
             throughput_warmup_steps = kwargs.get("throughput_warmup_steps", 3)
             use_warmup_inference_steps = (
                 num_batches <= throughput_warmup_steps and num_inference_steps > throughput_warmup_steps
             )
 
+            use_deep_cache = deep_cache_interval > 1 or deep_cache_refresh_steps is not None
+            if use_deep_cache:
+                deep_cache_schedule = get_deep_cache_schedule(
+                    len(timesteps), deep_cache_interval, deep_cache_refresh_steps
+                )
+                deep_cache_features = None
+
+            cfg_truncation_step = get_cfg_truncation_step(len(timesteps), cfg_truncation_fraction)
+
             for j in self.progress_bar(range(num_batches)):
                 # The throughput is calculated from the 3rd iteration
                 # because compilation occurs in the first two iterations
@@ -515,6 +570,8 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
                 latents_batches = torch.roll(latents_batches, shifts=-1, dims=0)
                 text_embeddings_batch = text_embeddings_batches[0]
                 text_embeddings_batches = torch.roll(text_embeddings_batches, shifts=-1, dims=0)
+                do_classifier_free_guidance = self.do_classifier_free_guidance
+                cfg_converged = False
 
                 for i in range(len(timesteps)):
                     if use_warmup_inference_steps and i == throughput_warmup_steps:
@@ -526,28 +583,53 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
                     timestep = timesteps[0]
                     timesteps = torch.roll(timesteps, shifts=-1, dims=0)
 
+                    if do_classifier_free_guidance and (cfg_converged or i >= cfg_truncation_step):
+                        # Switch to the graph of the conditional half of the batch for the remaining steps
+                        do_classifier_free_guidance = False
+                        text_embeddings_batch = text_embeddings_batch.chunk(2)[1]
+                        if use_deep_cache and deep_cache_features is not None:
+                            deep_cache_features = deep_cache_features.chunk(2)[1]
+
                     # expand the latents if we are doing classifier free guidance
                     latent_model_input = (
-                        torch.cat([latents_batch] * 2) if self.do_classifier_free_guidance else latents_batch
+                        torch.cat([latents_batch] * 2) if do_classifier_free_guidance else latents_batch
                     )
                     latent_model_input = self.scheduler.scale_model_input(latent_model_input, timestep)
 
                     # predict the noise residual
-                    noise_pred = self.unet_hpu(
-                        latent_model_input,
-                        timestep,
-                        text_embeddings_batch,
-                        timestep_cond,
-                        self.cross_attention_kwargs,
-                        added_cond_kwargs,
-                    )
+                    if use_deep_cache:
+                        noise_pred, features = self.unet_hpu(
+                            latent_model_input,
+                            timestep,
+                            text_embeddings_batch,
+                            timestep_cond,
+                            self.cross_attention_kwargs,
+                            added_cond_kwargs,
+                            deep_cache_depth=deep_cache_depth,
+                            deep_cache_features=None if deep_cache_schedule[i] else deep_cache_features,
+                        )
+                        if deep_cache_schedule[i]:
+                            deep_cache_features = features
+                    else:
+                        noise_pred = self.unet_hpu(
+                            latent_model_input,
+                            timestep,
+                            text_embeddings_batch,
+                            timestep_cond,
+                            self.cross_attention_kwargs,
+                            added_cond_kwargs,
+                        )
 
                     # perform guidance
-                    if self.do_classifier_free_guidance:
+                    if do_classifier_free_guidance:
                         noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                         noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
+                        if cfg_truncation_threshold is not None:
+                            cfg_converged = has_cfg_converged(
+                                noise_pred_uncond, noise_pred_text, cfg_truncation_threshold
+                            )
 
-                    if self.do_classifier_free_guidance and self.guidance_rescale > 0.0:
+                    if do_classifier_free_guidance and self.guidance_rescale > 0.0:
                         # Based on 3.4. in https://arxiv.org/pdf/2305.08891.pdf
                         noise_pred = rescale_noise_cfg(
                             noise_pred, noise_pred_text, guidance_rescale=self.guidance_rescale
@@ -583,18 +665,25 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
                         t1, t1_inf, num_inference_steps, throughput_warmup_steps
                     )
 
-                if not output_type == "latent":
+                if pipelined_decode:
+                    # Dummy samples are decoded to keep the shapes static but not checked
+                    num_samples = batch_size - num_dummy_samples if j == num_batches - 1 else batch_size
+                    decoder.submit(latents_batch, num_samples)
+                elif not output_type == "latent":
                     # 8. Post-processing
                     image = self.vae.decode(
                         latents_batch / self.vae.config.scaling_factor, return_dict=False, generator=generator
                     )[0]
+                    outputs["images"].append(image)
                 else:
-                    image = latents_batch
-                outputs["images"].append(image)
+                    outputs["images"].append(latents_batch)
 
                 if not self.use_hpu_graphs:
                     self.htcore.mark_step()
 
+            if pipelined_decode:
+                processed_batches = decoder.gather()
+
             hb_profiler.stop()
 
             speed_metrics_prefix = "generation"
@@ -614,27 +703,19 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
             )
             logger.info(f"Speed metrics: {speed_measures}")
 
-            # Remove dummy generations if needed
-            if num_dummy_samples > 0:
-                outputs["images"][-1] = outputs["images"][-1][:-num_dummy_samples]
-
-            # Process generated images
-            for i, image in enumerate(outputs["images"][:]):
-                if i == 0:
-                    outputs["images"].clear()
-
-                if output_type == "latent":
-                    has_nsfw_concept = None
-                else:
-                    image, has_nsfw_concept = self.run_safety_checker(image, device, prompt_embeds.dtype)
-
-                if has_nsfw_concept is None:
-                    do_denormalize = [True] * image.shape[0]
-                else:
-                    do_denormalize = [not has_nsfw for has_nsfw in has_nsfw_concept]
+            if not pipelined_decode:
+                # Remove dummy generations if needed
+                if num_dummy_samples > 0:
+                    outputs["images"][-1] = outputs["images"][-1][:-num_dummy_samples]
 
-                image = self.image_processor.postprocess(image, output_type=output_type, do_denormalize=do_denormalize)
+                processed_batches = [
+                    self._postprocess_batch(image, output_type, device, prompt_embeds.dtype)
+                    for image in outputs["images"]
+                ]
 
+            # Process generated images
+            outputs["images"] = []
+            for image, has_nsfw_concept in processed_batches:
                 if output_type == "pil" and isinstance(image, list):
                     outputs["images"] += image
                 elif output_type in ["np", "numpy"] and isinstance(image, np.ndarray):
@@ -665,6 +746,21 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
                 throughput=speed_measures[f"{speed_metrics_prefix}_samples_per_second"],
             )
 
+    def _postprocess_batch(self, image, output_type, device, dtype):
+        """Runs the safety checker on a batch of decoded images and converts them to `output_type`."""
+        if output_type == "latent":
+            has_nsfw_concept = None
+        else:
+            image, has_nsfw_concept = self.run_safety_checker(image, device, dtype)
+
+        if has_nsfw_concept is None:
+            do_denormalize = [True] * image.shape[0]
+        else:
+            do_denormalize = [not has_nsfw for has_nsfw in has_nsfw_concept]
+
+        image = self.image_processor.postprocess(image, output_type=output_type, do_denormalize=do_denormalize)
+        return image, has_nsfw_concept
+
     @torch.no_grad()
     def unet_hpu(
         self,
@@ -674,9 +770,27 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
         timestep_cond,
         cross_attention_kwargs,
         added_cond_kwargs,
+        deep_cache_depth=None,
+        deep_cache_features=None,
     ):
         if self.use_hpu_graphs:
-            return self.capture_replay(latent_model_input, timestep, encoder_hidden_states)
+            return self.capture_replay(
+                latent_model_input, timestep, encoder_hidden_states, deep_cache_depth, deep_cache_features
+            )
+        elif deep_cache_depth is not None:
+            # Deep features are only supported by the Gaudi forward, which may not be installed
+            return gaudi_unet_2d_condition_model_forward(
+                self.unet,
+                latent_model_input,
+                timestep,
+                encoder_hidden_states=encoder_hidden_states,
+                timestep_cond=timestep_cond,
+                cross_attention_kwargs=cross_attention_kwargs,
+                added_cond_kwargs=added_cond_kwargs,
+                return_dict=False,
+                deep_cache_depth=deep_cache_depth,
+                deep_cache_features=deep_cache_features,
+            )
         else:
             return self.unet(
                 latent_model_input,
@@ -689,8 +803,13 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
             )[0]
 
     @torch.no_grad()
-    def capture_replay(self, latent_model_input, timestep, encoder_hidden_states):
+    def capture_replay(
+        self, latent_model_input, timestep, encoder_hidden_states, deep_cache_depth=None, deep_cache_features=None
+    ):
         inputs = [latent_model_input, timestep, encoder_hidden_states, False]
+        if deep_cache_depth is not None:
+            # Full and cached steps are captured in different graphs
+            inputs += [deep_cache_depth, deep_cache_features]
         h = self.ht.hpu.graphs.input_hash(inputs)
         cached = self.cache.get(h)
 
@@ -699,7 +818,18 @@ class GaudiStableDiffusionPipeline(GaudiDiffusionPipeline, StableDiffusionPipeli
             with self.ht.hpu.stream(self.hpu_stream):
                 graph = self.ht.hpu.HPUGraph()
                 graph.capture_begin()
-                outputs = self.unet(inputs[0], inputs[1], inputs[2], inputs[3])[0]
+                if deep_cache_depth is None:
+                    outputs = self.unet(inputs[0], inputs[1], inputs[2], inputs[3])[0]
+                else:
+                    outputs = gaudi_unet_2d_condition_model_forward(
+                        self.unet,
+                        inputs[0],
+                        inputs[1],
+                        inputs[2],
+                        return_dict=False,
+                        deep_cache_depth=inputs[4],
+                        deep_cache_features=inputs[5],
+                    )
                 graph.capture_end()
                 graph_inputs = inputs
                 graph_outputs = outputs
@@ -43,7 +43,14 @@ from transformers import (
 from ....transformers.gaudi_configuration import GaudiConfig
 from ....utils import HabanaProfile, speed_metrics, warmup_inference_steps_time_adjustment
 from ...models.attention_processor import GaudiJointAttnProcessor2_0
-from ..pipeline_utils import GaudiDiffusionPipeline
+from ...models.transformers.transformer_sd3 import gaudi_sd3_transformer_2d_model_forward
+from ..pipeline_utils import (
+    GaudiDiffusionPipeline,
+    PipelinedDecoder,
+    get_cfg_truncation_step,
+    get_deep_cache_schedule,
+    has_cfg_converged,
+)
 
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
@@ -173,6 +180,8 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
 
         for block in self.transformer.transformer_blocks:
             block.attn.processor = GaudiJointAttnProcessor2_0(is_training)
+        # Gaudi forward supporting deep feature caching
+        SD3Transformer2DModel.forward = gaudi_sd3_transformer_2d_model_forward
 
         self.to(self._device)
 
@@ -297,6 +306,12 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
         use_distributed_cfg: bool = False,
         profiling_warmup_steps: Optional[int] = 0,
         profiling_steps: Optional[int] = 0,
+        pipelined_decode: bool = False,
+        deep_cache_interval: int = 1,
+        deep_cache_depth: int = 1,
+        deep_cache_refresh_steps: Optional[List[int]] = None,
+        cfg_truncation_fraction: Optional[float] = None,
+        cfg_truncation_threshold: Optional[float] = None,
         **kwargs,
     ):
         r"""
@@ -397,6 +412,25 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                 Number of steps to ignore for profling.
             profiling_steps (`int`, *optional*):
                 Number of steps to be captured when enabling profiling.
+            pipelined_decode (`bool`, *optional*, defaults to `False`):
+                Whether to decode and post-process each batch in a background thread, on a separate stream, while the
+                next batches are denoised.
+            deep_cache_interval (`int`, *optional*, defaults to 1):
+                Number of consecutive denoising steps sharing the output of the deep blocks of the transformer, which
+                is only computed at the first one. The default value disables feature caching.
+            deep_cache_depth (`int`, *optional*, defaults to 1):
+                Number of first and last blocks of the transformer that are still computed at every step when the
+                output of the deep blocks is cached.
+            deep_cache_refresh_steps (`List[int]`, *optional*):
+                Indices of the denoising steps computing the deep blocks of the transformer, which replaces
+                `deep_cache_interval`.
+            cfg_truncation_fraction (`float`, *optional*):
+                Fraction of the denoising steps after which classifier-free guidance is dropped, the transformer then
+                only predicting the noise of the conditional half of the batch.
+            cfg_truncation_threshold (`float`, *optional*):
+                Classifier-free guidance is dropped for the remaining steps of a batch once the conditional and
+                unconditional noise predictions differ by less than this value relative to the norm of the conditional
+                one. This requires a host-device synchronization at every guided step.
 
         Examples:
 
@@ -585,6 +619,18 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                 "images": [],
             }
 
+            if pipelined_decode:
+                decoder = PipelinedDecoder(self._decode_batch, use_habana=True)
+
+            use_deep_cache = deep_cache_interval > 1 or deep_cache_refresh_steps is not None
+            if use_deep_cache:
+                deep_cache_schedule = get_deep_cache_schedule(
+                    len(timesteps), deep_cache_interval, deep_cache_refresh_steps
+                )
+                deep_cache_features = None
+
+            cfg_truncation_step = get_cfg_truncation_step(len(timesteps), cfg_truncation_fraction)
+
             ht.hpu.synchronize()
 
             t0 = time.time()
@@ -598,6 +644,8 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                 text_embeddings_batches = torch.roll(text_embeddings_batches, shifts=-1, dims=0)
                 pooled_prompt_embeddings_batch = pooled_prompt_embeddings_batches[0]
                 pooled_prompt_embeddings_batches = torch.roll(pooled_prompt_embeddings_batches, shifts=-1, dims=0)
+                do_classifier_free_guidance = self.do_classifier_free_guidance
+                cfg_converged = False
 
                 if hasattr(self.scheduler, "_init_step_index"):
                     # Reset scheduler step index for next batch
@@ -618,15 +666,35 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                     if self.interrupt:
                         continue
 
+                    if do_classifier_free_guidance and (cfg_converged or i >= cfg_truncation_step):
+                        # Switch to the graph of the conditional half of the batch for the remaining steps, which
+                        # every rank computes when the guidance is distributed
+                        do_classifier_free_guidance = False
+                        text_embeddings_batch = text_embeddings_batch.chunk(2)[1]
+                        pooled_prompt_embeddings_batch = pooled_prompt_embeddings_batch.chunk(2)[1]
+                        if use_deep_cache and deep_cache_features is not None:
+                            if not use_distributed_cfg:
+                                deep_cache_features = deep_cache_features.chunk(2)[1]
+                            elif rank % 2 == 0:
+                                # The features of the unconditional branch are refreshed at the next step
+                                deep_cache_features = None
+
                     # expand the latents if we are doing classifier free guidance
                     latent_model_input = (
-                        torch.cat([latents_batch] * 2) if self.do_classifier_free_guidance else latents_batch
+                        torch.cat([latents_batch] * 2) if do_classifier_free_guidance else latents_batch
                     )
                     # broadcast to batch dimension in a way that's compatible with ONNX/Core ML
                     timestep_batch = timestep.expand(latent_model_input.shape[0])
 
+                    deep_cache_kwargs = {}
+                    if use_deep_cache:
+                        deep_cache_kwargs["deep_cache_depth"] = deep_cache_depth
+                        deep_cache_kwargs["deep_cache_features"] = (
+                            None if deep_cache_schedule[i] else deep_cache_features
+                        )
+
                     # noise prediction (transformer call)
-                    if use_distributed_cfg and self.do_classifier_free_guidance:
+                    if use_distributed_cfg and do_classifier_free_guidance:
                         idx = rank % 2
                         noise_pred_b1 = self.transformer_hpu(
                             latent_model_input[idx : idx + 1],
@@ -634,16 +702,20 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                             text_embeddings_batch[idx : idx + 1],
                             pooled_prompt_embeddings_batch[idx : idx + 1],
                             self.joint_attention_kwargs,
+                            **deep_cache_kwargs,
                         )
+                        if use_deep_cache:
+                            noise_pred_b1, features = noise_pred_b1
                         noise_pred_b2 = torch.zeros_like(noise_pred_b1)
                         send_req = dist.isend(tensor=noise_pred_b1, dst=rank ^ 1)
                         recv_req = dist.irecv(tensor=noise_pred_b2, src=rank ^ 1)
                         send_req.wait()
                         recv_req.wait()
                         if idx == 0:
-                            noise_pred = noise_pred_b1 + self.guidance_scale * (noise_pred_b2 - noise_pred_b1)
+                            noise_pred_uncond, noise_pred_text = noise_pred_b1, noise_pred_b2
                         else:
-                            noise_pred = noise_pred_b2 + self.guidance_scale * (noise_pred_b1 - noise_pred_b2)
+                            noise_pred_uncond, noise_pred_text = noise_pred_b2, noise_pred_b1
+                        noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
                     else:
                         noise_pred = self.transformer_hpu(
                             latent_model_input,
@@ -651,15 +723,24 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                             text_embeddings_batch,
                             pooled_prompt_embeddings_batch,
                             self.joint_attention_kwargs,
+                            **deep_cache_kwargs,
                         )
+                        if use_deep_cache:
+                            noise_pred, features = noise_pred
 
                         # perform guidance
-                        if self.do_classifier_free_guidance:
+                        if do_classifier_free_guidance:
                             noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                             noise_pred = noise_pred_uncond + self.guidance_scale * (
                                 noise_pred_text - noise_pred_uncond
                             )
 
+                    if do_classifier_free_guidance and cfg_truncation_threshold is not None:
+                        cfg_converged = has_cfg_converged(noise_pred_uncond, noise_pred_text, cfg_truncation_threshold)
+
+                    if use_deep_cache and (deep_cache_schedule[i] or deep_cache_features is None):
+                        deep_cache_features = features
+
                     # compute the previous noisy sample x_t -> x_t-1
                     latents_dtype = latents_batch.dtype
                     latents_batch = self.scheduler.step(noise_pred, timestep, latents_batch, return_dict=False)[0]
@@ -686,15 +767,14 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                     hb_profiler.step()
                     htcore.mark_step(sync=True)
 
-                if output_type == "latent":
-                    image = latents_batch
-
+                if pipelined_decode:
+                    num_samples = batch_size - num_dummy_samples if j == num_batches - 1 else batch_size
+                    decoder.submit(latents_batch, output_type, num_samples)
                 else:
-                    latents_batch = (latents_batch / self.vae.config.scaling_factor) + self.vae.config.shift_factor
-                    image = self.vae.decode(latents_batch, return_dict=False)[0]
-                    image = self.image_processor.postprocess(image, output_type=output_type)
+                    outputs["images"].append(self._decode_batch(latents_batch, output_type))
 
-                outputs["images"].append(image)
+            if pipelined_decode:
+                outputs["images"] = decoder.gather()
 
             # End of Denoising loop
 
@@ -724,7 +804,7 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
 
             # 8 Output Images
             # Remove dummy generations if needed
-            if num_dummy_samples > 0:
+            if num_dummy_samples > 0 and not pipelined_decode:
                 outputs["images"][-1] = outputs["images"][-1][:-num_dummy_samples]
 
             # Process generated images
@@ -758,6 +838,15 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                 throughput=speed_measures[f"{speed_metrics_prefix}_samples_per_second"],
             )
 
+    def _decode_batch(self, latents_batch, output_type, num_samples=None):
+        """Decodes and post-processes the first `num_samples` samples of a batch of denoised latents."""
+        latents_batch = latents_batch[:num_samples]
+        if output_type == "latent":
+            return latents_batch
+        latents_batch = (latents_batch / self.vae.config.scaling_factor) + self.vae.config.shift_factor
+        image = self.vae.decode(latents_batch, return_dict=False)[0]
+        return self.image_processor.postprocess(image, output_type=output_type)
+
     @torch.no_grad()
     def transformer_hpu(
         self,
@@ -766,6 +855,8 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
         text_embeddings_batch,
         pooled_prompt_embeddings_batch,
         joint_attention_kwargs,
+        deep_cache_depth=None,
+        deep_cache_features=None,
     ):
         if self.use_hpu_graphs:
             return self.capture_replay(
@@ -774,6 +865,19 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                 text_embeddings_batch,
                 pooled_prompt_embeddings_batch,
                 joint_attention_kwargs,
+                deep_cache_depth,
+                deep_cache_features,
+            )
+        elif deep_cache_depth is not None:
+            return self.transformer(
+                hidden_states=latent_model_input,
+                timestep=timestep,
+                encoder_hidden_states=text_embeddings_batch,
+                pooled_projections=pooled_prompt_embeddings_batch,
+                joint_attention_kwargs=joint_attention_kwargs,
+                return_dict=False,
+                deep_cache_depth=deep_cache_depth,
+                deep_cache_features=deep_cache_features,
             )
         else:
             return self.transformer(
@@ -793,6 +897,8 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
         encoder_hidden_states,
         pooled_prompt_embeddings_batch,
         joint_attention_kwargs,
+        deep_cache_depth=None,
+        deep_cache_features=None,
     ):
         inputs = [
             latent_model_input,
@@ -801,6 +907,9 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
             pooled_prompt_embeddings_batch,
             joint_attention_kwargs,
         ]
+        if deep_cache_depth is not None:
+            # Full and cached steps are captured in different graphs
+            inputs += [deep_cache_depth, deep_cache_features]
         h = self.ht.hpu.graphs.input_hash(inputs)
         cached = self.cache.get(h)
 
@@ -810,14 +919,26 @@ class GaudiStableDiffusion3Pipeline(GaudiDiffusionPipeline, StableDiffusion3Pipe
                 graph = self.ht.hpu.HPUGraph()
                 graph.capture_begin()
 
-                outputs = self.transformer(
-                    hidden_states=inputs[0],
-                    timestep=inputs[1],
-                    encoder_hidden_states=inputs[2],
-                    pooled_projections=inputs[3],
-                    joint_attention_kwargs=inputs[4],
-                    return_dict=False,
-                )[0]
+                if deep_cache_depth is None:
+                    outputs = self.transformer(
+                        hidden_states=inputs[0],
+                        timestep=inputs[1],
+                        encoder_hidden_states=inputs[2],
+                        pooled_projections=inputs[3],
+                        joint_attention_kwargs=inputs[4],
+                        return_dict=False,
+                    )[0]
+                else:
+                    outputs = self.transformer(
+                        hidden_states=inputs[0],
+                        timestep=inputs[1],
+                        encoder_hidden_states=inputs[2],
+                        pooled_projections=inputs[3],
+                        joint_attention_kwargs=inputs[4],
+                        return_dict=False,
+                        deep_cache_depth=inputs[5],
+                        deep_cache_features=inputs[6],
+                    )
 
                 graph.capture_end()
                 graph_inputs = inputs
@@ -113,6 +113,7 @@ class GaudiDDIMScheduler(DDIMScheduler):
         )
 
         self.reset_timestep_dependent_params()
+        self.sample_step_indices = None
 
     def reset_timestep_dependent_params(self):
         self.are_timestep_dependent_params_set = False
@@ -120,6 +121,20 @@ class GaudiDDIMScheduler(DDIMScheduler):
         self.alpha_prod_t_prev_list = []
         self.variance_list = []
 
+    def set_sample_step_indices(self, step_indices: Optional[torch.LongTensor]):
+        """
+        Makes `step` use the time-dependent parameters of a different step for every sample of the batch instead of
+        rolling them, so that samples which started denoising at different times can share a batch.
+
+        Args:
+            step_indices (`torch.LongTensor`, *optional*):
+                The index of the current step of every sample in `self.timesteps`. `None` restores the default
+                behavior.
+        """
+        if step_indices is not None and not self.are_timestep_dependent_params_set:
+            self.get_params()
+        self.sample_step_indices = step_indices
+
     def get_params(self, timestep: Optional[int] = None):
         """
         Initialize the time-dependent parameters, and retrieve the time-dependent
@@ -148,6 +163,14 @@ class GaudiDDIMScheduler(DDIMScheduler):
             self.variance_list = torch.stack(self.variance_list)
             self.are_timestep_dependent_params_set = True
 
+        if self.sample_step_indices is not None:
+            # One value per sample, shaped to be broadcast to the samples
+            index = self.sample_step_indices
+            alpha_prod_t = self.alpha_prod_t_list.to(index.device)[index].view(-1, 1, 1, 1)
+            alpha_prod_t_prev = self.alpha_prod_t_prev_list.to(index.device)[index].view(-1, 1, 1, 1)
+            variance = self.variance_list.to(index.device)[index].view(-1, 1, 1, 1)
+            return alpha_prod_t, alpha_prod_t_prev, variance
+
         alpha_prod_t = self.alpha_prod_t_list[0]
         alpha_prod_t_prev = self.alpha_prod_t_prev_list[0]
         variance = self.variance_list[0]
@@ -158,6 +181,9 @@ class GaudiDDIMScheduler(DDIMScheduler):
         """
         Roll tensors to update the values of the time-dependent parameters at each timestep.
         """
+        if self.sample_step_indices is not None:
+            # The caller advances the step of every sample
+            return
         if self.are_timestep_dependent_params_set:
             self.alpha_prod_t_list = torch.roll(self.alpha_prod_t_list, shifts=-1, dims=0)
             self.alpha_prod_t_prev_list = torch.roll(self.alpha_prod_t_prev_list, shifts=-1, dims=0)
@@ -113,13 +113,39 @@ class GaudiEulerDiscreteScheduler(EulerDiscreteScheduler):
         self._initial_timestep = None
         self.reset_timestep_dependent_params()
         self.hpu_opt = False
+        self.sample_step_indices = None
 
     def reset_timestep_dependent_params(self):
         self.are_timestep_dependent_params_set = False
         self.sigma_list = []
         self.sigma_next_list = []
 
+    def set_sample_step_indices(self, step_indices: Optional[torch.LongTensor]):
+        """
+        Makes `scale_model_input` and `step` use the time-dependent parameters of a different step for every sample of
+        the batch instead of rolling them, so that samples which started denoising at different times can share a
+        batch. Not supported with `hpu_opt`.
+
+        Args:
+            step_indices (`torch.LongTensor`, *optional*):
+                The index of the current step of every sample in `self.timesteps`. `None` restores the default
+                behavior.
+        """
+        if step_indices is not None:
+            if self.hpu_opt:
+                raise ValueError("Per-sample steps are not supported with `hpu_opt`.")
+            if not self.are_timestep_dependent_params_set:
+                self.get_params(self.timesteps[0])
+        self.sample_step_indices = step_indices
+
     def get_params(self, timestep: Union[float, torch.FloatTensor]):
+        if self.sample_step_indices is not None:
+            # One value per sample, shaped to be broadcast to the samples
+            index = self.sample_step_indices
+            sigma = self.sigma_list.to(index.device)[index].view(-1, 1, 1, 1)
+            sigma_next = self.sigma_next_list.to(index.device)[index].view(-1, 1, 1, 1)
+            return sigma, sigma_next
+
         if self.step_index is None:
             self._init_step_index(timestep)
 
@@ -144,6 +170,9 @@ class GaudiEulerDiscreteScheduler(EulerDiscreteScheduler):
         """
         Roll tensors to update the values of the time-dependent parameters at each timestep.
         """
+        if self.sample_step_indices is not None:
+            # The caller advances the step of every sample
+            return
         if self.are_timestep_dependent_params_set:
             self.sigma_list = torch.roll(self.sigma_list, shifts=-1, dims=0)
             self.sigma_next_list = torch.roll(self.sigma_next_list, shifts=-1, dims=0)
@@ -252,6 +281,8 @@ class GaudiEulerDiscreteScheduler(EulerDiscreteScheduler):
 
         if self.hpu_opt and sigma.device.type == "hpu":
             gamma = min(s_churn / (len(self.sigmas) - 1), 2**0.5 - 1)
+        elif self.sample_step_indices is not None:
+            gamma = min(s_churn / (len(self.sigmas) - 1), 2**0.5 - 1) * ((s_tmin <= sigma) & (sigma <= s_tmax))
         else:
             gamma = min(s_churn / (len(self.sigmas) - 1), 2**0.5 - 1) if s_tmin <= sigma <= s_tmax else 0.0
 
@@ -270,7 +301,7 @@ class GaudiEulerDiscreteScheduler(EulerDiscreteScheduler):
         eps = noise * s_noise
         sigma_hat = sigma * (gamma + 1)
 
-        if gamma > 0:
+        if torch.is_tensor(gamma) or gamma > 0:
             sample = sample + eps * (sigma_hat**2 - sigma**2) ** 0.5
 
         # 1. compute predicted original sample (x_0) from sigma-scaled predicted noise
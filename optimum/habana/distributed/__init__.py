@@ -3,7 +3,7 @@ import os
 import torch
 
 from .distributed_runner import DistributedRunner
-from .fast_ddp import all_reduce_gradients
+from .fast_ddp import BucketedGradientReducer, all_reduce_gradients, setup_bucketed_all_reduce
 from .zero3_utils import apply_zero3_leaf_promotion
 
 
@@ -0,0 +1,352 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+All-to-all token dispatch for the expert parallelism of mixture-of-experts blocks, expert load statistics and
+replication of the most loaded experts
+"""
+
+import copy
+import math
+from typing import Dict, List, Optional, Sequence
+
+import torch
+import torch.distributed as dist
+
+
+EP_DISPATCH_MODES = ("all_reduce", "all_to_all")
+
+
+def moe_capacity(num_tokens: int, top_k: int, num_experts: int, capacity_factor: float) -> int:
+    """
+    Number of tokens every expert receives from every rank: `capacity_factor` times the number of tokens an expert
+    gets when the routing is perfectly balanced. A `capacity_factor` of `num_experts / top_k` never drops any token.
+    """
+    return max(1, math.ceil(capacity_factor * num_tokens * top_k / num_experts))
+
+
+class ExpertLoadStats:
+    """
+    Number of tokens routed to every expert of a MoE block. The histogram is accumulated on the device and only copied
+    to the host when read. With static shapes, the padding tokens are counted too.
+    """
+
+    def __init__(self, num_experts: int, device: torch.device):
+        self.num_experts = num_experts
+        self._counts = torch.zeros(num_experts, dtype=torch.long, device=device)
+
+    def update(self, selected_experts: torch.LongTensor):
+        """Adds the `(num_tokens, top_k)` experts selected by the router."""
+        expert_ids = selected_experts.reshape(-1)
+        self._counts.index_add_(0, expert_ids, torch.ones_like(expert_ids))
+
+    def reset(self):
+        self._counts.zero_()
+
+    @property
+    def counts(self) -> torch.LongTensor:
+        """Number of tokens routed to every expert."""
+        return self._counts.cpu()
+
+    @property
+    def imbalance(self) -> float:
+        """Load of the most loaded expert relative to the average load, 1.0 for a perfectly balanced routing."""
+        counts = self.counts.double()
+        mean = counts.mean().item()
+        return counts.max().item() / mean if mean else 0.0
+
+    def to_dict(self) -> dict:
+        return {"tokens_per_expert": self.counts.tolist(), "imbalance": self.imbalance}
+
+
+def plan_expert_replicas(expert_load: torch.Tensor, ep_size: int, num_replicas_per_rank: int) -> List[List[int]]:
+    """
+    Chooses the experts replicated in the `num_replicas_per_rank` replica slots of every rank, -1 for an unused slot.
+
+    The load of an expert is split evenly between its copies. The expert with the highest load per copy is repeatedly
+    replicated onto the least loaded rank that has a free slot and does not hold it yet, as long as this lowers the
+    load of the most loaded rank holding it.
+    """
+    load = expert_load.double().cpu().tolist()
+    experts_per_rank = len(load) // ep_size
+    holders = [[expert_id // experts_per_rank] for expert_id in range(len(load))]
+    plan = [[] for _ in range(ep_size)]
+
+    def rank_loads():
+        loads = [0.0] * ep_size
+        for expert_id, ranks in enumerate(holders):
+            for rank in ranks:
+                loads[rank] += load[expert_id] / len(ranks)
+        return loads
+
+    while True:
+        loads = rank_loads()
+        for expert_id in sorted(range(len(load)), key=lambda e: -load[e] / len(holders[e])):
+            free_ranks = [
+                rank
+                for rank in range(ep_size)
+                if len(plan[rank]) < num_replicas_per_rank and rank not in holders[expert_id]
+            ]
+            if not free_ranks or load[expert_id] == 0:
+                continue
+            target = min(free_ranks, key=lambda rank: loads[rank])
+            new_share = load[expert_id] / (len(holders[expert_id]) + 1)
+            if loads[target] + new_share < max(loads[rank] for rank in holders[expert_id]):
+                holders[expert_id].append(target)
+                plan[target].append(expert_id)
+                break
+        else:
+            break
+
+    return [replicas + [-1] * (num_replicas_per_rank - len(replicas)) for replicas in plan]
+
+
+class AllToAllExpertDispatcher(torch.nn.Module):
+    """
+    Expert parallelism where every token is only sent to the ranks owning its selected experts, instead of computing
+    every expert of a rank on all the tokens and all-reducing the hidden states.
+
+    Experts are split in contiguous ranges of `num_experts // ep_size` experts per rank. A first all-to-all sends every
+    (token, expert) assignment to the rank owning the expert, every rank runs its experts on the tokens it received,
+    and a second all-to-all sends the outputs back to be combined with the routing weights. Every expert receives a
+    fixed number of `moe_capacity` tokens from every rank, padded with zeros, so that all the shapes only depend on
+    the number of tokens. Assignments beyond the capacity of their expert are dropped, i.e. they do not contribute to
+    the output of the token.
+
+    Every rank can also hold `num_replicas_per_rank` copies of experts owned by other ranks, chosen from the observed
+    expert load by `rebalance`. The tokens of a replicated expert are then split between its copies. Replicas and
+    routing tables are updated in place, so that `rebalance` can be called after HPU graphs are captured.
+
+    This is inference only and runs with any backend that implements `all_to_all_single`, gloo included.
+
+    Args:
+        num_experts (`int`):
+            Total number of experts.
+        capacity_factor (`float`, *optional*, defaults to 2.0):
+            Capacity of the experts relative to a perfectly balanced routing, see `moe_capacity`.
+        shard_tokens (`bool`, *optional*, defaults to `True`):
+            Whether all the ranks get the same tokens, as with `--parallel_strategy ep`. Every rank then only dispatches
+            `1 / ep_size` of them and the combined outputs are all-gathered.
+        group (`torch.distributed.ProcessGroup`, *optional*):
+            The expert parallel group, defaults to the world group.
+        num_replicas_per_rank (`int`, *optional*, defaults to 0):
+            Number of replica slots of every rank.
+        expert_template (`torch.nn.Module`, *optional*):
+            An expert the replicas are copied from, required if `num_replicas_per_rank > 0`.
+    """
+
+    def __init__(
+        self,
+        num_experts: int,
+        capacity_factor: float = 2.0,
+        shard_tokens: bool = True,
+        group: Optional[dist.ProcessGroup] = None,
+        num_replicas_per_rank: int = 0,
+        expert_template: Optional[torch.nn.Module] = None,
+    ):
+        super().__init__()
+        self.group = group
+        self.ep_size = dist.get_world_size(group)
+        self.ep_rank = dist.get_rank(group)
+        if num_experts % self.ep_size != 0:
+            raise ValueError(f"The number of experts ({num_experts}) must be divisible by ep_size ({self.ep_size}).")
+        if capacity_factor <= 0:
+            raise ValueError(f"`capacity_factor` must be positive but is {capacity_factor}.")
+        if num_replicas_per_rank > 0 and expert_template is None:
+            raise ValueError("`expert_template` is required to replicate experts.")
+        self.num_experts = num_experts
+        self.experts_per_rank = num_experts // self.ep_size
+        self.capacity_factor = capacity_factor
+        self.shard_tokens = shard_tokens
+        self.num_replicas_per_rank = num_replicas_per_rank
+        self.slots_per_rank = self.experts_per_rank + num_replicas_per_rank
+        self.replicas = torch.nn.ModuleList([copy.deepcopy(expert_template) for _ in range(num_replicas_per_rank)])
+        self.replica_experts = [[-1] * num_replicas_per_rank for _ in range(self.ep_size)]
+
+        # Slots of the copies of every expert, the home slot first, and number of copies
+        max_copies = 1 + min(self.ep_size - 1, self.ep_size * num_replicas_per_rank)
+        self.register_buffer(
+            "expert_slots", torch.zeros((num_experts, max_copies), dtype=torch.long), persistent=False
+        )
+        self.register_buffer("num_copies", torch.ones(num_experts, dtype=torch.long), persistent=False)
+        self._update_tables()
+
+    def _home_slot(self, expert_id: int) -> int:
+        return (expert_id // self.experts_per_rank) * self.slots_per_rank + expert_id % self.experts_per_rank
+
+    def _update_tables(self):
+        expert_slots = [[self._home_slot(expert_id)] for expert_id in range(self.num_experts)]
+        for rank, replicas in enumerate(self.replica_experts):
+            for i, expert_id in enumerate(replicas):
+                if expert_id >= 0:
+                    expert_slots[expert_id].append(rank * self.slots_per_rank + self.experts_per_rank + i)
+        num_copies = torch.tensor([len(slots) for slots in expert_slots])
+        padded = [slots + [slots[0]] * (self.expert_slots.shape[1] - len(slots)) for slots in expert_slots]
+        self.expert_slots.copy_(torch.tensor(padded))
+        self.num_copies.copy_(num_copies)
+
+    def _global_rank(self, rank: int) -> int:
+        return rank if self.group is None else dist.get_global_rank(self.group, rank)
+
+    @torch.no_grad()
+    def rebalance(self, expert_load: torch.Tensor, experts: Sequence[torch.nn.Module]):
+        """
+        Replicates the most loaded experts according to `expert_load`, the number of tokens routed to every expert,
+        and copies their weights from the ranks owning them. `experts` are the experts of this rank, in order.
+        """
+        if self.num_replicas_per_rank == 0:
+            return
+        expert_load = expert_load.clone()
+        if not self.shard_tokens:
+            # Every rank only saw its own tokens
+            dist.all_reduce(expert_load, group=self.group)
+        self.replica_experts = plan_expert_replicas(expert_load, self.ep_size, self.num_replicas_per_rank)
+
+        # Every rank takes part in all the broadcasts, in the same order
+        for rank, replicas in enumerate(self.replica_experts):
+            for i, expert_id in enumerate(replicas):
+                if expert_id < 0:
+                    continue
+                owner = expert_id // self.experts_per_rank
+                if self.ep_rank == owner:
+                    params = list(experts[expert_id % self.experts_per_rank].parameters())
+                elif self.ep_rank == rank:
+                    params = list(self.replicas[i].parameters())
+                else:
+                    params = [torch.empty_like(param) for param in self.replicas[0].parameters()]
+                for param in params:
+                    dist.broadcast(param.data, src=self._global_rank(owner), group=self.group)
+        self._update_tables()
+
+    def _all_to_all(self, tensor: torch.Tensor) -> torch.Tensor:
+        output = torch.empty_like(tensor)
+        dist.all_to_all_single(output, tensor, group=self.group)
+        return output
+
+    def _all_gather(self, tensor: torch.Tensor) -> torch.Tensor:
+        outputs = [torch.empty_like(tensor) for _ in range(self.ep_size)]
+        dist.all_gather(outputs, tensor, group=self.group)
+        return torch.cat(outputs)
+
+    def forward(
+        self,
+        hidden_states: torch.Tensor,
+        selected_experts: torch.LongTensor,
+        routing_weights: torch.Tensor,
+        experts: Sequence[torch.nn.Module],
+    ) -> torch.Tensor:
+        """
+        Args:
+            hidden_states (`torch.Tensor` of shape `(num_tokens, hidden_dim)`):
+                The inputs of the MoE block.
+            selected_experts (`torch.LongTensor` of shape `(num_tokens, top_k)`):
+                The experts every token is routed to.
+            routing_weights (`torch.Tensor` of shape `(num_tokens, top_k)`):
+                The weights of the outputs of the selected experts.
+            experts (`Sequence[torch.nn.Module]`):
+                The `experts_per_rank` experts of this rank, in order.
+
+        Returns:
+            `torch.Tensor` of shape `(num_tokens, hidden_dim)`: the weighted sum of the outputs of the selected experts
+            of every token.
+        """
+        num_tokens, hidden_dim = hidden_states.shape
+        top_k = selected_experts.shape[-1]
+        if self.shard_tokens:
+            shard_size = math.ceil(num_tokens / self.ep_size)
+            pad = shard_size * self.ep_size - num_tokens
+            if pad > 0:
+                hidden_states = torch.nn.functional.pad(hidden_states, (0, 0, 0, pad))
+                selected_experts = torch.nn.functional.pad(selected_experts, (0, 0, 0, pad))
+                routing_weights = torch.nn.functional.pad(routing_weights, (0, 0, 0, pad))
+            shard = slice(self.ep_rank * shard_size, (self.ep_rank + 1) * shard_size)
+            hidden_states, selected_experts, routing_weights = (
+                hidden_states[shard],
+                selected_experts[shard],
+                routing_weights[shard],
+            )
+        local_num_tokens = hidden_states.shape[0]
+        capacity = moe_capacity(local_num_tokens, top_k, self.num_experts, self.capacity_factor)
+        num_slots = self.ep_size * self.slots_per_rank
+
+        # The tokens of a replicated expert alternate between its copies
+        expert_ids = selected_experts.reshape(-1)
+        token_ids = torch.arange(local_num_tokens, device=hidden_states.device).repeat_interleave(top_k)
+        copy_ids = torch.remainder(token_ids, self.num_copies.index_select(0, expert_ids))
+        slot_ids = self.expert_slots.index_select(0, expert_ids).gather(1, copy_ids.unsqueeze(1)).squeeze(1)
+
+        # Row of every (token, expert) assignment in the `(num_slots, capacity)` send buffer, in token order
+        one_hot = torch.nn.functional.one_hot(slot_ids, num_slots)
+        positions = ((one_hot.cumsum(dim=0) - 1) * one_hot).sum(dim=-1)
+        kept = positions < capacity
+        # Dropped assignments go to an extra row that is never sent
+        num_rows = num_slots * capacity
+        rows = torch.where(kept, slot_ids * capacity + positions, num_rows)
+
+        send = hidden_states.new_zeros((num_rows + 1, hidden_dim))
+        send.index_copy_(0, rows, hidden_states.index_select(0, token_ids))
+        # Slots are contiguous per rank, so the buffer is already split by destination rank
+        received = self._all_to_all(send[:num_rows]).view(self.ep_size, self.slots_per_rank, capacity, hidden_dim)
+
+        expert_outputs = torch.stack(
+            [
+                expert(received[:, i].reshape(-1, hidden_dim)).view(self.ep_size, capacity, hidden_dim)
+                for i, expert in enumerate([*experts, *self.replicas])
+            ],
+            dim=1,
+        )
+        combined = self._all_to_all(expert_outputs.reshape(num_rows, hidden_dim))
+
+        combined = torch.cat((combined, combined.new_zeros((1, hidden_dim))))
+        weights = (routing_weights.reshape(-1) * kept).to(combined.dtype).unsqueeze(-1)
+        output = hidden_states.new_zeros((local_num_tokens, hidden_dim))
+        output.index_add_(0, token_ids, combined.index_select(0, rows) * weights)
+
+        if self.shard_tokens:
+            output = self._all_gather(output)[:num_tokens]
+        return output
+
+
+def _moe_blocks(model: torch.nn.Module):
+    # MoE blocks are the modules with an `expert_load_stats` attribute
+    return [(name, module) for name, module in model.named_modules() if hasattr(module, "expert_load_stats")]
+
+
+def enable_expert_load_stats(model: torch.nn.Module, enabled: bool = True):
+    """Starts, or stops if `enabled` is `False`, recording the number of tokens routed to the experts of `model`."""
+    for _, module in _moe_blocks(model):
+        device = next(module.parameters()).device
+        module.expert_load_stats = ExpertLoadStats(module.num_experts, device) if enabled else None
+
+
+def get_expert_load_stats(model: torch.nn.Module) -> Dict[str, ExpertLoadStats]:
+    """Returns the expert load statistics of every MoE block of `model`, by module name."""
+    return {
+        name: module.expert_load_stats for name, module in _moe_blocks(model) if module.expert_load_stats is not None
+    }
+
+
+def rebalance_experts(model: torch.nn.Module):
+    """
+    Replicates the most loaded experts of every MoE block of `model` that uses an `AllToAllExpertDispatcher` with
+    replica slots, based on the expert load recorded since `enable_expert_load_stats`.
+    """
+    for name, module in _moe_blocks(model):
+        dispatcher = getattr(module, "expert_dispatcher", None)
+        if dispatcher is None or dispatcher.num_replicas_per_rank == 0:
+            continue
+        if module.expert_load_stats is None:
+            raise ValueError(f"The expert load of {name} is not recorded, call `enable_expert_load_stats` first.")
+        dispatcher.rebalance(module.expert_load_stats._counts, [module.experts[i] for i in module.experts_range])
@@ -21,9 +21,173 @@
 Fast and lightweight alternative to DistributeDataParallel for Habana Gaudi
 """
 
+from typing import List, Optional
+
 import torch
 
 
+class _GradientBucket:
+    def __init__(self, params: List[torch.nn.Parameter], dtype: torch.dtype):
+        self.params = params
+        self.buffer = torch.zeros(sum(p.numel() for p in params), dtype=dtype, device=params[0].device)
+        self.views = []
+        offset = 0
+        for param in params:
+            self.views.append(self.buffer[offset : offset + param.numel()].view(param.shape))
+            offset += param.numel()
+        self.ready = [False] * len(params)
+        self.num_ready = 0
+        self.work = None
+
+
+class BucketedGradientReducer:
+    """
+    Overlaps the all-reduce of the gradients with the backward pass.
+
+    The parameters are grouped into buckets of at most `bucket_cap_mb` megabytes, in reverse order since this is
+    roughly the order in which backward produces their gradients. A hook copies every gradient into its bucket as soon
+    as it is accumulated, and the all-reduce of a bucket is launched asynchronously once all its gradients are there.
+    Buckets are always launched in the same order so that all ranks issue the same sequence of collectives.
+    `finalize` waits for the all-reduces and copies the averaged gradients back to the parameters.
+
+    Use `setup_bucketed_all_reduce` to create it, `all_reduce_gradients` then calls `finalize`.
+
+    Args:
+        model (torch.nn.Module): A model whose gradients are meant to be all-reduced.
+        bucket_cap_mb (float): The maximum size of a bucket in megabytes.
+        fp32_accumulation (bool): Whether the gradients are accumulated in float32 buckets across gradient accumulation
+            steps and all-reduced in float32. The gradients of the parameters are then released after each backward
+            pass, which avoids accumulating them in low precision.
+        fusion_buffer_dtype (torch.dtype, optional): The dtype of the buckets, defaults to the dtype of the gradients.
+            Ignored if `fp32_accumulation` is True.
+        process_group (optional): The process group to all-reduce over, defaults to the world group. The buckets are
+            allocated on the device of the parameters, so CPU parameters and a gloo group can be used for testing.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        bucket_cap_mb: float = 25.0,
+        fp32_accumulation: bool = False,
+        fusion_buffer_dtype: Optional[torch.dtype] = None,
+        process_group=None,
+    ):
+        self.process_group = process_group if process_group is not None else torch.distributed.group.WORLD
+        self.fp32_accumulation = fp32_accumulation
+        # Set it to False for the backward passes that should only accumulate gradients locally
+        self.require_backward_grad_sync = True
+
+        self.buckets = []
+        self._param_to_bucket = {}
+        bucket_cap_bytes = int(bucket_cap_mb * 1024 * 1024)
+        params, bucket_dtype, bucket_size = [], None, 0
+        for param in reversed([p for p in model.parameters() if p.requires_grad]):
+            dtype = torch.float32 if fp32_accumulation else (fusion_buffer_dtype or param.dtype)
+            param_size = param.numel() * dtype.itemsize
+            if params and (
+                bucket_size + param_size > bucket_cap_bytes
+                or dtype != bucket_dtype
+                or param.device != params[0].device
+            ):
+                self._add_bucket(params, bucket_dtype)
+                params, bucket_size = [], 0
+            params.append(param)
+            bucket_dtype = dtype
+            bucket_size += param_size
+        if params:
+            self._add_bucket(params, bucket_dtype)
+        self._next_bucket = 0
+
+        self._hook_handles = [
+            param.register_post_accumulate_grad_hook(self._grad_hook) for param in self._param_to_bucket
+        ]
+
+    def _add_bucket(self, params: List[torch.nn.Parameter], dtype: torch.dtype):
+        bucket = _GradientBucket(params, dtype)
+        for i, param in enumerate(params):
+            self._param_to_bucket[param] = (bucket, i)
+        self.buckets.append(bucket)
+
+    def _grad_hook(self, param: torch.nn.Parameter):
+        bucket, i = self._param_to_bucket[param]
+        if self.fp32_accumulation:
+            bucket.views[i].add_(param.grad)
+            param.grad = None
+        elif self.require_backward_grad_sync:
+            bucket.views[i].copy_(param.grad, non_blocking=True)
+        if self.require_backward_grad_sync and not bucket.ready[i]:
+            bucket.ready[i] = True
+            bucket.num_ready += 1
+            self._launch_ready_buckets()
+
+    def _launch(self, bucket: _GradientBucket):
+        bucket.buffer.mul_(1.0 / self.process_group.size())
+        bucket.work = torch.distributed.all_reduce(bucket.buffer, group=self.process_group, async_op=True)
+
+    def _launch_ready_buckets(self):
+        while self._next_bucket < len(self.buckets):
+            bucket = self.buckets[self._next_bucket]
+            if bucket.num_ready < len(bucket.params):
+                break
+            self._launch(bucket)
+            self._next_bucket += 1
+
+    def finalize(self):
+        """
+        Waits for the all-reduces of the buckets and writes the averaged gradients to the parameters. Buckets whose
+        parameters did not all receive a gradient are launched here, the missing gradients count as zeros.
+        """
+        for bucket in self.buckets[self._next_bucket :]:
+            if not self.fp32_accumulation:
+                for param, view, ready in zip(bucket.params, bucket.views, bucket.ready):
+                    if ready:
+                        continue
+                    if param.grad is None:
+                        view.zero_()
+                    else:
+                        view.copy_(param.grad, non_blocking=True)
+            self._launch(bucket)
+        self._next_bucket = 0
+
+        for bucket in self.buckets:
+            bucket.work.wait()
+            bucket.work = None
+            bucket.ready = [False] * len(bucket.params)
+            bucket.num_ready = 0
+            for param, view in zip(bucket.params, bucket.views):
+                if param.grad is None:
+                    param.grad = view.to(param.dtype, copy=True)
+                else:
+                    param.grad.copy_(view, non_blocking=True)
+            if self.fp32_accumulation:
+                bucket.buffer.zero_()
+
+    def remove_hooks(self):
+        for handle in self._hook_handles:
+            handle.remove()
+        self._hook_handles = []
+
+
+def setup_bucketed_all_reduce(
+    model: torch.nn.Module,
+    bucket_cap_mb: float = 25.0,
+    fp32_accumulation: bool = False,
+    fusion_buffer_dtype: Optional[torch.dtype] = None,
+    process_group=None,
+) -> BucketedGradientReducer:
+    """
+    Registers the gradient hooks of a `BucketedGradientReducer` on the model, so that the all-reduce of the gradients
+    overlaps with backward. It must be called before the first backward pass, `all_reduce_gradients` then only waits
+    for the communication to complete. See `BucketedGradientReducer` for the arguments.
+    """
+    reducer = model.__dict__.get("_bucketed_gradient_reducer", None)
+    if reducer is not None:
+        reducer.remove_hooks()
+    reducer = BucketedGradientReducer(model, bucket_cap_mb, fp32_accumulation, fusion_buffer_dtype, process_group)
+    model.__dict__["_bucketed_gradient_reducer"] = reducer
+    return reducer
+
+
 def all_reduce_gradients(
     model: torch.nn.Module, fusion_buffer_dtype: torch.dtype = torch.bfloat16, use_hpu_graphs: bool = True
 ):
@@ -40,8 +204,16 @@ def all_reduce_gradients(
 
     Raises:
         NotImplementedError: `all_reduce_gradients()` does not support changing the set of active gradients after first invocation.
+
+    If `setup_bucketed_all_reduce` was called on the model, the all-reduces were already launched during backward and
+    this function only waits for them and unpacks the gradients.
     """
 
+    reducer = model.__dict__.get("_bucketed_gradient_reducer", None)
+    if reducer is not None:
+        reducer.finalize()
+        return
+
     # Try to get the existing fusion buffer created for the model.
     fusion_entries = model.__dict__.get("_all_reduce_fusion_entries", None)
     if fusion_entries is not None:
@@ -16,9 +16,15 @@
 # The original version can be found at https://github.com/foundation-model-stack/foundation-model-stack
 
 import collections
+import json
+import math
+import mmap
 import os
+import struct
+import threading
 from collections import ChainMap
 from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Callable, List, Mapping, MutableMapping, Optional, Union
 
@@ -80,6 +86,10 @@ def _get_adapter(architecture: str, source: Optional[str]) -> Callable[[Mapping[
         return __adapters[architecture][source]
 
 
+def _has_adapter(architecture: str, source: Optional[str]) -> bool:
+    return source is not None and architecture in __adapters and source in __adapters[architecture]
+
+
 def get_adapted(architecture: str, source: Optional[str], state_dict: Mapping[str, Any]) -> Mapping[str, Any]:
     """
     Convert a state dict to FMS format, using an adapter specified by name.
@@ -98,21 +108,232 @@ def get_adapted(architecture: str, source: Optional[str], state_dict: Mapping[st
     return adapted
 
 
-def _get_safetensors_item(key, file: Path, device: torch.device) -> torch.Tensor:
-    from safetensors import safe_open  # type: ignore[import-untyped]
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": getattr(torch, "float8_e4m3fn", None),
+    "F8_E5M2": getattr(torch, "float8_e5m2", None),
+}
 
-    with torch.no_grad():
-        with safe_open(file, framework="pt", device=str(device)) as model_weights:  # type: ignore[attr-defined]
-            return model_weights.get_tensor(key)
+
+class SafetensorsFile:
+    """
+    A safetensors shard opened once and memory-mapped for its whole lifetime.
+
+    The header is parsed when the file is opened, then `get_tensor` returns tensors that are zero-copy views of the
+    mapping when they are requested on CPU with a dtype that torch can view the bytes as. The mapping is copy-on-write,
+    so in-place updates of these tensors never reach the file. Other tensors (unsupported dtype, misaligned data) are
+    read with `safetensors.safe_open`.
+
+    `read_slice` reads a slice of a tensor with positioned reads of its byte ranges only, into a buffer of the size of
+    the slice. This is what tensor-parallel ranks use to load their shard without reading the full weight.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._fd = os.open(self.path, os.O_RDONLY)
+        header.pop("__metadata__", None)
+        self.header = header
+        self.data_offset = 8 + header_size
+        self._safe_open_handles = {}
+        self._lock = threading.Lock()
+
+    def keys(self):
+        return list(self.header.keys())
+
+    def byte_range(self, key: str) -> tuple[int, int]:
+        """Returns the `[start, end)` offsets of the data of `key` in the file."""
+        start, end = self.header[key]["data_offsets"]
+        return self.data_offset + start, self.data_offset + end
+
+    def __del__(self):
+        if getattr(self, "_fd", None) is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _safe_open(self, device: torch.device):
+        from safetensors import safe_open  # type: ignore[import-untyped]
+
+        with self._lock:
+            handle = self._safe_open_handles.get(str(device))
+            if handle is None:
+                handle = safe_open(self.path, framework="pt", device=str(device))  # type: ignore[attr-defined]
+                self._safe_open_handles[str(device)] = handle
+        return handle
+
+    def _fallback_get_tensor(self, key: str, device: torch.device) -> torch.Tensor:
+        return self._safe_open(device).get_tensor(key)
+
+    def shape(self, key: str) -> List[int]:
+        return list(self.header[key]["shape"])
+
+    def dtype(self, key: str) -> Optional[torch.dtype]:
+        return _SAFETENSORS_DTYPES.get(self.header[key]["dtype"])
+
+    def get_tensor(self, key: str, device: torch.device = torch.device("cpu")) -> torch.Tensor:
+        info = self.header[key]
+        dtype = _SAFETENSORS_DTYPES.get(info["dtype"])
+        start, end = self.byte_range(key)
+        if dtype is None or start % dtype.itemsize != 0:
+            return self._fallback_get_tensor(key, device)
+        if start == end:
+            tensor = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensor = torch.frombuffer(self._mmap, dtype=dtype, count=(end - start) // dtype.itemsize, offset=start)
+            tensor = tensor.view(info["shape"])
+        if torch.device(device).type != "cpu":
+            tensor = tensor.to(device)
+        return tensor
+
+    def read_slice(
+        self, key: str, dim: int, start: int, length: int, device: torch.device = torch.device("cpu")
+    ) -> torch.Tensor:
+        """Reads `tensor.narrow(dim, start, length)` of the tensor `key` from the file."""
+        shape = self.shape(key)
+        dim = dim % len(shape)
+        if start < 0 or length < 0 or start + length > shape[dim]:
+            raise IndexError(
+                f"Slice [{start}, {start + length}) is out of bounds for dimension {dim} of {key} {shape}."
+            )
+        dtype = self.dtype(key)
+        if dtype is None:
+            index = tuple(slice(start, start + length) if i == dim else slice(None) for i in range(len(shape)))
+            return self._safe_open(device).get_slice(key)[index]
+
+        out = torch.empty(shape[:dim] + [length] + shape[dim + 1 :], dtype=dtype)
+        num_chunks = math.prod(shape[:dim])
+        inner_bytes = math.prod(shape[dim + 1 :]) * dtype.itemsize
+        chunk_bytes = length * inner_bytes
+        if chunk_bytes > 0:
+            # The slice is made of `num_chunks` contiguous byte ranges, one per index of the leading dimensions
+            buffer = memoryview(out.view(-1).view(torch.uint8).numpy())
+            tensor_start, _ = self.byte_range(key)
+            for i in range(num_chunks):
+                offset = tensor_start + (i * shape[dim] + start) * inner_bytes
+                self._pread(buffer[i * chunk_bytes : (i + 1) * chunk_bytes], offset)
+        if torch.device(device).type != "cpu":
+            out = out.to(device)
+        return out
+
+    def _pread(self, buffer: memoryview, offset: int):
+        while len(buffer) > 0:
+            num_bytes = os.preadv(self._fd, [buffer], offset)
+            if num_bytes == 0:
+                raise EOFError(f"Unexpected end of file while reading {self.path}.")
+            buffer = buffer[num_bytes:]
+            offset += num_bytes
+
+    def prefetch(self, key: str):
+        """Asks the kernel to read the pages of `key` ahead of their first access."""
+        if not hasattr(self._mmap, "madvise"):
+            return
+        start, end = self.byte_range(key)
+        page_start = start - start % mmap.PAGESIZE
+        if end > page_start:
+            self._mmap.madvise(mmap.MADV_WILLNEED, page_start, end - page_start)
+
+
+class SafetensorsHandlePool:
+    """Keeps one `SafetensorsFile` per shard so that every file is opened and its header parsed only once."""
+
+    def __init__(self):
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Union[str, Path]) -> SafetensorsFile:
+        path = Path(path)
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is None:
+                handle = SafetensorsFile(path)
+                self._handles[path] = handle
+        return handle
+
+    def clear(self):
+        # The mappings are released once the tensors viewing them are garbage collected
+        with self._lock:
+            self._handles.clear()
+
+
+class LazySafetensorsTensor:
+    """
+    Reference to a tensor of a safetensors shard that is not read yet. `narrow` reads only the requested slice, which
+    lets `load_state_dict_into_model` load the shard of a tensor-parallel rank without reading the full weight.
+    """
+
+    def __init__(self, handle: SafetensorsFile, key: str, device: torch.device):
+        self.handle = handle
+        self.key = key
+        self.device = torch.device(device)
+
+    @property
+    def shape(self) -> torch.Size:
+        return torch.Size(self.handle.shape(self.key))
+
+    def to(self, device: torch.device) -> "LazySafetensorsTensor":
+        return LazySafetensorsTensor(self.handle, self.key, device)
+
+    def narrow(self, dim: int, start: int, length: int) -> torch.Tensor:
+        return self.handle.read_slice(self.key, dim, start, length, self.device)
+
+    def materialize(self) -> torch.Tensor:
+        return self.handle.get_tensor(self.key, self.device)
 
 
 class LazySafetensorsDict(collections.UserDict):
+    """
+    State dict whose tensors are read from safetensors shards on first access. Values are either a callable that
+    loads the tensor, a `Future` of a prefetched tensor, or the tensor itself.
+    """
+
+    def __init__(self, *args, handle_pool: Optional[SafetensorsHandlePool] = None, **kwargs):
+        self.handle_pool = handle_pool if handle_pool is not None else SafetensorsHandlePool()
+        self._files = {}
+        super().__init__(*args, **kwargs)
+
     def set_lazy_tensor(self, key, file, device):
-        super().__setitem__(key, lambda: _get_safetensors_item(key, file, device))
+        self._files[key] = (file, device)
+        super().__setitem__(key, lambda: self.handle_pool.get(file).get_tensor(key, device))
+
+    def get_lazy_tensor(self, key):
+        """Returns a `LazySafetensorsTensor` for `key` if it has not been loaded yet, the loaded tensor otherwise."""
+        if callable(self.data.get(key)) and key in self._files:
+            file, device = self._files[key]
+            return LazySafetensorsTensor(self.handle_pool.get(file), key, device)
+        return self[key]
+
+    def _prefetch_tensor(self, key, lazy_tensor):
+        self.handle_pool.get(self._files[key][0]).prefetch(key)
+        return lazy_tensor()
+
+    def prefetch(self, keys: Iterable[str], executor: ThreadPoolExecutor):
+        """
+        Materializes the tensors of `keys` that have not been loaded yet on the threads of `executor`, after asking the
+        kernel to read their pages.
+        """
+        for key in keys:
+            lazy_tensor = self.data.get(key)
+            if callable(lazy_tensor) and key in self._files:
+                super().__setitem__(key, executor.submit(self._prefetch_tensor, key, lazy_tensor))
 
     def __getitem__(self, key):
         lazy_tensor = super().__getitem__(key)
-        if callable(lazy_tensor):
+        if isinstance(lazy_tensor, Future):
+            lazy_tensor = lazy_tensor.result()
+            super().__setitem__(key, lazy_tensor)
+        elif callable(lazy_tensor):
             lazy_tensor = lazy_tensor()
             super().__setitem__(key, lazy_tensor)
         return lazy_tensor
@@ -207,11 +428,13 @@ def load_state_dict(
 
     checkpoint_sds = []
     if checkpoints[0].suffix == ".safetensors":
+        handle_pool = SafetensorsHandlePool()
         for ckp in checkpoints:
             checkpoint_sds.append(
                 _load_safetensors_state_dict(
                     ckp,
                     initial_device,
+                    handle_pool,
                 )
             )
     else:
@@ -225,15 +448,11 @@ def load_state_dict(
 def _load_safetensors_state_dict(
     checkpoint: Path,
     device: torch.device,
+    handle_pool: Optional[SafetensorsHandlePool] = None,
 ):
-    sd = LazySafetensorsDict()
-
-    from safetensors import safe_open
-
-    with safe_open(checkpoint, framework="pt", device=str(device)) as model_weights:  # type: ignore[attr-defined]
-        sd_keys = list(model_weights.keys())
-        for key in sd_keys:
-            sd.set_lazy_tensor(key, checkpoint, device)
+    sd = LazySafetensorsDict(handle_pool=handle_pool)
+    for key in sd.handle_pool.get(checkpoint).keys():
+        sd.set_lazy_tensor(key, checkpoint, device)
     return sd
 
 
@@ -255,6 +474,9 @@ def load_state_dict_into_model(
     initial_device: torch.device = torch.device("cpu"),
     rank: int = 0,
     world_size: int = 0,
+    prefetch_window: int = 8,
+    num_prefetch_workers: int = 4,
+    sharded_reads: bool = True,
 ) -> None:
     """
     This function loads state_dict into model in the most efficient way possible,
@@ -276,6 +498,15 @@ def load_state_dict_into_model(
     checkpoint_sharding: the sharding format of the checkpoint.
             E.g. layer, tp, fsdp. Used for weight sharding.
     initial_device: where the weights will be loaded from disk.
+    prefetch_window: number of upcoming weights of a LazySafetensorsDict that
+            are read in the background while the current one is copied into
+            the model. 0 disables prefetching.
+    num_prefetch_workers: number of threads reading the prefetched weights.
+    sharded_reads: if True (default) and the weights need TP sharding, every
+            rank reads only the byte ranges of its shard of the TP'd weights
+            of a LazySafetensorsDict, instead of reading the full weights and
+            slicing them. Only applies to weights that are already in FMS
+            format (no adapter), and disables prefetching.
     """
 
     # 1. Get the adapter from checkpoint sd to fms sd
@@ -287,13 +518,28 @@ def load_state_dict_into_model(
     # 3. Iterate over the weights and load them into the model
     used_keys = set()
     sd_keys = list(state_dict.keys())
+    lazy_sds = [
+        sd
+        for sd in (state_dict.maps if isinstance(state_dict, ChainMap) else [state_dict])
+        if isinstance(sd, LazySafetensorsDict)
+    ]
+    sharded_reads = sharded_reads and needs_tp_sharding and not _has_adapter(architecture, source)
+    if sharded_reads:
+        # Prefetching would read the full weights
+        prefetch_window = 0
+    executor = None
+    if prefetch_window > 0 and num_prefetch_workers > 0 and lazy_sds:
+        executor = ThreadPoolExecutor(max_workers=num_prefetch_workers, thread_name_prefix="safetensors_prefetch")
+        _prefetch_lazy_tensors(lazy_sds, sd_keys[:prefetch_window], executor)
     with torch.no_grad():
-        for key in sd_keys:
+        for i, key in enumerate(sd_keys):
+            if executor is not None and i + prefetch_window < len(sd_keys):
+                _prefetch_lazy_tensors(lazy_sds, [sd_keys[i + prefetch_window]], executor)
             if key in used_keys:
                 continue
             used_keys.add(key)
             try:
-                partial_sd = {key: state_dict[key]}
+                partial_sd = {key: _get_lazy_tensor(state_dict, lazy_sds, key) if sharded_reads else state_dict[key]}
                 if partial_sd[key].device != initial_device:
                     partial_sd[key] = partial_sd[key].to(device=initial_device)
                 fms_partial_sd = adapter(partial_sd)
@@ -313,6 +559,20 @@ def load_state_dict_into_model(
                     state_dict.pop(p_key)
             del partial_sd
             del fms_partial_sd
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _get_lazy_tensor(state_dict: MutableMapping[str, Any], lazy_sds: List[LazySafetensorsDict], key: str):
+    for sd in lazy_sds:
+        if key in sd:
+            return sd.get_lazy_tensor(key)
+    return state_dict[key]
+
+
+def _prefetch_lazy_tensors(lazy_sds: List[LazySafetensorsDict], keys: List[str], executor: ThreadPoolExecutor):
+    for sd in lazy_sds:
+        sd.prefetch([key for key in keys if key in sd.data], executor)
 
 
 def _copy_colwise(param: torch.nn.Parameter, tensor_value, is_bias, rank, world_size):
@@ -324,7 +584,7 @@ def _copy_colwise(param: torch.nn.Parameter, tensor_value, is_bias, rank, world_
     ====
     param: torch.nn.Parameter
         Parameter that has had TP applied
-    tensor_value: torch.Tensor
+    tensor_value: torch.Tensor or LazySafetensorsTensor
         tensor that needs sharding
     rank: int
         Rank of the current process
@@ -332,14 +592,9 @@ def _copy_colwise(param: torch.nn.Parameter, tensor_value, is_bias, rank, world_
         Total number of TP processes
     """
     # Divide the weight matrix along the first dimension.
+    # `narrow` only reads the shard of a LazySafetensorsTensor
     output_size_per_partition = param.shape[0]
-    if not is_bias:
-        tensor = tensor_value[
-            (rank * output_size_per_partition) : ((rank + 1) * output_size_per_partition),
-            :,
-        ]
-    else:
-        tensor = tensor_value[(rank * output_size_per_partition) : ((rank + 1) * output_size_per_partition)]
+    tensor = tensor_value.narrow(0, rank * output_size_per_partition, output_size_per_partition)
     param.copy_(tensor, non_blocking=True)
 
 
@@ -352,7 +607,7 @@ def _copy_rowwise(param: torch.nn.Parameter, tensor_value, is_bias, rank, world_
     ====
     param: torch.nn.Parameter
         Parameter that has had TP applied
-    tensor_value: torch.Tensor
+    tensor_value: torch.Tensor or LazySafetensorsTensor
         tensor that needs sharding
     rank: int
         Rank of the current process
@@ -362,10 +617,7 @@ def _copy_rowwise(param: torch.nn.Parameter, tensor_value, is_bias, rank, world_
     # Divide the weight matrix along the last dimension.
     if not is_bias:
         output_size_per_partition = param.shape[1]
-        tensor = tensor_value[
-            :,
-            (rank * output_size_per_partition) : ((rank + 1) * output_size_per_partition),
-        ]
+        tensor = tensor_value.narrow(1, rank * output_size_per_partition, output_size_per_partition)
         param.copy_(tensor, non_blocking=True)
     else:
         if rank == 0:
@@ -383,7 +635,7 @@ def _copy_embedding(param: torch.nn.Parameter, tensor_value, rank, world_size):
     ====
     param: torch.nn.Parameter
         Parameter that has had TP applied
-    tensor_value: torch.Tensor
+    tensor_value: torch.Tensor or LazySafetensorsTensor
         tensor that needs sharding
     rank: int
         Rank of the current process
@@ -392,14 +644,13 @@ def _copy_embedding(param: torch.nn.Parameter, tensor_value, rank, world_size):
     """
     # Divide the weight matrix along the last dimension.
     output_size_per_partition = param.shape[1]
-    tensor = tensor_value[
-        :,
-        (rank * output_size_per_partition) : ((rank + 1) * output_size_per_partition),
-    ]
+    tensor = tensor_value.narrow(1, rank * output_size_per_partition, output_size_per_partition)
     param.copy_(tensor, non_blocking=True)
 
 
 def _copy_if_present(parameter, tensor_value):
+    if isinstance(tensor_value, LazySafetensorsTensor):
+        tensor_value = tensor_value.materialize()
     parameter.copy_(tensor_value, non_blocking=True)
 
 
@@ -0,0 +1,1100 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import math
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import torch
+
+
+class KVCache(torch.nn.Module):
+    """
+    Contiguous KV cache of an attention layer, allocated once for the maximum sequence length with `reuse_cache`.
+
+    Without `reuse_cache`, `update` is also used as a static method on the past keys/values passed to the model.
+    """
+
+    def __init__(self):
+        super(KVCache, self).__init__()
+        self.cache = None
+        self.inp_seq_len = -1
+
+    def allocate(self, inp_seq_len, dtype, device, shape):
+        if self.cache is None or self.cache.shape != shape:
+            self.inp_seq_len = inp_seq_len
+            self.cache = torch.zeros(shape, dtype=dtype, device=device)
+        else:
+            assert self.inp_seq_len == inp_seq_len, (
+                f"inp_seq_len must be the same. self.inp_seq_len:{self.inp_seq_len} inp_seq_len:{inp_seq_len}"
+            )
+            self.cache.fill_(0)
+
+    @staticmethod
+    def update(prev, cur, dim, idx, inp_seq_len):
+        orig_cur = cur
+        if prev.shape == cur.shape:
+            prev.copy_(cur)
+            return orig_cur
+        if cur.shape[dim] > 1 and cur.shape[dim] <= prev.shape[dim]:
+            # Initialize
+            prev.narrow(dim, 0, inp_seq_len).copy_(cur)
+            return orig_cur
+        assert cur.shape[dim] == 1, f"Cannot update kv-cache. Unsupported shapes. prev:{prev.shape} cur:{cur.shape}"
+        if idx is not None:
+            prev.index_copy_(dim, idx - 1, cur)
+            return prev
+        else:
+            return torch.cat((prev, cur), dim=dim)
+
+    def update_from(self, cur, offset):
+        """
+        Writes `cur` at positions `[offset, offset + cur_len)` and returns the cache up to the last written one.
+
+        `offset` may also be a tensor of per-sequence offsets, in which case the whole cache is returned so that the
+        shapes do not depend on it and the positions after the written ones must be masked out by the caller.
+        """
+        if isinstance(offset, torch.Tensor):
+            positions = offset.view(-1, 1) + torch.arange(cur.shape[2], device=cur.device)
+            self.cache.scatter_(2, positions.view(-1, 1, cur.shape[2], 1).expand_as(cur), cur)
+            return self.cache
+        end = offset + cur.shape[2]
+        self.cache[:, :, offset:end, :].copy_(cur)
+        return self.cache[:, :, :end, :]
+
+    def gather(self, seq_len=None):
+        return self.cache if seq_len is None else self.cache[:, :, :seq_len, :]
+
+    def reorder(self, beam_idx: torch.LongTensor):
+        self.cache.copy_(self.cache.index_select(0, beam_idx))
+
+    @property
+    def memory_bytes(self) -> int:
+        if self.cache is None:
+            return 0
+        return self.cache.numel() * self.cache.element_size()
+
+    def get_shape(self):
+        if self.cache is None:
+            return None
+        return self.cache.shape
+
+    def forward(self, cur, dim, idx):
+        return self.update(self.cache, cur, dim, idx, self.inp_seq_len)
+
+
+class PagedBlockAllocator:
+    """
+    Host-side bookkeeping for a block-paged KV cache shared by all the layers of a model.
+
+    The key/value storage of every layer is a pool of `num_blocks` blocks of `block_size` tokens each. Every sequence
+    (i.e. batch row) owns a list of blocks, recorded in `block_table`, a device tensor of shape
+    `(batch_size, max_blocks_per_seq)` that is updated in place so that it can be captured by HPU graphs.
+    Block 0 is never handed out: it is the "null" block that unused block-table entries point to. Writes to it only
+    ever happen for positions that are masked out by the attention mask, or for sequences that are finished.
+
+    Sequences are given blocks as they grow with `reserve_all`, and give them back with `free` once they are finished,
+    so that the pool only needs to hold the tokens of the running sequences.
+
+    Args:
+        block_size (`int`):
+            Number of tokens stored in a block.
+        num_blocks (`int`, *optional*):
+            Number of blocks in the pool, including the null block, which is then a hard limit. If not specified, the
+            pool is sized in `reset` for the prompts and half of the new tokens of every sequence, and grows when it
+            runs out of blocks.
+    """
+
+    NULL_BLOCK = 0
+
+    def __init__(self, block_size: int, num_blocks: Optional[int] = None):
+        if block_size <= 0:
+            raise ValueError(f"`block_size` must be a positive integer but is {block_size}.")
+        self.block_size = block_size
+        self.requested_num_blocks = num_blocks
+        self.num_blocks = None
+        self.max_seq_len = 0
+        self.block_table = None
+        self.free_blocks = []
+        self.seq_blocks = []
+        self.finished = set()
+        # Caches whose storage is extended when the pool grows
+        self.caches = weakref.WeakSet()
+
+    @property
+    def max_blocks_per_seq(self):
+        return math.ceil(self.max_seq_len / self.block_size)
+
+    @property
+    def num_free_blocks(self):
+        return len(self.free_blocks)
+
+    def reset(self, batch_size: int, max_seq_len: int, device: torch.device, inp_seq_len: Optional[int] = None):
+        """Releases all the blocks and prepares an empty block table for `batch_size` sequences."""
+        self.max_seq_len = max_seq_len
+        num_blocks = self.requested_num_blocks
+        if num_blocks is None:
+            num_prompt_blocks = batch_size * math.ceil(min(inp_seq_len or max_seq_len, max_seq_len) / self.block_size)
+            num_new_blocks = batch_size * self.max_blocks_per_seq - num_prompt_blocks
+            num_blocks = num_prompt_blocks + math.ceil(num_new_blocks / 2) + 1
+        if num_blocks < 2:
+            raise ValueError(f"The paged KV cache needs at least 2 blocks but got {num_blocks}.")
+        self.num_blocks = num_blocks
+        # Pop from the end so that blocks are handed out in increasing order
+        self.free_blocks = list(range(num_blocks - 1, self.NULL_BLOCK, -1))
+        self.seq_blocks = [[] for _ in range(batch_size)]
+        self.finished = set()
+        shape = (batch_size, self.max_blocks_per_seq)
+        if self.block_table is None or self.block_table.shape != shape or self.block_table.device != device:
+            self.block_table = torch.full(shape, self.NULL_BLOCK, dtype=torch.long, device=device)
+        else:
+            self.block_table.fill_(self.NULL_BLOCK)
+
+    def _sync_block_table(self):
+        table = torch.full(self.block_table.shape, self.NULL_BLOCK, dtype=torch.long)
+        for seq_id, blocks in enumerate(self.seq_blocks):
+            if blocks:
+                table[seq_id, : len(blocks)] = torch.tensor(blocks, dtype=torch.long)
+        self.block_table.copy_(table.to(self.block_table.device))
+
+    def _num_missing_blocks(self, seq_id: int, num_tokens: int) -> int:
+        num_tokens = min(num_tokens, self.max_seq_len)
+        return math.ceil(num_tokens / self.block_size) - len(self.seq_blocks[seq_id])
+
+    def _reserve(self, seq_id: int, num_tokens: int) -> bool:
+        needed = self._num_missing_blocks(seq_id, num_tokens)
+        if needed <= 0:
+            return False
+        if needed > len(self.free_blocks):
+            if self.requested_num_blocks is not None:
+                raise RuntimeError(
+                    f"The paged KV cache is out of blocks: sequence {seq_id} needs {needed} more block(s) but only "
+                    f"{len(self.free_blocks)} are free. Increase `kv_cache_num_blocks` or reduce the batch size."
+                )
+            self.grow(max(needed - len(self.free_blocks), (self.num_blocks - 1) // 2))
+        for _ in range(needed):
+            self.seq_blocks[seq_id].append(self.free_blocks.pop())
+        return True
+
+    def needs_blocks(self, num_tokens: int) -> bool:
+        """Whether `reserve_all(num_tokens)` hands out new blocks."""
+        return any(
+            self._num_missing_blocks(seq_id, num_tokens) > 0
+            for seq_id in range(len(self.seq_blocks))
+            if seq_id not in self.finished
+        )
+
+    def reserve(self, seq_id: int, num_tokens: int):
+        """Makes sure that sequence `seq_id` has enough blocks to store `num_tokens` tokens."""
+        self.finished.discard(seq_id)
+        if self._reserve(seq_id, num_tokens):
+            self._sync_block_table()
+
+    def reserve_all(self, num_tokens: int):
+        """
+        Same as `reserve` for every sequence that is not finished. The block table is copied to the device only if it
+        changed.
+        """
+        changed = False
+        for seq_id in range(len(self.seq_blocks)):
+            if seq_id not in self.finished:
+                changed = self._reserve(seq_id, num_tokens) or changed
+        if changed:
+            self._sync_block_table()
+
+    def free(self, *seq_ids: int):
+        """
+        Returns the blocks of the finished sequences `seq_ids` to the pool. `reserve_all` does not give them new blocks
+        until the next `reset`, and their block-table entries point to the null block.
+        """
+        changed = False
+        for seq_id in seq_ids:
+            self.finished.add(seq_id)
+            if self.seq_blocks[seq_id]:
+                self.free_blocks.extend(reversed(self.seq_blocks[seq_id]))
+                self.seq_blocks[seq_id] = []
+                changed = True
+        if changed:
+            self._sync_block_table()
+
+    def grow(self, num_blocks: int):
+        """
+        Adds `num_blocks` blocks to the pool and extends the storage of the caches accordingly. The storage tensors are
+        reallocated, so HPU graphs that captured them must be cleared.
+        """
+        old_num_blocks = self.num_blocks
+        self.num_blocks += num_blocks
+        # The new blocks are handed out after the free ones
+        self.free_blocks = list(range(self.num_blocks - 1, old_num_blocks - 1, -1)) + self.free_blocks
+        for cache in self.caches:
+            cache.grow(num_blocks)
+
+    def slot_mapping(self, positions: torch.Tensor) -> torch.Tensor:
+        """
+        Maps token positions to slots of the flattened block pool.
+
+        `positions` is either a 1D tensor shared by all sequences, which gives a `(batch_size, len(positions))`
+        mapping, or a 0D tensor, which gives a `(batch_size,)` mapping. Only device ops are used so that this can run
+        inside HPU graphs.
+        """
+        block_ids = torch.index_select(self.block_table, 1, positions.reshape(-1) // self.block_size)
+        slots = block_ids * self.block_size + positions.reshape(1, -1) % self.block_size
+        return slots.reshape(-1) if positions.dim() == 0 else slots
+
+
+class PagedKVCache(torch.nn.Module):
+    """
+    Drop-in replacement for `KVCache` (with `reuse_cache`) backed by a pool of fixed-size blocks.
+
+    The storage is a `(num_blocks * block_size, num_kv_heads, head_dim)` tensor, so a token slot is addressed with a
+    single index and both the scatter on write and the gather on read are plain `index_copy_`/`index_select` calls.
+    This runs on any device, CPU included. `gather` returns the usual dense `(batch, num_kv_heads, max_seq_len,
+    head_dim)` view, which the prefill and the prefix cache use. In the decode phase, the attention layers only write
+    the new token with `scatter` and attend with `paged_attention`, which reads the storage through the block table
+    without materializing the dense view.
+    """
+
+    def __init__(self, allocator: PagedBlockAllocator):
+        super().__init__()
+        self.allocator = allocator
+        self.cache = None
+        self.shape = None
+        self.inp_seq_len = -1
+        allocator.caches.add(self)
+
+    def allocate(self, inp_seq_len, dtype, device, shape):
+        batch_size, num_heads, max_seq_len, head_dim = shape
+        if self.allocator.block_table is None or self.allocator.block_table.shape[0] != batch_size:
+            raise RuntimeError("The block allocator must be reset before allocating the paged KV cache.")
+        storage_shape = (self.allocator.num_blocks * self.allocator.block_size, num_heads, head_dim)
+        if self.cache is None or self.cache.shape != storage_shape or self.cache.dtype != dtype:
+            self.cache = torch.zeros(storage_shape, dtype=dtype, device=device)
+        self.inp_seq_len = inp_seq_len
+        self.shape = torch.Size(shape)
+
+    def get_shape(self):
+        return self.shape
+
+    def grow(self, num_blocks):
+        if self.cache is not None:
+            new_slots = self.cache.new_zeros((num_blocks * self.allocator.block_size, *self.cache.shape[1:]))
+            self.cache = torch.cat((self.cache, new_slots))
+
+    def scatter(self, cur, positions):
+        """Writes `cur` of shape `(batch, num_kv_heads, len(positions), head_dim)` at `positions`."""
+        slots = self.allocator.slot_mapping(positions).reshape(-1)
+        self.cache.index_copy_(0, slots, cur.transpose(1, 2).reshape(-1, *self.cache.shape[1:]))
+
+    def gather(self, seq_len=None):
+        """Returns the dense `(batch, num_kv_heads, seq_len, head_dim)` view of the cache."""
+        seq_len = self.shape[2] if seq_len is None else seq_len
+        positions = torch.arange(seq_len, device=self.cache.device)
+        slots = self.allocator.slot_mapping(positions)
+        out = self.cache.index_select(0, slots.reshape(-1))
+        return out.view(slots.shape[0], seq_len, *self.cache.shape[1:]).transpose(1, 2)
+
+    @property
+    def memory_bytes(self) -> int:
+        if self.cache is None:
+            return 0
+        return self.cache.numel() * self.cache.element_size()
+
+    def blocks(self) -> torch.Tensor:
+        """Returns the `(num_blocks, block_size, num_kv_heads, head_dim)` view of the storage."""
+        return self.cache.view(self.allocator.num_blocks, self.allocator.block_size, *self.cache.shape[1:])
+
+    def reorder(self, beam_idx: torch.LongTensor):
+        dense = self.gather().index_select(0, beam_idx)
+        self.scatter(dense, torch.arange(self.shape[2], device=self.cache.device))
+
+    def update(self, cur, dim, idx):
+        assert dim == 2, f"The paged KV cache only supports updates along the sequence dim but got dim={dim}"
+        if cur.shape[2] > 1:
+            # Prefill: positions [0, cur_len) are written and the attention runs on `cur` directly
+            self.scatter(cur, torch.arange(cur.shape[2], device=cur.device))
+            return cur
+        assert idx is not None, "The paged KV cache requires `token_idx` in the decode phase"
+        self.scatter(cur, (idx - 1).reshape(()))
+        return self.gather()
+
+    def update_from(self, cur, offset):
+        """Writes `cur` at positions `[offset, offset + cur_len)` and returns the cache up to the last written one."""
+        end = offset + cur.shape[2]
+        self.scatter(cur, torch.arange(offset, end, device=cur.device))
+        return self.gather(end)
+
+    def forward(self, cur, dim, idx):
+        return self.update(cur, dim, idx)
+
+
+# Number of tokens `paged_attention` and `quantized_attention` read from the cache at once
+CACHE_ATTENTION_READ_SIZE = 512
+
+
+def _online_softmax_attention(
+    query: torch.Tensor,
+    attention_mask: torch.Tensor,
+    scaling: float,
+    num_kv_heads: int,
+    read_len: int,
+    read_kv: Callable[[int, int], tuple[torch.Tensor, torch.Tensor]],
+) -> torch.Tensor:
+    """
+    Attention of `query` of shape `(batch, num_heads, q_len, head_dim)` over keys/values read `read_len` positions at
+    a time by `read_kv(start, end)`, which returns them as `(batch, num_kv_heads, end - start, head_dim)` tensors. The
+    softmax is computed online in float32, so that the memory used does not depend on the length of the cache. The
+    positions read are the ones covering the last dim of the additive `attention_mask`, which masks out the positions
+    that are not written yet. Returns a tensor shaped like `query`.
+    """
+    batch_size, num_heads, q_len, head_dim = query.shape
+    dtype = query.dtype
+    num_groups = num_heads // num_kv_heads
+    kv_len = attention_mask.shape[-1]
+    min_value = torch.finfo(torch.float32).min
+
+    # The queries of the heads sharing a key/value head are stacked along the sequence dim
+    query = query.float().reshape(batch_size, num_kv_heads, num_groups * q_len, head_dim) * scaling
+    attention_mask = attention_mask.float().expand(batch_size, 1, q_len, kv_len).repeat(1, 1, num_groups, 1)
+
+    max_scores = torch.full((*query.shape[:-1], 1), min_value, device=query.device)
+    denominator = torch.zeros_like(max_scores)
+    output = torch.zeros_like(query)
+    for start in range(0, kv_len, read_len):
+        end = min(start + read_len, kv_len)
+        keys, values = read_kv(start, end)
+        scores = query @ keys.float().transpose(-1, -2) + attention_mask[..., start:end]
+        new_max_scores = torch.maximum(max_scores, scores.amax(dim=-1, keepdim=True))
+        correction = torch.exp(max_scores - new_max_scores)
+        probs = torch.exp(scores - new_max_scores)
+        denominator = denominator * correction + probs.sum(dim=-1, keepdim=True)
+        output = output * correction + probs @ values.float()
+        max_scores = new_max_scores
+    output = output / denominator
+    return output.reshape(batch_size, num_heads, q_len, head_dim).to(dtype)
+
+
+def paged_attention(
+    query: torch.Tensor,
+    k_cache: PagedKVCache,
+    v_cache: PagedKVCache,
+    attention_mask: torch.Tensor,
+    scaling: float,
+) -> torch.Tensor:
+    """
+    Attention of `query` of shape `(batch, num_heads, q_len, head_dim)` over the keys/values of paged caches, read
+    through the block table a few blocks at a time, see `_online_softmax_attention`.
+    """
+    block_table = k_cache.allocator.block_table
+    block_size = k_cache.allocator.block_size
+    k_blocks, v_blocks = k_cache.blocks(), v_cache.blocks()
+
+    def read_kv(start, end):
+        block_ids = block_table[:, start // block_size : math.ceil(end / block_size)]
+        # (batch, num_blocks * block_size, num_kv_heads, head_dim), the last block may be partly read
+        keys = k_blocks[block_ids].flatten(1, 2)[:, : end - start]
+        values = v_blocks[block_ids].flatten(1, 2)[:, : end - start]
+        return keys.transpose(1, 2), values.transpose(1, 2)
+
+    read_len = max(1, CACHE_ATTENTION_READ_SIZE // block_size) * block_size
+    return _online_softmax_attention(query, attention_mask, scaling, k_cache.cache.shape[1], read_len, read_kv)
+
+
+KV_CACHE_QUANTIZATION_DTYPES = {"int8": torch.int8, "fp8": torch.float8_e4m3fn}
+KV_CACHE_SCALE_GRANULARITIES = ("head", "token")
+
+
+class QuantizedKVCache(torch.nn.Module):
+    """
+    Drop-in replacement for `KVCache` (with `reuse_cache`) that stores the keys/values in int8 or fp8 along with
+    their scales, which halves the memory of the cache compared to bf16.
+
+    Values are quantized symmetrically with `scale = absmax / qmax`. With `granularity="token"`, every head of every
+    token has its own scale, computed when it is written. With `granularity="head"`, every head of every sequence has a
+    single scale computed from the first tokens written after `allocate` (usually the prompt), later tokens are clipped
+    to its range. Reads dequantize the cache to the dtype given to `allocate`, so the attention code and the attention
+    masks are left unchanged. In the decode phase, `quantized_attention` reads the cache a few tokens at a time instead
+    so that no dequantized copy of the whole cache is made. This is plain PyTorch and runs on any device, CPU included.
+
+    Args:
+        dtype (`str`, *optional*, defaults to `"int8"`):
+            The storage dtype, `"int8"` or `"fp8"` (`torch.float8_e4m3fn`).
+        granularity (`str`, *optional*, defaults to `"token"`):
+            The granularity of the scales, `"head"` or `"token"`.
+    """
+
+    def __init__(self, dtype: str = "int8", granularity: str = "token"):
+        super().__init__()
+        if dtype not in KV_CACHE_QUANTIZATION_DTYPES:
+            raise ValueError(
+                f"Unknown KV cache dtype {dtype}, it should be one of {list(KV_CACHE_QUANTIZATION_DTYPES)}."
+            )
+        if granularity not in KV_CACHE_SCALE_GRANULARITIES:
+            raise ValueError(
+                f"Unknown KV cache scale granularity {granularity}, it should be one of {KV_CACHE_SCALE_GRANULARITIES}."
+            )
+        self.quant_dtype = KV_CACHE_QUANTIZATION_DTYPES[dtype]
+        self.granularity = granularity
+        if self.quant_dtype.is_floating_point:
+            self.qmax = torch.finfo(self.quant_dtype).max
+        else:
+            self.qmax = torch.iinfo(self.quant_dtype).max
+        self.cache = None
+        self.scales = None
+        self.dtype = None
+        self.inp_seq_len = -1
+        self.calibrated = False
+
+    def allocate(self, inp_seq_len, dtype, device, shape):
+        batch_size, num_heads, max_seq_len, _ = shape
+        if self.cache is None or self.cache.shape != shape:
+            self.cache = torch.zeros(shape, dtype=self.quant_dtype, device=device)
+            scales_len = max_seq_len if self.granularity == "token" else 1
+            self.scales = torch.ones((batch_size, num_heads, scales_len, 1), dtype=torch.float32, device=device)
+        else:
+            self.cache.zero_()
+            self.scales.fill_(1)
+        self.dtype = dtype
+        self.inp_seq_len = inp_seq_len
+        self.calibrated = False
+
+    @property
+    def memory_bytes(self) -> int:
+        """Memory used by the quantized values and their scales."""
+        if self.cache is None:
+            return 0
+        return self.cache.numel() * self.cache.element_size() + self.scales.numel() * self.scales.element_size()
+
+    def get_shape(self):
+        if self.cache is None:
+            return None
+        return self.cache.shape
+
+    def _compute_scales(self, cur):
+        if self.granularity == "token":
+            absmax = cur.abs().amax(dim=-1, keepdim=True)
+        else:
+            absmax = cur.abs().amax(dim=(-2, -1), keepdim=True)
+        return (absmax.float() / self.qmax).clamp_(min=torch.finfo(torch.float32).tiny)
+
+    def quantize(self, cur, scales):
+        """Returns `cur` divided by `scales` and cast to the storage dtype."""
+        scaled = (cur.float() / scales).clamp_(-self.qmax, self.qmax)
+        if not self.quant_dtype.is_floating_point:
+            scaled = scaled.round_()
+        return scaled.to(self.quant_dtype)
+
+    def dequantize(self, values, scales, dtype=None):
+        """Returns `values * scales` computed in `dtype`, which defaults to the dtype given to `allocate`."""
+        dtype = self.dtype if dtype is None else dtype
+        return values.to(dtype) * scales.to(dtype)
+
+    def _write(self, cur, positions):
+        """Writes `cur` at the 1D `positions` of every sequence, or at the `(batch, cur_len)` ones if it is 2D."""
+        if self.granularity == "token":
+            scales = self._compute_scales(cur)
+        else:
+            if not self.calibrated:
+                self.scales.copy_(self._compute_scales(cur))
+                self.calibrated = True
+            scales = self.scales
+        # Copy the raw bytes, indexing ops are not implemented for fp8 on every device
+        values = self.quantize(cur, scales).view(torch.uint8)
+        cache = self.cache.view(torch.uint8)
+        if positions.dim() == 1:
+            cache.index_copy_(2, positions, values)
+            if self.granularity == "token":
+                self.scales.index_copy_(2, positions, scales)
+        else:
+            index = positions.view(positions.shape[0], 1, -1, 1)
+            cache.scatter_(2, index.expand_as(values), values)
+            if self.granularity == "token":
+                self.scales.scatter_(2, index.expand_as(scales), scales)
+
+    def scatter(self, cur, positions):
+        """Writes `cur` of shape `(batch, num_kv_heads, len(positions), head_dim)` at `positions`."""
+        self._write(cur, positions.reshape(-1))
+
+    def read(self, start, end, dtype=None):
+        """Returns the positions `[start, end)` of the cache dequantized to `dtype`, see `dequantize`."""
+        scales = self.scales[:, :, start:end] if self.granularity == "token" else self.scales
+        return self.dequantize(self.cache[:, :, start:end], scales, dtype)
+
+    def gather(self, seq_len=None):
+        """Returns the dequantized `(batch, num_kv_heads, seq_len, head_dim)` cache."""
+        return self.read(0, self.cache.shape[2] if seq_len is None else seq_len)
+
+    def reorder(self, beam_idx: torch.LongTensor):
+        cache = self.cache.view(torch.uint8)
+        cache.copy_(cache.index_select(0, beam_idx))
+        self.scales.copy_(self.scales.index_select(0, beam_idx))
+
+    def update(self, cur, dim, idx):
+        assert dim == 2, f"The quantized KV cache only supports updates along the sequence dim but got dim={dim}"
+        if cur.shape[2] > 1:
+            # Prefill: positions [0, cur_len) are written and the attention runs on `cur` directly
+            self._write(cur, torch.arange(cur.shape[2], device=cur.device))
+            return cur
+        assert idx is not None, "The quantized KV cache requires `token_idx` in the decode phase"
+        self._write(cur, (idx - 1).reshape(1))
+        return self.gather()
+
+    def update_from(self, cur, offset):
+        """
+        Writes `cur` at positions `[offset, offset + cur_len)` and returns the cache up to the last written one, or the
+        whole cache if `offset` is a tensor of per-sequence offsets.
+        """
+        if isinstance(offset, torch.Tensor):
+            self._write(cur, offset.view(-1, 1) + torch.arange(cur.shape[2], device=cur.device))
+            return self.gather()
+        end = offset + cur.shape[2]
+        self._write(cur, torch.arange(offset, end, device=cur.device))
+        return self.gather(end)
+
+    def forward(self, cur, dim, idx):
+        return self.update(cur, dim, idx)
+
+
+def quantized_attention(
+    query: torch.Tensor,
+    k_cache: QuantizedKVCache,
+    v_cache: QuantizedKVCache,
+    attention_mask: torch.Tensor,
+    scaling: float,
+) -> torch.Tensor:
+    """
+    Attention of `query` of shape `(batch, num_heads, q_len, head_dim)` over the keys/values of quantized caches,
+    dequantized `CACHE_ATTENTION_READ_SIZE` tokens at a time as they are read, see `_online_softmax_attention`.
+    """
+
+    def read_kv(start, end):
+        return k_cache.read(start, end, torch.float32), v_cache.read(start, end, torch.float32)
+
+    return _online_softmax_attention(
+        query, attention_mask, scaling, k_cache.cache.shape[1], CACHE_ATTENTION_READ_SIZE, read_kv
+    )
+
+
+def left_padding_lengths(attention_mask: Optional[torch.Tensor], batch_size: int, device=None) -> torch.Tensor:
+    """Returns the number of left padding tokens of every sequence of the 2D `attention_mask`."""
+    if attention_mask is None:
+        return torch.zeros(batch_size, dtype=torch.long, device=device)
+    return (attention_mask.cumsum(-1) == 0).sum(-1)
+
+
+def sliding_window_slot_positions(
+    position: torch.Tensor, window: int, num_sink_tokens: int = 0, sink_offsets: Optional[torch.Tensor] = None
+) -> torch.Tensor:
+    """
+    Returns the position of the token held by every slot of a `SlidingWindowKVCache` once the token at `position` is
+    written, or -1 for the slots that are still empty or whose token is held by another slot. The sinks of every
+    sequence start at its `sink_offsets`, i.e. its number of left padding tokens, and the result has shape
+    `(batch, num_sink_tokens + window)`, or `(1, num_sink_tokens + window)` without `sink_offsets`. Only device ops
+    are used so that this can run inside HPU graphs.
+    """
+    if sink_offsets is None:
+        sink_offsets = torch.zeros(1, dtype=torch.long, device=position.device)
+    sink_offsets = sink_offsets.view(-1, 1)
+    slots = torch.arange(num_sink_tokens + window, device=position.device)
+    # Ring slot `num_sink_tokens + j` holds the latest `p <= position` such that `(p - num_sink_tokens) % window == j`
+    ring_positions = position - torch.remainder(position - slots, window)
+    positions = torch.where(slots < num_sink_tokens, sink_offsets + slots, ring_positions)
+    # The sinks are only held by the sink slots
+    empty = (positions > position) | ((slots >= num_sink_tokens) & (positions < sink_offsets + num_sink_tokens))
+    return positions.masked_fill(empty, -1)
+
+
+class SlidingWindowKVCache(torch.nn.Module):
+    """
+    Drop-in replacement for `KVCache` (with `reuse_cache`) that only keeps the keys/values of the first
+    `num_sink_tokens` tokens and of the last `window` ones, StreamingLLM style, so that its memory and the cost of the
+    attention of every new token do not depend on the length of the sequence.
+
+    The sinks of a sequence are its first `num_sink_tokens` tokens after its left padding, which `set_sink_offsets`
+    sets before the prefill. The window is a ring buffer: every other token at position `p` is stored in slot
+    `num_sink_tokens + (p - num_sink_tokens) % window` and overwrites the token `window` positions before it. Reads
+    return the `(batch, num_kv_heads, num_sink_tokens + window, head_dim)` storage as is, the attention mask built by
+    `_gaudi_prepare_4d_causal_attention_mask` with `kv_cache_window` maps every slot to the position it holds. Keys
+    are cached after the rotary embedding, so they keep their original positions. `get_shape` returns the logical
+    `(batch, num_kv_heads, max_seq_len, head_dim)` shape, which the rotary embedding is sized with. Writes at an
+    offset (`update_from`, used by the prefix cache, chunked prefill and speculative decoding) are not supported.
+
+    Args:
+        window (`int`):
+            Number of most recent tokens kept.
+        num_sink_tokens (`int`, *optional*, defaults to 0):
+            Number of tokens at the start of the sequence that are always kept.
+    """
+
+    def __init__(self, window: int, num_sink_tokens: int = 0):
+        super().__init__()
+        if window <= 0:
+            raise ValueError(f"`window` must be a positive integer but is {window}.")
+        if num_sink_tokens < 0:
+            raise ValueError(f"`num_sink_tokens` must be a non-negative integer but is {num_sink_tokens}.")
+        self.max_window = window
+        self.max_num_sink_tokens = num_sink_tokens
+        self.window = window
+        self.num_sink_tokens = num_sink_tokens
+        self.cache = None
+        self.sink_offsets = None
+        self.shape = None
+        self.inp_seq_len = -1
+
+    def allocate(self, inp_seq_len, dtype, device, shape):
+        batch_size, num_heads, max_seq_len, head_dim = shape
+        # The ring never wraps if the sequences are shorter than the sinks and the window, then store `max_seq_len`
+        # tokens at most. The attention is the same since every previous token is within the window.
+        self.num_sink_tokens = min(self.max_num_sink_tokens, max_seq_len - 1)
+        self.window = min(self.max_window, max_seq_len - self.num_sink_tokens)
+        storage_shape = (batch_size, num_heads, self.num_sink_tokens + self.window, head_dim)
+        if self.cache is None or self.cache.shape != storage_shape or self.cache.dtype != dtype:
+            self.cache = torch.zeros(storage_shape, dtype=dtype, device=device)
+        else:
+            self.cache.fill_(0)
+        self.sink_offsets = torch.zeros(batch_size, dtype=torch.long, device=device)
+        self.inp_seq_len = inp_seq_len
+        self.shape = torch.Size(shape)
+
+    def get_shape(self):
+        return self.shape
+
+    def set_sink_offsets(self, sink_offsets: torch.Tensor):
+        """Sets the number of left padding tokens of every sequence, after which its sinks start."""
+        self.sink_offsets.copy_(sink_offsets)
+
+    def ring_slot(self, position: torch.Tensor) -> torch.Tensor:
+        """Returns the ring slot of the token at `position`."""
+        return self.num_sink_tokens + torch.remainder(position - self.num_sink_tokens, self.window)
+
+    def slot(self, position: torch.Tensor) -> torch.Tensor:
+        """Returns the slot of the token at `position` in every sequence."""
+        sink_index = position - self.sink_offsets
+        is_sink = (sink_index >= 0) & (sink_index < self.num_sink_tokens)
+        return torch.where(is_sink, sink_index, self.ring_slot(position))
+
+    def gather(self, seq_len=None):
+        return self.cache
+
+    @property
+    def memory_bytes(self) -> int:
+        if self.cache is None:
+            return 0
+        return self.cache.numel() * self.cache.element_size()
+
+    def reorder(self, beam_idx: torch.LongTensor):
+        self.cache.copy_(self.cache.index_select(0, beam_idx))
+        self.sink_offsets.copy_(self.sink_offsets.index_select(0, beam_idx))
+
+    def update(self, cur, dim, idx):
+        assert dim == 2, f"The sliding window KV cache only supports updates along the sequence dim but got dim={dim}"
+        batch_size, num_heads, seq_len, head_dim = cur.shape
+        if seq_len > 1:
+            # Prefill: only the sinks and the last `window` tokens are written and the attention runs on `cur` directly.
+            # The sinks of the sequences whose prompt is too short are written again in the decode phase.
+            if self.num_sink_tokens > 0:
+                sink_positions = self.sink_offsets.view(-1, 1) + torch.arange(self.num_sink_tokens, device=cur.device)
+                sink_positions = sink_positions.clamp(max=seq_len - 1)[:, None, :, None]
+                sinks = cur.gather(2, sink_positions.expand(batch_size, num_heads, -1, head_dim))
+                self.cache[:, :, : self.num_sink_tokens].copy_(sinks)
+            # The sinks also written to the ring are masked out
+            positions = torch.arange(max(0, seq_len - self.window), seq_len, device=cur.device)
+            self.cache.index_copy_(2, self.ring_slot(positions), cur.index_select(2, positions))
+            return cur
+        assert idx is not None, "The sliding window KV cache requires `token_idx` in the decode phase"
+        slots = self.slot(idx - 1)[:, None, None, None]
+        self.cache.scatter_(2, slots.expand(batch_size, num_heads, 1, head_dim), cur)
+        return self.cache
+
+    def forward(self, cur, dim, idx):
+        return self.update(cur, dim, idx)
+
+
+class KVCacheManager:
+    """
+    Owns the KV caches of the attention layers of a model used with `reuse_cache`: their allocation, beam
+    reordering, memory accounting and storage, i.e. contiguous (the `KVCache` class of the model), paged
+    (`PagedKVCache`), quantized (`QuantizedKVCache`) or sliding window (`SlidingWindowKVCache`).
+
+    Every attention layer keeps its caches in its `k_cache` and `v_cache` attributes, which the manager replaces when
+    the storage changes, and implements `allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)` since only the
+    layer knows the shape and dtype of its caches.
+
+    Args:
+        attention_layers (`list[torch.nn.Module]`):
+            The attention layers of the model.
+        cache_cls (`type`, *optional*):
+            The class of the contiguous caches. Defaults to the class of the caches of the first layer.
+    """
+
+    def __init__(self, attention_layers, cache_cls: Optional[type] = None):
+        self.attention_layers = list(attention_layers)
+        if cache_cls is None:
+            cache_cls = type(self.attention_layers[0].k_cache) if self.attention_layers else KVCache
+        self.cache_cls = cache_cls
+        self.allocator = None
+        self.quantization = None
+        self.sliding_window = None
+
+    def _replace_caches(self, cache_factory):
+        for layer in self.attention_layers:
+            layer.k_cache = cache_factory()
+            layer.v_cache = cache_factory()
+
+    def allocate(self, batch_size: int, max_seq_len: int, inp_seq_len: int, device: torch.device):
+        if self.allocator is not None:
+            self.allocator.reset(batch_size, max_seq_len, device, inp_seq_len)
+        for layer in self.attention_layers:
+            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
+
+    def enable_paged(
+        self, block_size: Optional[int], num_blocks: Optional[int] = None
+    ) -> Optional[PagedBlockAllocator]:
+        """
+        Switches to block-paged caches sharing a single pool of blocks, see `PagedBlockAllocator`, or back to
+        contiguous caches if `block_size` is `None`.
+        """
+        if block_size is None:
+            if self.allocator is not None:
+                self._replace_caches(self.cache_cls)
+                self.allocator = None
+            return None
+        if (
+            self.allocator is None
+            or self.allocator.block_size != block_size
+            or self.allocator.requested_num_blocks != num_blocks
+        ):
+            allocator = PagedBlockAllocator(block_size, num_blocks)
+            self._replace_caches(lambda: PagedKVCache(allocator))
+            self.allocator = allocator
+            self.quantization = None
+            self.sliding_window = None
+        return self.allocator
+
+    def enable_quantized(self, dtype: Optional[str], granularity: str = "token"):
+        """Switches to `QuantizedKVCache`s, or back to contiguous caches if `dtype` is `None`."""
+        quantization = None if dtype is None else (dtype, granularity)
+        if self.quantization != quantization:
+            if dtype is None:
+                self._replace_caches(self.cache_cls)
+            else:
+                self._replace_caches(lambda: QuantizedKVCache(dtype, granularity))
+            self.quantization = quantization
+            self.allocator = None
+            self.sliding_window = None
+
+    def enable_sliding_window(self, window: Optional[int], num_sink_tokens: int = 0):
+        """Switches to `SlidingWindowKVCache`s, or back to contiguous caches if `window` is `None`."""
+        sliding_window = None if window is None else (window, num_sink_tokens)
+        if self.sliding_window != sliding_window:
+            if window is None:
+                self._replace_caches(self.cache_cls)
+            else:
+                self._replace_caches(lambda: SlidingWindowKVCache(window, num_sink_tokens))
+            self.sliding_window = sliding_window
+            self.allocator = None
+            self.quantization = None
+
+    @property
+    def sliding_window_layout(self) -> Optional[tuple[int, int]]:
+        """
+        The `(window, num_sink_tokens)` of the allocated sliding window caches, which can be smaller than the requested
+        ones for short sequences, or `None` if the caches are not sliding window ones.
+        """
+        if self.sliding_window is None:
+            return None
+        k_cache = self.attention_layers[0].k_cache
+        return k_cache.window, k_cache.num_sink_tokens
+
+    def set_sink_offsets(self, attention_mask: Optional[torch.Tensor], batch_size: int):
+        """
+        Starts the sinks of the sliding window caches after the left padding of every sequence of the 2D
+        `attention_mask`. To call before the prefill, does nothing if the caches are not sliding window ones.
+        """
+        if self.sliding_window is None:
+            return
+        sink_offsets = None
+        for k_cache, v_cache in self.get_kv_caches():
+            if sink_offsets is None:
+                sink_offsets = left_padding_lengths(attention_mask, batch_size, k_cache.cache.device)
+            k_cache.set_sink_offsets(sink_offsets)
+            v_cache.set_sink_offsets(sink_offsets)
+
+    def get_kv_caches(self):
+        """Returns the `(k_cache, v_cache)` modules of every layer."""
+        return [(layer.k_cache, layer.v_cache) for layer in self.attention_layers]
+
+    def reorder(self, beam_idx: torch.LongTensor):
+        """Reorders the sequences of every cache along `beam_idx` and returns the `(k_shape, v_shape)` of every layer."""
+        shapes = []
+        for k_cache, v_cache in self.get_kv_caches():
+            if k_cache.cache is None:
+                shapes.append((None, None))
+                continue
+            k_cache.reorder(beam_idx)
+            v_cache.reorder(beam_idx)
+            shapes.append((k_cache.get_shape(), v_cache.get_shape()))
+        return tuple(shapes)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Memory used by the caches of all the layers."""
+        return sum(k_cache.memory_bytes + v_cache.memory_bytes for k_cache, v_cache in self.get_kv_caches())
+
+
+class GaudiKVCacheMixin:
+    """
+    Implements the model-level KV cache methods used by `generate` with `reuse_cache` (`allocate_kv_cache`,
+    `reorder_kv_cache`, `get_kv_caches`) on top of a `KVCacheManager` created on first use. Models whose attention
+    layers are not `layer.self_attn for layer in self.layers` override `_get_kv_cache_attention_layers`.
+    """
+
+    def _get_kv_cache_attention_layers(self):
+        return [layer.self_attn for layer in self.layers]
+
+    @property
+    def kv_cache_manager(self) -> KVCacheManager:
+        # Not an attribute set in `__init__` since most models keep the `__init__` of their Transformers class
+        manager = self.__dict__.get("_kv_cache_manager")
+        if manager is None:
+            manager = KVCacheManager(self._get_kv_cache_attention_layers())
+            self.__dict__["_kv_cache_manager"] = manager
+        return manager
+
+    @property
+    def kv_cache_allocator(self) -> Optional[PagedBlockAllocator]:
+        return self.kv_cache_manager.allocator
+
+    @property
+    def kv_cache_quantization(self) -> Optional[tuple[str, str]]:
+        return self.kv_cache_manager.quantization
+
+    @property
+    def kv_cache_sliding_window(self) -> Optional[tuple[int, int]]:
+        return self.kv_cache_manager.sliding_window
+
+    @property
+    def kv_cache_memory_bytes(self) -> int:
+        return self.kv_cache_manager.memory_bytes
+
+    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
+        self.kv_cache_manager.allocate(batch_size, max_seq_len, inp_seq_len, self.device)
+
+    def get_kv_caches(self):
+        """Returns the `(k_cache, v_cache)` modules of every layer, used with `reuse_cache`."""
+        return self.kv_cache_manager.get_kv_caches()
+
+    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
+        return self.kv_cache_manager.reorder(beam_idx)
+
+
+# Sequence dim of the keys and of the values of the legacy past key values (i.e. without `reuse_cache`) of the models
+# whose layout is not `(batch, num_heads, seq_len, head_dim)`
+PAST_KEY_VALUES_SEQUENCE_DIMS = {
+    # Keys are `(batch * num_heads, head_dim, seq_len)` and values `(batch * num_heads, seq_len, head_dim)`
+    "bloom": (-1, -2),
+}
+
+# Buffers the past key values are views of after a bucket expansion, by id
+_BUCKET_BUFFERS = weakref.WeakValueDictionary()
+
+
+def _expand_along(tensor: torch.Tensor, dim: int, pad_amount: int, pad_value) -> torch.Tensor:
+    new_len = tensor.shape[dim] + pad_amount
+    base = tensor._base
+    if (
+        base is not None
+        and _BUCKET_BUFFERS.get(id(base)) is base
+        and base.shape[dim] >= new_len
+        and tensor.data_ptr() == base.data_ptr()
+        and tensor.stride() == base.stride()
+    ):
+        # The models update their past key values in place, so the buffer already holds them
+        return base.narrow(dim, 0, new_len)
+    # Leave room for one more expansion, so that every other expansion narrows the buffer instead of copying it, for
+    # at most `pad_amount` tokens (usually one bucket) of unused memory
+    buffer_shape = list(tensor.shape)
+    buffer_shape[dim] = new_len + pad_amount
+    buffer = torch.full(buffer_shape, pad_value, dtype=tensor.dtype, device=tensor.device)
+    _BUCKET_BUFFERS[id(buffer)] = buffer
+    expanded = buffer.narrow(dim, 0, new_len)
+    expanded.narrow(dim, 0, tensor.shape[dim]).copy_(tensor)
+    return expanded
+
+
+def expand_past_key_values(
+    past_key_values, prev_len: int, pad_amount: int, bucket_size: int, pad_value, model_type: str, num_virtual_tokens=0
+):
+    """
+    Extends the sequence dim of the legacy past key values by `pad_amount` positions filled with `pad_value` when
+    the generation moves to the next bucket. Only the tensors whose length is `prev_len` (plus the virtual tokens of
+    prompt tuning) are extended.
+
+    The past key values are views of buffers with room for one more expansion along the sequence dim, so every other
+    expansion does not copy them, only narrows the buffer.
+    """
+    if isinstance(past_key_values[0], torch.Tensor):
+        # GPT-BigCode fuses the keys and values of a layer in a single tensor
+        return [_expand_along(layer_past, -2, pad_amount, pad_value) for layer_past in past_key_values]
+
+    if model_type in PAST_KEY_VALUES_SEQUENCE_DIMS:
+        seq_dims = PAST_KEY_VALUES_SEQUENCE_DIMS[model_type]
+    else:
+        assert past_key_values[0][0].dim() == 4, "Unknown case, please handle, or don't use bucketing"
+        seq_dims = (-2,) * len(past_key_values[0])
+
+    new_past_key_values = []
+    for layer_past in past_key_values:
+        new_layer_past = []
+        for tensor, seq_dim in zip(layer_past, seq_dims):
+            # This check is added in case we get a new model with a new kv-cache structure, and we attempt to pad some
+            # wrong dimension. With prompt tuning, the virtual tokens are not counted in the buckets
+            if tensor.shape[seq_dim] == prev_len + num_virtual_tokens:
+                assert tensor.shape[seq_dim] % bucket_size == num_virtual_tokens
+                tensor = _expand_along(tensor, seq_dim, pad_amount, pad_value)
+            new_layer_past.append(tensor)
+        new_past_key_values.append(tuple(new_layer_past))
+    return tuple(new_past_key_values)
+
+
+class PrefixCache:
+    """
+    Least-recently-used store of the keys/values of prompt prefixes, kept across `generate` calls.
+
+    Prompts are split into chunks of `chunk_size` tokens and every chunk is keyed by a hash of its token ids chained
+    with the key of the previous chunk, so that a key identifies the whole prefix ending with that chunk. An entry
+    holds the keys/values of one chunk of one sequence for all the layers as a
+    `(num_layers, 2, num_kv_heads, chunk_size, head_dim)` tensor. Entries are evicted once `max_memory_bytes` is
+    exceeded. The keys of a prefix are touched from the last chunk to the first one, so a chunk is never evicted before
+    the chunks that extend it.
+
+    The KV caches this reads from and writes to are the `(k_cache, v_cache)` pairs returned by the `get_kv_caches`
+    method of the model, i.e. `KVCache`-like modules with `update_from` and `gather`.
+
+    Args:
+        chunk_size (`int`, *optional*, defaults to 128):
+            Number of tokens per cached chunk.
+        max_memory_bytes (`int`, *optional*, defaults to 1 GiB):
+            Memory budget of the cached keys/values.
+    """
+
+    def __init__(self, chunk_size: int = 128, max_memory_bytes: int = 1 << 30):
+        if chunk_size <= 0:
+            raise ValueError(f"`chunk_size` must be a positive integer but is {chunk_size}.")
+        self.chunk_size = chunk_size
+        self.max_memory_bytes = max_memory_bytes
+        self.entries = OrderedDict()
+        self.memory_usage = 0
+        self.num_hit_tokens = 0
+        self.num_queried_tokens = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        return self.num_hit_tokens / self.num_queried_tokens if self.num_queried_tokens else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.memory_usage = 0
+
+    def chunk_keys(self, token_ids: torch.Tensor) -> list[bytes]:
+        """Returns the chained keys of the complete chunks of the 1D `token_ids`."""
+        token_ids = token_ids.detach().to("cpu", torch.int64)
+        keys = []
+        key = b""
+        for start in range(0, token_ids.numel() - self.chunk_size + 1, self.chunk_size):
+            chunk = token_ids[start : start + self.chunk_size].numpy().tobytes()
+            key = hashlib.blake2b(key + chunk, digest_size=16).digest()
+            keys.append(key)
+        return keys
+
+    def match(self, input_ids: torch.Tensor) -> tuple[list[list[bytes]], int]:
+        """
+        Hashes every sequence of the 2D `input_ids` and returns the chunk keys of each sequence along with the number
+        of leading chunks that are cached for all of them.
+        """
+        batch_keys = [self.chunk_keys(token_ids) for token_ids in input_ids]
+        num_chunks = min(self._num_cached(keys) for keys in batch_keys)
+        self.num_queried_tokens += input_ids.numel()
+        self.num_hit_tokens += num_chunks * self.chunk_size * input_ids.shape[0]
+        return batch_keys, num_chunks
+
+    def _num_cached(self, keys: list[bytes]) -> int:
+        num_chunks = 0
+        for key in keys:
+            if key not in self.entries:
+                break
+            num_chunks += 1
+        return num_chunks
+
+    def load(self, kv_caches, batch_keys: list[list[bytes]], num_chunks: int) -> int:
+        """
+        Writes the first `num_chunks` cached chunks of every sequence to positions `[0, num_chunks * chunk_size)` of
+        `kv_caches` and returns the number of tokens written.
+        """
+        if num_chunks == 0:
+            return 0
+        # (batch_size, num_layers, 2, num_kv_heads, num_tokens, head_dim)
+        prefix = torch.stack(
+            [torch.cat([self.entries[key] for key in keys[:num_chunks]], dim=3) for keys in batch_keys]
+        )
+        for layer_idx, (k_cache, v_cache) in enumerate(kv_caches):
+            k_cache.update_from(prefix[:, layer_idx, 0], 0)
+            v_cache.update_from(prefix[:, layer_idx, 1], 0)
+        self._touch(batch_keys)
+        return num_chunks * self.chunk_size
+
+    def store(self, kv_caches, batch_keys: list[list[bytes]]):
+        """Copies the chunks of `kv_caches` that are not cached yet, then evicts entries beyond the memory budget."""
+        num_tokens = max(len(keys) for keys in batch_keys) * self.chunk_size
+        missing = [
+            (seq_id, chunk_id, key)
+            for seq_id, keys in enumerate(batch_keys)
+            for chunk_id, key in enumerate(keys)
+            if key not in self.entries
+        ]
+        if missing:
+            # (batch_size, num_layers, 2, num_kv_heads, num_tokens, head_dim)
+            kv = torch.stack(
+                [
+                    torch.stack((k_cache.gather(num_tokens), v_cache.gather(num_tokens)), dim=1)
+                    for k_cache, v_cache in kv_caches
+                ],
+                dim=1,
+            )
+            for seq_id, chunk_id, key in missing:
+                if key in self.entries:
+                    # identical prefixes in the same batch
+                    continue
+                start = chunk_id * self.chunk_size
+                entry = kv[seq_id, ..., start : start + self.chunk_size, :].clone()
+                self.entries[key] = entry
+                self.memory_usage += entry.numel() * entry.element_size()
+        self._touch(batch_keys)
+        self._evict()
+
+    def _touch(self, batch_keys: list[list[bytes]]):
+        for keys in batch_keys:
+            for key in reversed(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+
+    def _evict(self):
+        while self.memory_usage > self.max_memory_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.memory_usage -= entry.numel() * entry.element_size()
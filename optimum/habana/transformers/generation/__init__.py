@@ -1,9 +1,17 @@
-from .candidate_generator import GaudiAssistedCandidateGenerator
+from .bucketing import expected_padding, length_histogram, plan_buckets
+from .candidate_generator import (
+    GaudiAssistedCandidateGenerator,
+    GaudiStaticDraftCandidateGenerator,
+    SpeculativeDecodingStats,
+)
 from .configuration_utils import GaudiGenerationConfig
+from .continuous_batching import ContinuousBatchingEngine, ContinuousBatchingOutput, GenerationRequest
+from .sampling import fused_sample, fused_sample_probs_reference, fused_top_k_scores
 from .stopping_criteria import (
     gaudi_EosTokenCriteria_call,
     gaudi_MaxLengthCriteria_call,
     gaudi_MaxTimeCriteria_call,
     gaudi_StoppingCriteriaList_call,
 )
+from .streamers import GaudiTextIteratorStreamer, GaudiTokenIteratorStreamer, IncrementalDetokenizer
 from .utils import MODELS_OPTIMIZED_WITH_STATIC_SHAPES, GaudiGenerationMixin
@@ -0,0 +1,185 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import math
+from collections import Counter
+from typing import Iterable, Mapping, Optional
+
+import numpy as np
+
+
+BUCKET_PLAN_STRATEGIES = ("optimal", "quantile", "geometric")
+
+
+def _round_up(length: int, multiple_of: int) -> int:
+    return int(math.ceil(length / multiple_of) * multiple_of)
+
+
+def length_histogram(prompt_lengths: Iterable[int], output_lengths: Optional[Iterable[int]] = None) -> dict[int, int]:
+    """
+    Returns the histogram of the sequence lengths that the forward passes of generation need room for.
+
+    A prompt of `p` tokens that generates `o` new tokens runs `o` forward passes that need a static buffer of at
+    least `p + 1`, `p + 2`, ..., `p + o` tokens. If `output_lengths` is not given, only the first forward pass of every
+    prompt is counted.
+    """
+    prompt_lengths = list(prompt_lengths)
+    output_lengths = [1] * len(prompt_lengths) if output_lengths is None else list(output_lengths)
+    if len(output_lengths) != len(prompt_lengths):
+        raise ValueError(
+            f"Got {len(prompt_lengths)} prompt lengths but {len(output_lengths)} output lengths, they should match."
+        )
+    # Difference array: +1 at p + 1 and -1 at p + o + 1
+    deltas = Counter()
+    for prompt_length, output_length in zip(prompt_lengths, output_lengths):
+        if output_length <= 0:
+            continue
+        deltas[prompt_length + 1] += 1
+        deltas[prompt_length + output_length + 1] -= 1
+    histogram = {}
+    count = 0
+    positions = sorted(deltas)
+    for position, next_position in zip(positions, positions[1:]):
+        count += deltas[position]
+        if count:
+            for length in range(position, next_position):
+                histogram[length] = count
+    return histogram
+
+
+def next_bucket(buckets: list[int], length: int, bucket_size: int) -> int:
+    """
+    Returns the smallest bucket of `buckets` that holds `length` tokens. Lengths beyond the last bucket are rounded up
+    to a multiple of `bucket_size`.
+    """
+    idx = bisect.bisect_left(buckets, length)
+    if idx < len(buckets):
+        return buckets[idx]
+    return _round_up(length, bucket_size)
+
+
+def expected_padding(histogram: Mapping[int, int], buckets: list[int]) -> float:
+    """Returns the average number of padding tokens per forward pass of `histogram` with the given buckets."""
+    total_count = sum(histogram.values())
+    if total_count == 0:
+        return 0.0
+    padding = 0
+    for length, count in histogram.items():
+        idx = bisect.bisect_left(buckets, length)
+        if idx == len(buckets):
+            raise ValueError(f"Length {length} does not fit in the largest bucket {buckets[-1]}.")
+        padding += (buckets[idx] - length) * count
+    return padding / total_count
+
+
+def _optimal_boundaries(candidates: np.ndarray, weights: np.ndarray, sums: np.ndarray, max_buckets: int) -> list[int]:
+    # cost[i, j] of a bucket at candidates[j] holding candidates[i..j] is candidates[j] * W[i..j] - S[i..j]
+    num_candidates = len(candidates)
+    cum_weights = np.concatenate(([0.0], np.cumsum(weights)))
+    cum_sums = np.concatenate(([0.0], np.cumsum(sums)))
+    # best[j] is the minimal padding of candidates[:j] with the buckets placed so far, the last one at candidates[j-1]
+    best = np.full(num_candidates + 1, np.inf)
+    best[0] = 0.0
+    choices = []
+    for _ in range(max_buckets):
+        new_best = np.full(num_candidates + 1, np.inf)
+        choice = np.zeros(num_candidates + 1, dtype=np.int64)
+        for j in range(1, num_candidates + 1):
+            starts = np.arange(j)
+            costs = (
+                best[starts]
+                + candidates[j - 1] * (cum_weights[j] - cum_weights[starts])
+                - (cum_sums[j] - cum_sums[starts])
+            )
+            choice[j] = int(np.argmin(costs))
+            new_best[j] = costs[choice[j]]
+        choices.append(choice)
+        best = new_best
+
+    boundaries = []
+    end = num_candidates
+    for choice in reversed(choices):
+        if end == 0:
+            break
+        boundaries.append(int(candidates[end - 1]))
+        end = choice[end]
+    return sorted(set(boundaries))
+
+
+def plan_buckets(
+    histogram: Mapping[int, int],
+    max_buckets: int,
+    strategy: str = "optimal",
+    multiple_of: int = 1,
+    max_length: Optional[int] = None,
+) -> list[int]:
+    """
+    Computes a non-uniform set of at most `max_buckets` static sequence lengths for the given length histogram (see
+    `length_histogram`), to be used as `GaudiGenerationConfig.buckets`.
+
+    Args:
+        histogram (`Mapping[int, int]`):
+            Number of occurrences of every sequence length.
+        max_buckets (`int`):
+            Maximum number of buckets, i.e. of compiled shapes.
+        strategy (`str`, *optional*, defaults to `"optimal"`):
+            `"optimal"` minimizes the expected padding with dynamic programming, `"quantile"` places the buckets at
+            evenly spaced quantiles of the histogram and `"geometric"` grows them by a constant ratio between the
+            smallest and the largest length.
+        multiple_of (`int`, *optional*, defaults to 1):
+            Every bucket is a multiple of this value. Set it to `bucket_size` for the plan to be used in `generate`.
+        max_length (`int`, *optional*):
+            If given, the largest bucket is at least `max_length`.
+
+    Returns:
+        `list[int]`: the sorted buckets. The largest one holds the largest length of the histogram.
+    """
+    if strategy not in BUCKET_PLAN_STRATEGIES:
+        raise ValueError(f"Unknown bucket plan strategy {strategy}, it should be one of {BUCKET_PLAN_STRATEGIES}.")
+    if max_buckets <= 0:
+        raise ValueError(f"`max_buckets` must be a positive integer but is {max_buckets}.")
+    histogram = {length: count for length, count in histogram.items() if count > 0}
+    if max_length is not None:
+        histogram.setdefault(max_length, 0)
+    if not histogram:
+        raise ValueError("Cannot plan buckets for an empty histogram.")
+
+    # Lengths are rounded up to `multiple_of` first, the rounded values are the candidate buckets
+    rounded = Counter()
+    rounded_sums = Counter()
+    for length, count in histogram.items():
+        candidate = _round_up(length, multiple_of)
+        rounded[candidate] += count
+        rounded_sums[candidate] += count * length
+    candidates = np.array(sorted(rounded), dtype=np.float64)
+    weights = np.array([rounded[c] for c in sorted(rounded)], dtype=np.float64)
+    largest = int(candidates[-1])
+    if len(candidates) <= max_buckets:
+        return [int(c) for c in candidates]
+
+    if strategy == "optimal":
+        sums = np.array([rounded_sums[c] for c in sorted(rounded)], dtype=np.float64)
+        return _optimal_boundaries(candidates, weights, sums, max_buckets)
+    elif strategy == "quantile":
+        cum_weights = np.cumsum(weights) / weights.sum()
+        quantiles = np.arange(1, max_buckets) / max_buckets
+        buckets = {int(candidates[np.searchsorted(cum_weights, q)]) for q in quantiles}
+    else:
+        smallest = int(candidates[0])
+        ratio = (largest / smallest) ** (1 / (max_buckets - 1)) if max_buckets > 1 else 1.0
+        buckets = {_round_up(smallest * ratio**i, multiple_of) for i in range(max_buckets - 1)}
+    buckets.add(largest)
+    return sorted(b for b in buckets if b <= largest)
@@ -1,5 +1,5 @@
 import inspect
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Optional, Union
 
 import torch
 from transformers.generation.candidate_generator import (
@@ -43,3 +43,226 @@ class GaudiAssistedCandidateGenerator(AssistedCandidateGenerator):
         for key, value in list(self.assistant_kwargs.items()):
             if value is not None and key not in model_args:
                 del self.assistant_kwargs[key]
+
+
+# Keyword arguments of `generate` forwarded to both models by static speculative decoding
+STATIC_SPECULATIVE_FORWARD_KWARGS = (
+    "lazy_mode",
+    "attn_softmax_bf16",
+    "use_flash_attention",
+    "flash_attention_recompute",
+    "flash_attention_fast_softmax",
+)
+
+
+def static_speculative_forward(
+    model: "PreTrainedModel",
+    input_ids: torch.LongTensor,
+    attention_mask: torch.Tensor,
+    position_ids: torch.LongTensor,
+    prefill_offset: Union[int, torch.Tensor],
+    logits_to_keep: int = 0,
+    **kwargs,
+) -> torch.Tensor:
+    """
+    Runs `input_ids` through `model` and writes their keys/values at `prefill_offset` in its preallocated cache.
+    `attention_mask` is the padding mask of the whole static buffer. Returns the logits of the last `logits_to_keep`
+    tokens, or of the last one if it is 0.
+    """
+    return model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        position_ids=position_ids,
+        prefill_offset=prefill_offset,
+        logits_to_keep=logits_to_keep,
+        use_cache=True,
+        reuse_cache=True,
+        **kwargs,
+    ).logits
+
+
+def greedy_acceptance(
+    draft_tokens: torch.LongTensor, target_logits: torch.Tensor
+) -> tuple[torch.LongTensor, torch.LongTensor]:
+    """
+    Verifies the `(batch_size, K)` draft tokens against the `(batch_size, K + 1, vocab_size)` target logits of the last
+    accepted token followed by the draft tokens.
+
+    Returns the number of accepted draft tokens of every sequence and the `(batch_size, K + 1)` new tokens, of which
+    the first `num_accepted + 1` are valid: the accepted draft tokens and the target token that follows them.
+    """
+    target_tokens = target_logits.argmax(dim=-1)
+    num_accepted = (draft_tokens == target_tokens[:, :-1]).long().cumprod(dim=-1).sum(dim=-1)
+    return num_accepted, target_tokens
+
+
+def speculative_sampling_acceptance(
+    draft_tokens: torch.LongTensor, draft_probs: torch.Tensor, target_probs: torch.Tensor
+) -> tuple[torch.LongTensor, torch.LongTensor]:
+    """
+    Same as `greedy_acceptance` for sampling (https://huggingface.co/papers/2211.17192): draft token `i` is accepted
+    with probability `min(1, p_i / q_i)` and the first rejected one is replaced by a sample of the normalized
+    `max(0, p - q)`. If every draft token is accepted, the next token is sampled from the last target distribution.
+    """
+    num_speculative_tokens = draft_tokens.shape[1]
+    draft_tokens_index = draft_tokens.unsqueeze(-1)
+    p = target_probs[:, :num_speculative_tokens].gather(-1, draft_tokens_index).squeeze(-1)
+    q = draft_probs.gather(-1, draft_tokens_index).squeeze(-1)
+    accepted = torch.rand_like(p) * q <= p
+    num_accepted = accepted.long().cumprod(dim=-1).sum(dim=-1)
+
+    residual = (target_probs[:, :num_speculative_tokens] - draft_probs).clamp_min(0)
+    residual = torch.cat((residual, target_probs[:, num_speculative_tokens:]), dim=1)
+    residual_sum = residual.sum(dim=-1, keepdim=True)
+    # The residual is empty when both distributions are equal, the token is then rejected with probability 0
+    residual = torch.where(residual_sum > 0, residual / residual_sum.clamp_min(1e-12), target_probs)
+    next_probs = residual.gather(1, num_accepted.view(-1, 1, 1).expand(-1, 1, residual.shape[-1])).squeeze(1)
+    next_tokens = torch.multinomial(next_probs, num_samples=1)
+
+    new_tokens = torch.cat((draft_tokens, next_tokens), dim=1).scatter(1, num_accepted.view(-1, 1), next_tokens)
+    return num_accepted, new_tokens
+
+
+class SpeculativeDecodingStats:
+    """
+    Acceptance statistics of static speculative decoding. They are accumulated on the device and only copied to the
+    host when read.
+    """
+
+    def __init__(self, num_speculative_tokens: int, device: torch.device):
+        self.num_speculative_tokens = num_speculative_tokens
+        self.num_rounds = 0
+        self._num_sequence_rounds = torch.zeros((), dtype=torch.long, device=device)
+        self._num_accepted = torch.zeros((), dtype=torch.long, device=device)
+
+    def update(self, num_accepted: torch.LongTensor, unfinished_sequences: torch.Tensor):
+        """Adds a verification round, `num_accepted` is only counted for the sequences that were not finished."""
+        self.num_rounds += 1
+        self._num_sequence_rounds += unfinished_sequences.sum()
+        self._num_accepted += (num_accepted * unfinished_sequences).sum()
+
+    @property
+    def num_drafted_tokens(self) -> int:
+        return int(self._num_sequence_rounds.item()) * self.num_speculative_tokens
+
+    @property
+    def num_accepted_tokens(self) -> int:
+        return int(self._num_accepted.item())
+
+    @property
+    def acceptance_rate(self) -> float:
+        """Fraction of the draft tokens accepted by the target model."""
+        num_drafted_tokens = self.num_drafted_tokens
+        return self.num_accepted_tokens / num_drafted_tokens if num_drafted_tokens else 0.0
+
+    @property
+    def mean_tokens_per_round(self) -> float:
+        """Average number of tokens a sequence gets from a target forward pass, the accepted ones plus the next one."""
+        num_sequence_rounds = int(self._num_sequence_rounds.item())
+        return (self.num_accepted_tokens + num_sequence_rounds) / num_sequence_rounds if num_sequence_rounds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "num_speculative_tokens": self.num_speculative_tokens,
+            "num_rounds": self.num_rounds,
+            "num_drafted_tokens": self.num_drafted_tokens,
+            "num_accepted_tokens": self.num_accepted_tokens,
+            "acceptance_rate": self.acceptance_rate,
+            "mean_tokens_per_round": self.mean_tokens_per_round,
+        }
+
+
+class GaudiStaticDraftCandidateGenerator:
+    """
+    Drafts `num_speculative_tokens` tokens per round for all the sequences of the batch with an assistant model whose
+    key/value cache is preallocated for the whole static buffer.
+
+    Every sequence has its own cursor: the position of its last accepted token, which is not in the caches yet. A round
+    feeds this token and the draft tokens one by one at the per-sequence positions `cursor, ..., cursor + K`. The
+    last forward pass only writes the keys/values of the last draft token, so that the cache holds every accepted
+    token whatever the number of accepted draft tokens. Entries of rejected tokens are simply overwritten by the next
+    round and are masked out until then, so the shapes of every round are the same.
+
+    Args:
+        assistant_model (`PreTrainedModel`):
+            The draft model, its `forward` must support a per-sequence `prefill_offset` with `reuse_cache`.
+        num_speculative_tokens (`int`):
+            The number of tokens drafted per round.
+        logits_processor (`LogitsProcessorList`, *optional*):
+            Processors applied to the draft logits.
+        do_sample (`bool`, *optional*, defaults to `False`):
+            Whether draft tokens are sampled, in which case their distributions are returned as well.
+        forward_kwargs:
+            Additional keyword arguments passed to every forward pass of the draft model.
+    """
+
+    def __init__(
+        self,
+        assistant_model: "PreTrainedModel",
+        num_speculative_tokens: int,
+        logits_processor: "LogitsProcessorList" = None,
+        do_sample: bool = False,
+        **forward_kwargs,
+    ):
+        self.assistant_model = assistant_model
+        self.num_speculative_tokens = num_speculative_tokens
+        self.logits_processor = logits_processor
+        self.do_sample = do_sample
+        self.forward_kwargs = forward_kwargs
+        self.attention_mask = None
+        self.position_ids = None
+
+    def prefill(self, input_ids: torch.LongTensor, attention_mask: torch.Tensor, position_ids: torch.LongTensor):
+        """
+        Allocates the cache of the draft model for the static buffer described by `attention_mask` and `position_ids`
+        and runs the `input_ids` prompt through it.
+        """
+        batch_size, max_length = attention_mask.shape
+        if hasattr(self.assistant_model, "update_sincos_cache"):
+            self.assistant_model.update_sincos_cache(seq_len=max_length)
+        self.assistant_model.allocate_kv_cache(batch_size, max_length, input_ids.shape[1])
+        self.attention_mask = attention_mask
+        self.position_ids = position_ids
+        static_speculative_forward(
+            self.assistant_model,
+            input_ids,
+            attention_mask,
+            position_ids[:, : input_ids.shape[1]],
+            0,
+            **self.forward_kwargs,
+        )
+
+    def get_candidates(
+        self, input_ids: torch.LongTensor, cursor: torch.LongTensor
+    ) -> tuple[torch.LongTensor, Optional[torch.Tensor]]:
+        """
+        Returns the `(batch_size, K)` draft tokens that follow the token of every sequence of the static buffer
+        `input_ids` at `cursor` and, with sampling, their `(batch_size, K, vocab_size)` distributions.
+        """
+        tokens = input_ids.gather(1, cursor.view(-1, 1))
+        draft_tokens = []
+        draft_probs = []
+        for i in range(self.num_speculative_tokens + 1):
+            offsets = cursor + i
+            logits = static_speculative_forward(
+                self.assistant_model,
+                tokens,
+                self.attention_mask,
+                self.position_ids.gather(1, offsets.view(-1, 1)),
+                offsets,
+                **self.forward_kwargs,
+            )
+            if i == self.num_speculative_tokens:
+                break
+            logits = logits[:, -1, :].float()
+            if self.logits_processor:
+                logits = self.logits_processor(input_ids, logits)
+            if self.do_sample:
+                probs = logits.softmax(dim=-1)
+                tokens = torch.multinomial(probs, num_samples=1)
+                draft_probs.append(probs)
+            else:
+                tokens = logits.argmax(dim=-1, keepdim=True)
+            draft_tokens.append(tokens)
+
+        return torch.cat(draft_tokens, dim=1), torch.stack(draft_probs, dim=1) if self.do_sample else None
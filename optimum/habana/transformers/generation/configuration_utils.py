@@ -29,6 +29,11 @@ class GaudiGenerationConfig(GenerationConfig):
         If negative (default=-1) pad to max if `static_shapes` is set. Else start with
         `shape = bucket_size * ceil(prompt_len/bucket_size)` and then grow space by `bucket_size` when needed.
         Only active if `static_shapes` is used. Can't be used with `reuse_cache`.
+    buckets (`list[int]`, *optional*):
+        Non-uniform static buffer sizes to grow through instead of multiples of `bucket_size`, for instance computed
+        from a length histogram with `optimum.habana.transformers.generation.plan_buckets`. Every bucket must be a
+        multiple of `bucket_size`, sizes beyond the largest bucket grow by `bucket_size`. Only used with
+        `bucket_size > 0`.
     bucket_internal (`bool`, *optional*):
         Split kv sequence into buckets in decode phase. It improves throughput when max_new_tokens is large.
     use_flash_attention (`bool`, *optional*):
@@ -43,6 +48,56 @@ class GaudiGenerationConfig(GenerationConfig):
         Specify the batch size split for attention and mlp layers. 1 for no split. This is enabled only for prompt.
     logits_bf16 (`bool`, *optional*):
         Keep logits in bf16.
+    kv_cache_block_size (`int`, *optional*):
+        If set, store the key/value cache in a pool of blocks of `kv_cache_block_size` tokens that are handed out to
+        sequences on demand instead of one contiguous `max_length` buffer per sequence. Requires `reuse_cache`.
+    kv_cache_num_blocks (`int`, *optional*):
+        Number of blocks in the paged key/value cache pool, which generation cannot exceed. If not specified, the pool
+        starts with the blocks of the prompts and half of the blocks of the new tokens, finished sequences give their
+        blocks back, and it grows if it runs out of blocks. Only used with `kv_cache_block_size`.
+    kv_cache_dtype (`str`, *optional*):
+        If set to `"int8"` or `"fp8"`, store the key/value cache quantized to this dtype with its scales, and
+        dequantize it when the attention reads it. It halves the memory of the cache compared to bf16. Only supported
+        by Llama for now. Requires `reuse_cache` and cannot be used with `kv_cache_block_size`.
+    kv_cache_scale_granularity (`str`, *optional*, defaults to `"token"`):
+        Granularity of the scales of the quantized key/value cache: `"token"` for one scale per head of every token,
+        computed when it is written, or `"head"` for one scale per head of every sequence, computed from the prompt.
+    kv_cache_window (`int`, *optional*):
+        If set, only keep the key/value cache of the last `kv_cache_window` tokens, plus the first
+        `kv_cache_sink_tokens` ones, in a ring buffer, so that the memory of the cache and the cost of the attention do
+        not grow with the length of the generation. Every token only attends to these tokens, which matches models
+        with a `sliding_window` equal to `kv_cache_window`. It is capped by the `sliding_window` of the model, if any.
+        Requires `reuse_cache` and cannot be used with `flash_attention_causal_mask`.
+    kv_cache_sink_tokens (`int`, *optional*, defaults to 0):
+        Number of tokens at the start of the sequences, after their left padding, that are always kept in the
+        key/value cache and attended to ("attention sinks"). Only used with `kv_cache_window`.
+    use_prefix_cache (`bool`, *optional*):
+        Whether to keep the key/value cache of prompt prefixes across `generate` calls and skip their prefill when a
+        new prompt starts with a cached prefix. Requires `reuse_cache`.
+    prefix_cache_chunk_size (`int`, *optional*, defaults to 128):
+        Granularity in tokens of the prefix cache, only whole chunks of the prompt are cached and looked up.
+    prefix_cache_max_memory_mb (`int`, *optional*, defaults to 1024):
+        Memory budget of the prefix cache in MiB. Least recently used prefixes are evicted beyond it.
+    prefill_chunk_size (`int`, *optional*):
+        If set, run the prompt through the model in chunks of `prefill_chunk_size` tokens that are written to the
+        preallocated key/value cache one after the other. It is rounded up to a multiple of `bucket_size`, chunks start
+        on multiples of it and the last one is padded, so that prefilling in chunks does not compile new graph shapes.
+        It bounds the peak activation memory of long prompts. Requires `reuse_cache`.
+    static_speculative_decoding (`bool`, *optional*):
+        Whether to run assisted generation with a fixed number of `num_assistant_tokens` draft tokens per round. Every
+        round has the same shapes, rejected tokens are overwritten in place in the preallocated key/value caches and
+        all the sequences of the batch are verified together, so that no new graph is compiled after the first round.
+        Requires `static_shapes` and `reuse_cache`.
+    decode_steps_per_sync (`int`, *optional*):
+        Number of decoding steps run back-to-back before the stopping criteria are read on the host. Finished
+        sequences are tracked on the device in between and only get padding, the steps run after the whole batch
+        finished are trimmed from the output. Avoids a device-to-host sync per token with greedy search and sampling.
+    use_fused_sampler (`bool`, *optional*):
+        Whether to sample with `optimum.habana.transformers.generation.fused_sample`: the `top_k` largest logits are
+        selected first and the repetition penalty, the temperature and `top_p` are only applied to them, then the
+        token is drawn with the Gumbel-max trick. It avoids the full-vocabulary softmax and `torch.multinomial` and
+        keeps the shapes static. Requires `do_sample` and `top_k`. The repetition penalty is only applied to the
+        `top_k` tokens and the returned scores are the ones before it.
     """
 
     def __init__(self, **kwargs):
@@ -56,6 +111,7 @@ class GaudiGenerationConfig(GenerationConfig):
         self.reuse_cache = kwargs.get("reuse_cache", None)
         self.bucket_size = kwargs.get("bucket_size", -1)
         self.bucket_internal = kwargs.get("bucket_internal", None)
+        self.buckets = kwargs.get("buckets", None)
         self.reduce_recompile = kwargs.get("reduce_recompile", None)
         self.use_flash_attention = kwargs.get("use_flash_attention", None)
         self.flash_attention_recompute = kwargs.get("flash_attention_recompute", None)
@@ -66,3 +122,16 @@ class GaudiGenerationConfig(GenerationConfig):
         self.valid_sequence_lengths = kwargs.get("valid_sequence_lengths", None)
         self.attn_batch_split = kwargs.get("attn_batch_split", 1)
         self.logits_bf16 = kwargs.get("logits_bf16", None)
+        self.kv_cache_block_size = kwargs.get("kv_cache_block_size", None)
+        self.kv_cache_num_blocks = kwargs.get("kv_cache_num_blocks", None)
+        self.kv_cache_dtype = kwargs.get("kv_cache_dtype", None)
+        self.kv_cache_scale_granularity = kwargs.get("kv_cache_scale_granularity", "token")
+        self.kv_cache_window = kwargs.get("kv_cache_window", None)
+        self.kv_cache_sink_tokens = kwargs.get("kv_cache_sink_tokens", 0)
+        self.use_prefix_cache = kwargs.get("use_prefix_cache", None)
+        self.prefix_cache_chunk_size = kwargs.get("prefix_cache_chunk_size", 128)
+        self.prefix_cache_max_memory_mb = kwargs.get("prefix_cache_max_memory_mb", 1024)
+        self.prefill_chunk_size = kwargs.get("prefill_chunk_size", None)
+        self.static_speculative_decoding = kwargs.get("static_speculative_decoding", None)
+        self.decode_steps_per_sync = kwargs.get("decode_steps_per_sync", None)
+        self.use_fused_sampler = kwargs.get("use_fused_sampler", None)
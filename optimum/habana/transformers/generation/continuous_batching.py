@@ -0,0 +1,435 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import inspect
+import itertools
+import math
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, Union
+
+import torch
+from transformers.generation.logits_process import LogitsProcessorList
+
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedModel
+
+    from .configuration_utils import GaudiGenerationConfig
+
+
+@dataclass
+class GenerationRequest:
+    """A prompt submitted to a [`ContinuousBatchingEngine`] and the tokens generated for it so far."""
+
+    request_id: int
+    prompt_ids: list[int]
+    max_new_tokens: int
+    generated_ids: list[int] = field(default_factory=list)
+    slot: Optional[int] = None
+    finished: bool = False
+
+
+@dataclass
+class ContinuousBatchingOutput:
+    """A token generated by a [`ContinuousBatchingEngine`] step."""
+
+    request_id: int
+    token_id: int
+    finished: bool
+
+
+def _map_cache(cache, fn: Callable[[torch.Tensor], torch.Tensor]):
+    """Applies `fn` to every tensor of a legacy (nested tuples/lists of tensors) key/value cache."""
+    if torch.is_tensor(cache):
+        return fn(cache)
+    return type(cache)(_map_cache(c, fn) for c in cache)
+
+
+def _flatten_cache(cache) -> list[torch.Tensor]:
+    if torch.is_tensor(cache):
+        return [cache]
+    return [t for c in cache for t in _flatten_cache(c)]
+
+
+class ContinuousBatchingEngine:
+    """
+    Request-level scheduler running in-flight (continuous) batching on top of a causal language model.
+
+    The engine owns `max_batch_size` slots laid out like a static-shape `generate` batch: `input_ids` and
+    `attention_mask` buffers of shape `(max_batch_size, max_seq_len)` where all the rows share the column `token_idx`
+    that the next token is written to, shorter sequences being left-padded. Between two decode steps, finished
+    sequences are evicted (their row is masked out) and queued prompts are admitted into the freed slots, right-aligned
+    on `token_idx`. Shapes never change, so a single decode graph is compiled whatever the traffic.
+
+    Three execution paths are available:
+    - models supporting `reuse_cache` decode into their own key/value caches, allocated once with
+      `model.allocate_kv_cache(max_batch_size, max_seq_len, ...)`. An admitted prompt is prefilled alone (with a
+      `(1, max_seq_len)` input and no cache reuse) and its keys/values are copied into its row of these caches, so
+      in-flight sequences are not recomputed. The engine owns the caches of the model while it has requests in flight.
+    - other models optimized for static shapes (whose `forward` accepts `token_idx`) keep legacy past key values of
+      shape `(max_batch_size, ..., max_seq_len, ...)` that the prefilled rows are scattered into.
+    - other models (e.g. a tiny CPU model used for tests) recompute the whole buffer at each step without cache.
+
+    When `token_idx` reaches `max_seq_len`, rows are shifted left by the smallest amount of left padding, which
+    frees room on the right without touching positions since these are derived from the attention mask. Keys and
+    values are shifted with them.
+
+    Args:
+        model ([`PreTrainedModel`]):
+            A decoder-only model with a language modeling head.
+        max_batch_size (`int`):
+            Number of slots, i.e. static batch size of the decode graph.
+        max_seq_len (`int`):
+            Length of the slots. Rounded up to a multiple of `generation_config.bucket_size` if it is positive.
+        generation_config ([`GaudiGenerationConfig`], *optional*):
+            Used for `max_new_tokens`, `do_sample`, `eos_token_id`, `pad_token_id` and `bucket_size`. Defaults to
+            `model.generation_config`.
+        logits_processor (`LogitsProcessorList`, *optional*):
+            Logits processors applied before token selection.
+        lazy_mode (`bool`, *optional*, defaults to `False`):
+            Whether the model runs in lazy mode, in which case graphs are cut after each forward pass.
+        max_finished_requests (`int`, *optional*, defaults to 1024):
+            Number of finished requests kept in `finished_requests` until they are retrieved with `pop_finished`.
+            Beyond that, the oldest ones are dropped so that a long-running engine does not grow without bound.
+        model_kwargs:
+            Additional kwargs forwarded to `model.prepare_inputs_for_generation` on the static-shape path (e.g.
+            `attn_softmax_bf16`, `use_flash_attention`).
+
+    Example:
+
+    ```python
+    >>> engine = ContinuousBatchingEngine(model, max_batch_size=8, max_seq_len=2048)
+    >>> request_id = engine.submit(tokenizer("Hello")["input_ids"], max_new_tokens=32)
+    >>> for output in engine.stream():
+    ...     print(output.request_id, tokenizer.decode(output.token_id))
+    ```
+    """
+
+    def __init__(
+        self,
+        model: "PreTrainedModel",
+        max_batch_size: int,
+        max_seq_len: int,
+        generation_config: Optional["GaudiGenerationConfig"] = None,
+        logits_processor: Optional[LogitsProcessorList] = None,
+        lazy_mode: bool = False,
+        max_finished_requests: int = 1024,
+        **model_kwargs,
+    ):
+        if model.config.is_encoder_decoder:
+            raise ValueError("ContinuousBatchingEngine only supports decoder-only models.")
+        generation_config = generation_config if generation_config is not None else model.generation_config
+        bucket_size = getattr(generation_config, "bucket_size", -1)
+        if bucket_size is not None and bucket_size > 0:
+            max_seq_len = int(math.ceil(max_seq_len / bucket_size) * bucket_size)
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_seq_len = max_seq_len
+        self.logits_processor = logits_processor if logits_processor is not None else LogitsProcessorList()
+        self.do_sample = generation_config.do_sample
+        self.default_max_new_tokens = generation_config.max_new_tokens or 20
+        eos_token_id = generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = []
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+        pad_token_id = generation_config.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = next(iter(self.eos_token_ids), 0)
+        self.pad_token_id = pad_token_id
+        self.lazy_mode = lazy_mode
+        # Whether the key/value caches of the model are reused is decided by the engine
+        model_kwargs.pop("reuse_cache", None)
+        self.model_kwargs = model_kwargs
+        if lazy_mode:
+            import habana_frameworks.torch.core as htcore
+
+            self.htcore = htcore
+
+        forward_args = inspect.signature(model.forward).parameters
+        self.use_static_kv_cache = "token_idx" in forward_args
+        self.reuse_cache = (
+            self.use_static_kv_cache and "reuse_cache" in forward_args and hasattr(model, "get_kv_caches")
+        )
+        if self.use_static_kv_cache and model.config.model_type in ["bloom", "gpt_bigcode"]:
+            # These models do not keep the batch on the first dimension of their key/value cache
+            raise ValueError(f"ContinuousBatchingEngine does not support {model.config.model_type} yet.")
+        if self.reuse_cache:
+            model.allocate_kv_cache(max_batch_size, max_seq_len, max_seq_len)
+
+        device = model.device
+        self.input_ids = torch.full((max_batch_size, max_seq_len), pad_token_id, dtype=torch.long, device=device)
+        self.attention_mask = torch.zeros((max_batch_size, max_seq_len), dtype=torch.long, device=device)
+        self.past_key_values = None
+        self.token_idx = 0
+        self.slots: list[Optional[GenerationRequest]] = [None] * max_batch_size
+        self.queue: deque[GenerationRequest] = deque()
+        # Queued and in-flight requests only, finished ones are moved to the bounded `finished_requests`
+        self.requests: dict[int, GenerationRequest] = {}
+        self.finished_requests: OrderedDict[int, GenerationRequest] = OrderedDict()
+        self.max_finished_requests = max_finished_requests
+        self._request_ids = itertools.count()
+        self.stats = {"decode_steps": 0, "prefills": 0, "shifts": 0, "active_slot_steps": 0}
+
+    @property
+    def num_active(self) -> int:
+        return sum(request is not None for request in self.slots)
+
+    def has_unfinished_requests(self) -> bool:
+        return self.num_active > 0 or len(self.queue) > 0
+
+    def slot_utilization(self) -> float:
+        """Fraction of the slot-steps run so far that were spent on actual sequences rather than on padding rows."""
+        total = self.stats["decode_steps"] * self.max_batch_size
+        return self.stats["active_slot_steps"] / total if total else 0.0
+
+    def submit(self, prompt_ids: Union[list[int], torch.Tensor], max_new_tokens: Optional[int] = None) -> int:
+        """Queues a prompt and returns its request id."""
+        if torch.is_tensor(prompt_ids):
+            prompt_ids = prompt_ids.reshape(-1).tolist()
+        max_new_tokens = max_new_tokens if max_new_tokens is not None else self.default_max_new_tokens
+        if len(prompt_ids) == 0:
+            raise ValueError("Cannot submit an empty prompt.")
+        if len(prompt_ids) + max_new_tokens > self.max_seq_len:
+            raise ValueError(
+                f"The prompt length ({len(prompt_ids)}) plus max_new_tokens ({max_new_tokens}) exceeds the slot "
+                f"length ({self.max_seq_len})."
+            )
+        request = GenerationRequest(next(self._request_ids), list(prompt_ids), max_new_tokens)
+        self.requests[request.request_id] = request
+        self.queue.append(request)
+        return request.request_id
+
+    def _shift(self, delta: int):
+        """Moves the content of all the rows by `delta` columns (to the right if positive, to the left otherwise)."""
+        self.input_ids = self.input_ids.roll(delta, dims=1)
+        self.attention_mask = self.attention_mask.roll(delta, dims=1)
+        if self.reuse_cache:
+            for caches in self.model.get_kv_caches():
+                for cache in caches:
+                    cache.cache.copy_(cache.cache.roll(delta, dims=-2))
+        elif self.past_key_values is not None:
+            self.past_key_values = _map_cache(
+                self.past_key_values,
+                lambda t: t.roll(delta, dims=-2) if t.dim() > 2 and t.shape[-2] == self.max_seq_len else t,
+            )
+        self.token_idx += delta
+        self.stats["shifts"] += 1
+
+    def _row_start(self, slot: int) -> int:
+        request = self.slots[slot]
+        return self.token_idx - len(request.prompt_ids) - len(request.generated_ids)
+
+    def _make_room(self) -> bool:
+        """Shifts the rows to the left so that one more token can be written. Returns False if it is not possible."""
+        if self.token_idx < self.max_seq_len:
+            return True
+        shift = min(
+            (self._row_start(slot) for slot, request in enumerate(self.slots) if request is not None),
+            default=self.token_idx,
+        )
+        if shift == 0:
+            return False
+        self._shift(-shift)
+        return True
+
+    def _evict(self, slot: int):
+        request = self.slots[slot]
+        request.finished = True
+        request.slot = None
+        self.slots[slot] = None
+        self.input_ids[slot].fill_(self.pad_token_id)
+        self.attention_mask[slot].zero_()
+        del self.requests[request.request_id]
+        self.finished_requests[request.request_id] = request
+        while len(self.finished_requests) > self.max_finished_requests:
+            self.finished_requests.popitem(last=False)
+
+    def pop_finished(self, request_id: int) -> Optional[list[int]]:
+        """
+        Returns the tokens generated for a finished request and forgets about it. Returns `None` if the request is not
+        finished yet or was dropped because more than `max_finished_requests` requests finished since.
+        """
+        request = self.finished_requests.pop(request_id, None)
+        return request.generated_ids if request is not None else None
+
+    def _fits(self, request: GenerationRequest) -> bool:
+        """
+        Whether `request` can join the in-flight sequences without any of them running out of columns. Rows advance in
+        lockstep, so a row that still has to generate `remaining` tokens needs `remaining + used` columns, where `used`
+        is the largest number of tokens held by the rows that are still alive at that point.
+        """
+        rows = [
+            (r.max_new_tokens - len(r.generated_ids), len(r.prompt_ids) + len(r.generated_ids))
+            for r in self.slots
+            if r is not None
+        ]
+        rows.append((request.max_new_tokens, len(request.prompt_ids)))
+        max_used = 0
+        for remaining, used in sorted(rows, reverse=True):
+            max_used = max(max_used, used)
+            if max_used + remaining > self.max_seq_len:
+                return False
+        return True
+
+    def _admit(self):
+        free_slots = [slot for slot, request in enumerate(self.slots) if request is None]
+        while free_slots and self.queue:
+            request = self.queue[0]
+            prompt_len = len(request.prompt_ids)
+            if self.num_active == 0:
+                # Empty batch: restart from the leftmost layout
+                self.token_idx = prompt_len
+            elif not self._fits(request):
+                # First come, first served: wait for some sequences to finish
+                break
+            elif prompt_len > self.token_idx:
+                # Not enough columns on the left of token_idx, the right side is free so shift everything there
+                self._shift(prompt_len - self.token_idx)
+
+            self.queue.popleft()
+            slot = free_slots.pop(0)
+            request.slot = slot
+            self.slots[slot] = request
+            start = self.token_idx - prompt_len
+            self.input_ids[slot].fill_(self.pad_token_id)
+            self.attention_mask[slot].zero_()
+            self.input_ids[slot, start : self.token_idx] = torch.tensor(request.prompt_ids, dtype=torch.long)
+            self.attention_mask[slot, start : self.token_idx] = 1
+            if self.use_static_kv_cache:
+                self._prefill(slot)
+
+    def _get_position_ids(self, attention_mask: torch.Tensor) -> torch.Tensor:
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        return position_ids
+
+    def _forward(self, input_ids, attention_mask, past_key_values=None, **kwargs):
+        model_inputs = self.model.prepare_inputs_for_generation(
+            input_ids,
+            past_key_values=past_key_values,
+            attention_mask=attention_mask,
+            token_idx=torch.tensor(self.token_idx, device=input_ids.device),
+            use_cache=True,
+            lazy_mode=self.lazy_mode,
+            **self.model_kwargs,
+            **kwargs,
+        )
+        outputs = self.model(**model_inputs, return_dict=True)
+        if self.lazy_mode:
+            self.htcore.mark_step()
+        return outputs
+
+    @torch.no_grad()
+    def _prefill(self, slot: int):
+        outputs = self._forward(self.input_ids[slot : slot + 1], self.attention_mask[slot : slot + 1].clone())
+        row_cache = outputs.past_key_values
+        rows = iter(_flatten_cache(row_cache))
+        if self.reuse_cache:
+            # The prefill ran without cache reuse, copy its keys/values into the row of the slot in the model caches
+            kv_caches = self.model.get_kv_caches()
+            for caches in kv_caches:
+                for cache in caches:
+                    cache.cache[slot].copy_(next(rows)[0])
+            # What the model returns with `reuse_cache`
+            self.past_key_values = [(k_cache.get_shape(), v_cache.get_shape()) for k_cache, v_cache in kv_caches]
+        else:
+            if self.past_key_values is None:
+                self.past_key_values = _map_cache(
+                    row_cache, lambda t: t.new_zeros((self.max_batch_size, *t.shape[1:]))
+                )
+            slot_idx = torch.tensor([slot], device=self.input_ids.device)
+            self.past_key_values = _map_cache(self.past_key_values, lambda t: t.index_copy_(0, slot_idx, next(rows)))
+        self.stats["prefills"] += 1
+
+    @torch.no_grad()
+    def _next_token_logits(self) -> torch.Tensor:
+        if self.use_static_kv_cache:
+            reuse_cache_kwargs = {"reuse_cache": True} if self.reuse_cache else {}
+            outputs = self._forward(self.input_ids, self.attention_mask, self.past_key_values, **reuse_cache_kwargs)
+            self.past_key_values = outputs.past_key_values
+            logits = outputs.logits
+            if logits.shape[-2] > 1:
+                logits = logits[:, self.token_idx - 1, :]
+            else:
+                logits = logits[:, -1, :]
+        else:
+            outputs = self.model(
+                input_ids=self.input_ids,
+                attention_mask=self.attention_mask,
+                position_ids=self._get_position_ids(self.attention_mask),
+                use_cache=False,
+                return_dict=True,
+            )
+            logits = outputs.logits[:, self.token_idx - 1, :]
+        return logits.float()
+
+    @torch.no_grad()
+    def step(self) -> list[ContinuousBatchingOutput]:
+        """
+        Runs one scheduling iteration: admits queued prompts into free slots, then runs one decode step for all the
+        slots and evicts the sequences that finished. Returns the tokens generated at this step.
+        """
+        self._admit()
+        if self.num_active == 0:
+            return []
+        if not self._make_room():
+            # A row spans the whole slot, which submit() prevents, so this should never happen
+            raise RuntimeError("No room left in the slots to generate a new token.")
+
+        next_token_scores = self.logits_processor(self.input_ids, self._next_token_logits())
+        if self.do_sample:
+            probs = torch.nn.functional.softmax(next_token_scores, dim=-1)
+            next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+        else:
+            next_tokens = torch.argmax(next_token_scores, dim=-1)
+
+        active = torch.tensor([request is not None for request in self.slots], device=next_tokens.device)
+        next_tokens = torch.where(active, next_tokens, self.pad_token_id)
+        self.input_ids[:, self.token_idx] = next_tokens
+        self.attention_mask[:, self.token_idx] = active.long()
+        self.token_idx += 1
+        self.stats["decode_steps"] += 1
+        self.stats["active_slot_steps"] += self.num_active
+
+        outputs = []
+        # A single host sync per step: the scheduler needs the token values to evict finished sequences
+        for slot, token_id in enumerate(next_tokens.tolist()):
+            request = self.slots[slot]
+            if request is None:
+                continue
+            request.generated_ids.append(token_id)
+            finished = token_id in self.eos_token_ids or len(request.generated_ids) >= request.max_new_tokens
+            outputs.append(ContinuousBatchingOutput(request.request_id, token_id, finished))
+            if finished:
+                self._evict(slot)
+        return outputs
+
+    def stream(self) -> Iterator[ContinuousBatchingOutput]:
+        """Runs the engine until all the submitted requests are finished, yielding tokens as they are generated."""
+        while self.has_unfinished_requests():
+            yield from self.step()
+
+    def run(self) -> dict[int, list[int]]:
+        """
+        Runs the engine until all the submitted requests are finished and returns the generated tokens of the requests
+        that were not retrieved yet. Results are collected as requests finish, so none of them is dropped.
+        """
+        results = {request_id: self.pop_finished(request_id) for request_id in list(self.finished_requests)}
+        for output in self.stream():
+            if output.finished:
+                results[output.request_id] = self.pop_finished(output.request_id)
+        return dict(sorted(results.items()))
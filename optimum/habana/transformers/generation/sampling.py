@@ -0,0 +1,163 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional, Tuple
+
+import torch
+from transformers.generation.logits_process import (
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+
+# Logits processors replaced by the fused sampler, they are removed from the logits processor list when it is used
+FUSED_SAMPLER_PROCESSORS = (
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+
+def _apply_repetition_penalty(
+    scores: torch.Tensor, token_ids: torch.LongTensor, input_ids: torch.LongTensor, penalty: float
+) -> torch.Tensor:
+    # Same as `RepetitionPenaltyLogitsProcessor`: previous tokens get less likely whatever the sign of their logit.
+    # Only the top-k ids are looked up in `input_ids`, no `(batch_size, vocab_size)` tensor is needed.
+    seen = (token_ids.unsqueeze(-1) == input_ids.unsqueeze(1)).any(dim=-1)
+    return torch.where(seen, torch.where(scores < 0, scores * penalty, scores / penalty), scores)
+
+
+def fused_top_k_scores(
+    logits: torch.Tensor,
+    input_ids: torch.LongTensor,
+    top_k: int,
+    top_p: Optional[float] = None,
+    temperature: Optional[float] = None,
+    repetition_penalty: Optional[float] = None,
+) -> Tuple[torch.LongTensor, torch.Tensor]:
+    """
+    Selects the `top_k` largest `logits` of every sequence, then applies the repetition penalty, the temperature and
+    top-p to these `top_k` logits only. `logits` are expected in the dtype of the model, only the `top_k` selected ones
+    are upcast to float32.
+
+    Returns the `(batch_size, top_k)` token ids and their float32 scores sorted in descending order, the tokens removed
+    by top-p have a score of `-inf`. The scores are log-probabilities up to a constant.
+    """
+    top_k = min(top_k, logits.shape[-1])
+    scores, token_ids = torch.topk(logits, top_k, dim=-1)
+    scores = scores.float()
+
+    if repetition_penalty is not None and repetition_penalty != 1.0:
+        scores = _apply_repetition_penalty(scores, token_ids, input_ids, repetition_penalty)
+        scores, order = scores.sort(dim=-1, descending=True)
+        token_ids = token_ids.gather(1, order)
+
+    if temperature is not None and temperature != 1.0:
+        scores = scores / temperature
+
+    if top_p is not None and top_p < 1.0:
+        probs = scores.softmax(dim=-1)
+        # Keep the smallest set of tokens whose probability reaches top_p, the first one is always kept
+        probs_before = probs.cumsum(dim=-1) - probs
+        scores = scores.masked_fill(probs_before >= top_p, -float("inf"))
+
+    return token_ids, scores
+
+
+def fused_sample(
+    logits: torch.Tensor,
+    input_ids: torch.LongTensor,
+    top_k: int,
+    top_p: Optional[float] = None,
+    temperature: Optional[float] = None,
+    repetition_penalty: Optional[float] = None,
+    generator: Optional[torch.Generator] = None,
+) -> torch.LongTensor:
+    """
+    Samples the next token of every sequence from the top-k logits processed by `fused_top_k_scores`.
+
+    The token is drawn with the Gumbel-max trick, i.e. as the argmax of the scores plus Gumbel noise, instead of a
+    softmax over the vocabulary followed by `torch.multinomial`. All the shapes only depend on the batch size and
+    `top_k`.
+
+    Args:
+        logits (`torch.Tensor` of shape `(batch_size, vocab_size)`):
+            The next token logits.
+        input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+            The previous tokens, only used for the repetition penalty.
+        top_k (`int`):
+            The number of tokens with the largest logits sampled from.
+        top_p (`float`, *optional*):
+            If smaller than 1, only the most probable of the `top_k` tokens whose probabilities add up to `top_p` are
+            sampled from.
+        temperature (`float`, *optional*):
+            The temperature the `top_k` logits are divided by.
+        repetition_penalty (`float`, *optional*):
+            The penalty of the tokens of `input_ids` among the `top_k` ones.
+        generator (`torch.Generator`, *optional*):
+            The random generator of the Gumbel noise.
+
+    Returns:
+        `torch.LongTensor` of shape `(batch_size,)`: the sampled tokens.
+    """
+    token_ids, scores = fused_top_k_scores(logits, input_ids, top_k, top_p, temperature, repetition_penalty)
+    uniform = torch.rand(scores.shape, generator=generator, device=scores.device, dtype=scores.dtype)
+    gumbel = -torch.log(-torch.log(uniform.clamp_(min=torch.finfo(scores.dtype).tiny)))
+    return token_ids.gather(1, (scores + gumbel).argmax(dim=-1, keepdim=True)).squeeze(1)
+
+
+def fused_sample_probs_reference(
+    logits: torch.Tensor,
+    input_ids: torch.LongTensor,
+    top_k: int,
+    top_p: Optional[float] = None,
+    temperature: Optional[float] = None,
+    repetition_penalty: Optional[float] = None,
+) -> torch.Tensor:
+    """
+    Reference implementation of the distribution `fused_sample` draws from, written one sequence and one token at a
+    time over the whole vocabulary in float64 on CPU. Returns the `(batch_size, vocab_size)` probabilities.
+    """
+    logits = logits.detach().to("cpu", torch.float64)
+    input_ids = input_ids.cpu()
+    probs = torch.zeros_like(logits)
+    for i in range(logits.shape[0]):
+        candidates = sorted(range(logits.shape[1]), key=lambda token_id: -logits[i, token_id].item())[:top_k]
+        previous_tokens = set(input_ids[i].tolist())
+        scores = {}
+        for token_id in candidates:
+            score = logits[i, token_id].item()
+            if repetition_penalty is not None and token_id in previous_tokens:
+                score = score * repetition_penalty if score < 0 else score / repetition_penalty
+            if temperature is not None:
+                score /= temperature
+            scores[token_id] = score
+
+        ordered = sorted(scores, key=lambda token_id: -scores[token_id])
+        weights = torch.tensor([scores[token_id] for token_id in ordered], dtype=torch.float64).softmax(dim=-1)
+        kept = []
+        cumulative_prob = 0.0
+        for token_id, weight in zip(ordered, weights.tolist()):
+            if kept and top_p is not None and cumulative_prob >= top_p:
+                break
+            kept.append(token_id)
+            cumulative_prob += weight
+
+        kept_weights = torch.tensor([scores[token_id] for token_id in kept], dtype=torch.float64).softmax(dim=-1)
+        probs[i, kept] = kept_weights
+    return probs
@@ -0,0 +1,261 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from queue import Queue
+from typing import List, Optional, Union
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+
+class IncrementalDetokenizer:
+    """
+    Turns the token ids of a sequence into text one step at a time without decoding the whole sequence again.
+
+    Only a small window of tokens is decoded at every step: the tokens since the last emitted text, preceded by a few
+    tokens of context so that tokenizers that depend on the previous token (e.g. for leading spaces) produce the same
+    text as a full decode. Text is held back while it ends with an incomplete UTF-8 character.
+
+    Args:
+        tokenizer (`PreTrainedTokenizerBase`):
+            The tokenizer used to decode the tokens.
+        prompt_ids (`List[int]`, *optional*):
+            The ids of the prompt, its last tokens are used as context for the first generated tokens.
+        num_context_tokens (`int`, *optional*, defaults to 5):
+            The number of previously emitted tokens decoded with the new ones.
+        decode_kwargs:
+            Additional keyword arguments passed to `tokenizer.decode`.
+    """
+
+    def __init__(
+        self, tokenizer, prompt_ids: Optional[List[int]] = None, num_context_tokens: int = 5, **decode_kwargs
+    ):
+        self.tokenizer = tokenizer
+        self.decode_kwargs = decode_kwargs
+        self.num_context_tokens = num_context_tokens
+        self.token_ids = list(prompt_ids[-num_context_tokens:]) if prompt_ids else []
+        # Text is emitted for the tokens up to `read_offset`, `prefix_offset` is the start of the decoded window
+        self.prefix_offset = 0
+        self.read_offset = len(self.token_ids)
+
+    def add_tokens(self, token_ids: List[int]) -> str:
+        """Adds new token ids and returns the text they complete, which may be empty."""
+        if not token_ids:
+            return ""
+        self.token_ids.extend(token_ids)
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset : self.read_offset], **self.decode_kwargs
+        )
+        new_text = self.tokenizer.decode(self.token_ids[self.prefix_offset :], **self.decode_kwargs)
+        if len(new_text) <= len(prefix_text) or new_text.endswith("�"):
+            return ""
+        # Keep the window small
+        self.prefix_offset = max(self.read_offset, len(self.token_ids) - self.num_context_tokens)
+        self.read_offset = len(self.token_ids)
+        return new_text[len(prefix_text) :]
+
+    def flush(self) -> str:
+        """Returns the text held back at the end of the sequence."""
+        prefix_text = self.tokenizer.decode(
+            self.token_ids[self.prefix_offset : self.read_offset], **self.decode_kwargs
+        )
+        new_text = self.tokenizer.decode(self.token_ids[self.prefix_offset :], **self.decode_kwargs)
+        self.prefix_offset = self.read_offset = len(self.token_ids)
+        return new_text[len(prefix_text) :]
+
+
+class GaudiTokenIteratorStreamer(BaseStreamer):
+    """
+    Streamer that yields the new token ids of every sequence of the batch, to be consumed as an iterator (or async
+    iterator) while `generate` runs in another thread. See `GaudiGenerationMixin.generate_stream` for a wrapper that
+    handles the thread.
+
+    `generate` passes the tokens of every step to `put` as device tensors. They are not copied to the host right away:
+    the tokens of `sync_interval` steps are gathered on the device and copied at once, which removes the host sync of
+    most decoding steps. The tokens of the first step are always copied right away to keep the time to first token low.
+
+    Every item of the iterator is a list with, for every sequence of the batch, the list of its new token ids (empty
+    if it did not produce any). Tokens after the first EOS token of a sequence are dropped, as well as the tokens that
+    `generate` masks out (e.g. the padding of sequences finished by a stopping criterion).
+
+    Args:
+        skip_prompt (`bool`, *optional*, defaults to `True`):
+            Whether the prompt passed to `generate` is yielded first.
+        eos_token_id (`Union[int, List[int]]`, *optional*):
+            The EOS token ids. If given, sequences stop yielding tokens after their first EOS token, which is included.
+        sync_interval (`int`, *optional*, defaults to 4):
+            The number of decoding steps whose tokens are copied to the host together.
+        timeout (`float`, *optional*):
+            The timeout of the queue read by the iterator. If `None`, the iterator blocks indefinitely.
+    """
+
+    accepts_device_tensors = True
+
+    def __init__(
+        self,
+        skip_prompt: bool = True,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        sync_interval: int = 4,
+        timeout: Optional[float] = None,
+    ):
+        if sync_interval <= 0:
+            raise ValueError(f"`sync_interval` must be a strictly positive integer but is {sync_interval}.")
+        self.skip_prompt = skip_prompt
+        self.eos_token_id = [eos_token_id] if isinstance(eos_token_id, int) else eos_token_id
+        self.sync_interval = sync_interval
+        self.timeout = timeout
+        self.queue = Queue()
+        self.stop_signal = None
+        self.prompt_ids = None
+        self.finished = None
+        self._pending = []
+        self._num_flushes = 0
+
+    def put(self, value: torch.Tensor, unfinished_sequences: Optional[torch.Tensor] = None):
+        """
+        Receives the new tokens of every sequence of the batch, of shape `(batch_size,)` or `(batch_size, num_tokens)`.
+        The tokens where `unfinished_sequences` (a mask of shape `(batch_size,)` or of the shape of `value`) is zero
+        are dropped, the others keep the index of their sequence.
+        """
+        if self.prompt_ids is None:
+            self.prompt_ids = value.cpu().tolist()
+            self.finished = [False] * len(self.prompt_ids)
+            if not self.skip_prompt:
+                self.on_new_tokens(self.prompt_ids)
+            return
+
+        value = value.unsqueeze(-1) if value.dim() == 1 else value
+        if unfinished_sequences is None:
+            mask = torch.ones_like(value)
+        else:
+            mask = unfinished_sequences.view(value.shape[0], -1).expand_as(value).to(value.dtype)
+        # Tokens and mask are stacked to be copied to the host together
+        self._pending.append(torch.stack([value, mask]))
+        if len(self._pending) >= self.sync_interval or self._num_flushes == 0:
+            self._flush()
+
+    def end(self):
+        self._flush()
+        self.queue.put(self.stop_signal, timeout=self.timeout)
+
+    def _flush(self):
+        if not self._pending:
+            return
+        # A single device to host copy for all the pending steps
+        new_tokens, mask = torch.cat(self._pending, dim=-1).cpu().tolist()
+        self._pending = []
+        self._num_flushes += 1
+        self._emit(
+            [
+                [token_id for token_id, keep in zip(token_ids, row_mask) if keep]
+                for token_ids, row_mask in zip(new_tokens, mask)
+            ]
+        )
+
+    def _emit(self, batch_token_ids: List[List[int]]):
+        new_tokens = []
+        for i, token_ids in enumerate(batch_token_ids):
+            if self.eos_token_id is not None:
+                for position, token_id in enumerate(token_ids):
+                    if self.finished[i]:
+                        token_ids = token_ids[:position]
+                        break
+                    self.finished[i] = token_id in self.eos_token_id
+            new_tokens.append(token_ids)
+        self.on_new_tokens(new_tokens)
+
+    def on_new_tokens(self, new_tokens: List[List[int]]):
+        """Puts the new tokens of every sequence in the queue, override it to consume them differently."""
+        self.queue.put(new_tokens, timeout=self.timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        value = self.queue.get(timeout=self.timeout)
+        if value is self.stop_signal:
+            raise StopIteration()
+        return value
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        value = await asyncio.get_running_loop().run_in_executor(None, self.queue.get, True, self.timeout)
+        if value is self.stop_signal:
+            raise StopAsyncIteration()
+        return value
+
+
+class GaudiTextIteratorStreamer(GaudiTokenIteratorStreamer):
+    """
+    Same as `GaudiTokenIteratorStreamer` but yields, for every sequence of the batch, the new text decoded with an
+    `IncrementalDetokenizer`.
+
+    Args:
+        tokenizer (`PreTrainedTokenizerBase`):
+            The tokenizer used to decode the tokens.
+        skip_prompt (`bool`, *optional*, defaults to `True`):
+            Whether the text of the prompt is yielded first.
+        eos_token_id (`Union[int, List[int]]`, *optional*):
+            The EOS token ids, defaults to the one of the tokenizer.
+        sync_interval (`int`, *optional*, defaults to 4):
+            The number of decoding steps whose tokens are copied to the host together.
+        timeout (`float`, *optional*):
+            The timeout of the queue read by the iterator. If `None`, the iterator blocks indefinitely.
+        decode_kwargs:
+            Additional keyword arguments passed to `tokenizer.decode`, e.g. `skip_special_tokens=True`.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        skip_prompt: bool = True,
+        eos_token_id: Optional[Union[int, List[int]]] = None,
+        sync_interval: int = 4,
+        timeout: Optional[float] = None,
+        **decode_kwargs,
+    ):
+        super().__init__(
+            skip_prompt=skip_prompt,
+            eos_token_id=eos_token_id if eos_token_id is not None else tokenizer.eos_token_id,
+            sync_interval=sync_interval,
+            timeout=timeout,
+        )
+        self.tokenizer = tokenizer
+        self.decode_kwargs = decode_kwargs
+        self.detokenizers = None
+
+    def on_new_tokens(self, new_tokens: List[List[int]]):
+        if self.detokenizers is None:
+            self.detokenizers = []
+            for prompt_ids in self.prompt_ids:
+                # Padding is not part of the context of the first generated tokens
+                if self.tokenizer.pad_token_id is not None:
+                    prompt_ids = [token_id for token_id in prompt_ids if token_id != self.tokenizer.pad_token_id]
+                if not self.skip_prompt:
+                    prompt_ids = None
+                self.detokenizers.append(IncrementalDetokenizer(self.tokenizer, prompt_ids, **self.decode_kwargs))
+        texts = [detokenizer.add_tokens(token_ids) for detokenizer, token_ids in zip(self.detokenizers, new_tokens)]
+        self.queue.put(texts, timeout=self.timeout)
+
+    def end(self):
+        self._flush()
+        if self.detokenizers is not None:
+            texts = [detokenizer.flush() for detokenizer in self.detokenizers]
+            if any(texts):
+                self.queue.put(texts, timeout=self.timeout)
+        self.queue.put(self.stop_signal, timeout=self.timeout)
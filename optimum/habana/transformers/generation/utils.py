@@ -17,6 +17,7 @@
 import copy
 import inspect
 import math
+from threading import Thread
 from typing import TYPE_CHECKING, Any, Callable, Optional, Union
 
 import torch
@@ -72,9 +73,21 @@ from transformers.modeling_outputs import CausalLMOutputWithPast, Seq2SeqLMOutpu
 from transformers.utils import ModelOutput, is_hqq_available, is_optimum_quanto_available
 
 from ...utils import HabanaGenerationTime, HabanaProfile, warn0
+from ..cache_utils import PrefixCache, expand_past_key_values
 from ..integrations.deepspeed import unwrap_deepspeed_model
-from .candidate_generator import GaudiAssistedCandidateGenerator
+from .bucketing import next_bucket
+from .candidate_generator import (
+    STATIC_SPECULATIVE_FORWARD_KWARGS,
+    GaudiAssistedCandidateGenerator,
+    GaudiStaticDraftCandidateGenerator,
+    SpeculativeDecodingStats,
+    greedy_acceptance,
+    speculative_sampling_acceptance,
+    static_speculative_forward,
+)
 from .configuration_utils import GaudiGenerationConfig
+from .sampling import FUSED_SAMPLER_PROCESSORS, fused_sample
+from .streamers import GaudiTokenIteratorStreamer
 
 
 if TYPE_CHECKING:
@@ -143,23 +156,54 @@ INITIAL_TOKEN_IDX = 1
 logger = logging.get_logger(__name__)
 
 
-def incrementor(bucket_size, prompt_len):
+def _streamer_put(
+    streamer: "BaseStreamer", token_ids: torch.Tensor, unfinished_sequences: Optional[torch.Tensor] = None
+):
+    """
+    Puts the new tokens of every sequence of the batch in `streamer`. `unfinished_sequences` is a mask of the
+    sequences (or of the tokens, if it has the shape of `token_ids`) that are still running: the tokens of the other
+    ones are padding, or tokens generated after they stopped when finished sequences are not checked at every step.
+    """
+    if getattr(streamer, "accepts_device_tensors", False):
+        # These streamers decide themselves when to copy the tokens to the host and drop the masked ones there
+        if unfinished_sequences is None:
+            streamer.put(token_ids)
+        else:
+            streamer.put(token_ids, unfinished_sequences=unfinished_sequences)
+        return
+    if unfinished_sequences is not None and not unfinished_sequences.any():
+        # Finished rows keep their position in the batch, so they are only skipped when all of them are finished
+        return
+    streamer.put(token_ids.cpu())
+
+
+def incrementor(bucket_size, prompt_len, buckets=None):
+    """
+    Yields the static buffer size of every generation step. The buffer grows by `bucket_size` or, if `buckets` is
+    given (see `bucketing.plan_buckets`), to the next of these sizes.
+    """
     assert bucket_size > 0
     passnum = -1
     while True:
         passnum += 1
         if passnum == 0:
             token_idx = prompt_len
-            allocated_space = int(math.ceil(prompt_len / bucket_size) * bucket_size)
-            if prompt_len % bucket_size == 0:
-                allocated_space += bucket_size
+            if buckets:
+                allocated_space = next_bucket(buckets, prompt_len + 1, bucket_size)
+            else:
+                allocated_space = int(math.ceil(prompt_len / bucket_size) * bucket_size)
+                if prompt_len % bucket_size == 0:
+                    allocated_space += bucket_size
             need_expansion = True
         else:
             token_idx += 1
             need_expansion = token_idx >= allocated_space
             if need_expansion:
-                assert (allocated_space - token_idx) <= bucket_size
-                allocated_space += bucket_size
+                if buckets:
+                    allocated_space = next_bucket(buckets, token_idx + 1, bucket_size)
+                else:
+                    assert (allocated_space - token_idx) <= bucket_size
+                    allocated_space += bucket_size
         yield {
             "allocated_space": allocated_space,
             "passnum": passnum,
@@ -380,6 +424,97 @@ class GaudiGenerationMixin(GenerationMixin):
 
         return model_inputs
 
+    def _reserve_paged_kv_cache(self, model_kwargs, num_tokens=None, unfinished_sequences=None):
+        """
+        Hands out the blocks of the paged KV cache needed to store `num_tokens` tokens per sequence (defaults to
+        `token_idx_cpu`, i.e. what the next forward pass writes). This is a no-op without paged KV cache.
+
+        With `unfinished_sequences`, the sequences that are finished give their blocks back to the pool before the
+        others are given new ones. Reading them syncs with the device, which only happens when new blocks are needed,
+        i.e. once every `kv_cache_block_size` steps.
+        """
+        allocator = getattr(unwrap_deepspeed_model(self), "kv_cache_allocator", None)
+        if allocator is None or allocator.block_table is None or not model_kwargs.get("reuse_cache", False):
+            return
+        if num_tokens is None:
+            num_tokens = model_kwargs.get("token_idx_cpu", allocator.max_seq_len)
+        num_tokens += model_kwargs.get("num_virtual_tokens", 0)
+        if unfinished_sequences is not None and allocator.needs_blocks(num_tokens):
+            allocator.free(*unfinished_sequences.eq(0).nonzero().view(-1).tolist())
+        num_blocks = allocator.num_blocks
+        allocator.reserve_all(num_tokens)
+        if allocator.num_blocks != num_blocks and model_kwargs.get("use_hpu_graphs", False):
+            # The pool grew, so the HPU graphs captured the previous storage of the caches
+            self.clear_cache()
+
+    def _prepare_inputs_for_cached_prefix(self, model_inputs, model_kwargs):
+        """
+        Removes the prompt tokens whose keys/values are in the prefix cache from the inputs of the first forward pass
+        and copies these keys/values to the KV cache instead. Returns the updated model inputs along with the chunk
+        keys of the prompt, to store the new chunks once the prefill is done.
+        """
+        prefix_cache = model_kwargs["prefix_cache"]
+        input_ids = model_inputs["input_ids"]
+        batch_keys, num_chunks = prefix_cache.match(input_ids)
+        # At least one prompt token must go through the model to get the logits of the first new token
+        num_chunks = min(num_chunks, (input_ids.shape[1] - 1) // prefix_cache.chunk_size)
+        prefill_offset = prefix_cache.load(unwrap_deepspeed_model(self).get_kv_caches(), batch_keys, num_chunks)
+        if prefill_offset > 0:
+            model_inputs["input_ids"] = input_ids[:, prefill_offset:]
+            if model_inputs.get("position_ids") is not None:
+                model_inputs["position_ids"] = model_inputs["position_ids"][:, prefill_offset:]
+            model_inputs["prefill_offset"] = prefill_offset
+        return model_inputs, batch_keys
+
+    def _prefill_in_chunks(self, input_ids, model_inputs, model_kwargs, hpu_graphs_kwargs):
+        """
+        Runs the prompt through the model in chunks of `prefill_chunk_size` tokens that write their keys/values to the
+        preallocated KV cache. Every chunk is exactly `prefill_chunk_size` tokens long and starts on a multiple of it,
+        so that no new graph shape is compiled whatever the prompt length:
+        - the first chunk starts at the chunk boundary before the cached prefix, if any, and recomputes its tail,
+        - the last chunk is right-padded. Its padding keys are masked out and overwritten by the decoding steps. If
+          there is not enough room left in the cache for the padding, it is moved back to end on the last position
+          and recomputes the end of the previous chunk instead.
+        The inputs of the last chunk are returned for the regular forward pass that produces the logits of the first
+        new token, which `token_idx` points to.
+        """
+        chunk_size = model_kwargs["prefill_chunk_size"]
+        offset = model_inputs.get("prefill_offset") or 0
+        prompt_len = offset + model_inputs["input_ids"].shape[1]
+        first_start = offset // chunk_size * chunk_size
+        if prompt_len - first_start <= chunk_size and first_start == offset:
+            return model_inputs
+
+        # `input_ids` and the attention mask are padded up to the length of the cache with static shapes
+        attention_mask = model_kwargs["attention_mask"]
+        max_len = attention_mask.shape[-1]
+        position_ids = None
+        if model_inputs.get("position_ids") is not None:
+            position_ids = attention_mask.long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask == 0, 1)
+
+        def chunk_inputs(start):
+            start = min(start, max_len - chunk_size)
+            stop = start + chunk_size
+            inputs = {
+                **model_inputs,
+                "input_ids": input_ids[:, start:stop],
+                "attention_mask": attention_mask[:, :stop],
+                "prefill_offset": start,
+                # position right after the last prompt token of the chunk
+                "token_idx": torch.tensor(min(stop, prompt_len), device=input_ids.device),
+            }
+            if position_ids is not None:
+                inputs["position_ids"] = position_ids[:, start:stop]
+            return inputs
+
+        starts = list(range(first_start, prompt_len, chunk_size))
+        for start in starts[:-1]:
+            self(**chunk_inputs(start), return_dict=True, **hpu_graphs_kwargs)
+            if model_kwargs.get("lazy_mode", False):
+                self.htcore_generation.mark_step()
+        return chunk_inputs(starts[-1])
+
     def _get_hpu_graphs_kwargs(self, model_kwargs):
         hpu_graphs_kwargs = {}
         if model_kwargs["limit_hpu_graphs"]:
@@ -712,57 +847,15 @@ class GaudiGenerationMixin(GenerationMixin):
                 model_kwargs["attention_mask"] = model_kwargs["attention_mask"].to(self.device)
 
             if "past_key_values" in model_kwargs:
-
-                def create_pad_arg(pad_amount, i, j):
-                    if model_kwargs["past_key_values"][0][0].dim() == 3:
-                        assert self.config.model_type == "bloom"
-                        if j == 0:
-                            return (0, pad_amount)
-                        elif j == 1:
-                            return (0, 0, 0, pad_amount)
-                        else:
-                            assert False
-                    elif model_kwargs["past_key_values"][0][0].dim() == 4:
-                        return (0, 0, 0, pad_amount)  # llama, falcon, qwen2, starcoder2, gemma
-                    else:
-                        assert False, "Unknown case, please handle, or don't use bucketing"
-
-                new_kv = [None for i in range(len(model_kwargs["past_key_values"]))]
-                if self.config.model_type == "gpt_bigcode" and model_kwargs["past_key_values"][0][0].dim() == 2:
-                    # GPT_BIGCODE's kv cache is list of tensors.
-                    new_kv = [None for i in range(len(model_kwargs["past_key_values"]))]
-                    for i in range(len(model_kwargs["past_key_values"])):
-                        pad = (0, 0, 0, pad_amount)
-                        new_kv[i] = torch.nn.functional.pad(
-                            model_kwargs["past_key_values"][i], pad, value=pad_token_id
-                        )
-                    model_kwargs["past_key_values"] = list(new_kv)
-                else:
-                    for i in range(len(model_kwargs["past_key_values"])):
-                        tmp_lst = [None for j in range(len(model_kwargs["past_key_values"][i]))]
-                        for j in range(len(model_kwargs["past_key_values"][i])):
-                            pad_tuple = create_pad_arg(pad_amount, i, j)
-                            # Different models might have different shapes of kv-cache
-                            # create_pad_arg handles them on a per-model basis
-                            # This is a necessary (but not sufficient) condition: what ever dimension we are padding, should be a multiple of bucket_size
-                            # This check is added in case we get a new model with a new kv-cache structure, and we attempt to pad some wrong dimension
-                            # in peft case, if there's virtual token. the model_kwargs["past_key_values"][i][j].shape[-(len(pad_tuple) // 2)] % bucket_size == num_virtual_token, no need of assert, the pad length of past_key_value should be aligned with input id and attention_mask
-                            num_virtual_tokens = model_kwargs.get("num_virtual_tokens", 0)
-                            if (
-                                model_kwargs["past_key_values"][i][j].shape[-(len(pad_tuple) // 2)]
-                                == params["allocated_space"] - pad_amount + num_virtual_tokens
-                            ):
-                                assert (
-                                    model_kwargs["past_key_values"][i][j].shape[-(len(pad_tuple) // 2)] % bucket_size
-                                    == num_virtual_tokens
-                                )
-                                tmp_lst[j] = torch.nn.functional.pad(
-                                    model_kwargs["past_key_values"][i][j], pad_tuple, value=pad_token_id
-                                )
-                            else:
-                                tmp_lst[j] = model_kwargs["past_key_values"][i][j]
-                        new_kv[i] = tuple(tmp_lst)
-                    model_kwargs["past_key_values"] = tuple(new_kv)
+                model_kwargs["past_key_values"] = expand_past_key_values(
+                    model_kwargs["past_key_values"],
+                    params["allocated_space"] - pad_amount,
+                    pad_amount,
+                    bucket_size,
+                    pad_token_id,
+                    self.config.model_type,
+                    num_virtual_tokens=model_kwargs.get("num_virtual_tokens", 0),
+                )
 
         if "token_idx" not in model_kwargs:
             model_kwargs["token_idx"] = torch.tensor(params["token_idx"], device=self.device)
@@ -1174,6 +1267,61 @@ class GaudiGenerationMixin(GenerationMixin):
         else:
             return
 
+    def generate_stream(
+        self,
+        inputs: Optional[torch.Tensor] = None,
+        generation_config: Optional[GaudiGenerationConfig] = None,
+        streamer: Optional[GaudiTokenIteratorStreamer] = None,
+        **kwargs,
+    ):
+        """
+        Runs `generate` in a background thread and yields the new tokens of every sequence as soon as they are
+        generated, see `GaudiTokenIteratorStreamer`. Pass a `GaudiTextIteratorStreamer` to get text instead of token
+        ids. The output of `generate` is the return value of the generator.
+
+        Parameters:
+            inputs (`torch.Tensor`, *optional*):
+                The prompt, see `generate`.
+            generation_config (`GaudiGenerationConfig`, *optional*):
+                The generation configuration, see `generate`.
+            streamer (`GaudiTokenIteratorStreamer`, *optional*):
+                The streamer to read the new tokens from. Defaults to a `GaudiTokenIteratorStreamer` that stops at the
+                EOS tokens of the generation configuration.
+            kwargs (`dict[str, Any]`, *optional*):
+                The other arguments of `generate`.
+
+        Examples:
+
+        ```python
+        >>> for new_tokens in model.generate_stream(**inputs, max_new_tokens=32, lazy_mode=True):
+        ...     print(tokenizer.batch_decode(new_tokens))
+        ```
+        """
+        if streamer is None:
+            config = generation_config if generation_config is not None else self.generation_config
+            ignore_eos = kwargs.get("ignore_eos", getattr(config, "ignore_eos", False))
+            eos_token_id = None if ignore_eos else kwargs.get("eos_token_id", config.eos_token_id)
+            streamer = GaudiTokenIteratorStreamer(eos_token_id=eos_token_id)
+
+        result = {}
+
+        def run_generate():
+            try:
+                result["outputs"] = self.generate(
+                    inputs, generation_config=generation_config, streamer=streamer, **kwargs
+                )
+            except BaseException as e:
+                result["error"] = e
+                streamer.queue.put(streamer.stop_signal)
+
+        thread = Thread(target=run_generate, daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["outputs"]
+
     @torch.no_grad()
     def generate(
         self,
@@ -1404,6 +1552,12 @@ class GaudiGenerationMixin(GenerationMixin):
         )
         model_kwargs["bucket_size"] = generation_config.bucket_size if generation_config.static_shapes else -1
         model_kwargs["bucket_internal"] = generation_config.bucket_internal
+        if generation_config.buckets:
+            assert generation_config.bucket_size > 0, "please set bucket_size to use buckets"
+            assert all(bucket % generation_config.bucket_size == 0 for bucket in generation_config.buckets), (
+                "buckets must be multiples of bucket_size, use `plan_buckets(..., multiple_of=bucket_size)`"
+            )
+            model_kwargs["buckets"] = sorted(generation_config.buckets)
         model_kwargs["reduce_recompile"] = (
             generation_config.reduce_recompile if generation_config.reduce_recompile is not None else False
         )
@@ -1458,6 +1612,11 @@ class GaudiGenerationMixin(GenerationMixin):
                     token_idx = inputs_tensor.shape[1]
                     if generation_config.max_new_tokens is None:
                         generation_config.max_new_tokens = generation_config.max_length - token_idx
+                    static_pad_length = generation_config.max_new_tokens
+                    if generation_config.static_speculative_decoding:
+                        # The last round of static speculative decoding writes up to `num_assistant_tokens + 1`
+                        # tokens past `max_new_tokens`
+                        static_pad_length += generation_config.num_assistant_tokens + 1
                     if model_input_name == "inputs_embeds" and model_kwargs["input_ids"].numel() == 0:
                         inputs_embeds_offset = -model_kwargs["inputs_embeds"].shape[1]
 
@@ -1473,12 +1632,12 @@ class GaudiGenerationMixin(GenerationMixin):
                     ):
                         model_kwargs["inputs_embeds"] = torch.nn.functional.pad(
                             model_kwargs["inputs_embeds"],
-                            (0, 0, 0, generation_config.max_new_tokens),
+                            (0, 0, 0, static_pad_length),
                             value=generation_config.pad_token_id,
                         )
                     else:
                         inputs_tensor = torch.nn.functional.pad(
-                            inputs_tensor, (0, generation_config.max_new_tokens), value=generation_config.pad_token_id
+                            inputs_tensor, (0, static_pad_length), value=generation_config.pad_token_id
                         )
                     model_kwargs["token_idx"] = torch.tensor(token_idx, device=inputs_tensor.device)
                     model_kwargs["token_idx_cpu"] = token_idx
@@ -1487,13 +1646,13 @@ class GaudiGenerationMixin(GenerationMixin):
                         if model_kwargs.get(other_inputs) is not None:
                             model_kwargs[other_inputs] = torch.nn.functional.pad(
                                 model_kwargs[other_inputs],
-                                (0, generation_config.max_new_tokens),
+                                (0, static_pad_length),
                                 value=0,
                             )
                     if model_kwargs.get("cross_attention_mask") is not None:
                         model_kwargs["cross_attention_mask"] = torch.nn.functional.pad(
                             model_kwargs["cross_attention_mask"],
-                            (0, 0, 0, 0, 0, generation_config.max_new_tokens),
+                            (0, 0, 0, 0, 0, static_pad_length),
                             value=0,
                         )
             else:
@@ -1544,7 +1703,7 @@ class GaudiGenerationMixin(GenerationMixin):
             input_ids = self.heal_tokens(input_ids, tokenizer)
 
         if streamer is not None:
-            streamer.put(input_ids.cpu())
+            _streamer_put(streamer, input_ids)
 
         # 6. Prepare `max_length` depending on other stopping criteria.
         input_ids_length = input_ids.shape[1]
@@ -1628,6 +1787,95 @@ class GaudiGenerationMixin(GenerationMixin):
             calculated_max_length = input_ids.shape[1] + num_virtual_tokens
             if not generation_config.static_shapes and generation_config.max_new_tokens is not None:
                 calculated_max_length = input_ids.shape[1] + generation_config.max_new_tokens + num_virtual_tokens
+            if generation_config.kv_cache_block_size is not None:
+                assert generation_config.use_cache and generation_config.reuse_cache, (
+                    "please set use_cache and reuse_cache to use kv_cache_block_size"
+                )
+                if not hasattr(unwrap_deepspeed_model(self), "enable_paged_kv_cache"):
+                    raise ValueError(f"kv_cache_block_size is not supported by {self.__class__.__name__}")
+                unwrap_deepspeed_model(self).enable_paged_kv_cache(
+                    generation_config.kv_cache_block_size, generation_config.kv_cache_num_blocks
+                )
+            elif getattr(unwrap_deepspeed_model(self), "kv_cache_allocator", None) is not None:
+                # Restore the regular KV caches of a previous call
+                unwrap_deepspeed_model(self).enable_paged_kv_cache(None)
+            if generation_config.kv_cache_dtype is not None:
+                assert generation_config.use_cache and generation_config.reuse_cache, (
+                    "please set use_cache and reuse_cache to use kv_cache_dtype"
+                )
+                if generation_config.kv_cache_block_size is not None:
+                    raise ValueError("kv_cache_dtype cannot be used with kv_cache_block_size")
+                if not hasattr(unwrap_deepspeed_model(self), "enable_quantized_kv_cache"):
+                    raise ValueError(f"kv_cache_dtype is not supported by {self.__class__.__name__}")
+                unwrap_deepspeed_model(self).enable_quantized_kv_cache(
+                    generation_config.kv_cache_dtype, generation_config.kv_cache_scale_granularity
+                )
+            elif getattr(unwrap_deepspeed_model(self), "kv_cache_quantization", None) is not None:
+                # Restore the regular KV caches of a previous call
+                unwrap_deepspeed_model(self).enable_quantized_kv_cache(None)
+            if generation_config.kv_cache_window is not None:
+                assert generation_config.use_cache and generation_config.reuse_cache, (
+                    "please set use_cache and reuse_cache to use kv_cache_window"
+                )
+                for option in (
+                    "kv_cache_block_size",
+                    "kv_cache_dtype",
+                    "bucket_internal",
+                    "use_prefix_cache",
+                    "prefill_chunk_size",
+                    "static_speculative_decoding",
+                    # The causal FusedSDPA of the prefill would ignore the window and the sinks
+                    "flash_attention_causal_mask",
+                ):
+                    if getattr(generation_config, option):
+                        raise ValueError(f"kv_cache_window cannot be used with {option}")
+                if not hasattr(unwrap_deepspeed_model(self), "enable_sliding_window_kv_cache"):
+                    raise ValueError(f"kv_cache_window is not supported by {self.__class__.__name__}")
+                kv_cache_window = generation_config.kv_cache_window
+                if getattr(self.config, "sliding_window", None) is not None:
+                    # The model never attends to the tokens out of its own window
+                    kv_cache_window = min(kv_cache_window, self.config.sliding_window)
+                unwrap_deepspeed_model(self).enable_sliding_window_kv_cache(
+                    kv_cache_window, generation_config.kv_cache_sink_tokens
+                )
+            elif getattr(unwrap_deepspeed_model(self), "kv_cache_sliding_window", None) is not None:
+                # Restore the regular KV caches of a previous call
+                unwrap_deepspeed_model(self).enable_sliding_window_kv_cache(None)
+            if generation_config.use_prefix_cache:
+                assert generation_config.use_cache and generation_config.reuse_cache, (
+                    "please set use_cache and reuse_cache to use use_prefix_cache"
+                )
+                model = unwrap_deepspeed_model(self)
+                if not hasattr(model, "get_kv_caches"):
+                    raise ValueError(f"use_prefix_cache is not supported by {self.__class__.__name__}")
+                if num_virtual_tokens > 0 or "inputs_embeds" in model_kwargs:
+                    raise ValueError("use_prefix_cache requires `input_ids` and cannot be used with prompt tuning")
+                max_memory_bytes = generation_config.prefix_cache_max_memory_mb * 1024**2
+                prefix_cache = getattr(model, "prefix_cache", None)
+                if prefix_cache is None or prefix_cache.chunk_size != generation_config.prefix_cache_chunk_size:
+                    prefix_cache = PrefixCache(generation_config.prefix_cache_chunk_size, max_memory_bytes)
+                    model.prefix_cache = prefix_cache
+                prefix_cache.max_memory_bytes = max_memory_bytes
+                model_kwargs["prefix_cache"] = prefix_cache
+            if generation_config.prefill_chunk_size is not None:
+                assert generation_config.use_cache and generation_config.reuse_cache, (
+                    "please set use_cache and reuse_cache to use prefill_chunk_size"
+                )
+                if generation_config.prefill_chunk_size <= 0:
+                    raise ValueError(
+                        f"prefill_chunk_size must be a positive integer but is {generation_config.prefill_chunk_size}"
+                    )
+                if "prefill_offset" not in inspect.signature(unwrap_deepspeed_model(self).forward).parameters:
+                    raise ValueError(f"prefill_chunk_size is not supported by {self.__class__.__name__}")
+                if num_virtual_tokens > 0 or "inputs_embeds" in model_kwargs:
+                    raise ValueError("prefill_chunk_size requires `input_ids` and cannot be used with prompt tuning")
+                prefill_chunk_size = generation_config.prefill_chunk_size
+                if generation_config.bucket_size > 0:
+                    # Chunks span whole buckets so that they do not add graph shapes
+                    prefill_chunk_size = (
+                        math.ceil(prefill_chunk_size / generation_config.bucket_size) * generation_config.bucket_size
+                    )
+                model_kwargs["prefill_chunk_size"] = min(prefill_chunk_size, calculated_max_length)
             if generation_config.use_cache and generation_config.reuse_cache:
                 bs, _ = input_ids.shape
                 if not is_greedy_or_beam_and_bucket:
@@ -1675,6 +1923,29 @@ class GaudiGenerationMixin(GenerationMixin):
                 GenerationMode.CONTRASTIVE_SEARCH,
             ], "generation_config.bucket_size > 0 supported only for greedy mode"
 
+        if (
+            generation_config.kv_cache_block_size is not None
+            and not self.config.is_encoder_decoder
+            and generation_mode not in (GenerationMode.SAMPLE, GenerationMode.GREEDY_SEARCH)
+        ):
+            # Only `_sample` grows the paged KV cache step by step, other modes get all their blocks upfront
+            self._reserve_paged_kv_cache(model_kwargs, num_tokens=calculated_max_length)
+
+        if generation_config.use_prefix_cache and generation_mode not in (
+            GenerationMode.SAMPLE,
+            GenerationMode.GREEDY_SEARCH,
+        ):
+            raise ValueError("use_prefix_cache is only supported with greedy search and sampling")
+        if generation_config.prefill_chunk_size is not None and generation_mode not in (
+            GenerationMode.SAMPLE,
+            GenerationMode.GREEDY_SEARCH,
+        ):
+            raise ValueError("prefill_chunk_size is only supported with greedy search and sampling")
+        if generation_config.decode_steps_per_sync is not None and generation_config.decode_steps_per_sync <= 0:
+            raise ValueError(
+                f"decode_steps_per_sync must be a positive integer but is {generation_config.decode_steps_per_sync}"
+            )
+
         if streamer is not None and (generation_config.num_beams > 1):
             raise ValueError(
                 "`streamer` cannot be used with beam search (yet!). Make sure that `num_beams` is set to 1."
@@ -1723,7 +1994,42 @@ class GaudiGenerationMixin(GenerationMixin):
             self.htcore_generation = htcore
 
         # 10. go into different generation modes
-        if generation_mode == GenerationMode.ASSISTED_GENERATION:
+        if generation_mode == GenerationMode.ASSISTED_GENERATION and generation_config.static_speculative_decoding:
+            if generation_config.num_return_sequences > 1:
+                raise ValueError(
+                    "num_return_sequences has to be 1 when doing static speculative decoding, "
+                    f"but is {generation_config.num_return_sequences}."
+                )
+            if not (generation_config.static_shapes and generation_config.use_cache and generation_config.reuse_cache):
+                raise ValueError("static speculative decoding requires `static_shapes`, `use_cache` and `reuse_cache`")
+            if generation_config.kv_cache_block_size is not None:
+                raise ValueError("static speculative decoding is not supported with kv_cache_block_size")
+            if assistant_tokenizer is not None:
+                raise ValueError("static speculative decoding requires the assistant model to share the tokenizer")
+            if num_virtual_tokens > 0 or "inputs_embeds" in model_kwargs:
+                raise ValueError(
+                    "static speculative decoding requires `input_ids` and cannot be used with prompt tuning"
+                )
+            for speculative_model in (self, assistant_model):
+                forward_args = inspect.signature(unwrap_deepspeed_model(speculative_model).forward).parameters
+                if "prefill_offset" not in forward_args:
+                    raise ValueError(
+                        f"static speculative decoding is not supported by {speculative_model.__class__.__name__}"
+                    )
+
+            result = self._static_speculative_decoding(
+                input_ids,
+                assistant_model=assistant_model,
+                logits_processor=prepared_logits_processor,
+                generation_config=generation_config,
+                streamer=streamer,
+                lazy_mode=lazy_mode,
+                ignore_eos=generation_config.ignore_eos,
+                profiler=profiler,
+                hb_gen_time=hb_gen_time,
+                **model_kwargs,
+            )
+        elif generation_mode == GenerationMode.ASSISTED_GENERATION:
             if generation_config.num_return_sequences > 1:
                 raise ValueError(
                     "num_return_sequences has to be 1 when doing assisted generate, "
@@ -1820,6 +2126,16 @@ class GaudiGenerationMixin(GenerationMixin):
             )
 
         elif generation_mode in (GenerationMode.SAMPLE, GenerationMode.GREEDY_SEARCH):
+            if generation_config.use_fused_sampler and generation_config.do_sample:
+                if not generation_config.top_k:
+                    raise ValueError("use_fused_sampler requires `top_k` to be set")
+                # The fused sampler applies these processors to the top-k logits itself
+                prepared_logits_processor = LogitsProcessorList(
+                    processor
+                    for processor in prepared_logits_processor
+                    if not isinstance(processor, FUSED_SAMPLER_PROCESSORS)
+                )
+
             # 11. expand input_ids with `num_return_sequences` additional sequences per batch
             input_ids, model_kwargs = self._expand_inputs_for_generation(
                 input_ids=input_ids,
@@ -2158,7 +2474,7 @@ class GaudiGenerationMixin(GenerationMixin):
 
         if not bucket_internal:
             if bucket_size >= 0:
-                inc = iter(incrementor(bucket_size, cur_len))
+                inc = iter(incrementor(bucket_size, cur_len, model_kwargs.get("buckets")))
             if bucket_size > 0:
                 assert "position_ids" not in model_kwargs, "Untested path"
 
@@ -2518,7 +2834,7 @@ class GaudiGenerationMixin(GenerationMixin):
                 input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
 
             if streamer is not None:
-                streamer.put(next_tokens.cpu())
+                _streamer_put(streamer, next_tokens, None if ignore_eos else unfinished_sequences)
             model_kwargs = self._update_model_kwargs_for_generation(
                 outputs,
                 model_kwargs,
@@ -2719,6 +3035,12 @@ class GaudiGenerationMixin(GenerationMixin):
         return_dict_in_generate = generation_config.return_dict_in_generate
         has_eos_stopping_criteria = any(hasattr(criteria, "eos_token_id") for criteria in stopping_criteria)
         do_sample = generation_config.do_sample
+        use_fused_sampler = do_sample and generation_config.use_fused_sampler
+        # The processors the fused sampler does not apply itself still run on the whole vocabulary in float32
+        upcast_logits = not use_fused_sampler or len(logits_processor) > 0
+        decode_steps_per_sync = generation_config.decode_steps_per_sync or 1
+        # The maximum length is known on the host, reaching it is never deferred
+        max_length = stopping_criteria.max_length
 
         # init attention / hidden states / scores tuples
         scores = () if (return_dict_in_generate and output_scores) else None
@@ -2751,7 +3073,7 @@ class GaudiGenerationMixin(GenerationMixin):
 
         if not bucket_internal:
             if bucket_size >= 0:
-                inc = iter(incrementor(bucket_size, cur_len))
+                inc = iter(incrementor(bucket_size, cur_len, model_kwargs.get("buckets")))
             if bucket_size > 0:
                 assert "position_ids" not in model_kwargs, "Untested path"
 
@@ -2762,6 +3084,11 @@ class GaudiGenerationMixin(GenerationMixin):
             cur_len = (token_idx + model_kwargs.get("inputs_embeds_offset", 0)).item()
             start_token_idx = token_idx
 
+        if not ignore_eos and decode_steps_per_sync > 1:
+            # Number of steps run while at least one sequence was unfinished, the following ones are trimmed
+            num_valid_steps = torch.zeros((), dtype=torch.long, device=input_ids.device)
+        steps_since_sync = 0
+
         time_to_first_token_done = False
         model_kwargs["pad_done"] = False
         model_kwargs["mqa_model"] = False
@@ -2777,8 +3104,17 @@ class GaudiGenerationMixin(GenerationMixin):
                     params, input_ids, model_kwargs, pad_token_id, bucket_size, reduce_recompile
                 )
 
+            # hand out the paged KV cache blocks this step writes to (only when a block boundary is crossed)
+            self._reserve_paged_kv_cache(
+                model_kwargs, unfinished_sequences=None if ignore_eos else unfinished_sequences
+            )
+
             # prepare model inputs
             model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+            prefix_cache_keys = None
+            if model_kwargs.get("prefix_cache") is not None and model_inputs.get("past_key_values") is None:
+                # skip the prefill of the cached prompt prefix
+                model_inputs, prefix_cache_keys = self._prepare_inputs_for_cached_prefix(model_inputs, model_kwargs)
 
             # prepare variable output controls (note: some models won't accept all output controls)
             model_inputs.update({"output_attentions": output_attentions} if output_attentions else {})
@@ -2786,22 +3122,31 @@ class GaudiGenerationMixin(GenerationMixin):
 
             hpu_graphs_kwargs = self._get_hpu_graphs_kwargs(model_kwargs)
 
+            if model_kwargs.get("prefill_chunk_size") is not None and model_inputs.get("past_key_values") is None:
+                model_inputs = self._prefill_in_chunks(input_ids, model_inputs, model_kwargs, hpu_graphs_kwargs)
+
             # forward pass to get next token
             outputs = self(
                 **model_inputs,
                 return_dict=True,
                 **hpu_graphs_kwargs,
             )
+            if prefix_cache_keys is not None:
+                model_kwargs["prefix_cache"].store(unwrap_deepspeed_model(self).get_kv_caches(), prefix_cache_keys)
+
             # synced_gpus: don't waste resources running the code we don't need
             if synced_gpus and this_peer_finished:
                 continue
 
             token_idx = model_kwargs.get("token_idx", None)
+            # Logits are upcast to float32 to retain precision for later logits manipulations. When no processor is left
+            # besides the fused sampler, it runs top-k on the logits in their own dtype and only upcasts the top-k ones.
+            logits_dtype = torch.float32 if upcast_logits else outputs.logits.dtype
             if token_idx is not None and outputs.logits.shape[-2] > 1:
                 # case1 (w/o KV caching): outputs.logits.shape: [batch_size, max_length, vocab_size]
                 if self.config.is_encoder_decoder:
-                    next_token_logits = outputs.logits[:, token_idx - 1, :].float()
-                    next_token_logits = next_token_logits.to(input_ids.device)
+                    next_token_logits = outputs.logits[:, token_idx - 1, :]
+                    next_token_logits = next_token_logits.to(input_ids.device, logits_dtype)
                     next_token_scores = logits_processor(input_ids[:, :token_idx], next_token_logits)
                 else:
                     if model_kwargs.get("num_virtual_tokens", 0) > 0:
@@ -2810,15 +3155,14 @@ class GaudiGenerationMixin(GenerationMixin):
                             output_idx = torch.tensor(outputs.logits.shape[-2], device=input_ids.device)
                         else:
                             output_idx = token_idx + outputs.logits.shape[-2] - input_ids.shape[-1]
-                        next_token_logits = torch.index_select(outputs.logits, -2, output_idx - 1).squeeze(-2).float()
+                        next_token_logits = torch.index_select(outputs.logits, -2, output_idx - 1).squeeze(-2)
                     else:
-                        next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2).float()
-                    next_token_logits = next_token_logits.to(input_ids.device)
+                        next_token_logits = torch.index_select(outputs.logits, -2, token_idx - 1).squeeze(-2)
+                    next_token_logits = next_token_logits.to(input_ids.device, logits_dtype)
                     next_token_scores = logits_processor(input_ids, next_token_logits)
             else:
-                # .float() is needed to retain precision for later logits manipulations
-                next_token_logits = outputs.logits[:, -1, :].float()
-                next_token_logits = next_token_logits.to(input_ids.device)
+                next_token_logits = outputs.logits[:, -1, :]
+                next_token_logits = next_token_logits.to(input_ids.device, logits_dtype)
                 if token_idx is not None and self.config.is_encoder_decoder:
                     # case2 (with KV caching): outputs.logits.shape: [batch_size, 1, vocab_size]
                     next_token_scores = logits_processor(input_ids[:, :token_idx], next_token_logits)
@@ -2847,7 +3191,16 @@ class GaudiGenerationMixin(GenerationMixin):
                     )
 
             # token selection
-            if do_sample:
+            if use_fused_sampler:
+                next_tokens = fused_sample(
+                    next_token_scores,
+                    input_ids,
+                    generation_config.top_k,
+                    top_p=generation_config.top_p,
+                    temperature=generation_config.temperature,
+                    repetition_penalty=generation_config.repetition_penalty,
+                )
+            elif do_sample:
                 # Workaround on HPU for output quality issues with torch.multinomial for lower precision models
                 # Distribution sampled by torch.multinomial may be affected by next_token_logits upcast to float
                 probs = torch.nn.functional.softmax(next_token_scores, dim=-1).to(outputs.logits.dtype)
@@ -2872,7 +3225,7 @@ class GaudiGenerationMixin(GenerationMixin):
                 input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
 
             if streamer is not None:
-                streamer.put(next_tokens.cpu())
+                _streamer_put(streamer, next_tokens, None if ignore_eos else unfinished_sequences)
 
             model_kwargs = self._update_model_kwargs_for_generation(
                 outputs,
@@ -2901,6 +3254,8 @@ class GaudiGenerationMixin(GenerationMixin):
                     eos_token_id=generation_config.eos_token_id,
                 )
             else:
+                if decode_steps_per_sync > 1:
+                    num_valid_steps += unfinished_sequences.max()
                 unfinished_sequences = unfinished_sequences & ~stopping_criteria(
                     input_ids,
                     scores,
@@ -2908,7 +3263,11 @@ class GaudiGenerationMixin(GenerationMixin):
                     ignore_eos=ignore_eos,
                     eos_token_id=generation_config.eos_token_id,
                 )
-                this_peer_finished = unfinished_sequences.max() == 0
+                # Reading the finished sequences on the host syncs with the device, only do it every few steps
+                steps_since_sync += 1
+                if steps_since_sync >= decode_steps_per_sync or (max_length is not None and cur_len >= max_length):
+                    this_peer_finished = unfinished_sequences.max() == 0
+                    steps_since_sync = 0
 
             if hb_gen_time is not None:
                 if not time_to_first_token_done:
@@ -2978,6 +3337,22 @@ class GaudiGenerationMixin(GenerationMixin):
         if streamer is not None:
             streamer.end()
 
+        if not ignore_eos and decode_steps_per_sync > 1:
+            # Trim the steps run after the whole batch finished, they only produced padding
+            num_valid_steps = int(num_valid_steps.item())
+            if token_idx is None:
+                input_ids = input_ids[:, : start_token_idx + num_valid_steps]
+            if scores is not None:
+                scores = scores[:num_valid_steps]
+            if raw_logits is not None:
+                raw_logits = raw_logits[:num_valid_steps]
+            if decoder_attentions is not None:
+                decoder_attentions = decoder_attentions[:num_valid_steps]
+            if cross_attentions is not None:
+                cross_attentions = cross_attentions[:num_valid_steps]
+            if decoder_hidden_states is not None:
+                decoder_hidden_states = decoder_hidden_states[:num_valid_steps]
+
         if batch_size > 1 and has_eos_stopping_criteria:
             eos_token_id = generation_config.eos_token_id
             # Init eos_positions
@@ -2997,7 +3372,7 @@ class GaudiGenerationMixin(GenerationMixin):
 
                 mask_len = min(input_ids.shape[1], generation_config.max_length)
                 # Create a mask for positions greater than the first eos_token_id
-                mask = torch.arange(mask_len, device="hpu").expand(batch_size, mask_len) > eos_positions.unsqueeze(1)
+                mask = torch.arange(mask_len, device=input_ids.device).expand(batch_size, mask_len) > eos_positions.unsqueeze(1)
                 # Apply the mask to set positions greater than the first eos_token_id to pad_token_id
                 input_ids[mask] = pad_token_id
 
@@ -3270,7 +3645,7 @@ class GaudiGenerationMixin(GenerationMixin):
 
         if not bucket_internal:
             if bucket_size >= 0:
-                inc = iter(incrementor(bucket_size, cur_len))
+                inc = iter(incrementor(bucket_size, cur_len, model_kwargs.get("buckets")))
             if bucket_size > 0 and "position_ids" in model_kwargs:
                 logger.warning("Untested path for bucketing with position_ids")
 
@@ -3949,6 +4324,208 @@ class GaudiGenerationMixin(GenerationMixin):
         else:
             return sequence_outputs["sequences"]
 
+    def _static_speculative_decoding(
+        self,
+        input_ids: torch.LongTensor,
+        assistant_model: "PreTrainedModel",
+        logits_processor: LogitsProcessorList,
+        generation_config: GaudiGenerationConfig,
+        streamer: Optional["BaseStreamer"],
+        lazy_mode: Optional[bool] = False,
+        ignore_eos: Optional[bool] = False,
+        profiler: Optional[HabanaProfile] = None,
+        hb_gen_time: Optional[HabanaGenerationTime] = None,
+        **model_kwargs,
+    ) -> Union[GenerateNonBeamOutput, torch.LongTensor]:
+        r"""
+        Generates sequences of token ids with speculative decoding in static shapes, for the whole batch at once.
+
+        Every round drafts `generation_config.num_assistant_tokens` tokens per sequence with `assistant_model` and
+        verifies them with a single forward pass of the target model on the last accepted token followed by the draft
+        tokens. Every sequence then keeps its accepted draft tokens plus the token picked by the target model after
+        them. Sequences advance by different numbers of tokens, so each one has its own position in the static buffer
+        and in the preallocated key/value caches, where both models write their new keys/values with a per-sequence
+        `prefill_offset`. The entries of rejected tokens are overwritten by the next round, so rolling them back costs
+        nothing and the shapes of every round are the same.
+
+        The stopping conditions (`max_new_tokens` and EOS tokens) are checked on the device and copied to the host
+        once per round. Other stopping criteria are not supported. Logits processors are given the static buffer of
+        the accepted tokens at the start of the round.
+
+        Acceptance statistics are stored in `self.speculative_decoding_stats`, a
+        [`~generation.SpeculativeDecodingStats`].
+
+        Parameters:
+            input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
+                The static buffer, the left-padded prompt followed by padding.
+            assistant_model (`PreTrainedModel`):
+                The draft model, it must share the tokenizer of the target model.
+            logits_processor (`LogitsProcessorList`):
+                An instance of [`LogitsProcessorList`] applied to the logits of both models.
+            generation_config ([`~generation.GenerationConfig`]):
+                The generation configuration to be used as parametrization of the decoding method.
+            streamer (`BaseStreamer`, *optional*):
+                Streamer object that will be used to stream the generated sequences. Every round passes
+                `num_assistant_tokens + 1` tokens per sequence, padded with `pad_token_id` after the new ones.
+            lazy_mode (`bool`, *optional*, defaults to `False`):
+                Whether the run is executed in lazy mode or not (i.e. eager mode).
+            profiler (`HabanaProfile`, *optional*, defaults to None):
+                HabanaProfile object to use for profiling.
+            model_kwargs:
+                Additional model specific keyword arguments will be forwarded to the `forward` function of the models.
+
+        Return:
+            [`transformers.generation.GenerateDecoderOnlyOutput`] or `torch.LongTensor`: A `torch.LongTensor` containing
+            the generated tokens (default behaviour) or a [`transformers.generation.GenerateDecoderOnlyOutput`] if
+            `return_dict_in_generate=True`. Scores, attentions and hidden states are not returned.
+        """
+        do_sample = generation_config.do_sample
+        num_speculative_tokens = generation_config.num_assistant_tokens
+        max_new_tokens = generation_config.max_new_tokens
+        pad_token_id = generation_config._pad_token_tensor
+        eos_token_id = None if ignore_eos else generation_config._eos_token_tensor
+        batch_size, max_length = input_ids.shape
+        prompt_length = model_kwargs["token_idx_cpu"]
+        device = input_ids.device
+
+        # The whole static buffer past the prompt is valid, each sequence only attends up to its own position
+        attention_mask = model_kwargs.get("attention_mask")
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        attention_mask = attention_mask.clone()
+        attention_mask[:, prompt_length:] = 1
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp_min(0)
+
+        model_kwargs["lazy_mode"] = lazy_mode
+        forward_kwargs = {}
+        draft_forward_kwargs = {}
+        target_args = inspect.signature(unwrap_deepspeed_model(self).forward).parameters
+        draft_args = inspect.signature(unwrap_deepspeed_model(assistant_model).forward).parameters
+        for key in STATIC_SPECULATIVE_FORWARD_KWARGS:
+            if model_kwargs.get(key) is not None:
+                if key in target_args:
+                    forward_kwargs[key] = model_kwargs[key]
+                if key in draft_args:
+                    draft_forward_kwargs[key] = model_kwargs[key]
+        candidate_generator = GaudiStaticDraftCandidateGenerator(
+            unwrap_deepspeed_model(assistant_model),
+            num_speculative_tokens,
+            logits_processor=logits_processor,
+            do_sample=do_sample,
+            **draft_forward_kwargs,
+        )
+        stats = SpeculativeDecodingStats(num_speculative_tokens, device)
+        self.speculative_decoding_stats = stats
+
+        if profiler is not None:
+            profiler.start()
+
+        # Prefill both models, the first token comes from the target model alone
+        hpu_graphs_kwargs = self._get_hpu_graphs_kwargs(model_kwargs)
+        logits = static_speculative_forward(
+            self,
+            input_ids[:, :prompt_length],
+            attention_mask,
+            position_ids[:, :prompt_length],
+            0,
+            **forward_kwargs,
+            **hpu_graphs_kwargs,
+        )
+        candidate_generator.prefill(input_ids[:, :prompt_length], attention_mask, position_ids)
+        next_token_scores = logits_processor(input_ids, logits[:, -1, :].float())
+        if do_sample:
+            next_tokens = torch.multinomial(next_token_scores.softmax(dim=-1), num_samples=1)
+        else:
+            next_tokens = next_token_scores.argmax(dim=-1, keepdim=True)
+        input_ids[:, prompt_length : prompt_length + 1] = next_tokens
+        if streamer is not None:
+            _streamer_put(streamer, next_tokens)
+
+        # Position of the last token of every sequence, which is not in the key/value caches yet
+        cursor = torch.full((batch_size,), prompt_length, dtype=torch.long, device=device)
+        num_generated = torch.ones(batch_size, dtype=torch.long, device=device)
+        unfinished_sequences = num_generated < max_new_tokens
+        if eos_token_id is not None:
+            unfinished_sequences &= ~torch.isin(next_tokens.squeeze(1), eos_token_id)
+        new_positions = torch.arange(num_speculative_tokens + 1, device=device)
+
+        if hb_gen_time is not None:
+            import habana_frameworks.torch.hpu as torch_hpu
+
+            torch_hpu.synchronize()
+            hb_gen_time.step()
+
+        # One host sync per round
+        while unfinished_sequences.any().item():
+            if lazy_mode:
+                self.htcore_generation.mark_step()
+
+            # 1. Draft tokens for every sequence
+            draft_tokens, draft_probs = candidate_generator.get_candidates(input_ids, cursor)
+
+            # 2. Verify them at once, the keys/values of rejected tokens are overwritten in the next round
+            verify_ids = torch.cat((input_ids.gather(1, cursor.view(-1, 1)), draft_tokens), dim=1)
+            hpu_graphs_kwargs = self._get_hpu_graphs_kwargs(model_kwargs)
+            logits = static_speculative_forward(
+                self,
+                verify_ids,
+                attention_mask,
+                position_ids.gather(1, cursor.view(-1, 1) + new_positions),
+                cursor,
+                num_speculative_tokens + 1,
+                **forward_kwargs,
+                **hpu_graphs_kwargs,
+            ).float()
+            if len(logits_processor) > 0:
+                logits = logits_processor(
+                    input_ids.repeat_interleave(num_speculative_tokens + 1, dim=0),
+                    logits.view(batch_size * (num_speculative_tokens + 1), -1),
+                ).view(batch_size, num_speculative_tokens + 1, -1)
+
+            # 3. Select the accepted tokens
+            if do_sample:
+                num_accepted, new_tokens = speculative_sampling_acceptance(
+                    draft_tokens, draft_probs, logits.softmax(dim=-1)
+                )
+            else:
+                num_accepted, new_tokens = greedy_acceptance(draft_tokens, logits)
+            stats.update(num_accepted, unfinished_sequences)
+
+            # 4. Keep the accepted tokens and the next one, up to max_new_tokens and the first EOS token
+            keep = (new_positions <= num_accepted.view(-1, 1)) & unfinished_sequences.view(-1, 1)
+            keep &= new_positions < (max_new_tokens - num_generated).view(-1, 1)
+            if eos_token_id is not None:
+                is_eos = torch.isin(new_tokens, eos_token_id) & keep
+                keep &= (is_eos.long().cumsum(dim=-1) - is_eos.long()) == 0
+                unfinished_sequences &= ~is_eos.any(dim=-1)
+            new_tokens = torch.where(keep, new_tokens, pad_token_id)
+            num_new_tokens = keep.sum(dim=-1)
+            input_ids.scatter_(1, cursor.view(-1, 1) + 1 + new_positions, new_tokens)
+            cursor += num_new_tokens
+            num_generated += num_new_tokens
+            unfinished_sequences &= num_generated < max_new_tokens
+            if streamer is not None:
+                _streamer_put(streamer, new_tokens, keep)
+
+            if hb_gen_time is not None:
+                hb_gen_time.step()
+
+            if profiler is not None:
+                profiler.step()
+
+        if profiler is not None:
+            profiler.stop()
+
+        if streamer is not None:
+            streamer.end()
+
+        # Drop the room of the last round past `max_new_tokens`
+        input_ids = input_ids[:, : prompt_length + max_new_tokens]
+        if generation_config.return_dict_in_generate:
+            return GenerateDecoderOnlyOutput(sequences=input_ids)
+        else:
+            return input_ids
+
     def _assisted_decoding(
         self,
         input_ids: torch.LongTensor,
@@ -4155,7 +4732,7 @@ class GaudiGenerationMixin(GenerationMixin):
             else:
                 input_ids = torch.cat((input_ids, valid_tokens), dim=-1)
             if streamer is not None:
-                streamer.put(valid_tokens.cpu())
+                _streamer_put(streamer, valid_tokens)
             new_cur_len = input_ids.shape[1]
 
             # 4.2. Discard past key values relative to unused assistant tokens
@@ -18,6 +18,8 @@ import torch
 from transformers.modeling_attn_mask_utils import AttentionMaskConverter
 from transformers.utils.import_utils import is_torchdynamo_compiling
 
+from .cache_utils import left_padding_lengths, sliding_window_slot_positions
+
 
 @dataclass
 class GaudiAttentionMaskConverter(AttentionMaskConverter):
@@ -156,13 +158,22 @@ def _gaudi_prepare_4d_causal_attention_mask(
     inputs_embeds: torch.Tensor,
     past_key_values_length: int,
     sliding_window: Optional[int] = None,
+    kv_cache_window: Optional[Tuple[int, int]] = None,
+    token_idx: Optional[torch.Tensor] = None,
 ):
     """
     Adapted from: https://github.com/huggingface/transformers/blob/v4.37.2/src/transformers/modeling_attn_mask_utils.py#L278
 
     Differences:
     - replace `AttentionMaskConverter` by `GaudiAttentionMaskConverter`
+    - add new args `kv_cache_window` and `token_idx` for the `SlidingWindowKVCache`, see
+      `_gaudi_prepare_4d_sliding_window_cache_mask`
     """
+    if kv_cache_window is not None:
+        return _gaudi_prepare_4d_sliding_window_cache_mask(
+            attention_mask, input_shape, *kv_cache_window, token_idx=token_idx, dtype=inputs_embeds.dtype
+        )
+
     attn_mask_converter = GaudiAttentionMaskConverter(is_causal=True, sliding_window=sliding_window)
 
     key_value_length = input_shape[-1] + past_key_values_length
@@ -190,3 +201,73 @@ def _gaudi_prepare_4d_causal_attention_mask(
         )
 
     return attention_mask
+
+
+def _gaudi_prepare_4d_sliding_window_cache_mask(
+    attention_mask: Optional[torch.Tensor],
+    input_shape: Union[torch.Size, Tuple, List],
+    window: int,
+    num_sink_tokens: int,
+    token_idx: Optional[torch.Tensor],
+    dtype: torch.dtype,
+):
+    """
+    Builds the 4D mask of a model whose KV caches are `SlidingWindowKVCache`s, every token attends to the first
+    `num_sink_tokens` tokens after the left padding of its sequence and to the last `window` ones, itself included.
+
+    The prefill attends to the new keys directly, so the mask has shape `(bsz, 1, query_length, query_length)`. The
+    decode attends to the whole cache, so the mask has shape `(bsz, 1, 1, num_sink_tokens + window)` and maps every
+    slot of the cache to the position it holds with `sliding_window_slot_positions`, `token_idx - 1` being the position
+    of the new token. `attention_mask` is the 2D padding mask of the whole sequence.
+    """
+    bsz, query_length = input_shape[0], input_shape[-1]
+    device = attention_mask.device if attention_mask is not None else None
+    sink_offsets = left_padding_lengths(attention_mask, bsz, device)
+    if query_length > 1:
+        query_positions = torch.arange(query_length, device=device).view(-1, 1)
+        key_positions = torch.arange(query_length, device=device).view(1, -1)
+        sink_indices = key_positions - sink_offsets.view(-1, 1, 1)
+        is_sink = (sink_indices >= 0) & (sink_indices < num_sink_tokens)
+        attended = (key_positions <= query_positions) & ((key_positions > query_positions - window) | is_sink)
+        attended = attended[:, None, :, :]
+        if attention_mask is not None:
+            attended = attended & (attention_mask[:, None, None, :query_length] != 0)
+    else:
+        if token_idx is None:
+            raise ValueError("The sliding window KV cache requires `token_idx` in the decode phase")
+        key_positions = sliding_window_slot_positions(token_idx.reshape(()) - 1, window, num_sink_tokens, sink_offsets)
+        attended = key_positions >= 0
+        if attention_mask is not None:
+            padding_mask = attention_mask.gather(1, key_positions.clamp(min=0))
+            attended = attended & (padding_mask != 0)
+        attended = attended[:, None, None, :]
+    return torch.zeros(attended.shape, dtype=dtype, device=attended.device).masked_fill(
+        ~attended, torch.finfo(dtype).min
+    )
+
+
+def _gaudi_prepare_4d_causal_attention_mask_with_offset(
+    attention_mask: torch.Tensor,
+    query_length: int,
+    prefill_offset: Union[int, torch.Tensor],
+    dtype: torch.dtype,
+):
+    """
+    Builds the 4D mask of a prefill whose first `prefill_offset` tokens already are in the KV cache (cached prompt
+    prefix or previous prefill chunk). The `query_length` new tokens attend to all the cached tokens and causally to
+    each other, so the returned mask has shape `(bsz, 1, query_length, prefill_offset + query_length)`.
+    `attention_mask` is the 2D padding mask of the whole sequence, it is sliced to the key length here.
+
+    If `prefill_offset` is a tensor of per-sequence offsets, the keys span the whole `attention_mask` so that the shape
+    of the mask does not depend on the offsets, and the keys after the new tokens of every sequence are masked out.
+    """
+    device = attention_mask.device
+    if isinstance(prefill_offset, torch.Tensor):
+        key_value_length = attention_mask.shape[-1]
+        query_positions = (prefill_offset.view(-1, 1) + torch.arange(query_length, device=device))[:, None, :, None]
+    else:
+        key_value_length = prefill_offset + query_length
+        query_positions = torch.arange(prefill_offset, key_value_length, device=device)[None, None, :, None]
+    key_positions = torch.arange(key_value_length, device=device).view(1, 1, 1, -1)
+    masked = (key_positions > query_positions) | (attention_mask[:, None, None, :key_value_length] == 0)
+    return torch.zeros(masked.shape, dtype=dtype, device=device).masked_fill(masked, torch.finfo(dtype).min)
@@ -58,8 +58,10 @@ from transformers.utils import (
     logging,
 )
 
+from ....distributed.expert_parallel import AllToAllExpertDispatcher
 from ....distributed.tensorparallel import _all_reduce
 from ....utils import warn0
+from ...cache_utils import KVCache
 from ...modeling_attn_mask_utils import _gaudi_prepare_4d_causal_attention_mask
 from .configuration_deepseek_v2 import DeepseekV2Config
 
@@ -623,7 +625,22 @@ class DeepseekV2MoE(nn.Module):
                     for i in range(config.n_routed_experts)
                 ]
             )
+        self.num_experts = config.n_routed_experts
+        self.experts_range = range(self.ep_rank * self.experts_per_rank, (self.ep_rank + 1) * self.experts_per_rank)
+
+        # Send every token only to the ranks owning its experts instead of all-reducing the outputs of all tokens
+        self.expert_dispatcher = None
+        if self.ep_size > 1 and getattr(config, "ep_dispatch", "all_reduce") == "all_to_all":
+            self.expert_dispatcher = AllToAllExpertDispatcher(
+                config.n_routed_experts,
+                capacity_factor=getattr(config, "moe_capacity_factor", 2.0),
+                num_replicas_per_rank=getattr(config, "moe_num_replicas_per_rank", 0),
+                expert_template=self.experts[self.experts_range[0]],
+            )
+
         self.gate = MoEGate(config)
+        # Number of tokens routed to every expert, set by `enable_expert_load_stats`
+        self.expert_load_stats = None
         if config.n_shared_experts is not None:
             intermediate_size = config.moe_intermediate_size * config.n_shared_experts
             self.shared_experts = DeepseekV2MLP(config=config, intermediate_size=intermediate_size)
@@ -635,6 +652,8 @@ class DeepseekV2MoE(nn.Module):
         identity = hidden_states
         orig_shape = hidden_states.shape
         topk_idx, topk_weight, aux_loss = self.gate(hidden_states)
+        if self.expert_load_stats is not None:
+            self.expert_load_stats.update(topk_idx)
         hidden_states = hidden_states.view(-1, hidden_states.shape[-1])
         # we cast back to the input dtype
         topk_weight = topk_weight.to(hidden_states.dtype)
@@ -664,6 +683,10 @@ class DeepseekV2MoE(nn.Module):
             final_hidden_states = final_hidden_states.type(hidden_states.dtype)
             final_hidden_states = final_hidden_states.view(*orig_shape)
             final_hidden_states = AddAuxiliaryLoss.apply(final_hidden_states, aux_loss)
+        elif self.expert_dispatcher is not None:
+            experts = [self.experts[i] for i in self.experts_range]
+            final_hidden_states = self.expert_dispatcher(hidden_states, topk_idx, topk_weight, experts)
+            final_hidden_states = final_hidden_states.reshape(-1, sequence_length, hidden_dim)
         else:
             final_hidden_states = torch.zeros(
                 (batch * sequence_length, hidden_dim), dtype=hidden_states.dtype, device=hidden_states.device
@@ -749,48 +772,6 @@ def gaudi_deepseekv2_repeat_kv(
     return query_states, key_states, value_states, attention_mask
 
 
-class KVCache(torch.nn.Module):
-    def __init__(self):
-        super(KVCache, self).__init__()
-        self.cache = None
-        self.inp_seq_len = -1
-
-    def allocate(self, inp_seq_len, dtype, device, shape):
-        if self.cache is None or self.cache.shape != shape:
-            self.inp_seq_len = inp_seq_len
-            self.cache = torch.zeros(shape, dtype=dtype, device=device)
-        else:
-            assert self.inp_seq_len == inp_seq_len, (
-                f"inp_seq_len must be the same. self.inp_seq_len:{self.inp_seq_len} inp_seq_len:{inp_seq_len}"
-            )
-            self.cache.fill_(0)
-
-    def update(self, prev, cur, dim, idx, inp_seq_len):
-        orig_cur = cur
-        if prev.shape == cur.shape:
-            prev.copy_(cur)
-            return orig_cur
-        if cur.shape[1] > 1 and cur.shape[1] <= prev.shape[1]:
-            # Initialize
-            prev[:, :inp_seq_len, :].copy_(cur)
-            return orig_cur
-        assert cur.shape[1] == 1, f"Cannot update kv-cache. Unsupported shapes. prev:{prev.shape} cur:{cur.shape}"
-
-        if idx is not None:
-            prev.index_copy_(dim, idx - 1, cur)
-            return prev
-        else:
-            return torch.cat((prev, cur), dim=dim)
-
-    def get_shape(self):
-        if self.cache is None:
-            return None
-        return self.cache.shape
-
-    def forward(self, cur, dim, idx):
-        return self.update(self.cache, cur, dim, idx, self.inp_seq_len)
-
-
 class ModuleFusedSDPA(torch.nn.Module):
     def __init__(self, fusedSDPA, scale, attention_dropout, enable_recompute, flash_attention_fp8):
         super().__init__()
@@ -39,6 +39,7 @@ from transformers.models.gemma.modeling_gemma import (
 from transformers.processing_utils import Unpack
 from transformers.utils import TransformersKwargs, logging
 
+from ...cache_utils import GaudiKVCacheMixin, KVCache
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
 )
@@ -121,47 +122,6 @@ class Matmul(torch.nn.Module):
         return torch.matmul(x, y)
 
 
-class KVCache(torch.nn.Module):
-    def __init__(self):
-        super(KVCache, self).__init__()
-        self.cache = None
-        self.inp_seq_len = -1
-
-    def allocate(self, inp_seq_len, dtype, device, shape):
-        if self.cache is None or self.cache.shape != shape:
-            self.inp_seq_len = inp_seq_len
-            self.cache = torch.zeros(shape, dtype=dtype, device=device)
-        else:
-            assert self.inp_seq_len == inp_seq_len, (
-                f"inp_seq_len must be the same. self.inp_seq_len:{self.inp_seq_len} inp_seq_len:{inp_seq_len}"
-            )
-            self.cache.fill_(0)
-
-    def update(self, prev, cur, dim, idx, inp_seq_len):
-        orig_cur = cur
-        if prev.shape == cur.shape:
-            prev.copy_(cur)
-            return orig_cur
-        if cur.shape[2] > 1 and cur.shape[2] <= prev.shape[2]:
-            # Initialize
-            prev[:, :, :inp_seq_len, :].copy_(cur)
-            return orig_cur
-        assert cur.shape[2] == 1, f"Cannot update kv-cache. Unsupported shapes. prev:{prev.shape} cur:{cur.shape}"
-        if idx is not None:
-            prev.index_copy_(dim, idx - 1, cur)
-            return prev
-        else:
-            return torch.cat((prev, cur), dim=dim)
-
-    def get_shape(self):
-        if self.cache is None:
-            return None
-        return self.cache.shape
-
-    def forward(self, cur, dim, idx):
-        return self.update(self.cache, cur, dim, idx, self.inp_seq_len)
-
-
 def gaudi_eager_attention_forward(
     module: torch.nn.Module,
     query: torch.Tensor,
@@ -226,20 +186,6 @@ class GaudiGemmaAttention(GemmaAttention):
             self.max_position_embeddings = seq_len
             self.rotary_emb._set_cos_sin_cache(seq_len, self.k_proj.weight.device, self.k_proj.weight.dtype)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def gaudi_flash_attn_v1(
         self, query_layer, key_layer, value_layer, attention_mask, dropout_rate, q_block_size, enable_recompute
     ):
@@ -438,12 +384,6 @@ class GaudiGemmaDecoderLayer(GemmaDecoderLayer):
         self.self_attn = GaudiGemmaAttention(config, layer_idx)
         self.mlp = GaudiGemmaMLP(config)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -564,14 +504,7 @@ class GaudiGemmaDecoderLayer(GemmaDecoderLayer):
         return hidden_states
 
 
-class GaudiGemmaModel(GemmaModel):
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
-
+class GaudiGemmaModel(GaudiKVCacheMixin, GemmaModel):
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
             layer.update_sincos_cache(seq_len)
@@ -34,6 +34,7 @@ from transformers.models.gemma2.modeling_gemma2 import (
 )
 from transformers.utils import logging
 
+from ...cache_utils import GaudiKVCacheMixin
 from ...modeling_attn_mask_utils import _gaudi_prepare_4d_causal_attention_mask
 from ...modeling_rope_utils import GaudiRotaryEmbedding
 from ..modeling_all_models import KVCache, Matmul, apply_customized_rope_module
@@ -180,20 +181,6 @@ class GaudiGemma2Attention(Gemma2Attention):
             self.max_position_embeddings = seq_len
             _, _ = self.rotary_emb(self.k_proj.weight, seq_len=seq_len)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def gaudi_flash_attn_v1(self, query_layer, key_layer, value_layer, attention_mask, dropout_rate, q_block_size):
         """
         Gaudi version of Flash Attention V1 to support long sequence at prompt phase
@@ -386,12 +373,6 @@ class GaudiGemma2DecoderLayer(Gemma2DecoderLayer):
         self.self_attn = GaudiGemma2Attention(config, layer_idx)
         self.mlp = GaudiGemma2MLP(config)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -531,17 +512,10 @@ class GaudiGemma2DecoderLayer(Gemma2DecoderLayer):
         return hidden_states
 
 
-class GaudiGemma2Model(Gemma2Model):
+class GaudiGemma2Model(GaudiKVCacheMixin, Gemma2Model):
     # used in Trainer to avoid passing `loss_kwargs` to model forward
     accepts_loss_kwargs = False
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
-
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
             layer.update_sincos_cache(seq_len)
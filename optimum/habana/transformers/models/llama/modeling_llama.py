@@ -27,8 +27,18 @@ from ....distributed.tensorparallel import (
 )
 from ....distributed.tp import TPModule
 from ....utils.features import import_usable_component
+from ...cache_utils import (
+    GaudiKVCacheMixin,
+    PagedBlockAllocator,
+    PagedKVCache,
+    QuantizedKVCache,
+    paged_attention,
+    quantized_attention,
+)
+from ...cache_utils import KVCache as GaudiKVCache
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
+    _gaudi_prepare_4d_causal_attention_mask_with_offset,
 )
 from ..modeling_all_models import Matmul, apply_customized_rope_module
 from .configuration_llama import LlamaConfig
@@ -308,22 +318,7 @@ class ModuleFusedSDPA(torch.nn.Module):
         )
 
 
-class KVCache(torch.nn.Module):
-    def __init__(self):
-        super(KVCache, self).__init__()
-        self.cache = None
-        self.inp_seq_len = -1
-
-    def allocate(self, inp_seq_len, dtype, device, shape):
-        if self.cache is None or self.cache.shape != shape:
-            self.inp_seq_len = inp_seq_len
-            self.cache = torch.zeros(shape, dtype=dtype, device=device)
-        else:
-            assert self.inp_seq_len == inp_seq_len, (
-                f"inp_seq_len must be the same. self.inp_seq_len:{self.inp_seq_len} inp_seq_len:{inp_seq_len}"
-            )
-            self.cache.fill_(0)
-
+class KVCache(GaudiKVCache):
     @staticmethod
     def update(prev, cur, dim, idx, inp_seq_len):
         if inp_seq_len != -1:
@@ -343,14 +338,6 @@ class KVCache(torch.nn.Module):
         else:
             return torch.cat((prev, cur), dim=dim)
 
-    def get_shape(self):
-        if self.cache is None:
-            return None
-        return self.cache.shape
-
-    def forward(self, cur, dim, idx):
-        return self.update(self.cache, cur, dim, idx, self.inp_seq_len)
-
 
 class GaudiDistributedAttention(torch.nn.Module):
     def __init__(
@@ -540,20 +527,6 @@ class GaudiLlamaAttention(LlamaAttention):
             self.rotary_emb.original_max_seq_len = seq_len
             _, _ = self.rotary_emb(self.get_k_proj_weight(), seq_len=seq_len)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def pre_attn_forward(
         self,
         hidden_states: torch.Tensor,
@@ -575,6 +548,7 @@ class GaudiLlamaAttention(LlamaAttention):
         valid_sequence_lengths: Optional[torch.Tensor] = None,
         cache_idx: int = None,
         num_virtual_tokens: int = None,
+        prefill_offset: Optional[int] = None,
         **kwargs,
     ) -> tuple[torch.Tensor, Optional[torch.Tensor], Optional[tuple[torch.Tensor]]]:
         """
@@ -590,6 +564,7 @@ class GaudiLlamaAttention(LlamaAttention):
         - add new arg flash_attention_causal_mask
         - add new arg flash_attention_fast_softmax
         - add new arg num_virtual_tokens
+        - add new arg prefill_offset
         """
         input_shape = hidden_states.shape[:-1]
         q_len = input_shape[1]
@@ -624,6 +599,11 @@ class GaudiLlamaAttention(LlamaAttention):
                         kv_seq_len = past_key_value[0].shape[-2] + kv_seq_len
                     else:
                         kv_seq_len = past_key_value[0].shape[-2]
+        if isinstance(prefill_offset, torch.Tensor):
+            # Per-sequence offsets: the new tokens attend to the whole static cache
+            kv_seq_len = max(kv_seq_len, self.k_cache.get_shape()[-2])
+        elif prefill_offset is not None:
+            kv_seq_len = max(kv_seq_len, prefill_offset + q_len)
 
         # TODO: the following section cause torch.compile performance issue with graph recompilation
         # as we are not using position_embeddings, disable it for now
@@ -657,6 +637,17 @@ class GaudiLlamaAttention(LlamaAttention):
             query_states, key_states, cos, sin, position_ids, self.training
         )
 
+        # With paged or quantized caches, the next token attends to the cache read a few tokens at a time instead of
+        # to a dense copy of it
+        use_cache_attention = (
+            use_cache
+            and reuse_cache
+            and q_len == 1
+            and isinstance(self.k_cache, (PagedKVCache, QuantizedKVCache))
+            and attention_mask is not None
+            and prefill_offset is None
+            and (past_key_value is None or not isinstance(past_key_value[0], torch.Tensor))
+        )
         if use_cache:
             # reuse k, v, self_attention
             if reuse_cache:
@@ -664,8 +655,17 @@ class GaudiLlamaAttention(LlamaAttention):
                     # prefix tuning case. attach past_key_value to generate first token.
                     key_states = torch.cat((past_key_value[0], key_states), -2)
                     value_states = torch.cat((past_key_value[1], value_states), -2)
-                key_states = self.k_cache(key_states, 2, token_idx)
-                value_states = self.v_cache(value_states, 2, token_idx)
+                if prefill_offset is not None:
+                    # the first `prefill_offset` tokens are already cached, attend to them and to the new ones
+                    key_states = self.k_cache.update_from(key_states, prefill_offset)
+                    value_states = self.v_cache.update_from(value_states, prefill_offset)
+                elif use_cache_attention:
+                    # the attention reads the cache itself, only write the new token
+                    self.k_cache.scatter(key_states, (token_idx - 1).reshape(()))
+                    self.v_cache.scatter(value_states, (token_idx - 1).reshape(()))
+                else:
+                    key_states = self.k_cache(key_states, 2, token_idx)
+                    value_states = self.v_cache(value_states, 2, token_idx)
                 past_key_value = (self.k_cache.get_shape(), self.v_cache.get_shape())
             else:
                 if past_key_value is None:
@@ -706,7 +706,7 @@ class GaudiLlamaAttention(LlamaAttention):
                 if token_idx is None:
                     past_key_value = (key_states, value_states)
 
-            if cache_idx is not None and q_len == 1:
+            if cache_idx is not None and q_len == 1 and not use_cache_attention:
                 key_states = key_states[:, :, :cache_idx, :]
                 value_states = value_states[:, :, :cache_idx, :]
                 if attention_mask is not None:
@@ -717,7 +717,14 @@ class GaudiLlamaAttention(LlamaAttention):
         fused_scaled_dot_product_attention = get_gaudi_distributed_attention(
             self.fused_scaled_dot_product_attention, self.fused_scaled_dot_product_attention_distributed
         )
-        if use_flash_attention and FusedSDPA is not None:
+        if use_cache_attention:
+            # next token, only the positions covered by the attention mask are read
+            if cache_idx is not None:
+                attention_mask = attention_mask[:, :, :, :cache_idx]
+            cache_attention = paged_attention if isinstance(self.k_cache, PagedKVCache) else quantized_attention
+            attn_output = cache_attention(query_states, self.k_cache, self.v_cache, attention_mask, self.scaling)
+            attn_weights = None
+        elif use_flash_attention and FusedSDPA is not None:
             attn_weights = None
             if q_len == 1:
                 # next token
@@ -737,7 +744,7 @@ class GaudiLlamaAttention(LlamaAttention):
             else:
                 # first token
                 softmax_mode = "fast" if flash_attention_fast_softmax else "None"
-                if flash_attention_causal_mask:
+                if flash_attention_causal_mask and prefill_offset is None:
                     # causal masking on first token requires inputs to be of the same length
                     attn_output = fused_scaled_dot_product_attention(
                         query_states,
@@ -915,12 +922,6 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
         self.input_layernorm = LlamaRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
         self.post_attention_layernorm = LlamaRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -946,6 +947,7 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
         num_virtual_tokens: int = None,
         attn_batch_split: int = 1,
         prev_layer_residual: Optional[torch.Tensor] = None,
+        prefill_offset: Optional[int] = None,
         **kwargs,
     ) -> tuple[torch.FloatTensor, Optional[tuple[torch.FloatTensor, torch.FloatTensor]]]:
         """
@@ -1003,6 +1005,7 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
                     valid_sequence_lengths=sub_valid_sequence_lengths[i],
                     cache_idx=cache_idx,
                     num_virtual_tokens=num_virtual_tokens,
+                    prefill_offset=prefill_offset,
                 )
                 self.self_attn.attention_all_reduce(split_hidden_states[i])
                 if use_cache:
@@ -1044,6 +1047,7 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
                 valid_sequence_lengths=valid_sequence_lengths,
                 cache_idx=cache_idx,
                 num_virtual_tokens=num_virtual_tokens,
+                prefill_offset=prefill_offset,
             )
             self.self_attn.attention_all_reduce(hidden_states)
             hidden_states, residual = self.post_attn_pre_mlp(hidden_states, residual)
@@ -1080,6 +1084,7 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
         valid_sequence_lengths: Optional[torch.Tensor] = None,
         cache_idx: int = None,
         num_virtual_tokens: int = None,
+        prefill_offset: Optional[int] = None,
     ) -> tuple[torch.FloatTensor, Optional[tuple[torch.FloatTensor, torch.FloatTensor]]]:
         hidden_states = self.input_layernorm(hidden_states)
         hidden_states, attn_weights, present_key_value = self.self_attn.pre_attn_forward(
@@ -1102,6 +1107,7 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
             valid_sequence_lengths=valid_sequence_lengths,
             cache_idx=cache_idx,
             num_virtual_tokens=num_virtual_tokens,
+            prefill_offset=prefill_offset,
         )
 
         return hidden_states, attn_weights, present_key_value
@@ -1133,7 +1139,7 @@ class GaudiLlamaDecoderLayer(LlamaDecoderLayer):
         return hidden_states
 
 
-class GaudiLlamaModel(LlamaModel):
+class GaudiLlamaModel(GaudiKVCacheMixin, LlamaModel):
     """
     Copied from https://github.com/huggingface/transformers/blob/v4.38.2/src/transformers/models/llama/modeling_llama.py#L909
     """
@@ -1164,12 +1170,24 @@ class GaudiLlamaModel(LlamaModel):
         # Initialize weights and apply final processing
         self.post_init()
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
+    def enable_paged_kv_cache(
+        self, block_size: Optional[int], num_blocks: Optional[int] = None
+    ) -> Optional[PagedBlockAllocator]:
+        """
+        Replaces the contiguous per-layer KV caches with block-paged caches sharing a single pool of blocks, or
+        restores the contiguous caches if `block_size` is `None`. Blocks are handed out on demand with
+        `kv_cache_allocator.reserve_all` so sequences only pay for the tokens they actually hold. Requires
+        `reuse_cache`.
+        """
+        return self.kv_cache_manager.enable_paged(block_size, num_blocks)
 
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
+    def enable_quantized_kv_cache(self, dtype: Optional[str], granularity: str = "token"):
+        """
+        Replaces the KV caches of every layer with `QuantizedKVCache`s storing int8 (`dtype="int8"`) or fp8
+        (`dtype="fp8"`) values with per-head or per-token scales, or restores the regular caches if `dtype` is `None`.
+        The decode steps attend to them with `quantized_attention`. Requires `reuse_cache`.
+        """
+        self.kv_cache_manager.enable_quantized(dtype, granularity)
 
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
@@ -1197,6 +1215,7 @@ class GaudiLlamaModel(LlamaModel):
         lazy_mode: Optional[bool] = True,
         num_virtual_tokens: int = None,
         attn_batch_split: int = 1,
+        prefill_offset: Optional[int] = None,
         **kwargs,
     ) -> BaseModelOutputWithPast:
         """
@@ -1211,6 +1230,7 @@ class GaudiLlamaModel(LlamaModel):
         - add new arg flash_attention_causal_mask
         - add new arg flash_attention_fast_softmax
         - add new arg lazy_mode
+        - add new arg prefill_offset
         """
         use_cache = use_cache if use_cache is not None else self.config.use_cache
 
@@ -1265,7 +1285,13 @@ class GaudiLlamaModel(LlamaModel):
             cache_position = None
 
         # HPU specific mask generation
-        if ignore_cache_position:
+        if prefill_offset is not None:
+            if not reuse_cache:
+                raise ValueError("`prefill_offset` requires `reuse_cache`.")
+            causal_mask = _gaudi_prepare_4d_causal_attention_mask_with_offset(
+                attention_mask, seq_length, prefill_offset, inputs_embeds.dtype
+            )
+        elif ignore_cache_position:
             causal_mask = _gaudi_prepare_4d_causal_attention_mask(
                 attention_mask,
                 input_ids.shape if input_ids is not None else (batch_size, seq_length),
@@ -1331,6 +1357,7 @@ class GaudiLlamaModel(LlamaModel):
                 num_virtual_tokens,
                 attn_batch_split,
                 layer_prev_layer_residual,
+                prefill_offset,
             )
             if use_prev_layer_residual:
                 index = 1 + int(use_cache)
@@ -1365,6 +1392,7 @@ class GaudiLlamaForCausalLM(LlamaForCausalLM):
     - from step2 when enable KV cache, slice next_position_ids from position_ids base on the token_idx
     - add new args attn_softmax_bf16
     - add new args reuse_cache
+    - add new args prefill_offset
     """
 
     def __init__(self, config, parallel_strategy: DistributedStrategy = NoOpStrategy):
@@ -1378,6 +1406,25 @@ class GaudiLlamaForCausalLM(LlamaForCausalLM):
     def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
         self.model.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
 
+    def enable_paged_kv_cache(
+        self, block_size: Optional[int], num_blocks: Optional[int] = None
+    ) -> Optional[PagedBlockAllocator]:
+        return self.model.enable_paged_kv_cache(block_size, num_blocks)
+
+    def enable_quantized_kv_cache(self, dtype: Optional[str], granularity: str = "token"):
+        self.model.enable_quantized_kv_cache(dtype, granularity)
+
+    @property
+    def kv_cache_allocator(self):
+        return self.model.kv_cache_allocator
+
+    @property
+    def kv_cache_quantization(self):
+        return self.model.kv_cache_quantization
+
+    def get_kv_caches(self):
+        return self.model.get_kv_caches()
+
     def reorder_kv_cache(self, beam_idx: torch.LongTensor):
         return self.model.reorder_kv_cache(beam_idx)
 
@@ -1409,6 +1456,7 @@ class GaudiLlamaForCausalLM(LlamaForCausalLM):
         lazy_mode: Optional[bool] = True,
         num_virtual_tokens: int = None,
         attn_batch_split: int = 1,
+        prefill_offset: Optional[int] = None,
         **kwargs: Unpack[TransformersKwargs],
     ) -> CausalLMOutputWithPast:
         if self.generation_config.use_fused_rope is False:
@@ -1436,12 +1484,20 @@ class GaudiLlamaForCausalLM(LlamaForCausalLM):
             lazy_mode=lazy_mode,
             num_virtual_tokens=num_virtual_tokens,
             attn_batch_split=attn_batch_split,
+            prefill_offset=prefill_offset,
             **kwargs,
         )
 
         hidden_states = outputs.last_hidden_state
         _, seq_len, _ = hidden_states.shape
-        if seq_len > 1 and trim_logits and not self.training:
+        if prefill_offset is not None and not logits_to_keep:
+            # Only the logits of the last prompt token are needed, the prompt is left-padded
+            if token_idx is not None and not isinstance(prefill_offset, torch.Tensor):
+                # a prefill chunk may be right-padded, `token_idx` follows its last prompt token
+                hidden_states = hidden_states.index_select(1, token_idx - 1 - prefill_offset)
+            else:
+                hidden_states = hidden_states[:, -1:, :]
+        elif seq_len > 1 and trim_logits and not self.training:
             if token_idx is not None:
                 hidden_states = hidden_states.index_select(1, token_idx - 1)
             else:
@@ -39,6 +39,7 @@ from transformers.models.mistral.modeling_mistral import (
 from transformers.processing_utils import Unpack
 from transformers.utils import TransformersKwargs, logging
 
+from ...cache_utils import GaudiKVCacheMixin
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
 )
@@ -196,20 +197,6 @@ class GaudiMistralAttention(MistralAttention):
             self.max_position_embeddings = seq_len
             _, _ = self.rotary_emb(self.k_proj.weight, seq_len=seq_len)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -348,12 +335,6 @@ class GaudiMistralDecoderLayer(MistralDecoderLayer):
         self.input_layernorm = MistralRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
         self.post_attention_layernorm = MistralRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -418,13 +399,13 @@ class GaudiMistralDecoderLayer(MistralDecoderLayer):
         return outputs
 
 
-class GaudiMistralModel(MistralModel):
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
+class GaudiMistralModel(GaudiKVCacheMixin, MistralModel):
+    def enable_sliding_window_kv_cache(self, window: Optional[int], num_sink_tokens: int = 0):
+        """
+        Replaces the KV caches of every layer with `SlidingWindowKVCache`s keeping the first `num_sink_tokens` tokens
+        and the last `window` ones, or restores the regular caches if `window` is `None`. Requires `reuse_cache`.
+        """
+        self.kv_cache_manager.enable_sliding_window(window, num_sink_tokens)
 
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
@@ -479,6 +460,10 @@ class GaudiMistralModel(MistralModel):
         if position_ids is None:
             position_ids = cache_position.unsqueeze(0)
 
+        if reuse_cache and seq_length > 1:
+            # The attention sinks of a sliding window KV cache start after the left padding
+            self.kv_cache_manager.set_sink_offsets(attention_mask, batch_size)
+
         # 4d mask is passed through the layers
         causal_mask = _gaudi_prepare_4d_causal_attention_mask(
             attention_mask,
@@ -486,6 +471,8 @@ class GaudiMistralModel(MistralModel):
             inputs_embeds,
             past_key_values_length,
             sliding_window=self.config.sliding_window,
+            kv_cache_window=self.kv_cache_manager.sliding_window_layout if reuse_cache else None,
+            token_idx=token_idx,
         )
 
         hidden_states = inputs_embeds
@@ -545,6 +532,13 @@ class GaudiMistralForCausalLM(MistralForCausalLM):
     def reorder_kv_cache(self, beam_idx: torch.LongTensor):
         return self.model.reorder_kv_cache(beam_idx)
 
+    def enable_sliding_window_kv_cache(self, window: Optional[int], num_sink_tokens: int = 0):
+        self.model.enable_sliding_window_kv_cache(window, num_sink_tokens)
+
+    @property
+    def kv_cache_sliding_window(self):
+        return self.model.kv_cache_sliding_window
+
     def update_sincos_cache(self, seq_len):
         self.model.update_sincos_cache(seq_len)
 
@@ -50,7 +50,9 @@ from transformers.models.mixtral.modeling_mixtral import (
 from transformers.processing_utils import Unpack
 from transformers.utils import TransformersKwargs, logging
 
+from ....distributed.expert_parallel import AllToAllExpertDispatcher
 from ....distributed.tensorparallel import _all_reduce
+from ...cache_utils import GaudiKVCacheMixin
 from ..llama.modeling_llama import GaudiLlamaRotaryEmbedding
 from ..modeling_all_models import KVCache, apply_customized_rope_module
 from .configuration_mixtral import MixtralConfig
@@ -213,6 +215,18 @@ class GaudiMixtralSparseMoeBlock(torch.nn.Module):
             self.experts_max = self.num_experts - 1
             self.experts_range = range(self.experts_min, self.experts_max + 1)
 
+        # Send every token only to the ranks owning its experts instead of all-reducing the outputs of all tokens
+        self.expert_dispatcher = None
+        if self.ep_size > 1 and getattr(config, "ep_dispatch", "all_reduce") == "all_to_all":
+            self.expert_dispatcher = AllToAllExpertDispatcher(
+                self.num_experts,
+                capacity_factor=getattr(config, "moe_capacity_factor", 2.0),
+                num_replicas_per_rank=getattr(config, "moe_num_replicas_per_rank", 0),
+                expert_template=self.experts[self.experts_min],
+            )
+        # Number of tokens routed to every expert, set by `enable_expert_load_stats`
+        self.expert_load_stats = None
+
         # Jitter parameters
         self.jitter_noise = config.router_jitter_noise
 
@@ -226,6 +240,14 @@ class GaudiMixtralSparseMoeBlock(torch.nn.Module):
         router_logits = self.gate(hidden_states)
 
         routing_weights, selected_experts = calculate_routing_tensors(router_logits, self.top_k, hidden_states.dtype)
+        if self.expert_load_stats is not None:
+            self.expert_load_stats.update(selected_experts)
+
+        if self.expert_dispatcher is not None and not self.training:
+            final_hidden_states = self.expert_dispatcher(
+                hidden_states, selected_experts, routing_weights, [self.experts[i] for i in self.experts_range]
+            )
+            return final_hidden_states.view(original_shape), router_logits
 
         final_hidden_states = self.call_dynamic_moe_op(hidden_states, selected_experts, routing_weights)
 
@@ -484,9 +506,6 @@ class GaudiMixtralDecoderLayer(MixtralDecoderLayer):
         super().__init__(config, layer_idx)
         self.self_attn = GaudiMixtralAttention(config, layer_idx)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -544,11 +563,7 @@ class GaudiMixtralDecoderLayer(MixtralDecoderLayer):
         return outputs
 
 
-class GaudiMixtralModel(MixtralModel):
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
+class GaudiMixtralModel(GaudiKVCacheMixin, MixtralModel):
     def forward(
         self,
         input_ids: Optional[torch.LongTensor] = None,
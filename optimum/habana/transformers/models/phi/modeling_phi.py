@@ -35,6 +35,7 @@ from transformers.models.phi.modeling_phi import (
 from transformers.processing_utils import Unpack
 from transformers.utils import TransformersKwargs, logging
 
+from ...cache_utils import GaudiKVCacheMixin
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
 )
@@ -249,9 +250,6 @@ class GaudiPhiDecoderLayer(torch.nn.Module):
         self.input_layernorm = torch.nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.resid_dropout = torch.nn.Dropout(config.resid_pdrop)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -308,11 +306,7 @@ class GaudiPhiDecoderLayer(torch.nn.Module):
         return outputs
 
 
-class GaudiPhiModel(PhiModel):
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
+class GaudiPhiModel(GaudiKVCacheMixin, PhiModel):
     def forward(
         self,
         input_ids: Optional[torch.LongTensor] = None,
@@ -44,6 +44,8 @@ from transformers.models.qwen2_moe.modeling_qwen2_moe import (
 from transformers.utils import logging
 
 from ....utils import warn0
+from ...cache_utils import GaudiKVCacheMixin
+from ...cache_utils import KVCache as GaudiKVCache
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
 )
@@ -178,22 +180,7 @@ class Matmul(torch.nn.Module):
         return torch.matmul(x, y)
 
 
-class KVCache(torch.nn.Module):
-    def __init__(self):
-        super(KVCache, self).__init__()
-        self.cache = None
-        self.inp_seq_len = -1
-
-    def allocate(self, inp_seq_len, dtype, device, shape):
-        if self.cache is None or self.cache.shape != shape:
-            self.inp_seq_len = inp_seq_len
-            self.cache = torch.zeros(shape, dtype=dtype, device=device)
-        else:
-            assert self.inp_seq_len == inp_seq_len, (
-                f"inp_seq_len must be the same. self.inp_seq_len:{self.inp_seq_len} inp_seq_len:{inp_seq_len}"
-            )
-            self.cache.fill_(0)
-
+class KVCache(GaudiKVCache):
     @staticmethod
     def update(prev, cur, dim, idx, inp_seq_len):
         orig_cur = cur
@@ -210,14 +197,6 @@ class KVCache(torch.nn.Module):
         else:
             return torch.cat((prev, cur), dim=dim)
 
-    def get_shape(self):
-        if self.cache is None:
-            return None
-        return self.cache.shape
-
-    def forward(self, cur, dim, idx):
-        return self.update(self.cache, cur, dim, idx, self.inp_seq_len)
-
 
 #  FusedScaledDotProductAttention
 class ModuleFusedSDPA(torch.nn.Module):
@@ -300,20 +279,6 @@ class GaudiQwen2MoeAttention(Qwen2MoeAttention):
             self.max_position_embeddings = seq_len
             _, _ = self.rotary_emb(self.k_proj.weight, seq_len=seq_len)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def pre_attn_forward(
         self,
         hidden_states: torch.Tensor,
@@ -606,12 +571,6 @@ class GaudiQwen2MoeDecoderLayer(Qwen2MoeDecoderLayer):
         self.input_layernorm = Qwen2MoeRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
         self.post_attention_layernorm = Qwen2MoeRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -767,7 +726,7 @@ class GaudiQwen2MoeDecoderLayer(Qwen2MoeDecoderLayer):
         return hidden_states
 
 
-class GaudiQwen2MoeModel(Qwen2MoeModel):
+class GaudiQwen2MoeModel(GaudiKVCacheMixin, Qwen2MoeModel):
     def __init__(self, config: Qwen2MoeConfig):
         super(Qwen2MoeModel, self).__init__(config)
         self.padding_idx = config.pad_token_id
@@ -783,13 +742,6 @@ class GaudiQwen2MoeModel(Qwen2MoeModel):
         # Initialize weights and apply final processing
         self.post_init()
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
-
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
             layer.update_sincos_cache(seq_len)
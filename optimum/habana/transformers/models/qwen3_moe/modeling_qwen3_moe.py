@@ -53,6 +53,7 @@ from transformers.utils import logging
 
 from ....distributed import parallel_state
 from ....utils import warn0
+from ...cache_utils import GaudiKVCacheMixin
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
 )
@@ -367,20 +368,6 @@ class GaudiQwen3MoeAttention(Qwen3MoeAttention):
             self.max_position_embeddings = seq_len
             _, _ = self.rotary_emb(self.get_k_proj_weight(), seq_len=seq_len)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def pre_attn_forward(
         self,
         hidden_states: torch.Tensor,
@@ -674,12 +661,6 @@ class GaudiQwen3MoeDecoderLayer(Qwen3MoeDecoderLayer):
         self.input_layernorm = Qwen3MoeRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
         self.post_attention_layernorm = Qwen3MoeRMSNorm(config.hidden_size, eps=config.rms_norm_eps)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -819,7 +800,7 @@ class GaudiQwen3MoeDecoderLayer(Qwen3MoeDecoderLayer):
         return hidden_states
 
 
-class GaudiQwen3MoeModel(Qwen3MoeModel):
+class GaudiQwen3MoeModel(GaudiKVCacheMixin, Qwen3MoeModel):
     def __init__(self, config: Qwen3MoeConfig):
         super(Qwen3MoeModel, self).__init__(config)
         self.padding_idx = config.pad_token_id
@@ -835,13 +816,6 @@ class GaudiQwen3MoeModel(Qwen3MoeModel):
         # Initialize weights and apply final processing
         self.post_init()
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
-
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
             layer.update_sincos_cache(seq_len)
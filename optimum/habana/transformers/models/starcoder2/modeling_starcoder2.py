@@ -37,6 +37,7 @@ from transformers.models.starcoder2.modeling_starcoder2 import (
 from transformers.processing_utils import Unpack
 from transformers.utils import TransformersKwargs, logging
 
+from ...cache_utils import GaudiKVCacheMixin
 from ...modeling_attn_mask_utils import (
     _gaudi_prepare_4d_causal_attention_mask,
 )
@@ -167,20 +168,6 @@ class GaudiStarcoder2Attention(Starcoder2Attention):
             self.max_position_embeddings = seq_len
             _, _ = self.rotary_emb(self.k_proj.weight, seq_len=seq_len)
 
-    def reorder(self, tensor, beam_idx, dim_a, dim_b):
-        updated = tensor.index_select(0, beam_idx)
-        tensor.copy_(updated)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        if self.k_cache.cache is None:
-            return (None, None)
-
-        head_dim = self.k_cache.cache.size(-1)
-        seq_length = self.k_cache.cache.size(-2)
-        self.reorder(self.k_cache.cache, beam_idx, seq_length, head_dim)
-        self.reorder(self.v_cache.cache, beam_idx, seq_length, head_dim)
-        return (self.k_cache.cache.shape, self.v_cache.cache.shape)
-
     def gaudi_flash_attn_v1(self, query_layer, key_layer, value_layer, attention_mask, dropout_rate, q_block_size):
         """
         Gaudi version of Flash Attention V1 to support long sequence at prompt phase
@@ -356,12 +343,6 @@ class GaudiStarcoder2DecoderLayer(Starcoder2DecoderLayer):
         self.input_layernorm = torch.nn.LayerNorm(config.hidden_size, eps=config.norm_epsilon)
         self.post_attention_layernorm = torch.nn.LayerNorm(config.hidden_size, eps=config.norm_epsilon)
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        self.self_attn.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return self.self_attn.reorder_kv_cache(beam_idx)
-
     def update_sincos_cache(self, seq_len):
         self.self_attn.update_sincos_cache(seq_len)
 
@@ -477,7 +458,7 @@ class GaudiStarcoder2DecoderLayer(Starcoder2DecoderLayer):
         return hidden_states
 
 
-class GaudiStarcoder2Model(Starcoder2Model):
+class GaudiStarcoder2Model(GaudiKVCacheMixin, Starcoder2Model):
     def __init__(self, config: Starcoder2Config):
         super(Starcoder2Model, self).__init__(config)
         self.padding_idx = config.pad_token_id
@@ -493,12 +474,12 @@ class GaudiStarcoder2Model(Starcoder2Model):
         # Initialize weights and apply final processing
         self.post_init()
 
-    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
-        for layer in self.layers:
-            layer.allocate_kv_cache(batch_size, max_seq_len, inp_seq_len)
-
-    def reorder_kv_cache(self, beam_idx: torch.LongTensor):
-        return tuple(layer.reorder_kv_cache(beam_idx) for layer in self.layers)
+    def enable_sliding_window_kv_cache(self, window: Optional[int], num_sink_tokens: int = 0):
+        """
+        Replaces the KV caches of every layer with `SlidingWindowKVCache`s keeping the first `num_sink_tokens` tokens
+        and the last `window` ones, or restores the regular caches if `window` is `None`. Requires `reuse_cache`.
+        """
+        self.kv_cache_manager.enable_sliding_window(window, num_sink_tokens)
 
     def update_sincos_cache(self, seq_len):
         for layer in self.layers:
@@ -552,12 +533,18 @@ class GaudiStarcoder2Model(Starcoder2Model):
             position_ids = position_ids.unsqueeze(0)
         cache_position = None
 
+        if reuse_cache and seq_length > 1:
+            # The attention sinks of a sliding window KV cache start after the left padding
+            self.kv_cache_manager.set_sink_offsets(attention_mask, batch_size)
+
         # HPU specific mask generation
         attention_mask = _gaudi_prepare_4d_causal_attention_mask(
             attention_mask,
             input_ids.shape if input_ids is not None else (batch_size, seq_length),
             inputs_embeds,
             past_seen_tokens,
+            kv_cache_window=self.kv_cache_manager.sliding_window_layout if reuse_cache else None,
+            token_idx=token_idx,
         )
 
         hidden_states = inputs_embeds
@@ -623,6 +610,13 @@ class GaudiStarcoder2ForCausalLM(Starcoder2ForCausalLM):
     def reorder_kv_cache(self, beam_idx: torch.LongTensor):
         return self.model.reorder_kv_cache(beam_idx)
 
+    def enable_sliding_window_kv_cache(self, window: Optional[int], num_sink_tokens: int = 0):
+        self.model.enable_sliding_window_kv_cache(window, num_sink_tokens)
+
+    @property
+    def kv_cache_sliding_window(self):
+        return self.model.kv_cache_sliding_window
+
     def update_sincos_cache(self, seq_len):
         self.model.update_sincos_cache(seq_len)
 
@@ -88,6 +88,7 @@ from transformers.trainer_utils import (
     find_executable_batch_size,
     get_last_checkpoint,
     has_length,
+    seed_worker,
 )
 from transformers.training_args import OptimizerNames, ParallelMode, TrainingArguments
 from transformers.utils import (
@@ -109,6 +110,7 @@ from transformers.utils.deprecation import deprecate_kwarg
 from transformers.utils.import_utils import check_torch_load_is_safe
 
 from ..accelerate import GaudiAccelerator
+from ..accelerate.data_loader import DevicePrefetchDataLoader
 from ..accelerate.utils import FP8ContextWrapper
 from ..utils import (
     HabanaGenerationTime,
@@ -121,7 +123,8 @@ from ..utils import (
 )
 from .gaudi_configuration import GAUDI_CONFIG_NAME, GaudiConfig
 from .integrations.deepspeed import deepspeed_init
-from .trainer_utils import convert_into_dtypes, get_dtype
+from .trainer_pt_utils import BucketedBatchSampler, BucketedDataCollator, get_length_buckets
+from .trainer_utils import AsyncCheckpointWriter, convert_into_dtypes, get_dtype
 from .training_args import GaudiTrainingArguments
 
 
@@ -323,6 +326,10 @@ class GaudiTrainer(Trainer):
                 raise error
             self.hpu_random = hpu_random
 
+        if args.async_save and (getattr(self.model, "_tp_size", None) or 0) > 1:
+            raise ValueError("`async_save` is not supported with tensor parallelism.")
+        self.checkpoint_writer = AsyncCheckpointWriter() if args.async_save else None
+
         # Set the correct log level depending on the node
         # Already done in super().init() but we have to do it again
         # because we use optimum.utils.logging here and not
@@ -393,6 +400,75 @@ class GaudiTrainer(Trainer):
                 )
             return RandomSampler(train_dataset, num_samples=num_samples)
 
+    def get_train_dataloader(self) -> DataLoader:
+        """
+        Same as `Trainer.get_train_dataloader`, except that the batches are grouped by length and padded to one of
+        `args.num_length_buckets` sequence lengths if it is set.
+        """
+        if (
+            not self.args.num_length_buckets
+            or self.train_dataset is None
+            or isinstance(self.train_dataset, IterableDataset)
+            or not has_length(self.train_dataset)
+        ):
+            return super().get_train_dataloader()
+
+        train_dataset = self.train_dataset
+        processing_class = self.processing_class
+        if isinstance(processing_class, ProcessorMixin):
+            processing_class = getattr(processing_class, "tokenizer", processing_class)
+        model_input_name = (
+            processing_class.model_input_names[0]
+            if getattr(processing_class, "model_input_names", None)
+            else "input_ids"
+        )
+
+        # The lengths are computed before the unused columns are removed since they may include the length column
+        if (
+            is_datasets_available()
+            and isinstance(train_dataset, datasets.Dataset)
+            and self.args.length_column_name in train_dataset.column_names
+        ):
+            lengths = list(train_dataset[self.args.length_column_name])
+        else:
+            lengths = [len(sample[model_input_name]) for sample in train_dataset]
+        buckets = get_length_buckets(lengths, self.args.num_length_buckets)
+        logger.info(f"Training batches are padded to one of the following sequence lengths: {buckets}")
+
+        data_collator = self.data_collator
+        if is_datasets_available() and isinstance(train_dataset, datasets.Dataset):
+            train_dataset = self._remove_unused_columns(train_dataset, description="Training")
+        else:
+            data_collator = self._get_collator_with_removed_columns(data_collator, description="Training")
+        data_collator = BucketedDataCollator(
+            data_collator,
+            buckets,
+            pad_token_id=getattr(processing_class, "pad_token_id", None),
+            padding_side=getattr(processing_class, "padding_side", "right"),
+            input_name=model_input_name,
+        )
+
+        batch_sampler = BucketedBatchSampler(
+            lengths,
+            buckets,
+            self._train_batch_size,
+            drop_last=self.args.dataloader_drop_last,
+            seed=self.args.data_seed if self.args.data_seed is not None else self.args.seed,
+        )
+        dataloader_params = {
+            "batch_sampler": batch_sampler,
+            "collate_fn": data_collator,
+            "num_workers": self.args.dataloader_num_workers,
+            "pin_memory": self.args.dataloader_pin_memory,
+            "persistent_workers": self.args.dataloader_persistent_workers,
+            "prefetch_factor": self.args.dataloader_prefetch_factor,
+            "worker_init_fn": functools.partial(
+                seed_worker, num_workers=self.args.dataloader_num_workers, rank=self.args.process_index
+            ),
+        }
+
+        return self.accelerator.prepare(DataLoader(train_dataset, **dataloader_params))
+
     def create_optimizer(self):
         """
         Setup the optimizer.
@@ -886,6 +962,7 @@ class GaudiTrainer(Trainer):
 
         # In multi-worker training: broadcast model parameters from worker:0 to all the others.
         # This must be done manually unless DistributedDataParallel is used.
+        fast_ddp_reducer = None
         if self.args.parallel_mode == ParallelMode.DISTRIBUTED and self.args.distribution_strategy == "fast_ddp":
             from ..distributed import all_reduce_gradients
 
@@ -895,6 +972,15 @@ class GaudiTrainer(Trainer):
             for param in model.parameters():
                 torch.distributed.broadcast(param.data, src=0)
 
+            if args.fast_ddp_bucket_cap_mb is not None:
+                from ..distributed import setup_bucketed_all_reduce
+
+                fast_ddp_reducer = setup_bucketed_all_reduce(
+                    model,
+                    bucket_cap_mb=args.fast_ddp_bucket_cap_mb,
+                    fp32_accumulation=args.fast_ddp_fp32_accumulation,
+                )
+
         # Update the references
         for attr in ("model", "optimizer", "lr_scheduler"):
             setattr(self.callback_handler, attr, getattr(self, attr))
@@ -967,7 +1053,10 @@ class GaudiTrainer(Trainer):
             rng_to_sync = False
             steps_skipped = 0
             if steps_trained_in_current_epoch > 0:
-                epoch_dataloader = skip_first_batches(epoch_dataloader, steps_trained_in_current_epoch)
+                if isinstance(epoch_dataloader, DevicePrefetchDataLoader):
+                    epoch_dataloader = epoch_dataloader.skip_first_batches(steps_trained_in_current_epoch)
+                else:
+                    epoch_dataloader = skip_first_batches(epoch_dataloader, steps_trained_in_current_epoch)
                 steps_skipped = steps_trained_in_current_epoch
                 steps_trained_in_current_epoch = 0
                 rng_to_sync = True
@@ -1051,6 +1140,9 @@ class GaudiTrainer(Trainer):
                         and self.accelerator.distributed_type != DistributedType.DEEPSPEED
                         else contextlib.nullcontext
                     )
+                    if fast_ddp_reducer is not None:
+                        # Gradients are only all-reduced in the backward pass of the last accumulation step
+                        fast_ddp_reducer.require_backward_grad_sync = do_sync_step
                     with context():
                         tr_loss_step = self.training_step(model, inputs, num_items_in_batch)
 
@@ -1173,6 +1265,8 @@ class GaudiTrainer(Trainer):
             delattr(self, "_past")
 
         logger.info("\n\nTraining completed. Do not forget to share your model on huggingface.co/models =)\n\n")
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.shutdown()
         if args.load_best_model_at_end and self.state.best_model_checkpoint is not None:
             # Wait for everyone to get here so we are sure the model has been saved by process 0.
             if args.parallel_mode == ParallelMode.DISTRIBUTED:
@@ -1337,6 +1431,10 @@ class GaudiTrainer(Trainer):
         if self.args.adjust_throughput:
             timer.step()
 
+        if self.checkpoint_writer is not None:
+            # Rotate the checkpoints on the main thread once a checkpoint written in the background is complete
+            self.checkpoint_writer.poll()
+
         if self.control.should_log and self.state.global_step > self._globalstep_last_logged:
             logs: dict[str, float] = {}
 
@@ -1408,6 +1506,9 @@ class GaudiTrainer(Trainer):
 
         run_dir = self._get_output_dir(trial=trial)
         output_dir = os.path.join(run_dir, checkpoint_folder)
+        if self.checkpoint_writer is not None:
+            self._save_checkpoint_async(run_dir, output_dir)
+            return
         self.save_model(output_dir, _internal_call=True)
 
         # NOTE(pbielak): In a multi-card scenario, the model saving is done by the main process (rank zero),
@@ -1453,6 +1554,63 @@ class GaudiTrainer(Trainer):
             # mtime is not reliable especially on some fuse fs in cloud environments.
             self._rotate_checkpoints(use_mtime=False, output_dir=run_dir)
 
+    def _save_checkpoint_async(self, run_dir, output_dir):
+        """
+        Same as `_save_checkpoint` but the model, optimizer, scheduler and trainer states are copied to host memory and
+        written by `self.checkpoint_writer` in the background. Training only blocks if the previous checkpoint is still
+        being written. Only the main process writes, as with `save_model` without DeepSpeed or FSDP.
+        """
+        staging_dir = AsyncCheckpointWriter.staging_dir(output_dir)
+
+        # The best checkpoint may be the one being written
+        if self.args.save_strategy in [SaveStrategy.STEPS, SaveStrategy.EPOCH] and self.state.best_global_step:
+            best_checkpoint_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}")
+            if best_checkpoint_dir == output_dir or os.path.exists(best_checkpoint_dir):
+                self.state.best_model_checkpoint = best_checkpoint_dir
+
+        if self.args.should_save:
+            if self.checkpoint_writer.is_writing:
+                logger.warning(f"Waiting for the previous checkpoint to be written before saving {output_dir}.")
+            model_state = self.checkpoint_writer.snapshot(self.model.state_dict(), "model")
+            if not self.args.save_only_model:
+                optimizer_state = self.checkpoint_writer.snapshot(self.optimizer.state_dict(), "optimizer")
+                scheduler_state = copy.deepcopy(self.lr_scheduler.state_dict())
+            for cb in [
+                cb for cb in self.callback_handler.callbacks + [self.control] if isinstance(cb, ExportableState)
+            ]:
+                cb_name = cb.__class__.__name__
+                cb_state = cb.state()
+                if isinstance(self.state.stateful_callbacks[cb_name], list):
+                    self.state.stateful_callbacks[cb_name].append(cb_state)
+                else:
+                    self.state.stateful_callbacks[cb_name] = cb_state
+            trainer_state = copy.deepcopy(self.state)
+
+        if not self.args.save_only_model:
+            # RNG states are small and saved by every process, the staging directory is renamed once they are all written
+            self._save_rng_state(staging_dir)
+            if self.args.should_save:
+                self._save_scaler(staging_dir)
+        if self.args.parallel_mode == ParallelMode.DISTRIBUTED:
+            torch.distributed.barrier()
+
+        if not self.args.should_save:
+            return
+
+        def write(staging_dir):
+            self._save(staging_dir, state_dict=model_state)
+            if not self.args.save_only_model:
+                torch.save(optimizer_state, os.path.join(staging_dir, OPTIMIZER_NAME))
+                with warnings.catch_warnings(record=True) as caught_warnings:
+                    torch.save(scheduler_state, os.path.join(staging_dir, SCHEDULER_NAME))
+                reissue_pt_warnings(caught_warnings)
+            trainer_state.save_to_json(os.path.join(staging_dir, TRAINER_STATE_NAME))
+
+        # Older checkpoints are only deleted once the new one is complete, from the main thread
+        self.checkpoint_writer.submit(
+            write, output_dir, on_done=lambda: self._rotate_checkpoints(use_mtime=False, output_dir=run_dir)
+        )
+
     def _load_rng_state(self, checkpoint):
         # Load RNG states from `checkpoint`
         if checkpoint is None:
@@ -1645,6 +1803,9 @@ class GaudiTrainer(Trainer):
 
         mem_stats = get_hpu_memory_stats(self.args.device)
         logs.update(mem_stats)
+        if self.args.dataloader_prefetch_batches > 0:
+            # Time the steps waited for batches since the previous log
+            logs["data_wait_time"] = round(self.accelerator.pop_data_wait_time(), 4)
 
         output = {**logs, **{"step": self.state.global_step}}
         self.state.log_history.append(output)
@@ -1654,6 +1815,7 @@ class GaudiTrainer(Trainer):
         """
         Prepares one `data` before feeding it to the model, be it a tensor or a nested list/dictionary of tensors.
         Compared to Transformers, it is also possible to enable non-blocking data copy.
+        The tensors of the batches of a `DevicePrefetchDataLoader` are already sliced for sequence parallelism.
         """
         if isinstance(data, Mapping):
             return type(data)({k: self._prepare_input(v) for k, v in data.items()})
@@ -1663,6 +1825,7 @@ class GaudiTrainer(Trainer):
             if (
                 self.accelerator.mpu.sequence_parallel_is_initialized()
                 and self.accelerator.mpu.get_sequence_parallel_world_size() > 1
+                and not getattr(data, "is_sequence_parallel_slice", False)
             ):
                 seq_parallel_world_rank = self.accelerator.mpu.get_sequence_parallel_rank()
                 sub_seq_length = int(data.size()[1] / self.accelerator.mpu.get_sequence_parallel_world_size())
@@ -1791,6 +1954,10 @@ class GaudiTrainer(Trainer):
         if output_dir is None:
             output_dir = self.args.output_dir
 
+        if self.checkpoint_writer is not None:
+            # A checkpoint written in the background could be moved to `output_dir` after this save
+            self.checkpoint_writer.shutdown()
+
         # We are in N-D parallelism if we have parallelism_config set, so we check accelerate if we're on a to_save rank
         if getattr(self.accelerator, "parallelism_config", None) is not None:
             if self.accelerator.should_save_model:
@@ -2665,7 +2832,10 @@ class GaudiTrainer(Trainer):
             logger.warning(
                 "`non_blocking` is enabled but `dataloader_pin_memory` is not. For the best performance, it's recommended to enable both."
             )
-        dataloader_config.non_blocking = non_blocking
+        # Prefetched batches are copied by the data loader instead of `_prepare_input`
+        dataloader_config.non_blocking = non_blocking or (
+            self.args.dataloader_prefetch_batches > 0 and self.args.non_blocking_data_copy
+        )
         # this would have been updated above, no need for it anymore
         accelerator_config.pop("gradient_accumulation_kwargs")
 
@@ -2675,6 +2845,7 @@ class GaudiTrainer(Trainer):
             # OH specific
             "distribution_strategy": self.args.distribution_strategy,
             "compiled_autograd_enabled": self.args.use_compiled_autograd,
+            "dataloader_prefetch_batches": self.args.dataloader_prefetch_batches,
         }
         # tp is initialized at Accelerator init phase so
         # args should be prepared here
@@ -0,0 +1,160 @@
+# coding=utf-8
+# Copyright 2025 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+def get_length_buckets(lengths: Sequence[int], num_buckets: int) -> List[int]:
+    """
+    Splits the sequence lengths of a dataset into at most `num_buckets` buckets holding the same number of samples,
+    and returns the maximum length of every bucket in increasing order. The last one is the maximum length.
+    """
+    if num_buckets < 1:
+        raise ValueError(f"`num_buckets` must be strictly positive but is {num_buckets}.")
+    quantiles = np.percentile(lengths, np.linspace(0, 100, num_buckets + 1)[1:], method="higher")
+    return sorted({int(length) for length in quantiles})
+
+
+class BucketedBatchSampler(Sampler[List[int]]):
+    """
+    Batch sampler grouping samples of similar lengths: every sample is assigned to the smallest bucket that fits it
+    and every batch only holds samples of the same bucket. Combined with `BucketedDataCollator`, all the batches have
+    one of `len(buckets)` shapes.
+
+    The samples of every bucket are shuffled, split into batches of `batch_size` samples, and the batches of all the
+    buckets are shuffled. The last batch of a bucket is completed with samples of the same bucket, unless `drop_last`
+    is set. The order only depends on `seed` and on the epoch, so that it is the same on all processes.
+
+    Args:
+        lengths (`Sequence[int]`):
+            The length of every sample of the dataset.
+        buckets (`Sequence[int]`):
+            The maximum lengths of the buckets in increasing order, see `get_length_buckets`. Samples longer than the
+            last one go to the last bucket.
+        batch_size (`int`):
+            The number of samples per batch.
+        drop_last (`bool`, *optional*, defaults to `False`):
+            Whether to drop the last incomplete batch of every bucket.
+        seed (`int`, *optional*, defaults to 0):
+            The seed of the shuffling.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        buckets: Sequence[int],
+        batch_size: int,
+        drop_last: bool = False,
+        seed: int = 0,
+    ):
+        self.buckets = list(buckets)
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.bucket_indices = [[] for _ in self.buckets]
+        for index, length in enumerate(lengths):
+            bucket = min(bisect.bisect_left(self.buckets, length), len(self.buckets) - 1)
+            self.bucket_indices[bucket].append(index)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return sum(len(indices) // self.batch_size for indices in self.bucket_indices)
+        return sum(-(-len(indices) // self.batch_size) for indices in self.bucket_indices)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        # Processes that do not call `set_epoch` get a new order at every iteration too
+        self.epoch += 1
+
+        batches = []
+        for indices in self.bucket_indices:
+            if not indices:
+                continue
+            indices = torch.tensor(indices)[torch.randperm(len(indices), generator=generator)].tolist()
+            remainder = len(indices) % self.batch_size
+            if remainder and self.drop_last:
+                indices = indices[:-remainder]
+            elif remainder:
+                # Repeat samples of the bucket to keep the batch size static
+                num_missing = self.batch_size - remainder
+                indices += (indices * (num_missing // len(indices) + 1))[:num_missing]
+            batches += [indices[i : i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+
+        for i in torch.randperm(len(batches), generator=generator).tolist():
+            yield batches[i]
+
+
+class BucketedDataCollator:
+    """
+    Pads the batches of `data_collator` along the sequence dimension to the smallest of `buckets` that fits them, so
+    that their shapes are known in advance. Tensors with at least two dimensions whose second one is the sequence length
+    of `input_name` are padded, the labels with -100, the inputs with `pad_token_id` and the others with 0.
+
+    Args:
+        data_collator (`Callable`):
+            The collator batching the samples.
+        buckets (`Sequence[int]`):
+            The sequence lengths of the batches in increasing order. Longer batches are not padded.
+        pad_token_id (`int`, *optional*, defaults to 0):
+            The padding value of `input_name`.
+        padding_side (`str`, *optional*, defaults to `"right"`):
+            Whether to pad on the `"right"` or on the `"left"`.
+        input_name (`str`, *optional*, defaults to `"input_ids"`):
+            The input whose sequence length is bucketed.
+    """
+
+    def __init__(
+        self,
+        data_collator: Callable[[List[Any]], Dict[str, Any]],
+        buckets: Sequence[int],
+        pad_token_id: Optional[int] = 0,
+        padding_side: str = "right",
+        input_name: str = "input_ids",
+    ):
+        if padding_side not in ("right", "left"):
+            raise ValueError(f"`padding_side` must be 'right' or 'left' but is {padding_side}.")
+        self.data_collator = data_collator
+        self.buckets = list(buckets)
+        self.pad_values = {input_name: pad_token_id or 0, "labels": -100}
+        self.padding_side = padding_side
+        self.input_name = input_name
+
+    def __call__(self, features: List[Any]) -> Dict[str, Any]:
+        batch = self.data_collator(features)
+        if not isinstance(batch, Mapping) or self.input_name not in batch:
+            return batch
+
+        sequence_length = batch[self.input_name].shape[1]
+        bucket = bisect.bisect_left(self.buckets, sequence_length)
+        if bucket == len(self.buckets) or self.buckets[bucket] == sequence_length:
+            return batch
+
+        pad = self.buckets[bucket] - sequence_length
+        for name, value in batch.items():
+            if isinstance(value, torch.Tensor) and value.dim() >= 2 and value.shape[1] == sequence_length:
+                padding = [0, 0] * (value.dim() - 2) + ([0, pad] if self.padding_side == "right" else [pad, 0])
+                batch[name] = torch.nn.functional.pad(value, padding, value=self.pad_values.get(name, 0))
+        return batch
@@ -13,7 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Tuple, Union
+import copy
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -72,3 +76,111 @@ def convert_into_dtypes(
         return tuple(convert_into_dtypes(preds_tensor, dtype) for preds_tensor in preds)
     else:
         raise TypeError(f"preds should be of type np.ndarray or tuple, got {type(preds)} which is not supported")
+
+
+class AsyncCheckpointWriter:
+    """
+    Writes checkpoints from a background thread so that training goes on while they are serialized.
+
+    The state to save is first copied to host memory with `snapshot`, pinned if possible, then `submit` writes it to a
+    staging directory that is renamed to the checkpoint directory once complete, so that an interrupted write never
+    leaves a partial checkpoint behind. Only one checkpoint is written at a time: `snapshot` waits for the previous
+    one, whose host buffers are reused. `shutdown` must be called before writing to the checkpoints from elsewhere.
+    """
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._future: Optional[Future] = None
+        self._on_done: Optional[Callable[[], None]] = None
+        self._buffers: Dict[str, torch.Tensor] = {}
+        self._pin_memory = True
+
+    def _host_buffer(self, key: str, tensor: torch.Tensor) -> torch.Tensor:
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+            try:
+                buffer = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=self._pin_memory)
+            except RuntimeError:
+                # No accelerator to pin memory for
+                self._pin_memory = False
+                buffer = torch.empty(tensor.shape, dtype=tensor.dtype)
+            self._buffers[key] = buffer
+        return buffer
+
+    def snapshot(self, obj: Any, name: str) -> Any:
+        """
+        Returns a copy of `obj`, nested dicts, lists and tuples included, whose tensors are in host memory. The copy is
+        not affected by later updates of `obj`. Tensors sharing memory, like tied weights, still do in the copy. `name`
+        identifies the host buffers of `obj` across checkpoints.
+        """
+        self.wait()
+        return self._snapshot(obj, name, {})
+
+    def _snapshot(self, obj: Any, key: str, copies: Dict[Tuple, torch.Tensor]) -> Any:
+        if isinstance(obj, torch.Tensor):
+            alias = (obj.data_ptr(), obj.shape, obj.stride(), obj.dtype)
+            if alias not in copies:
+                copies[alias] = self._host_buffer(key, obj).copy_(obj.detach())
+            return copies[alias]
+        if isinstance(obj, dict):
+            return type(obj)((k, self._snapshot(v, f"{key}/{k}", copies)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v, f"{key}/{i}", copies) for i, v in enumerate(obj))
+        return copy.deepcopy(obj)
+
+    def submit(self, write_fn: Callable[[str], None], output_dir: str, on_done: Optional[Callable[[], None]] = None):
+        """
+        Calls `write_fn(staging_dir)` in the background, then renames `staging_dir` to `output_dir`. The staging
+        directory is `output_dir` prefixed with `tmp-`, it may already contain files. `on_done` is called once the
+        checkpoint is written, from the thread calling `poll`, `wait` or `shutdown` rather than from the background one.
+        """
+        self.wait()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._future = self._executor.submit(self._write, write_fn, output_dir)
+        self._on_done = on_done
+
+    @staticmethod
+    def staging_dir(output_dir: str) -> str:
+        return os.path.join(os.path.dirname(output_dir), f"tmp-{os.path.basename(output_dir)}")
+
+    def _write(self, write_fn: Callable[[str], None], output_dir: str):
+        staging_dir = self.staging_dir(output_dir)
+        os.makedirs(staging_dir, exist_ok=True)
+        write_fn(staging_dir)
+        if os.path.exists(output_dir):
+            # Move the previous checkpoint aside and only delete it once the new one is in place, so that a complete
+            # checkpoint exists whenever the write is interrupted
+            old_dir = os.path.join(os.path.dirname(output_dir), f"old-{os.path.basename(output_dir)}")
+            if os.path.exists(old_dir):
+                shutil.rmtree(old_dir)
+            os.replace(output_dir, old_dir)
+            os.replace(staging_dir, output_dir)
+            shutil.rmtree(old_dir)
+        else:
+            os.replace(staging_dir, output_dir)
+
+    @property
+    def is_writing(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def poll(self):
+        """Calls the `on_done` of the checkpoint being written if it is complete, without blocking."""
+        if self._future is not None and self._future.done():
+            self.wait()
+
+    def wait(self):
+        """Waits for the checkpoint being written, raises the error of the write if any, then calls its `on_done`."""
+        if self._future is not None:
+            future, self._future = self._future, None
+            on_done, self._on_done = self._on_done, None
+            future.result()
+            if on_done is not None:
+                on_done()
+
+    def shutdown(self):
+        """Waits for the checkpoint being written and stops the background thread, which `submit` starts again."""
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -121,6 +121,11 @@ class GaudiTrainingArguments(TrainingArguments):
             Maximum number of hpu graphs to be cached. Reduce to save device memory.
         distribution_strategy (`str`, *optional*, defaults to `ddp`):
             Determines how data parallel distributed training is achieved. May be: `ddp` or `fast_ddp`.
+        fast_ddp_bucket_cap_mb (`float`, *optional*):
+            If set with `fast_ddp`, the gradients are all-reduced in buckets of at most this size in megabytes, launched
+            asynchronously during the backward pass instead of all at once after it.
+        fast_ddp_fp32_accumulation (`bool`, *optional*, defaults to `False`):
+            Whether the bucketed all-reduce of `fast_ddp` accumulates the gradients and communicates in float32.
         throughput_warmup_steps (`int`, *optional*, defaults to 0):
             Number of steps to ignore for throughput calculation. For example, with `throughput_warmup_steps=N`,
             the first N steps will not be considered in the calculation of the throughput. This is especially
@@ -132,6 +137,13 @@ class GaudiTrainingArguments(TrainingArguments):
             host backward building and HPU forward computing.
         non_blocking_data_copy (`bool`, *optional*, defaults to `False`):
             Whether to enable async data copy when preparing inputs.
+        dataloader_prefetch_batches (`int`, *optional*, defaults to 0):
+            Number of batches the data loaders send to the device ahead of the current step, so that the copies
+            overlap with the computation. The time the steps waited for data is logged as `data_wait_time`.
+        num_length_buckets (`int`, *optional*, defaults to 0):
+            If strictly positive, the training samples are grouped in batches of similar lengths that are padded to one
+            of at most `num_length_buckets` sequence lengths computed from the training dataset, so that the number
+            of compiled graphs stays bounded. Not compatible with `group_by_length`.
         profiling_warmup_steps (`int`, *optional*, defaults to 0):
             Number of training steps to ignore for profiling.
         profiling_steps (`int`, *optional*, defaults to 0):
@@ -140,6 +152,10 @@ class GaudiTrainingArguments(TrainingArguments):
             Number of eval steps to ignore for profiling.
         profiling_steps_eval (`int`, *optional*, defaults to 0):
             Number of eval steps to be captured when enabling profiling.
+        async_save (`bool`, *optional*, defaults to `False`):
+            Whether to write checkpoints in the background. The states to save are copied to host memory and training
+            only waits for a checkpoint to be written when the next one is saved. Not supported with DeepSpeed, FSDP
+            or `push_to_hub`.
     """
 
     use_habana: Optional[bool] = field(
@@ -244,6 +260,21 @@ class GaudiTrainingArguments(TrainingArguments):
         },
     )
 
+    fast_ddp_bucket_cap_mb: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "If set with `fast_ddp`, the gradients are all-reduced in buckets of at most this size in megabytes, "
+            "launched asynchronously during the backward pass instead of all at once after it."
+        },
+    )
+
+    fast_ddp_fp32_accumulation: bool = field(
+        default=False,
+        metadata={
+            "help": "Whether the bucketed all-reduce of `fast_ddp` accumulates the gradients and communicates in float32."
+        },
+    )
+
     context_parallel_size: Optional[int] = field(
         default=1,
         metadata={"help": ("Determines how many ranks are divided into context parallel group.")},
@@ -292,6 +323,22 @@ class GaudiTrainingArguments(TrainingArguments):
         metadata={"help": ("Whether to enable async data copy when preparing inputs.")},
     )
 
+    dataloader_prefetch_batches: int = field(
+        default=0,
+        metadata={
+            "help": "Number of batches the data loaders send to the device ahead of the current step, so that the "
+            "copies overlap with the computation."
+        },
+    )
+
+    num_length_buckets: int = field(
+        default=0,
+        metadata={
+            "help": "If strictly positive, the training samples are grouped in batches of similar lengths that are "
+            "padded to one of at most this number of sequence lengths computed from the training dataset."
+        },
+    )
+
     profiling_warmup_steps: Optional[int] = field(
         default=0,
         metadata={"help": ("Number of training steps to ignore for profiling.")},
@@ -321,6 +368,14 @@ class GaudiTrainingArguments(TrainingArguments):
         default=False,
         metadata={"help": ("record source information (file and line number) for the ops when enabling profiling.")},
     )
+    async_save: bool = field(
+        default=False,
+        metadata={
+            "help": "Whether to write checkpoints in the background. Training only waits for a checkpoint to be written "
+            "when the next one is saved."
+        },
+    )
+
     # Overriding the default value of optim because 'adamw_hf' is deprecated
     optim: Optional[Union[OptimizerNames, str]] = field(
         default="adamw_torch",
@@ -414,6 +469,18 @@ class GaudiTrainingArguments(TrainingArguments):
                 f"`--distribution_strategy` is {self.distribution_strategy} which is an invalid or unsupported value. Possible choices are: {', '.join(SUPPORTED_DISTRIBUTION_STRATEGIES)}."
             )
 
+        if self.fast_ddp_bucket_cap_mb is not None:
+            if self.distribution_strategy != "fast_ddp":
+                raise ValueError(
+                    "`--fast_ddp_bucket_cap_mb` can only be used with `--distribution_strategy fast_ddp`."
+                )
+            if self.fast_ddp_bucket_cap_mb <= 0:
+                raise ValueError(
+                    f"`--fast_ddp_bucket_cap_mb` must be strictly positive but is {self.fast_ddp_bucket_cap_mb}."
+                )
+        if self.fast_ddp_fp32_accumulation and self.fast_ddp_bucket_cap_mb is None:
+            raise ValueError("`--fast_ddp_fp32_accumulation` requires `--fast_ddp_bucket_cap_mb` to be set.")
+
         if self.disable_tensor_cache_hpu_graphs and not use_hpu_graphs:
             raise ValueError("must be using hpu graphs to set disable_tensor_cache_hpu_graphs.")
 
@@ -436,6 +503,17 @@ class GaudiTrainingArguments(TrainingArguments):
         if self.throughput_warmup_steps < 0:
             raise ValueError("--throughput_warmup_steps must be positive.")
 
+        if self.dataloader_prefetch_batches < 0:
+            raise ValueError("--dataloader_prefetch_batches must be positive.")
+
+        if self.num_length_buckets < 0:
+            raise ValueError("--num_length_buckets must be positive.")
+        if self.num_length_buckets and self.group_by_length:
+            raise ValueError("`--num_length_buckets` cannot be used with `--group_by_length`.")
+
+        if self.async_save and (self.deepspeed or self.fsdp or self.push_to_hub):
+            raise ValueError("`--async_save` cannot be used with `--deepspeed`, `--fsdp` or `--push_to_hub`.")
+
         # Set default output_dir if not provided
         if self.output_dir is None:
             self.output_dir = "trainer_output"
@@ -0,0 +1,74 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+
+import pytest
+
+from optimum.habana.transformers.generation import expected_padding, length_histogram, plan_buckets
+from optimum.habana.transformers.generation.utils import incrementor
+
+
+# Mostly short prompts with a long tail
+PROMPT_LENGTHS = [20] * 50 + [35] * 30 + [60] * 10 + [250] * 5 + [1000] * 2
+MAX_NEW_TOKENS = 50
+
+
+def linear_buckets(histogram, bucket_size):
+    return list(range(bucket_size, max(histogram) + bucket_size, bucket_size))
+
+
+def test_length_histogram():
+    histogram = length_histogram([3, 5], [2, 3])
+    assert histogram == {4: 1, 5: 1, 6: 1, 7: 1, 8: 1}
+    assert length_histogram([3, 3, 7]) == {4: 2, 8: 1}
+
+
+@pytest.mark.parametrize("strategy", ["optimal", "quantile", "geometric"])
+def test_plan_buckets(strategy):
+    bucket_size = 16
+    histogram = length_histogram(PROMPT_LENGTHS, [MAX_NEW_TOKENS] * len(PROMPT_LENGTHS))
+
+    buckets = plan_buckets(histogram, 8, strategy=strategy, multiple_of=bucket_size)
+
+    assert len(buckets) <= 8
+    assert buckets == sorted(buckets)
+    assert all(bucket % bucket_size == 0 for bucket in buckets)
+    assert buckets[-1] >= max(histogram)
+    # Same number of compiled shapes as the plan, but evenly spaced
+    coarse_linear_buckets = linear_buckets(histogram, buckets[-1] // len(buckets))
+    assert expected_padding(histogram, buckets) < expected_padding(histogram, coarse_linear_buckets)
+
+
+def test_optimal_plan_is_optimal():
+    histogram = {3: 5, 4: 1, 9: 2, 10: 7, 17: 1, 30: 4}
+    buckets = plan_buckets(histogram, 3)
+
+    best = min(
+        expected_padding(histogram, sorted(combination) + [30])
+        for combination in itertools.combinations(sorted(histogram)[:-1], 2)
+    )
+    assert expected_padding(histogram, buckets) == pytest.approx(best)
+
+
+def test_incrementor_with_buckets():
+    buckets = [32, 48, 96]
+    steps = list(itertools.islice(incrementor(16, 30, buckets), 80))
+
+    assert steps[0]["allocated_space"] == 32
+    expansions = [step["allocated_space"] for step in steps if step["need_expansion"]]
+    # Beyond the largest bucket, the buffer grows by bucket_size
+    assert expansions == [32, 48, 96, 112]
+    assert all(step["token_idx"] < step["allocated_space"] for step in steps)
@@ -0,0 +1,167 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from optimum.habana.transformers.generation import ContinuousBatchingEngine
+from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+from optimum.habana.transformers.models import GaudiLlamaForCausalLM
+from optimum.habana.transformers.models.llama.configuration_llama import LlamaConfig as GaudiLlamaConfig
+
+
+EOS_TOKEN_ID = 3
+PAD_TOKEN_ID = 0
+PROMPTS = [[5, 6, 7], [8, 9, 10, 11, 12, 13], [14, 15], [20, 21, 22, 23], [30]]
+MAX_NEW_TOKENS = [6, 3, 8, 5, 9]
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        eos_token_id=EOS_TOKEN_ID,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    model = LlamaForCausalLM(config).eval()
+    model.generation_config.do_sample = False
+    model.generation_config.eos_token_id = EOS_TOKEN_ID
+    model.generation_config.pad_token_id = PAD_TOKEN_ID
+    return model
+
+
+def greedy_reference(model, prompt, max_new_tokens):
+    input_ids = torch.tensor([prompt])
+    for _ in range(max_new_tokens):
+        next_token = model(input_ids).logits[0, -1].argmax()
+        input_ids = torch.cat([input_ids, next_token.reshape(1, 1)], dim=-1)
+        if next_token == EOS_TOKEN_ID:
+            break
+    return input_ids[0, len(prompt) :].tolist()
+
+
+@pytest.mark.parametrize("max_batch_size", [1, 2, 4])
+def test_continuous_batching_matches_greedy(tiny_model, max_batch_size):
+    engine = ContinuousBatchingEngine(tiny_model, max_batch_size=max_batch_size, max_seq_len=24)
+    request_ids = [engine.submit(prompt, n) for prompt, n in zip(PROMPTS, MAX_NEW_TOKENS)]
+
+    with torch.no_grad():
+        results = engine.run()
+        for request_id, prompt, max_new_tokens in zip(request_ids, PROMPTS, MAX_NEW_TOKENS):
+            assert results[request_id] == greedy_reference(tiny_model, prompt, max_new_tokens)
+
+    assert not engine.has_unfinished_requests()
+    assert all(slot is None for slot in engine.slots)
+
+
+def test_continuous_batching_refills_freed_slots(tiny_model):
+    engine = ContinuousBatchingEngine(tiny_model, max_batch_size=2, max_seq_len=24)
+    short_id = engine.submit([5, 6], max_new_tokens=1)
+    long_id = engine.submit([7, 8], max_new_tokens=6)
+    queued_id = engine.submit([9, 10], max_new_tokens=2)
+
+    first_step = engine.step()
+    assert [(o.request_id, o.finished) for o in first_step] == [(short_id, True), (long_id, False)]
+    assert engine.num_active == 1
+
+    # The slot freed by the short request is given to the queued one before the next decode step
+    second_step = engine.step()
+    assert {o.request_id for o in second_step} == {long_id, queued_id}
+
+    streamed = list(engine.stream())
+    assert streamed[-1].finished
+    assert engine.slot_utilization() > 0.5
+
+
+def test_continuous_batching_bounds_finished_requests(tiny_model):
+    engine = ContinuousBatchingEngine(tiny_model, max_batch_size=2, max_seq_len=24, max_finished_requests=2)
+    request_ids = [engine.submit(prompt, n) for prompt, n in zip(PROMPTS, MAX_NEW_TOKENS)]
+
+    with torch.no_grad():
+        # run() collects the results as requests finish, so the cap does not drop any of them
+        results = engine.run()
+    assert list(results) == request_ids
+    assert engine.requests == {} and engine.finished_requests == {}
+
+    with torch.no_grad():
+        request_ids = [engine.submit(prompt, n) for prompt, n in zip(PROMPTS, MAX_NEW_TOKENS)]
+        for _ in engine.stream():
+            pass
+    # Only the last finished requests are kept until they are retrieved
+    assert len(engine.finished_requests) == 2
+    assert all(engine.pop_finished(request_id) is not None for request_id in list(engine.finished_requests))
+    assert engine.requests == {} and engine.finished_requests == {}
+
+
+def test_continuous_batching_rejects_too_long_requests(tiny_model):
+    engine = ContinuousBatchingEngine(tiny_model, max_batch_size=2, max_seq_len=8)
+    with pytest.raises(ValueError):
+        engine.submit([1, 2, 4, 5], max_new_tokens=5)
+
+
+def test_continuous_batching_reuses_the_model_kv_caches():
+    adapt_transformers_to_gaudi()
+    torch.manual_seed(0)
+    config = GaudiLlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    model = GaudiLlamaForCausalLM(config).eval()
+    model.generation_config.do_sample = False
+    model.generation_config.eos_token_id = None
+    model.generation_config.pad_token_id = PAD_TOKEN_ID
+    # The second prompt is admitted by shifting the first one to the right, the third one refills the slot of the
+    # second one and the first one is shifted back to the left once it reaches the end of the slot
+    prompts = [[5, 6], [8, 9, 10, 11, 12, 13], [14, 15, 16]]
+    max_new_tokens = [9, 2, 4]
+
+    with torch.no_grad():
+        references = []
+        for prompt, n in zip(prompts, max_new_tokens):
+            input_ids = torch.tensor([prompt])
+            output = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                do_sample=False,
+                max_new_tokens=n,
+                pad_token_id=PAD_TOKEN_ID,
+                eos_token_id=None,
+                lazy_mode=False,
+            )
+            references.append(output[0, len(prompt) : len(prompt) + n].tolist())
+
+        engine = ContinuousBatchingEngine(model, max_batch_size=2, max_seq_len=12)
+        request_ids = [engine.submit(prompt, n) for prompt, n in zip(prompts, max_new_tokens)]
+        results = engine.run()
+
+    assert engine.reuse_cache
+    assert all(k_cache.get_shape()[0] == 2 for k_cache, _ in model.get_kv_caches())
+    assert engine.stats["prefills"] == 3
+    assert engine.stats["shifts"] == 2
+    assert [results[request_id] for request_id in request_ids] == references
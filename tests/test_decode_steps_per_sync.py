@@ -0,0 +1,113 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+
+from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+from optimum.habana.transformers.models import GaudiLlamaForCausalLM
+from optimum.habana.transformers.models.llama.configuration_llama import LlamaConfig
+
+
+adapt_transformers_to_gaudi()
+
+PAD_TOKEN_ID = 0
+PROMPTS = torch.tensor([[5, 6, 7, 8], [9, 10, 11, 12]])
+MAX_NEW_TOKENS = 10
+DECODE_STEPS_PER_SYNC = 4
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    return GaudiLlamaForCausalLM(config).eval()
+
+
+def generate(model, input_ids, **kwargs):
+    with torch.no_grad():
+        return model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            do_sample=False,
+            max_new_tokens=MAX_NEW_TOKENS,
+            pad_token_id=PAD_TOKEN_ID,
+            lazy_mode=False,
+            ignore_eos=False,
+            **kwargs,
+        )
+
+
+def eos_token_in_first_sync_window(model, input_ids, static_shapes):
+    """Returns a token the first sequence generates before the end of the first `DECODE_STEPS_PER_SYNC` steps."""
+    generated = generate(model, input_ids, eos_token_id=None, static_shapes=static_shapes)
+    return generated[0, input_ids.shape[1] + DECODE_STEPS_PER_SYNC // 2].item()
+
+
+@pytest.mark.parametrize("static_shapes", [False, True])
+@pytest.mark.parametrize("batch_size", [1, 2])
+@pytest.mark.parametrize("stop_at_eos", [False, True])
+def test_decode_steps_per_sync_matches_per_step_sync(tiny_model, static_shapes, batch_size, stop_at_eos):
+    input_ids = PROMPTS[:batch_size]
+    eos_token_id = eos_token_in_first_sync_window(tiny_model, input_ids, static_shapes) if stop_at_eos else None
+
+    expected = generate(tiny_model, input_ids, eos_token_id=eos_token_id, static_shapes=static_shapes)
+    output = generate(
+        tiny_model,
+        input_ids,
+        eos_token_id=eos_token_id,
+        static_shapes=static_shapes,
+        decode_steps_per_sync=DECODE_STEPS_PER_SYNC,
+    )
+
+    if stop_at_eos and batch_size == 1 and not static_shapes:
+        # The batch finished in the middle of the first sync window, the steps run after it are trimmed
+        assert expected.shape[1] < input_ids.shape[1] + DECODE_STEPS_PER_SYNC
+    assert torch.equal(output, expected)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_decode_steps_per_sync_trims_optional_outputs(tiny_model, batch_size):
+    input_ids = PROMPTS[:batch_size]
+    eos_token_id = eos_token_in_first_sync_window(tiny_model, input_ids, static_shapes=False)
+    kwargs = {
+        "eos_token_id": eos_token_id,
+        "static_shapes": False,
+        "return_dict_in_generate": True,
+        "output_scores": True,
+        "output_logits": True,
+        "output_attentions": True,
+        "output_hidden_states": True,
+    }
+
+    expected = generate(tiny_model, input_ids, **kwargs)
+    output = generate(tiny_model, input_ids, decode_steps_per_sync=DECODE_STEPS_PER_SYNC, **kwargs)
+
+    assert torch.equal(output.sequences, expected.sequences)
+    for name in ("scores", "logits", "attentions", "hidden_states"):
+        assert len(getattr(output, name)) == len(getattr(expected, name)), name
+    # One step per generated token
+    assert len(output.scores) == output.sequences.shape[1] - input_ids.shape[1]
+    for scores, expected_scores in zip(output.scores, expected.scores):
+        torch.testing.assert_close(scores, expected_scores)
@@ -124,6 +124,7 @@ from optimum.habana.diffusers import (
     GaudiStableVideoDiffusionControlNetPipeline,
     GaudiStableVideoDiffusionPipeline,
     GaudiTextToVideoSDPipeline,
+    StableDiffusionContinuousBatchingEngine,
 )
 from optimum.habana.diffusers.models import (
     ControlNetSDVModel,
@@ -192,6 +193,23 @@ def legacy(test_case):
     return pytest.mark.skipif(skip, reason="This test is for old/legacy model. Skipped starting 1.16.0.")(test_case)
 
 
+def count_forward_calls(modules):
+    """
+    Registers forward hooks on `modules` and returns the list of their numbers of calls, updated in place.
+    """
+    calls = [0] * len(modules)
+
+    def make_hook(index):
+        def hook(module, args, output):
+            calls[index] += 1
+
+        return hook
+
+    for index, module in enumerate(modules):
+        module.register_forward_hook(make_hook(index))
+    return calls
+
+
 class GaudiPipelineUtilsTester(TestCase):
     """
     Tests the features added on top of diffusers/pipeline_utils.py.
@@ -454,6 +472,44 @@ class GaudiStableDiffusionPipelineTester(TestCase):
 
         self.assertLess(np.abs(image_slice.flatten() - expected_slice).max(), 1e-2)
 
+    @parameterized.expand([GaudiDDIMScheduler, GaudiEulerDiscreteScheduler])
+    def test_stable_diffusion_continuous_batching(self, scheduler_class):
+        components = self.get_dummy_components()
+        components["scheduler"] = scheduler_class.from_config(components["scheduler"].config)
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+        sd_pipe = GaudiStableDiffusionPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        prompts = ["A painting of a squirrel eating a burger", "A photo of an astronaut", "A red apple"]
+        latents = [torch.randn((1, 4, 32, 32), generator=torch.Generator().manual_seed(i)) for i in range(5)]
+        engine = StableDiffusionContinuousBatchingEngine(
+            sd_pipe, batch_size=2, num_inference_steps=3, guidance_scale=6.0, output_type="np"
+        )
+        for i in range(3):
+            engine.submit(prompts[i % 3], latents=latents[i])
+        outputs = {output.request_id: output for output in engine.step()}
+        # Requests submitted while others are being denoised join the batch at a different step
+        for i in range(3, 5):
+            engine.submit(prompts[i % 3], latents=latents[i])
+        outputs.update(engine.run())
+
+        self.assertEqual(sorted(outputs), list(range(5)))
+        self.assertLess(engine.slot_utilization(), 1.0)
+        for i in range(5):
+            expected_image = sd_pipe(
+                prompts[i % 3],
+                num_inference_steps=3,
+                guidance_scale=6.0,
+                latents=latents[i],
+                output_type="np",
+            ).images[0]
+            self.assertEqual(outputs[i].image.shape, (64, 64, 3))
+            self.assertLess(np.abs(outputs[i].image - expected_image).max(), 1e-3)
+
     def test_stable_diffusion_no_safety_checker(self):
         gaudi_config = GaudiConfig()
         scheduler = GaudiDDIMScheduler(
@@ -629,6 +685,117 @@ class GaudiStableDiffusionPipelineTester(TestCase):
         self.assertEqual(len(images), num_prompts * num_images_per_prompt)
         self.assertEqual(images[-1].shape, (64, 64, 3))
 
+    def test_stable_diffusion_pipelined_decode(self):
+        components = self.get_dummy_components()
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+
+        sd_pipe = GaudiStableDiffusionPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        # 5 images in batches of 2 so that the last batch contains a dummy sample
+        inputs = self.get_dummy_inputs("cpu")
+        images = sd_pipe(**inputs, batch_size=2, num_images_per_prompt=5).images
+
+        inputs = self.get_dummy_inputs("cpu")
+        pipelined_images = sd_pipe(**inputs, batch_size=2, num_images_per_prompt=5, pipelined_decode=True).images
+
+        self.assertEqual(len(pipelined_images), 5)
+        self.assertLess(np.abs(pipelined_images - images).max(), 1e-3)
+
+    def test_stable_diffusion_deep_cache(self):
+        components = self.get_dummy_components()
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+
+        sd_pipe = GaudiStableDiffusionPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        inputs = self.get_dummy_inputs("cpu")
+        image = sd_pipe(**inputs).images[0]
+
+        # Refreshing the deep features at every step is the same as not caching them
+        inputs = self.get_dummy_inputs("cpu")
+        refreshed_image = sd_pipe(**inputs, deep_cache_refresh_steps=[0, 1]).images[0]
+        self.assertLess(np.abs(refreshed_image - image).max(), 1e-4)
+
+        inputs = self.get_dummy_inputs("cpu")
+        cached_image = sd_pipe(**inputs, deep_cache_interval=2).images[0]
+        self.assertEqual(cached_image.shape, (64, 64, 3))
+
+    def test_stable_diffusion_cfg_truncation(self):
+        components = self.get_dummy_components()
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+
+        sd_pipe = GaudiStableDiffusionPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        inputs = self.get_dummy_inputs("cpu")
+        image = sd_pipe(**inputs).images[0]
+        inputs = self.get_dummy_inputs("cpu")
+        inputs["guidance_scale"] = 1.0
+        unguided_image = sd_pipe(**inputs).images[0]
+
+        # Guidance is only dropped after the last step
+        inputs = self.get_dummy_inputs("cpu")
+        truncated_image = sd_pipe(**inputs, cfg_truncation_fraction=1.0).images[0]
+        self.assertLess(np.abs(truncated_image - image).max(), 1e-4)
+
+        # Guidance is dropped from the first step
+        inputs = self.get_dummy_inputs("cpu")
+        truncated_image = sd_pipe(**inputs, cfg_truncation_fraction=0.0).images[0]
+        self.assertLess(np.abs(truncated_image - unguided_image).max(), 1e-4)
+
+        # Guidance is dropped after the first step, whose predictions are always close enough
+        inputs = self.get_dummy_inputs("cpu")
+        truncated_image = sd_pipe(**inputs, cfg_truncation_threshold=1e6).images[0]
+        self.assertEqual(truncated_image.shape, (64, 64, 3))
+        self.assertGreater(np.abs(truncated_image - image).max(), 1e-4)
+
+    def test_stable_diffusion_prompt_embeds_cache(self):
+        components = self.get_dummy_components()
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+
+        sd_pipe = GaudiStableDiffusionPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        inputs = self.get_dummy_inputs("cpu")
+        image = sd_pipe(**inputs).images[0]
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            cache = sd_pipe.enable_prompt_embeds_cache(cache_dir=tmpdirname)
+            inputs = self.get_dummy_inputs("cpu")
+            sd_pipe(**inputs)
+            self.assertEqual(cache.hits, 0)
+
+            inputs = self.get_dummy_inputs("cpu")
+            cached_image = sd_pipe(**inputs).images[0]
+            self.assertGreater(cache.hits, 0)
+            self.assertLess(np.abs(cached_image - image).max(), 1e-4)
+
+            # The embeddings saved to disk are reused by a new cache
+            cache = sd_pipe.enable_prompt_embeds_cache(cache_dir=tmpdirname)
+            inputs = self.get_dummy_inputs("cpu")
+            sd_pipe(**inputs)
+            self.assertEqual(cache.misses, 0)
+
+        sd_pipe.disable_prompt_embeds_cache()
+        self.assertIsNone(sd_pipe.prompt_embeds_cache)
+
     def test_stable_diffusion_bf16(self):
         """Test that stable diffusion works with bf16"""
         components = self.get_dummy_components()
@@ -1292,6 +1459,69 @@ class GaudiStableDiffusionXLPipelineTester(TestCase):
         self.assertEqual(len(images), num_prompts * num_images_per_prompt)
         self.assertEqual(images[-1].shape, (64, 64, 3))
 
+    def test_stable_diffusion_xl_pipelined_decode(self):
+        components = self.get_dummy_components()
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+
+        sd_pipe = GaudiStableDiffusionXLPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        # 6 images of 2 prompts in batches of 4 so that the last batch contains dummy samples
+        inputs = self.get_dummy_inputs("cpu")
+        inputs["prompt"] = [inputs["prompt"], "A photo of a cat"]
+        images = sd_pipe(**inputs, batch_size=4, num_images_per_prompt=3).images
+
+        inputs = self.get_dummy_inputs("cpu")
+        inputs["prompt"] = [inputs["prompt"], "A photo of a cat"]
+        pipelined_images = sd_pipe(**inputs, batch_size=4, num_images_per_prompt=3, pipelined_decode=True).images
+
+        self.assertEqual(len(pipelined_images), 6)
+        self.assertLess(np.abs(pipelined_images - images).max(), 1e-3)
+
+    def test_stable_diffusion_xl_cfg_truncation(self):
+        components = self.get_dummy_components()
+        gaudi_config = GaudiConfig(use_torch_autocast=False)
+
+        sd_pipe = GaudiStableDiffusionXLPipeline(
+            use_habana=True,
+            gaudi_config=gaudi_config,
+            **components,
+        )
+        sd_pipe.set_progress_bar_config(disable=None)
+
+        def get_inputs():
+            inputs = self.get_dummy_inputs("cpu")
+            # Different added time ids for the unconditional branch, so that keeping the wrong half of them shows
+            inputs["negative_original_size"] = (32, 32)
+            inputs["negative_target_size"] = (32, 32)
+            # 3 images in batches of 2 so that the last batch contains a dummy sample
+            inputs["batch_size"] = 2
+            inputs["num_images_per_prompt"] = 3
+            return inputs
+
+        images = sd_pipe(**get_inputs()).images
+        inputs = get_inputs()
+        inputs["guidance_scale"] = 1.0
+        unguided_images = sd_pipe(**inputs).images
+
+        # Guidance is only dropped after the last step
+        truncated_images = sd_pipe(**get_inputs(), cfg_truncation_fraction=1.0).images
+        self.assertLess(np.abs(truncated_images - images).max(), 1e-4)
+
+        # Guidance is dropped from the first step, the added text embeddings and time ids are the conditional ones
+        truncated_images = sd_pipe(**get_inputs(), cfg_truncation_fraction=0.0).images
+        self.assertLess(np.abs(truncated_images - unguided_images).max(), 1e-4)
+
+        # Guidance is dropped after the first step
+        truncated_images = sd_pipe(**get_inputs(), cfg_truncation_fraction=0.5).images
+        self.assertEqual(len(truncated_images), 3)
+        self.assertGreater(np.abs(truncated_images - images).max(), 1e-4)
+        self.assertGreater(np.abs(truncated_images - unguided_images).max(), 1e-4)
+
     def test_stable_diffusion_xl_bf16(self):
         """Test that stable diffusion works with bf16"""
         components = self.get_dummy_components()
@@ -1647,13 +1877,13 @@ class GaudiStableDiffusion3PipelineTester(TestCase):
         """
         self.baseline = baseline
 
-    def get_dummy_components(self):
+    def get_dummy_components(self, num_layers=1):
         torch.manual_seed(0)
         transformer = SD3Transformer2DModel(
             sample_size=32,
             patch_size=1,
             in_channels=4,
-            num_layers=1,
+            num_layers=num_layers,
             attention_head_dim=8,
             num_attention_heads=4,
             caption_projection_dim=32,
@@ -1848,6 +2078,38 @@ class GaudiStableDiffusion3PipelineTester(TestCase):
             "Original outputs should match when fused QKV projections are disabled."
         )
 
+    def test_stable_diffusion_3_deep_cache(self):
+        # The middle block is the only one whose residual is cached with the default `deep_cache_depth=1`
+        pipe = self.pipeline_class(
+            use_habana=True,
+            gaudi_config=GaudiConfig(use_torch_autocast=False),
+            **self.get_dummy_components(num_layers=3),
+        )
+        pipe.set_progress_bar_config(disable=None)
+        num_inference_steps = 4
+
+        block_calls = count_forward_calls(pipe.transformer.transformer_blocks)
+
+        inputs = self.get_dummy_inputs("cpu")
+        inputs["num_inference_steps"] = num_inference_steps
+        image = pipe(**inputs).images[0]
+
+        # Refreshing the deep features at every step, i.e. an interval of 1, is the same as not caching them
+        inputs = self.get_dummy_inputs("cpu")
+        inputs["num_inference_steps"] = num_inference_steps
+        refreshed_image = pipe(**inputs, deep_cache_refresh_steps=list(range(num_inference_steps))).images[0]
+        self.assertLess(np.abs(refreshed_image - image).max(), 1e-4)
+
+        block_calls[:] = [0] * len(block_calls)
+        inputs = self.get_dummy_inputs("cpu")
+        inputs["num_inference_steps"] = num_inference_steps
+        cached_image = pipe(**inputs, deep_cache_interval=2).images[0]
+
+        # The middle block only runs at the full steps 0 and 2
+        self.assertEqual(block_calls, [num_inference_steps, 2, num_inference_steps])
+        self.assertEqual(cached_image.shape, image.shape)
+        self.assertGreater(np.abs(cached_image - image).max(), 0)
+
     @slow
     @check_gated_model_access("stabilityai/stable-diffusion-3-medium-diffusers")
     @pytest.mark.skipif(IS_GAUDI1, reason="does not fit into Gaudi1 memory")
@@ -6529,13 +6791,13 @@ class GaudiFluxPipelineTester(TestCase):
         """
         self.baseline = baseline
 
-    def get_dummy_components(self):
+    def get_dummy_components(self, num_layers=1, num_single_layers=1):
         torch.manual_seed(0)
         transformer = FluxTransformer2DModel(
             patch_size=1,
             in_channels=4,
-            num_layers=1,
-            num_single_layers=1,
+            num_layers=num_layers,
+            num_single_layers=num_single_layers,
             attention_head_dim=16,
             num_attention_heads=2,
             joint_attention_dim=32,
@@ -6663,6 +6925,61 @@ class GaudiFluxPipelineTester(TestCase):
         max_diff = np.abs(output_with_prompt - output_with_embeds).max()
         assert max_diff < 1e-4
 
+    def test_flux_pipelined_decode(self):
+        pipe = self.pipeline_class(
+            use_habana=True,
+            gaudi_config=GaudiConfig(use_torch_autocast=False),
+            **self.get_dummy_components(),
+        ).to(torch_device)
+        pipe.set_progress_bar_config(disable=None)
+
+        # 6 images of 2 prompts in batches of 4 so that the last batch contains dummy samples
+        inputs = self.get_dummy_inputs(torch_device)
+        inputs["prompt"] = [inputs["prompt"], "A photo of a cat"]
+        images = pipe(**inputs, batch_size=4, num_images_per_prompt=3).images
+
+        inputs = self.get_dummy_inputs(torch_device)
+        inputs["prompt"] = [inputs["prompt"], "A photo of a cat"]
+        pipelined_images = pipe(**inputs, batch_size=4, num_images_per_prompt=3, pipelined_decode=True).images
+
+        assert len(pipelined_images) == 6
+        assert np.abs(pipelined_images - images).max() < 1e-3
+
+    def test_flux_deep_cache(self):
+        # With the default `deep_cache_depth=1`, the residual of the second dual-stream block and of the first
+        # single-stream block is cached
+        pipe = self.pipeline_class(
+            use_habana=True,
+            gaudi_config=GaudiConfig(use_torch_autocast=False),
+            **self.get_dummy_components(num_layers=2, num_single_layers=2),
+        ).to(torch_device)
+        pipe.set_progress_bar_config(disable=None)
+        num_inference_steps = 4
+
+        block_calls = count_forward_calls(
+            list(pipe.transformer.transformer_blocks) + list(pipe.transformer.single_transformer_blocks)
+        )
+
+        inputs = self.get_dummy_inputs(torch_device)
+        inputs["num_inference_steps"] = num_inference_steps
+        image = pipe(**inputs).images[0]
+
+        # Refreshing the deep features at every step, i.e. an interval of 1, is the same as not caching them
+        inputs = self.get_dummy_inputs(torch_device)
+        inputs["num_inference_steps"] = num_inference_steps
+        refreshed_image = pipe(**inputs, deep_cache_refresh_steps=list(range(num_inference_steps))).images[0]
+        assert np.abs(refreshed_image - image).max() < 1e-4
+
+        block_calls[:] = [0] * len(block_calls)
+        inputs = self.get_dummy_inputs(torch_device)
+        inputs["num_inference_steps"] = num_inference_steps
+        cached_image = pipe(**inputs, deep_cache_interval=2).images[0]
+
+        # The cached blocks only run at the full steps 0 and 2
+        assert block_calls == [num_inference_steps, 2, 2, num_inference_steps]
+        assert cached_image.shape == image.shape
+        assert np.abs(cached_image - image).max() > 0
+
     @slow
     @pytest.mark.skipif(IS_GAUDI1, reason="does not fit into Gaudi1 memory")
     def test_flux_inference(self):
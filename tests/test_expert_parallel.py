@@ -0,0 +1,196 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from optimum.habana.distributed.expert_parallel import (
+    AllToAllExpertDispatcher,
+    ExpertLoadStats,
+    moe_capacity,
+    plan_expert_replicas,
+)
+
+
+WORLD_SIZE = 2
+NUM_EXPERTS = 4
+TOP_K = 2
+HIDDEN_DIM = 8
+
+
+def make_experts():
+    torch.manual_seed(0)
+    return [
+        torch.nn.Sequential(
+            torch.nn.Linear(HIDDEN_DIM, 16, bias=False), torch.nn.SiLU(), torch.nn.Linear(16, HIDDEN_DIM)
+        )
+        for _ in range(NUM_EXPERTS)
+    ]
+
+
+def make_inputs(num_tokens, seed):
+    torch.manual_seed(seed)
+    hidden_states = torch.randn(num_tokens, HIDDEN_DIM)
+    routing_weights, selected_experts = torch.randn(num_tokens, NUM_EXPERTS).softmax(dim=-1).topk(TOP_K, dim=-1)
+    return hidden_states, selected_experts, routing_weights
+
+
+def reference_moe(experts, hidden_states, selected_experts, routing_weights, capacity=None):
+    """Dense MoE, assignments beyond `capacity` of an expert in token order are dropped."""
+    output = torch.zeros_like(hidden_states)
+    num_assigned = [0] * NUM_EXPERTS
+    for token_id in range(hidden_states.shape[0]):
+        for expert_id, weight in zip(selected_experts[token_id].tolist(), routing_weights[token_id]):
+            num_assigned[expert_id] += 1
+            if capacity is None or num_assigned[expert_id] <= capacity:
+                output[token_id] += weight * experts[expert_id](hidden_states[token_id])
+    return output
+
+
+def run_worker(rank, init_file, num_tokens, shard_tokens, capacity_factor, results):
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=WORLD_SIZE)
+    try:
+        experts_per_rank = NUM_EXPERTS // WORLD_SIZE
+        local_experts = make_experts()[rank * experts_per_rank : (rank + 1) * experts_per_rank]
+        dispatcher = AllToAllExpertDispatcher(NUM_EXPERTS, capacity_factor=capacity_factor, shard_tokens=shard_tokens)
+        # Sharded tokens are the same on all ranks, otherwise every rank has its own
+        inputs = make_inputs(num_tokens, seed=0 if shard_tokens else rank + 1)
+        with torch.no_grad():
+            results[rank] = dispatcher(*inputs, local_experts)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_replicated_worker(rank, init_file, num_tokens, shard_tokens, expert_load, results):
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=WORLD_SIZE)
+    try:
+        experts_per_rank = NUM_EXPERTS // WORLD_SIZE
+        local_experts = make_experts()[rank * experts_per_rank : (rank + 1) * experts_per_rank]
+        dispatcher = AllToAllExpertDispatcher(
+            NUM_EXPERTS,
+            capacity_factor=NUM_EXPERTS / TOP_K,
+            shard_tokens=shard_tokens,
+            num_replicas_per_rank=1,
+            expert_template=local_experts[0],
+        )
+        # Without shard_tokens, the load of every rank is all-reduced
+        dispatcher.rebalance(
+            expert_load if shard_tokens or rank == 0 else torch.zeros_like(expert_load), local_experts
+        )
+        inputs = make_inputs(num_tokens, seed=0 if shard_tokens else rank + 1)
+        with torch.no_grad():
+            results[rank] = (dispatcher.replica_experts, dispatcher(*inputs, local_experts))
+    finally:
+        dist.destroy_process_group()
+
+
+def run_dispatcher(tmp_path, num_tokens, shard_tokens, capacity_factor):
+    results = mp.Manager().dict()
+    mp.spawn(
+        run_worker,
+        args=(str(tmp_path / "init"), num_tokens, shard_tokens, capacity_factor, results),
+        nprocs=WORLD_SIZE,
+        join=True,
+    )
+    return [results[rank] for rank in range(WORLD_SIZE)]
+
+
+@pytest.mark.parametrize("shard_tokens", [True, False])
+@pytest.mark.parametrize("num_tokens", [1, 7, 16])
+def test_all_to_all_dispatch_matches_dense_moe(tmp_path, shard_tokens, num_tokens):
+    # No token is dropped with this capacity factor
+    outputs = run_dispatcher(tmp_path, num_tokens, shard_tokens, capacity_factor=NUM_EXPERTS / TOP_K)
+
+    experts = make_experts()
+    with torch.no_grad():
+        for rank, output in enumerate(outputs):
+            expected = reference_moe(experts, *make_inputs(num_tokens, seed=0 if shard_tokens else rank + 1))
+            torch.testing.assert_close(output, expected)
+
+
+def test_all_to_all_dispatch_drops_tokens_beyond_capacity(tmp_path):
+    num_tokens, capacity_factor = 12, 0.5
+    outputs = run_dispatcher(tmp_path, num_tokens, shard_tokens=True, capacity_factor=capacity_factor)
+
+    experts = make_experts()
+    hidden_states, selected_experts, routing_weights = make_inputs(num_tokens, seed=0)
+    shard_size = num_tokens // WORLD_SIZE
+    capacity = moe_capacity(shard_size, TOP_K, NUM_EXPERTS, capacity_factor)
+    with torch.no_grad():
+        # The capacity applies to the tokens dispatched by every rank
+        expected = torch.cat(
+            [
+                reference_moe(
+                    experts,
+                    *(t[i : i + shard_size] for t in (hidden_states, selected_experts, routing_weights)),
+                    capacity,
+                )
+                for i in range(0, num_tokens, shard_size)
+            ]
+        )
+        for output in outputs:
+            torch.testing.assert_close(output, expected)
+    assert not torch.allclose(expected, reference_moe(experts, hidden_states, selected_experts, routing_weights))
+
+
+def test_moe_capacity():
+    assert moe_capacity(16, 2, 8, 1.0) == 4
+    assert moe_capacity(16, 2, 8, 1.25) == 5
+    assert moe_capacity(1, 2, 64, 1.0) == 1
+
+
+@pytest.mark.parametrize("shard_tokens", [True, False])
+def test_replicated_experts_match_dense_moe(tmp_path, shard_tokens):
+    num_tokens = 9
+    # Expert 0 is replicated on rank 1 and expert 2 on rank 0
+    expert_load = torch.tensor([100, 10, 10, 10])
+    results = mp.Manager().dict()
+    mp.spawn(
+        run_replicated_worker,
+        args=(str(tmp_path / "init"), num_tokens, shard_tokens, expert_load, results),
+        nprocs=WORLD_SIZE,
+        join=True,
+    )
+
+    experts = make_experts()
+    with torch.no_grad():
+        for rank in range(WORLD_SIZE):
+            replica_experts, output = results[rank]
+            assert replica_experts == [[2], [0]]
+            expected = reference_moe(experts, *make_inputs(num_tokens, seed=0 if shard_tokens else rank + 1))
+            torch.testing.assert_close(output, expected)
+
+
+def test_plan_expert_replicas():
+    # The hottest expert is replicated on every other rank
+    assert plan_expert_replicas(torch.tensor([90, 10, 10, 10, 10, 10, 10, 10]), 4, 1) == [[2], [0], [0], [0]]
+    # Rank 0 then gets 60 tokens and rank 1 70 tokens, a copy of expert 2 balances them
+    assert plan_expert_replicas(torch.tensor([100, 10, 10, 10]), 2, 1) == [[2], [0]]
+    # Replicas do not help a balanced load
+    assert plan_expert_replicas(torch.tensor([10, 10, 10, 10]), 2, 1) == [[-1], [-1]]
+    assert plan_expert_replicas(torch.zeros(4), 2, 1) == [[-1], [-1]]
+
+
+def test_expert_load_stats():
+    stats = ExpertLoadStats(NUM_EXPERTS, torch.device("cpu"))
+    stats.update(torch.tensor([[0, 1], [0, 3]]))
+    stats.update(torch.tensor([[0, 1]]))
+
+    assert stats.counts.tolist() == [3, 2, 0, 1]
+    assert stats.imbalance == 2.0
+    stats.reset()
+    assert stats.counts.tolist() == [0, 0, 0, 0]
@@ -0,0 +1,93 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from optimum.habana.distributed.fast_ddp import all_reduce_gradients, setup_bucketed_all_reduce
+
+
+WORLD_SIZE = 2
+ACCUMULATION_STEPS = 3
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self, dtype):
+        super().__init__()
+        self.layers = torch.nn.Sequential(
+            torch.nn.Linear(8, 32), torch.nn.ReLU(), torch.nn.Linear(32, 32), torch.nn.ReLU(), torch.nn.Linear(32, 4)
+        ).to(dtype)
+        # Never receives a gradient
+        self.unused = torch.nn.Linear(4, 4).to(dtype)
+
+    def forward(self, x):
+        return self.layers(x)
+
+
+def grads_of_rank(model, rank, num_steps, dtype):
+    grads = []
+    for step in range(num_steps):
+        torch.manual_seed(1000 * rank + step)
+        model(torch.randn(4, 8, dtype=dtype)).float().pow(2).sum().backward()
+    for param in model.parameters():
+        grads.append(torch.zeros_like(param, dtype=torch.float32) if param.grad is None else param.grad.float())
+    return grads
+
+
+def run_worker(rank, init_file, bucket_cap_mb, fp32_accumulation, dtype, results):
+    dist.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=WORLD_SIZE)
+    try:
+        torch.manual_seed(0)
+        model = TinyModel(dtype)
+        reducer = setup_bucketed_all_reduce(model, bucket_cap_mb=bucket_cap_mb, fp32_accumulation=fp32_accumulation)
+        assert len(reducer.buckets) > 1
+        for _ in range(2):
+            model.zero_grad()
+            for step in range(ACCUMULATION_STEPS):
+                reducer.require_backward_grad_sync = step == ACCUMULATION_STEPS - 1
+                torch.manual_seed(1000 * rank + step)
+                model(torch.randn(4, 8, dtype=dtype)).float().pow(2).sum().backward()
+            all_reduce_gradients(model)
+        results[rank] = [param.grad.float().clone() for param in model.parameters()]
+    finally:
+        dist.destroy_process_group()
+
+
+@pytest.mark.parametrize(
+    "fp32_accumulation, dtype", [(False, torch.float32), (True, torch.float32), (True, torch.bfloat16)]
+)
+def test_bucketed_all_reduce_matches_average(tmp_path, fp32_accumulation, dtype):
+    results = mp.Manager().dict()
+    # Small buckets to get several of them
+    mp.spawn(
+        run_worker,
+        args=(str(tmp_path / "init"), 2e-3, fp32_accumulation, dtype, results),
+        nprocs=WORLD_SIZE,
+        join=True,
+    )
+
+    expected = None
+    for rank in range(WORLD_SIZE):
+        torch.manual_seed(0)
+        grads = grads_of_rank(TinyModel(torch.float32), rank, ACCUMULATION_STEPS, torch.float32)
+        expected = grads if expected is None else [e + g for e, g in zip(expected, grads)]
+    expected = [e / WORLD_SIZE for e in expected]
+
+    tolerance = {"atol": 5e-2, "rtol": 5e-2} if dtype == torch.bfloat16 else {}
+    for rank in range(WORLD_SIZE):
+        for grad, expected_grad in zip(results[rank], expected):
+            torch.testing.assert_close(grad, expected_grad, **tolerance)
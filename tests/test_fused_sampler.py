@@ -0,0 +1,162 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+from transformers.generation.logits_process import (
+    LogitsProcessorList,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+from optimum.habana.transformers.generation import fused_sample, fused_sample_probs_reference, fused_top_k_scores
+from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+from optimum.habana.transformers.models import GaudiLlamaForCausalLM
+from optimum.habana.transformers.models.llama.configuration_llama import LlamaConfig
+
+
+adapt_transformers_to_gaudi()
+
+BATCH_SIZE = 3
+VOCAB_SIZE = 40
+
+
+def fused_probs(logits, input_ids, top_k, **kwargs):
+    token_ids, scores = fused_top_k_scores(logits, input_ids, top_k, **kwargs)
+    return torch.zeros(logits.shape, dtype=torch.float64).scatter(1, token_ids, scores.double().softmax(dim=-1))
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"temperature": 0.7},
+        {"top_p": 0.8},
+        {"repetition_penalty": 1.3},
+        {"temperature": 1.5, "top_p": 0.9, "repetition_penalty": 1.2},
+    ],
+)
+@pytest.mark.parametrize("top_k", [1, 5, 16])
+def test_fused_scores_match_reference(kwargs, top_k):
+    torch.manual_seed(0)
+    logits = torch.randn(BATCH_SIZE, VOCAB_SIZE) * 3
+    input_ids = torch.randint(0, VOCAB_SIZE, (BATCH_SIZE, 12))
+
+    torch.testing.assert_close(
+        fused_probs(logits, input_ids, top_k, **kwargs),
+        fused_sample_probs_reference(logits, input_ids, top_k, **kwargs),
+    )
+
+
+def test_fused_scores_of_bf16_logits():
+    torch.manual_seed(0)
+    logits = (torch.randn(BATCH_SIZE, VOCAB_SIZE) * 3).bfloat16()
+    input_ids = torch.randint(0, VOCAB_SIZE, (BATCH_SIZE, 12))
+    kwargs = {"temperature": 0.7, "top_p": 0.9, "repetition_penalty": 1.2}
+
+    token_ids, scores = fused_top_k_scores(logits, input_ids, 8, **kwargs)
+
+    # Only the top-k scores are upcast, the result is the one of the float32 logits holding the same values
+    assert scores.dtype == torch.float32
+    torch.testing.assert_close(
+        fused_probs(logits, input_ids, 8, **kwargs),
+        fused_sample_probs_reference(logits.float(), input_ids, 8, **kwargs),
+    )
+
+
+def test_fused_scores_match_logits_warpers():
+    torch.manual_seed(0)
+    logits = torch.randn(BATCH_SIZE, VOCAB_SIZE) * 3
+    input_ids = torch.randint(0, VOCAB_SIZE, (BATCH_SIZE, 12))
+    warpers = LogitsProcessorList([TemperatureLogitsWarper(0.8), TopKLogitsWarper(10), TopPLogitsWarper(0.9)])
+
+    expected = warpers(input_ids, logits.clone()).double().softmax(dim=-1)
+
+    torch.testing.assert_close(fused_probs(logits, input_ids, 10, temperature=0.8, top_p=0.9), expected)
+
+
+def test_fused_sample_follows_the_distribution():
+    torch.manual_seed(0)
+    num_samples = 20000
+    logits = torch.randn(1, VOCAB_SIZE).expand(num_samples, -1) * 2
+    input_ids = torch.zeros(num_samples, 1, dtype=torch.long)
+    kwargs = {"temperature": 1.3, "top_p": 0.95}
+
+    tokens = fused_sample(logits, input_ids, 8, **kwargs)
+
+    frequencies = torch.bincount(tokens, minlength=VOCAB_SIZE).double() / num_samples
+    expected = fused_sample_probs_reference(logits[:1], input_ids[:1], 8, **kwargs)[0]
+    torch.testing.assert_close(frequencies, expected, atol=0.015, rtol=0)
+
+
+def test_fused_sample_with_top_k_1_is_greedy():
+    torch.manual_seed(0)
+    logits = torch.randn(BATCH_SIZE, VOCAB_SIZE)
+    input_ids = torch.randint(0, VOCAB_SIZE, (BATCH_SIZE, 4))
+
+    assert torch.equal(fused_sample(logits, input_ids, 1, temperature=2.0), logits.argmax(dim=-1))
+
+
+@pytest.fixture(scope="module")
+def tiny_bf16_model():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        pad_token_id=0,
+    )
+    return GaudiLlamaForCausalLM(config).to(torch.bfloat16).eval()
+
+
+def fused_generate(model, input_ids, **kwargs):
+    with torch.no_grad():
+        return model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            do_sample=True,
+            use_fused_sampler=True,
+            top_k=1,
+            max_new_tokens=6,
+            pad_token_id=0,
+            static_shapes=False,
+            lazy_mode=False,
+            ignore_eos=False,
+            return_dict_in_generate=True,
+            output_scores=True,
+            **kwargs,
+        )
+
+
+def test_fused_sampler_with_remaining_processors(tiny_bf16_model):
+    input_ids = torch.tensor([[5, 6, 7, 8], [9, 10, 11, 12]])
+    output = fused_generate(tiny_bf16_model, input_ids, eos_token_id=None)
+    # Without other processors, the logits are left in the model dtype
+    assert output.scores[0].dtype == torch.bfloat16
+    # top_k=1 is greedy, the first token of the first sequence is generated again with the same prompt
+    eos_token_id = output.sequences[0, input_ids.shape[1]].item()
+
+    output = fused_generate(tiny_bf16_model, input_ids, eos_token_id=eos_token_id, min_new_tokens=3)
+
+    # The min-length processor still runs on the whole vocabulary in float32
+    assert output.scores[0].dtype == torch.float32
+    for scores in output.scores[:3]:
+        assert torch.all(scores[:, eos_token_id] == -float("inf"))
+    assert eos_token_id not in output.sequences[:, input_ids.shape[1] : input_ids.shape[1] + 3]
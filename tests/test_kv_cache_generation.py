@@ -0,0 +1,243 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import pytest
+import torch
+
+from optimum.habana.transformers.cache_utils import KVCache, PagedKVCache, QuantizedKVCache
+from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+from optimum.habana.transformers.models import GaudiLlamaForCausalLM, GaudiMistralForCausalLM, MistralConfig
+from optimum.habana.transformers.models.llama.configuration_llama import LlamaConfig
+
+
+adapt_transformers_to_gaudi()
+
+PAD_TOKEN_ID = 0
+PROMPTS = torch.tensor([[5, 6, 7, 8, 9, 10], [11, 12, 13, 14, 15, 16]])
+MAX_NEW_TOKENS = 8
+
+
+def tiny_llama():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    return GaudiLlamaForCausalLM(config).eval()
+
+
+def generate(model, input_ids, attention_mask=None, **kwargs):
+    """Greedy static-shape generation on CPU, returns the generated tokens only."""
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    with torch.no_grad():
+        output = model.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            do_sample=False,
+            max_new_tokens=MAX_NEW_TOKENS,
+            pad_token_id=PAD_TOKEN_ID,
+            eos_token_id=None,
+            static_shapes=True,
+            use_cache=True,
+            lazy_mode=False,
+            **kwargs,
+        )
+    return output[:, input_ids.shape[1] : input_ids.shape[1] + MAX_NEW_TOKENS]
+
+
+def test_paged_kv_cache_is_disabled_by_the_next_call():
+    model = tiny_llama()
+    fresh_model = copy.deepcopy(model)
+
+    paged_tokens = generate(model, PROMPTS, reuse_cache=True, kv_cache_block_size=4)
+    assert isinstance(model.model.layers[0].self_attn.k_cache, PagedKVCache)
+    assert torch.equal(paged_tokens, generate(fresh_model, PROMPTS, reuse_cache=True))
+
+    # Beam search does not grow the paged cache step by step, the next call must get contiguous caches back
+    beam_tokens = generate(model, PROMPTS, reuse_cache=True, num_beams=2)
+
+    assert model.kv_cache_allocator is None
+    assert not isinstance(model.model.layers[0].self_attn.k_cache, PagedKVCache)
+    assert torch.equal(beam_tokens, generate(fresh_model, PROMPTS, reuse_cache=True, num_beams=2))
+
+
+def test_prefix_cache_reuses_a_shared_system_prompt():
+    model = tiny_llama()
+    system_prompt = torch.tensor([[20, 21, 22, 23, 24, 25, 26, 27]]).expand(2, -1)
+    first_prompts = torch.cat((system_prompt, torch.tensor([[30, 31, 32], [33, 34, 35]])), dim=1)
+    second_prompts = torch.cat((system_prompt, torch.tensor([[40, 41, 42], [43, 44, 45]])), dim=1)
+    expected = generate(model, second_prompts, reuse_cache=True)
+
+    generate(model, first_prompts, reuse_cache=True, use_prefix_cache=True, prefix_cache_chunk_size=4)
+    assert model.prefix_cache.num_hit_tokens == 0
+    tokens = generate(model, second_prompts, reuse_cache=True, use_prefix_cache=True, prefix_cache_chunk_size=4)
+
+    # Both chunks of the system prompt are loaded from the cache for both sequences
+    assert model.prefix_cache.num_hit_tokens == 2 * system_prompt.shape[1]
+    assert torch.equal(tokens, expected)
+
+
+def test_chunked_prefill_matches_a_single_prefill():
+    model = tiny_llama()
+    # 11 tokens: two full chunks of 4 tokens and a padded one
+    prompts = torch.cat((PROMPTS, torch.tensor([[17, 18, 19, 20, 21], [22, 23, 24, 25, 26]])), dim=1)
+    num_forward_calls = []
+    model.model.register_forward_pre_hook(lambda module, args: num_forward_calls.append(1))
+    kwargs = {"reuse_cache": True, "bucket_size": 4, "bucket_internal": True}
+
+    expected = generate(model, prompts, **kwargs)
+    num_unchunked_calls = len(num_forward_calls)
+    num_forward_calls.clear()
+    tokens = generate(model, prompts, prefill_chunk_size=4, **kwargs)
+
+    # The first two chunks run before the regular prefill
+    assert len(num_forward_calls) == num_unchunked_calls + 2
+    assert torch.equal(tokens, expected)
+
+
+def test_int8_kv_cache_matches_the_dense_cache():
+    model = tiny_llama()
+
+    def generate_with_scores(**kwargs):
+        with torch.no_grad():
+            return model.generate(
+                PROMPTS,
+                attention_mask=torch.ones_like(PROMPTS),
+                do_sample=False,
+                max_new_tokens=MAX_NEW_TOKENS,
+                pad_token_id=PAD_TOKEN_ID,
+                eos_token_id=None,
+                static_shapes=True,
+                reuse_cache=True,
+                lazy_mode=False,
+                return_dict_in_generate=True,
+                output_scores=True,
+                **kwargs,
+            )
+
+    expected = generate_with_scores()
+    output = generate_with_scores(kv_cache_dtype="int8")
+
+    assert isinstance(model.model.layers[0].self_attn.k_cache, QuantizedKVCache)
+    assert torch.equal(output.sequences, expected.sequences)
+    # The decode steps read keys/values rounded to int8
+    for scores, expected_scores in zip(output.scores, expected.scores):
+        torch.testing.assert_close(scores, expected_scores, atol=1e-2, rtol=0)
+
+    # The next call without kv_cache_dtype gets dense caches back
+    output = generate_with_scores()
+    assert model.kv_cache_quantization is None
+    assert type(model.model.layers[0].self_attn.k_cache) is KVCache
+    assert torch.equal(output.sequences, expected.sequences)
+
+
+LEFT_PADDED_PROMPTS = torch.tensor([[PAD_TOKEN_ID, PAD_TOKEN_ID, 5, 6, 7, 8], [9, 10, 11, 12, 13, 14]])
+LEFT_PADDED_ATTENTION_MASK = torch.tensor([[0, 0, 1, 1, 1, 1], [1, 1, 1, 1, 1, 1]])
+
+
+def tiny_mistral(sliding_window=None):
+    torch.manual_seed(0)
+    config = MistralConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        sliding_window=sliding_window,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    return GaudiMistralForCausalLM(config).eval()
+
+
+def sliding_window_reference(model, input_ids, attention_mask, window, num_sink_tokens):
+    """
+    Greedy generation without cache where every token attends to the first `num_sink_tokens` tokens after the left
+    padding and to the last `window` tokens, itself included.
+    """
+    model = copy.deepcopy(model)
+    model.config.sliding_window = None
+    sink_offsets = (attention_mask == 0).sum(-1).view(-1, 1, 1)
+    with torch.no_grad():
+        for _ in range(MAX_NEW_TOKENS):
+            positions = torch.arange(input_ids.shape[1])
+            query_positions, key_positions = positions.view(-1, 1), positions.view(1, -1)
+            is_sink = (key_positions >= sink_offsets) & (key_positions < sink_offsets + num_sink_tokens)
+            attended = (key_positions <= query_positions) & ((key_positions > query_positions - window) | is_sink)
+            attended = attended[:, None] & attention_mask.bool()[:, None, None, :]
+            position_ids = (attention_mask.cumsum(-1) - 1).masked_fill(attention_mask == 0, 1)
+            logits = model(
+                input_ids, attention_mask=attended.float(), position_ids=position_ids, use_cache=False, lazy_mode=False
+            ).logits
+            next_tokens = logits[:, -1].argmax(-1, keepdim=True)
+            input_ids = torch.cat((input_ids, next_tokens), dim=-1)
+            attention_mask = torch.cat((attention_mask, torch.ones_like(next_tokens)), dim=-1)
+    return input_ids[:, -MAX_NEW_TOKENS:]
+
+
+def test_sliding_window_kv_cache_larger_than_the_sequences_keeps_every_token():
+    model = tiny_mistral()
+    expected = generate(model, LEFT_PADDED_PROMPTS, LEFT_PADDED_ATTENTION_MASK, reuse_cache=True)
+
+    tokens = generate(
+        model,
+        LEFT_PADDED_PROMPTS,
+        LEFT_PADDED_ATTENTION_MASK,
+        reuse_cache=True,
+        kv_cache_window=64,
+        kv_cache_sink_tokens=2,
+    )
+
+    assert torch.equal(tokens, expected)
+
+
+@pytest.mark.parametrize(
+    "config_sliding_window, kv_cache_window, num_sink_tokens, expected_window",
+    [
+        (None, 4, 2, 4),
+        (None, 3, 0, 3),
+        # The window of the model caps the one of the cache
+        (5, 64, 0, 5),
+    ],
+)
+def test_sliding_window_kv_cache_matches_masked_attention(
+    config_sliding_window, kv_cache_window, num_sink_tokens, expected_window
+):
+    model = tiny_mistral(config_sliding_window)
+    expected = sliding_window_reference(
+        model, LEFT_PADDED_PROMPTS, LEFT_PADDED_ATTENTION_MASK, expected_window, num_sink_tokens
+    )
+
+    tokens = generate(
+        model,
+        LEFT_PADDED_PROMPTS,
+        LEFT_PADDED_ATTENTION_MASK,
+        reuse_cache=True,
+        kv_cache_window=kv_cache_window,
+        kv_cache_sink_tokens=num_sink_tokens,
+    )
+
+    assert model.kv_cache_sliding_window == (expected_window, num_sink_tokens)
+    assert torch.equal(tokens, expected)
@@ -0,0 +1,571 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+
+from optimum.habana.transformers import cache_utils
+from optimum.habana.transformers.cache_utils import (
+    KVCache,
+    KVCacheManager,
+    PagedBlockAllocator,
+    PagedKVCache,
+    PrefixCache,
+    QuantizedKVCache,
+    SlidingWindowKVCache,
+    expand_past_key_values,
+    paged_attention,
+    quantized_attention,
+)
+from optimum.habana.transformers.modeling_attn_mask_utils import (
+    _gaudi_prepare_4d_causal_attention_mask,
+    _gaudi_prepare_4d_causal_attention_mask_with_offset,
+)
+
+
+BATCH_SIZE = 3
+NUM_HEADS = 2
+HEAD_DIM = 4
+PROMPT_LEN = 5
+MAX_SEQ_LEN = 12
+
+
+def run_cache(cache, allocator=None, num_new_tokens=MAX_SEQ_LEN - PROMPT_LEN):
+    torch.manual_seed(0)
+    shape = (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM)
+    if allocator is not None:
+        allocator.reset(BATCH_SIZE, MAX_SEQ_LEN, torch.device("cpu"))
+        allocator.reserve_all(PROMPT_LEN)
+    cache.allocate(PROMPT_LEN, torch.float32, "cpu", shape)
+    # The contiguous cache returns itself in the decode phase, hence the clones
+    outputs = [cache(torch.randn(BATCH_SIZE, NUM_HEADS, PROMPT_LEN, HEAD_DIM), 2, torch.tensor(PROMPT_LEN)).clone()]
+    for token_idx in range(PROMPT_LEN + 1, PROMPT_LEN + 1 + num_new_tokens):
+        if allocator is not None:
+            allocator.reserve_all(token_idx)
+        outputs.append(cache(torch.randn(BATCH_SIZE, NUM_HEADS, 1, HEAD_DIM), 2, torch.tensor(token_idx)).clone())
+    return outputs
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 5, 16])
+def test_paged_kv_cache_matches_contiguous(block_size):
+    allocator = PagedBlockAllocator(block_size)
+    paged_outputs = run_cache(PagedKVCache(allocator), allocator)
+    dense_outputs = run_cache(KVCache())
+
+    for paged, dense in zip(paged_outputs, dense_outputs):
+        assert paged.shape == dense.shape
+        torch.testing.assert_close(paged, dense)
+
+
+def test_paged_kv_cache_allocates_on_demand():
+    allocator = PagedBlockAllocator(block_size=4, num_blocks=BATCH_SIZE * 2 + 1)
+    run_cache(PagedKVCache(allocator), allocator, num_new_tokens=2)
+
+    # 7 tokens per sequence fit in 2 blocks of 4, which exhausts the pool
+    assert allocator.num_free_blocks == 0
+    with pytest.raises(RuntimeError):
+        allocator.reserve(0, 9)
+
+    allocator.free(1)
+    assert allocator.num_free_blocks == 2
+    allocator.reserve(0, 9)
+    assert allocator.block_table[1].eq(PagedBlockAllocator.NULL_BLOCK).all()
+
+
+def test_paged_kv_cache_frees_finished_sequences():
+    allocator = PagedBlockAllocator(block_size=4)
+    cache = PagedKVCache(allocator)
+    run_cache(cache, allocator, num_new_tokens=2)
+    num_free_blocks = allocator.num_free_blocks
+
+    allocator.free(0, 2)
+    allocator.reserve_all(MAX_SEQ_LEN)
+
+    # Only sequence 1 grows, from 2 to 3 blocks, with one of the blocks given back
+    assert allocator.num_free_blocks == num_free_blocks + 4 - 1
+    assert allocator.block_table[0].eq(PagedBlockAllocator.NULL_BLOCK).all()
+    assert allocator.block_table[1].ne(PagedBlockAllocator.NULL_BLOCK).all()
+    assert not allocator.needs_blocks(MAX_SEQ_LEN)
+
+
+def test_paged_kv_cache_default_pool_grows():
+    allocator = PagedBlockAllocator(block_size=4)
+    allocator.reset(BATCH_SIZE, MAX_SEQ_LEN, torch.device("cpu"), PROMPT_LEN)
+    cache = PagedKVCache(allocator)
+    cache.allocate(PROMPT_LEN, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM))
+    # 2 prompt blocks and half of the 1 new block per sequence, plus the null block
+    assert allocator.num_blocks == BATCH_SIZE * 2 + 2 + 1
+    allocator.reserve_all(PROMPT_LEN)
+    key = torch.randn(BATCH_SIZE, NUM_HEADS, PROMPT_LEN, HEAD_DIM)
+    cache(key, 2, torch.tensor(PROMPT_LEN))
+
+    allocator.reserve_all(MAX_SEQ_LEN)
+
+    assert allocator.num_blocks > BATCH_SIZE * 2 + 2 + 1
+    assert cache.cache.shape[0] == allocator.num_blocks * allocator.block_size
+    torch.testing.assert_close(cache.gather(PROMPT_LEN), key)
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 5])
+def test_paged_attention_matches_dense(block_size, monkeypatch):
+    # Several reads per call
+    monkeypatch.setattr(cache_utils, "CACHE_ATTENTION_READ_SIZE", 4)
+    torch.manual_seed(0)
+    allocator = PagedBlockAllocator(block_size)
+    k_cache, v_cache = PagedKVCache(allocator), PagedKVCache(allocator)
+    allocator.reset(BATCH_SIZE, MAX_SEQ_LEN, torch.device("cpu"))
+    allocator.reserve_all(MAX_SEQ_LEN)
+    for cache in (k_cache, v_cache):
+        cache.allocate(PROMPT_LEN, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM))
+        cache.update_from(torch.randn(BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM), 0)
+    # 2 query heads per key/value head and left padding
+    query = torch.randn(BATCH_SIZE, 2 * NUM_HEADS, 1, HEAD_DIM)
+    attention_mask = torch.zeros(BATCH_SIZE, 1, 1, MAX_SEQ_LEN - 1)
+    attention_mask[:, :, :, PROMPT_LEN + 2 :] = torch.finfo(torch.float32).min
+    attention_mask[1, :, :, :2] = torch.finfo(torch.float32).min
+
+    output = paged_attention(query, k_cache, v_cache, attention_mask, HEAD_DIM**-0.5)
+
+    key = k_cache.gather(MAX_SEQ_LEN - 1).repeat_interleave(2, dim=1)
+    value = v_cache.gather(MAX_SEQ_LEN - 1).repeat_interleave(2, dim=1)
+    expected = attention(query * HEAD_DIM**-0.5, key, value, attention_mask)
+    torch.testing.assert_close(output, expected)
+
+
+def test_paged_kv_cache_reorder():
+    allocator = PagedBlockAllocator(block_size=4)
+    cache = PagedKVCache(allocator)
+    run_cache(cache, allocator, num_new_tokens=3)
+    beam_idx = torch.tensor([2, 0, 0])
+    expected = cache.gather().index_select(0, beam_idx)
+
+    cache.reorder(beam_idx)
+
+    torch.testing.assert_close(cache.gather(), expected)
+
+
+@pytest.mark.parametrize("granularity", ["head", "token"])
+@pytest.mark.parametrize("dtype, rtol", [("int8", 0.02), ("fp8", 0.1)])
+def test_quantized_kv_cache_matches_contiguous(dtype, rtol, granularity):
+    quantized_outputs = run_cache(QuantizedKVCache(dtype, granularity))
+    dense_outputs = run_cache(KVCache())
+
+    for quantized, dense in zip(quantized_outputs, dense_outputs):
+        assert quantized.shape == dense.shape
+        assert quantized.dtype == dense.dtype
+        # Tokens written after the prompt are clipped to the range of the per-head scales
+        if granularity == "head":
+            bound = quantized.abs().amax(dim=(-2, -1), keepdim=True)
+            dense = dense.clamp(-bound, bound)
+        torch.testing.assert_close(quantized, dense, rtol=0, atol=rtol * dense.abs().max().item())
+
+
+@pytest.mark.parametrize("granularity", ["head", "token"])
+def test_quantized_attention_matches_dense(granularity, monkeypatch):
+    # Several reads per call
+    monkeypatch.setattr(cache_utils, "CACHE_ATTENTION_READ_SIZE", 5)
+    torch.manual_seed(0)
+    k_cache, v_cache = QuantizedKVCache("int8", granularity), QuantizedKVCache("int8", granularity)
+    for cache in (k_cache, v_cache):
+        cache.allocate(PROMPT_LEN, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM))
+        cache.update_from(torch.randn(BATCH_SIZE, NUM_HEADS, PROMPT_LEN, HEAD_DIM), 0)
+        # Decode steps only write the new token
+        cache.scatter(torch.randn(BATCH_SIZE, NUM_HEADS, 1, HEAD_DIM), torch.tensor(PROMPT_LEN))
+    query = torch.randn(BATCH_SIZE, 2 * NUM_HEADS, 1, HEAD_DIM)
+    attention_mask = torch.zeros(BATCH_SIZE, 1, 1, MAX_SEQ_LEN - 1)
+    attention_mask[:, :, :, PROMPT_LEN + 1 :] = torch.finfo(torch.float32).min
+    attention_mask[1, :, :, :2] = torch.finfo(torch.float32).min
+
+    output = quantized_attention(query, k_cache, v_cache, attention_mask, HEAD_DIM**-0.5)
+
+    key = k_cache.gather(MAX_SEQ_LEN - 1).repeat_interleave(2, dim=1)
+    value = v_cache.gather(MAX_SEQ_LEN - 1).repeat_interleave(2, dim=1)
+    expected = attention(query * HEAD_DIM**-0.5, key, value, attention_mask)
+    torch.testing.assert_close(output, expected)
+
+
+def test_quantized_kv_cache_memory():
+    cache = QuantizedKVCache("int8")
+    cache.allocate(PROMPT_LEN, torch.bfloat16, "cpu", (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, 128))
+
+    dense_bytes = BATCH_SIZE * NUM_HEADS * MAX_SEQ_LEN * 128 * torch.bfloat16.itemsize
+    assert cache.memory_bytes < 0.55 * dense_bytes
+    assert cache.gather().dtype == torch.bfloat16
+
+
+def test_quantized_kv_cache_per_sequence_offsets_and_reorder():
+    torch.manual_seed(0)
+    cache = QuantizedKVCache("int8")
+    cache.allocate(PROMPT_LEN, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM))
+    cache.update_from(torch.randn(BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM), 0)
+    expected = cache.gather().clone()
+    offsets = torch.tensor([5, 2, 7])
+    cur = torch.randn(BATCH_SIZE, NUM_HEADS, 3, HEAD_DIM)
+
+    outputs = cache.update_from(cur, offsets)
+
+    for i, offset in enumerate(offsets.tolist()):
+        expected[i, :, offset : offset + 3] = cur[i]
+    torch.testing.assert_close(outputs, expected, rtol=0, atol=0.02 * expected.abs().max().item())
+
+    beam_idx = torch.tensor([2, 0, 0])
+    reordered = outputs.index_select(0, beam_idx)
+    cache.reorder(beam_idx)
+    torch.testing.assert_close(cache.gather(), reordered)
+
+
+class ToyAttention(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.k_cache = KVCache()
+        self.v_cache = KVCache()
+
+    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
+        shape = (batch_size, NUM_HEADS, max_seq_len, HEAD_DIM)
+        self.k_cache.allocate(inp_seq_len, torch.float32, "cpu", shape)
+        self.v_cache.allocate(inp_seq_len, torch.float32, "cpu", shape)
+
+
+def test_kv_cache_manager_storage_modes():
+    layers = [ToyAttention(), ToyAttention()]
+    manager = KVCacheManager(layers)
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    dense_bytes = 2 * len(layers) * BATCH_SIZE * NUM_HEADS * MAX_SEQ_LEN * HEAD_DIM * 4
+    assert manager.memory_bytes == dense_bytes
+
+    allocator = manager.enable_paged(block_size=4)
+    assert manager.enable_paged(block_size=4) is allocator
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    assert all(isinstance(cache, PagedKVCache) for caches in manager.get_kv_caches() for cache in caches)
+    assert allocator.block_table.shape == (BATCH_SIZE, 3)
+
+    manager.enable_quantized("int8")
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    assert manager.allocator is None
+    assert isinstance(layers[0].k_cache, QuantizedKVCache)
+    # One byte per value and a float32 scale per head of every token
+    assert manager.memory_bytes == dense_bytes // 4 + dense_bytes // HEAD_DIM
+
+    manager.enable_quantized(None)
+    assert type(layers[1].v_cache) is KVCache
+
+
+def test_kv_cache_manager_reorder():
+    torch.manual_seed(0)
+    layers = [ToyAttention(), ToyAttention()]
+    manager = KVCacheManager(layers)
+    assert manager.reorder(torch.tensor([0, 0, 1])) == ((None, None), (None, None))
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    for k_cache, v_cache in manager.get_kv_caches():
+        k_cache.cache.normal_()
+        v_cache.cache.normal_()
+    beam_idx = torch.tensor([2, 0, 0])
+    expected = [
+        (k.cache.index_select(0, beam_idx), v.cache.index_select(0, beam_idx)) for k, v in manager.get_kv_caches()
+    ]
+
+    shapes = manager.reorder(beam_idx)
+
+    assert shapes == ((torch.Size((BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM)),) * 2,) * 2
+    for (k_cache, v_cache), (expected_k, expected_v) in zip(manager.get_kv_caches(), expected):
+        torch.testing.assert_close(k_cache.cache, expected_k)
+        torch.testing.assert_close(v_cache.cache, expected_v)
+
+
+def sliding_window_reference_mask(attention_mask, window, num_sink_tokens):
+    positions = torch.arange(attention_mask.shape[-1])
+    query_positions, key_positions = positions.view(-1, 1), positions.view(1, -1)
+    # The sinks are the first tokens after the left padding
+    sink_offsets = (attention_mask == 0).sum(-1).view(-1, 1, 1)
+    is_sink = (key_positions >= sink_offsets) & (key_positions < sink_offsets + num_sink_tokens)
+    attended = (key_positions <= query_positions) & ((key_positions > query_positions - window) | is_sink)
+    attended = attended[:, None] & attention_mask.bool()[:, None, None, :]
+    return torch.zeros(attended.shape).masked_fill(~attended, torch.finfo(torch.float32).min)
+
+
+@pytest.mark.parametrize("window, num_sink_tokens", [(3, 0), (3, 2), (4, 1), (20, 2)])
+def test_sliding_window_kv_cache_matches_masked_attention(window, num_sink_tokens):
+    torch.manual_seed(0)
+    query, key, value = (torch.randn(BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM) for _ in range(3))
+    attention_mask = torch.ones(BATCH_SIZE, MAX_SEQ_LEN, dtype=torch.long)
+    attention_mask[1, :2] = 0
+    # The sinks of this sequence are not all in the prompt
+    attention_mask[2, : PROMPT_LEN - 1] = 0
+    expected = attention(query, key, value, sliding_window_reference_mask(attention_mask, window, num_sink_tokens))
+
+    manager = KVCacheManager([ToyAttention()])
+    manager.enable_sliding_window(window, num_sink_tokens)
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    manager.set_sink_offsets(attention_mask[:, :PROMPT_LEN], BATCH_SIZE)
+    k_cache, v_cache = manager.get_kv_caches()[0]
+    inputs_embeds = torch.zeros(BATCH_SIZE, PROMPT_LEN, 1)
+    mask = _gaudi_prepare_4d_causal_attention_mask(
+        attention_mask[:, :PROMPT_LEN],
+        (BATCH_SIZE, PROMPT_LEN),
+        inputs_embeds,
+        0,
+        kv_cache_window=manager.sliding_window_layout,
+        token_idx=torch.tensor(PROMPT_LEN),
+    )
+    prompt = slice(0, PROMPT_LEN)
+    outputs = [
+        attention(
+            query[:, :, prompt], k_cache(key[:, :, prompt], 2, None), v_cache(value[:, :, prompt], 2, None), mask
+        )
+    ]
+    for position in range(PROMPT_LEN, MAX_SEQ_LEN):
+        token_idx = torch.tensor(position + 1)
+        mask = _gaudi_prepare_4d_causal_attention_mask(
+            attention_mask,
+            (BATCH_SIZE, 1),
+            inputs_embeds,
+            0,
+            kv_cache_window=manager.sliding_window_layout,
+            token_idx=token_idx,
+        )
+        new_token = slice(position, position + 1)
+        keys, values = k_cache(key[:, :, new_token], 2, token_idx), v_cache(value[:, :, new_token], 2, token_idx)
+        assert keys.shape[2] == sum(manager.sliding_window_layout) <= MAX_SEQ_LEN
+        outputs.append(attention(query[:, :, new_token], keys, values, mask))
+
+    # The outputs of padding positions are not meaningful
+    valid = attention_mask.bool()[:, None, :, None].expand_as(expected)
+    torch.testing.assert_close(torch.cat(outputs, dim=2)[valid], expected[valid])
+
+
+def test_sliding_window_kv_cache_memory():
+    layers = [ToyAttention(), ToyAttention()]
+    manager = KVCacheManager(layers)
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    dense_bytes = manager.memory_bytes
+
+    manager.enable_sliding_window(window=2, num_sink_tokens=1)
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    assert isinstance(layers[1].v_cache, SlidingWindowKVCache)
+    assert manager.memory_bytes == dense_bytes * 3 // MAX_SEQ_LEN
+    assert layers[0].k_cache.get_shape() == (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM)
+
+    # The window is capped by the sequence length
+    manager.enable_sliding_window(window=4096, num_sink_tokens=4)
+    manager.allocate(BATCH_SIZE, MAX_SEQ_LEN, PROMPT_LEN, torch.device("cpu"))
+    assert manager.sliding_window_layout == (MAX_SEQ_LEN - 4, 4)
+    assert manager.memory_bytes == dense_bytes
+
+    manager.enable_quantized("int8")
+    assert manager.sliding_window is None
+    manager.enable_sliding_window(window=2)
+    manager.enable_sliding_window(None)
+    assert type(layers[0].k_cache) is KVCache
+
+
+@pytest.mark.parametrize("model_type", ["llama", "bloom"])
+def test_expand_past_key_values_matches_padding(model_type):
+    torch.manual_seed(0)
+    bucket_size, pad_value = 4, 7
+    if model_type == "bloom":
+        shapes = [(BATCH_SIZE * NUM_HEADS, HEAD_DIM, bucket_size), (BATCH_SIZE * NUM_HEADS, bucket_size, HEAD_DIM)]
+        pads = [(0, bucket_size), (0, 0, 0, bucket_size)]
+    else:
+        shapes = [(BATCH_SIZE, NUM_HEADS, bucket_size, HEAD_DIM)] * 2
+        pads = [(0, 0, 0, bucket_size)] * 2
+    past_key_values = tuple(tuple(torch.randn(shape) for shape in shapes) for _ in range(2))
+    expected = past_key_values
+
+    for prev_len in range(bucket_size, 4 * bucket_size, bucket_size):
+        past_key_values = expand_past_key_values(
+            past_key_values, prev_len, bucket_size, bucket_size, pad_value, model_type
+        )
+        expected = tuple(
+            tuple(torch.nn.functional.pad(t, pad, value=pad_value) for t, pad in zip(layer_past, pads))
+            for layer_past in expected
+        )
+        for layer_past, expected_layer_past in zip(past_key_values, expected):
+            for tensor, expected_tensor in zip(layer_past, expected_layer_past):
+                torch.testing.assert_close(tensor, expected_tensor)
+
+
+def test_expand_past_key_values_reuses_buffers():
+    bucket_size = 4
+    past_key_values = ((torch.randn(BATCH_SIZE, NUM_HEADS, bucket_size, HEAD_DIM),) * 2,)
+
+    first = expand_past_key_values(past_key_values, bucket_size, bucket_size, bucket_size, 0, "llama")
+    # The models write the new tokens in place
+    first[0][0][:, :, bucket_size].fill_(1)
+    second = expand_past_key_values(first, 2 * bucket_size, bucket_size, bucket_size, 0, "llama")
+
+    assert second[0][0].shape[2] == 3 * bucket_size
+    assert second[0][0].data_ptr() == first[0][0].data_ptr()
+    assert second[0][0][:, :, bucket_size].eq(1).all()
+    assert second[0][0][:, :, bucket_size + 1 :].eq(0).all()
+    # The buffers only have room for one more bucket
+    assert second[0][0]._base.shape[2] == 3 * bucket_size
+    third = expand_past_key_values(second, 3 * bucket_size, bucket_size, bucket_size, 0, "llama")
+    assert third[0][0]._base.shape[2] == 5 * bucket_size
+    torch.testing.assert_close(third[0][0][:, :, : 3 * bucket_size], second[0][0])
+
+
+def make_kv_caches(num_layers=2, seq_len=MAX_SEQ_LEN):
+    kv_caches = []
+    for _ in range(num_layers):
+        k_cache, v_cache = KVCache(), KVCache()
+        k_cache.allocate(PROMPT_LEN, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, seq_len, HEAD_DIM))
+        v_cache.allocate(PROMPT_LEN, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, seq_len, HEAD_DIM))
+        kv_caches.append((k_cache, v_cache))
+    return kv_caches
+
+
+def test_prefix_cache_store_and_load():
+    torch.manual_seed(0)
+    prefix_cache = PrefixCache(chunk_size=4)
+    input_ids = torch.randint(0, 100, (BATCH_SIZE, 10))
+    src_caches = make_kv_caches()
+    for k_cache, v_cache in src_caches:
+        k_cache.update_from(torch.randn(BATCH_SIZE, NUM_HEADS, 10, HEAD_DIM), 0)
+        v_cache.update_from(torch.randn(BATCH_SIZE, NUM_HEADS, 10, HEAD_DIM), 0)
+
+    batch_keys, num_chunks = prefix_cache.match(input_ids)
+    assert num_chunks == 0
+    prefix_cache.store(src_caches, batch_keys)
+    assert len(prefix_cache) == BATCH_SIZE * 2
+
+    # Same first 8 tokens, different suffix: both complete chunks are hits
+    new_input_ids = torch.cat([input_ids[:, :8], torch.randint(100, 200, (BATCH_SIZE, 3))], dim=-1)
+    batch_keys, num_chunks = prefix_cache.match(new_input_ids)
+    assert num_chunks == 2
+    dst_caches = make_kv_caches()
+    assert prefix_cache.load(dst_caches, batch_keys, num_chunks) == 8
+    for (src_k, src_v), (dst_k, dst_v) in zip(src_caches, dst_caches):
+        torch.testing.assert_close(dst_k.gather(8), src_k.gather(8))
+        torch.testing.assert_close(dst_v.gather(8), src_v.gather(8))
+
+    # A different first chunk invalidates the whole prefix
+    new_input_ids[0, 0] += 1
+    assert prefix_cache.match(new_input_ids)[1] == 0
+
+
+def test_prefix_cache_evicts_longest_prefixes_first():
+    kv_caches = make_kv_caches(num_layers=1)
+    entry_size = 2 * NUM_HEADS * 4 * HEAD_DIM * 4
+    prefix_cache = PrefixCache(chunk_size=4, max_memory_bytes=2 * entry_size)
+    input_ids = torch.arange(12).expand(BATCH_SIZE, 12)
+
+    batch_keys, _ = prefix_cache.match(input_ids)
+    prefix_cache.store(kv_caches, batch_keys)
+
+    assert len(prefix_cache) == 2
+    assert prefix_cache.memory_usage == 2 * entry_size
+    assert batch_keys[0][2] not in prefix_cache.entries
+    assert prefix_cache.match(input_ids)[1] == 2
+
+
+@pytest.mark.parametrize("prefill_offset", [1, 4, 7])
+def test_causal_mask_with_offset_matches_full_prefill(prefill_offset):
+    seq_len = 8
+    attention_mask = torch.ones(BATCH_SIZE, MAX_SEQ_LEN, dtype=torch.long)
+    attention_mask[0, :3] = 0
+    inputs_embeds = torch.zeros(BATCH_SIZE, seq_len, 1)
+    full_mask = _gaudi_prepare_4d_causal_attention_mask(
+        attention_mask[:, :seq_len], (BATCH_SIZE, seq_len), inputs_embeds, 0
+    )
+
+    mask = _gaudi_prepare_4d_causal_attention_mask_with_offset(
+        attention_mask, seq_len - prefill_offset, prefill_offset, inputs_embeds.dtype
+    )
+
+    torch.testing.assert_close(mask, full_mask[:, :, prefill_offset:, :])
+
+
+def attention(query, key, value, mask):
+    scores = query @ key.transpose(-1, -2) + mask
+    return torch.softmax(scores, dim=-1) @ value
+
+
+@pytest.mark.parametrize("cache_cls", [KVCache, PagedKVCache])
+def test_chunked_prefill_matches_full_prefill(cache_cls):
+    torch.manual_seed(0)
+    seq_len, chunk_size = 10, 4
+    query, key, value = (torch.randn(BATCH_SIZE, NUM_HEADS, seq_len, HEAD_DIM) for _ in range(3))
+    attention_mask = torch.ones(BATCH_SIZE, seq_len, dtype=torch.long)
+    attention_mask[1, :2] = 0
+    full_mask = _gaudi_prepare_4d_causal_attention_mask(
+        attention_mask, (BATCH_SIZE, seq_len), torch.zeros(BATCH_SIZE, seq_len, 1), 0
+    )
+    expected = attention(query, key, value, full_mask)
+
+    if cache_cls is PagedKVCache:
+        allocator = PagedBlockAllocator(block_size=3)
+        allocator.reset(BATCH_SIZE, MAX_SEQ_LEN, torch.device("cpu"))
+        allocator.reserve_all(seq_len)
+        k_cache, v_cache = PagedKVCache(allocator), PagedKVCache(allocator)
+    else:
+        k_cache, v_cache = KVCache(), KVCache()
+    for cache in (k_cache, v_cache):
+        cache.allocate(seq_len, torch.float32, "cpu", (BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM))
+    # The last chunk is right-padded to `chunk_size` with tokens masked out by the static-shape attention mask
+    padded_query, padded_key, padded_value = (
+        torch.cat([t, torch.randn(BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN - seq_len, HEAD_DIM)], dim=2)
+        for t in (query, key, value)
+    )
+    padded_mask = torch.nn.functional.pad(attention_mask, (0, MAX_SEQ_LEN - seq_len))
+    outputs = []
+    for start in range(0, seq_len, chunk_size):
+        stop = start + chunk_size
+        mask = _gaudi_prepare_4d_causal_attention_mask_with_offset(padded_mask, chunk_size, start, torch.float32)
+        outputs.append(
+            attention(
+                padded_query[:, :, start:stop],
+                k_cache.update_from(padded_key[:, :, start:stop], start),
+                v_cache.update_from(padded_value[:, :, start:stop], start),
+                mask,
+            )
+        )
+
+    # The outputs of padding positions are not meaningful
+    valid = attention_mask.bool()[:, None, :, None].expand_as(expected)
+    torch.testing.assert_close(torch.cat(outputs, dim=2)[:, :, :seq_len][valid], expected[valid])
+
+
+def test_per_sequence_offsets_match_per_sequence_updates():
+    torch.manual_seed(0)
+    query_length = 3
+    offsets = torch.tensor([5, 2, 7])
+    query, key, value = (torch.randn(BATCH_SIZE, NUM_HEADS, query_length, HEAD_DIM) for _ in range(3))
+    attention_mask = torch.ones(BATCH_SIZE, MAX_SEQ_LEN, dtype=torch.long)
+    attention_mask[1, 0] = 0
+    k_cache, v_cache = make_kv_caches(num_layers=1)[0]
+    for cache in (k_cache, v_cache):
+        cache.update_from(torch.randn(BATCH_SIZE, NUM_HEADS, MAX_SEQ_LEN, HEAD_DIM), 0)
+    expected_k, expected_v = k_cache.gather().clone(), v_cache.gather().clone()
+
+    mask = _gaudi_prepare_4d_causal_attention_mask_with_offset(attention_mask, query_length, offsets, torch.float32)
+    outputs = attention(query, k_cache.update_from(key, offsets), v_cache.update_from(value, offsets), mask)
+
+    assert mask.shape == (BATCH_SIZE, 1, query_length, MAX_SEQ_LEN)
+    for i, offset in enumerate(offsets.tolist()):
+        expected_k[i, :, offset : offset + query_length] = key[i]
+        expected_v[i, :, offset : offset + query_length] = value[i]
+        # Same as writing the sequence alone at its offset, the stale entries after it are masked out
+        row_mask = _gaudi_prepare_4d_causal_attention_mask_with_offset(
+            attention_mask[i : i + 1], query_length, offset, torch.float32
+        )
+        expected = attention(
+            query[i : i + 1],
+            expected_k[i : i + 1, :, : offset + query_length],
+            expected_v[i : i + 1, :, : offset + query_length],
+            row_mask,
+        )
+        torch.testing.assert_close(outputs[i : i + 1], expected)
+    torch.testing.assert_close(k_cache.gather(), expected_k)
+    torch.testing.assert_close(v_cache.gather(), expected_v)
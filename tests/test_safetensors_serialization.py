@@ -0,0 +1,194 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from optimum.habana.distributed.serialization import (
+    LazySafetensorsDict,
+    SafetensorsFile,
+    SafetensorsHandlePool,
+    load_state_dict,
+    load_state_dict_into_model,
+)
+from optimum.habana.distributed.tp import TPModule
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(16, 8)
+        self.layers = torch.nn.ModuleList([torch.nn.Linear(8, 8) for _ in range(3)])
+        self.head = torch.nn.Linear(8, 4, bias=False)
+
+
+class TinyTPFeedForward(TPModule):
+    def __init__(self, hidden_size, intermediate_size, rank=0, world_size=1):
+        super().__init__()
+        self.w1 = torch.nn.Linear(hidden_size, intermediate_size // world_size)
+        self.w2 = torch.nn.Linear(intermediate_size // world_size, hidden_size)
+        self.setup_tp(rank, world_size)
+
+    def colwise_param_names(self):
+        return ["w1"]
+
+    def rowwise_param_names(self):
+        return ["w2"]
+
+    @staticmethod
+    def import_module(module, group):
+        raise NotImplementedError
+
+
+class TinyTPModel(torch.nn.Module):
+    def __init__(self, rank=0, world_size=1):
+        super().__init__()
+        self.norm = torch.nn.LayerNorm(8)
+        self.ff = TinyTPFeedForward(8, 16, rank, world_size)
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    torch.manual_seed(0)
+    state_dict = TinyModel().state_dict()
+    keys = list(state_dict.keys())
+    # Two shards
+    save_file({k: state_dict[k].clone() for k in keys[::2]}, tmp_path / "model-00001-of-00002.safetensors")
+    save_file({k: state_dict[k].clone() for k in keys[1::2]}, tmp_path / "model-00002-of-00002.safetensors")
+    return tmp_path, state_dict
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16, torch.float16, torch.int64, torch.int8, torch.bool])
+def test_handle_matches_safe_open(tmp_path, dtype):
+    path = tmp_path / "weights.safetensors"
+    tensors = {
+        "a": torch.randn(3, 5).to(dtype),
+        "b": torch.randn(7).to(dtype),
+        "empty": torch.zeros(0, 4, dtype=dtype),
+    }
+    save_file(tensors, path)
+
+    handle = SafetensorsHandlePool().get(path)
+    with safe_open(path, framework="pt") as f:
+        for key in tensors:
+            torch.testing.assert_close(handle.get_tensor(key), f.get_tensor(key))
+
+
+def test_handle_pool_returns_zero_copy_views(tmp_path):
+    path = tmp_path / "weights.safetensors"
+    save_file({"a": torch.arange(8, dtype=torch.float32), "b": torch.ones(4, dtype=torch.float32)}, path)
+    pool = SafetensorsHandlePool()
+
+    handle = pool.get(path)
+    assert pool.get(str(path)) is handle
+    a, b = handle.get_tensor("a"), handle.get_tensor("b")
+    start_a, _ = handle.byte_range("a")
+    start_b, _ = handle.byte_range("b")
+    # Both tensors view the same mapping
+    assert b.data_ptr() - a.data_ptr() == start_b - start_a
+
+    # The mapping is copy-on-write
+    a.add_(1)
+    with safe_open(path, framework="pt") as f:
+        torch.testing.assert_close(f.get_tensor("a"), torch.arange(8, dtype=torch.float32))
+
+
+def test_prefetch_matches_lazy_loading(checkpoint):
+    path, state_dict = checkpoint
+    lazy_sd = load_state_dict(str(path))
+    prefetched_sd = load_state_dict(str(path))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for sd in prefetched_sd.maps:
+            assert isinstance(sd, LazySafetensorsDict)
+            sd.prefetch(list(sd.keys()), executor)
+        for key, value in state_dict.items():
+            torch.testing.assert_close(prefetched_sd[key], value)
+            torch.testing.assert_close(lazy_sd[key], value)
+
+
+@pytest.mark.parametrize("prefetch_window", [0, 1, 16])
+def test_load_state_dict_into_model(checkpoint, prefetch_window):
+    path, state_dict = checkpoint
+    model = TinyModel()
+    lazy_sd = load_state_dict(str(path))
+
+    load_state_dict_into_model(model, lazy_sd, "tiny", "fms", prefetch_window=prefetch_window)
+
+    assert len(lazy_sd) == 0
+    for key, value in model.state_dict().items():
+        torch.testing.assert_close(value, state_dict[key])
+
+
+@pytest.mark.parametrize("dim", [0, 1, 2, -1])
+def test_read_slice_matches_narrow(tmp_path, dim):
+    path = tmp_path / "weights.safetensors"
+    tensors = {"a": torch.randn(4, 6, 8).to(torch.bfloat16), "b": torch.arange(4 * 6 * 8).view(4, 6, 8)}
+    save_file(tensors, path)
+    handle = SafetensorsFile(path)
+
+    for key, tensor in tensors.items():
+        for start, length in [(0, 2), (1, 3), (2, 2), (0, 4), (3, 0)]:
+            torch.testing.assert_close(handle.read_slice(key, dim, start, length), tensor.narrow(dim, start, length))
+    with pytest.raises(IndexError):
+        handle.read_slice("a", dim, 7, 2)
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 4])
+def test_sharded_reads_only_read_the_rank_shard(tmp_path, monkeypatch, world_size):
+    torch.manual_seed(0)
+    full_model = TinyTPModel()
+    save_file(full_model.state_dict(), tmp_path / "model.safetensors")
+    tp_weights_size = sum(
+        p.numel() * p.element_size() for name, p in full_model.named_parameters() if name.startswith("ff.")
+    )
+
+    num_bytes_read = []
+    pread = SafetensorsFile._pread
+
+    def counting_pread(self, buffer, offset):
+        num_bytes_read.append(len(buffer))
+        pread(self, buffer, offset)
+
+    monkeypatch.setattr(SafetensorsFile, "_pread", counting_pread)
+    for rank in range(world_size):
+        num_bytes_read.clear()
+        model = TinyTPModel(rank, world_size)
+        load_state_dict_into_model(
+            model,
+            load_state_dict(str(tmp_path)),
+            "tiny",
+            None,
+            distributed_strategy="tp",
+            rank=rank,
+            world_size=world_size,
+        )
+
+        full_ff = full_model.ff
+        shard = 16 // world_size
+        torch.testing.assert_close(model.norm.weight, full_model.norm.weight)
+        torch.testing.assert_close(model.ff.w1.weight, full_ff.w1.weight[rank * shard : (rank + 1) * shard])
+        torch.testing.assert_close(model.ff.w1.bias, full_ff.w1.bias[rank * shard : (rank + 1) * shard])
+        torch.testing.assert_close(model.ff.w2.weight, full_ff.w2.weight[:, rank * shard : (rank + 1) * shard])
+        torch.testing.assert_close(
+            model.ff.w2.bias, full_ff.w2.bias if rank == 0 else torch.zeros_like(full_ff.w2.bias)
+        )
+        # Sharded reads are enabled by default when TP-sharding safetensors weights: the bias of the rowwise layer is
+        # not sharded, the other weights are read by every rank in 1 / world_size
+        assert sum(num_bytes_read) == (tp_weights_size - full_ff.w2.bias.numel() * 4) // world_size
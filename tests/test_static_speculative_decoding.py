@@ -0,0 +1,241 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+from types import SimpleNamespace
+
+import torch
+
+from optimum.habana.transformers.generation import GaudiStaticDraftCandidateGenerator, SpeculativeDecodingStats
+from optimum.habana.transformers.generation.candidate_generator import (
+    greedy_acceptance,
+    speculative_sampling_acceptance,
+)
+from optimum.habana.transformers.modeling_utils import adapt_transformers_to_gaudi
+from optimum.habana.transformers.models import GaudiLlamaForCausalLM
+from optimum.habana.transformers.models.llama.configuration_llama import LlamaConfig
+
+
+adapt_transformers_to_gaudi()
+
+VOCAB_SIZE = 8
+PAD_TOKEN_ID = 0
+
+
+def one_hot_logits(tokens):
+    return torch.nn.functional.one_hot(tokens, VOCAB_SIZE).float() * 10
+
+
+def test_greedy_acceptance():
+    draft_tokens = torch.tensor([[1, 2, 3], [1, 5, 3], [4, 2, 3]])
+    target_tokens = torch.tensor([[1, 2, 3, 7], [1, 2, 3, 7], [1, 2, 3, 7]])
+
+    num_accepted, new_tokens = greedy_acceptance(draft_tokens, one_hot_logits(target_tokens))
+
+    assert num_accepted.tolist() == [3, 1, 0]
+    # The first `num_accepted + 1` new tokens are the accepted draft tokens and the target token after them
+    for i in range(3):
+        assert new_tokens[i, : num_accepted[i] + 1].tolist() == target_tokens[i, : num_accepted[i] + 1].tolist()
+
+
+def test_speculative_sampling_acceptance_keeps_the_target_distribution():
+    torch.manual_seed(0)
+    num_samples = 20000
+    target_probs = torch.tensor([0.5, 0.3, 0.2, 0, 0, 0, 0, 0]).expand(num_samples, 2, VOCAB_SIZE)
+    draft_probs = torch.tensor([0.2, 0.2, 0.6, 0, 0, 0, 0, 0]).expand(num_samples, 1, VOCAB_SIZE)
+    draft_tokens = torch.multinomial(draft_probs[:, 0], num_samples=1)
+
+    num_accepted, new_tokens = speculative_sampling_acceptance(draft_tokens, draft_probs, target_probs)
+
+    # The first new token follows the target distribution whatever the draft one
+    frequencies = torch.bincount(new_tokens[:, 0], minlength=VOCAB_SIZE).float() / num_samples
+    torch.testing.assert_close(frequencies, target_probs[0, 0], atol=0.02, rtol=0)
+    # Acceptance rate is the sum of min(p, q)
+    assert abs(num_accepted.float().mean().item() - 0.6) < 0.02
+    # Accepted tokens are kept
+    accepted = num_accepted == 1
+    assert torch.equal(new_tokens[accepted, 0], draft_tokens[accepted, 0])
+
+
+def test_speculative_sampling_acceptance_with_equal_distributions():
+    torch.manual_seed(0)
+    probs = torch.softmax(torch.randn(4, 4, VOCAB_SIZE), dim=-1)
+    draft_tokens = torch.multinomial(probs[:, 0], num_samples=3)
+
+    num_accepted, new_tokens = speculative_sampling_acceptance(draft_tokens, probs[:, :3], probs)
+
+    assert num_accepted.tolist() == [3] * 4
+    assert torch.equal(new_tokens[:, :3], draft_tokens)
+
+
+class CountingModel(torch.nn.Module):
+    """Predicts the previous token + 1 and records where the keys/values of every forward pass are written."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def allocate_kv_cache(self, batch_size, max_seq_len, inp_seq_len):
+        self.cache_shape = (batch_size, max_seq_len)
+
+    def forward(self, input_ids, attention_mask, position_ids, prefill_offset, logits_to_keep, **kwargs):
+        self.writes.append((prefill_offset, input_ids.clone()))
+        next_tokens = (input_ids[:, -1:] + 1) % VOCAB_SIZE
+        return SimpleNamespace(logits=one_hot_logits(next_tokens))
+
+
+def test_static_draft_candidate_generator():
+    model = CountingModel()
+    generator = GaudiStaticDraftCandidateGenerator(model, num_speculative_tokens=3)
+    input_ids = torch.tensor([[0, 1, 2, 0, 0, 0, 0, 0, 0, 0], [3, 4, 5, 0, 0, 0, 0, 0, 0, 0]])
+    attention_mask = torch.ones_like(input_ids)
+    generator.prefill(input_ids[:, :3], attention_mask, attention_mask.cumsum(-1) - 1)
+    assert model.cache_shape == (2, 10)
+
+    input_ids[:, 3] = torch.tensor([3, 6])
+    input_ids[1, 4] = 7
+    cursor = torch.tensor([3, 4])
+    draft_tokens, draft_probs = generator.get_candidates(input_ids, cursor)
+
+    assert draft_tokens.tolist() == [[4, 5, 6], [0, 1, 2]]
+    assert draft_probs is None
+    # The last token and every draft token are written at the position of each sequence
+    offsets = [offset.tolist() for offset, _ in model.writes[1:]]
+    assert offsets == [[3, 4], [4, 5], [5, 6], [6, 7]]
+    assert [tokens[:, 0].tolist() for _, tokens in model.writes[1:]] == [[3, 7], [4, 0], [5, 1], [6, 2]]
+
+
+def test_speculative_decoding_stats():
+    stats = SpeculativeDecodingStats(num_speculative_tokens=4, device="cpu")
+    stats.update(torch.tensor([4, 2, 0]), torch.tensor([True, True, False]))
+    stats.update(torch.tensor([1, 3, 3]), torch.tensor([True, False, False]))
+
+    assert stats.to_dict() == {
+        "num_speculative_tokens": 4,
+        "num_rounds": 2,
+        "num_drafted_tokens": 12,
+        "num_accepted_tokens": 7,
+        "acceptance_rate": 7 / 12,
+        "mean_tokens_per_round": 10 / 3,
+    }
+
+
+def tiny_llama():
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    return GaudiLlamaForCausalLM(config).eval()
+
+
+def generate_greedy(model, input_ids, max_new_tokens, **kwargs):
+    with torch.no_grad():
+        output = model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            do_sample=False,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=PAD_TOKEN_ID,
+            eos_token_id=None,
+            static_shapes=True,
+            use_cache=True,
+            reuse_cache=True,
+            lazy_mode=False,
+            **kwargs,
+        )
+    return output[:, input_ids.shape[1] :]
+
+
+def simulate_greedy_speculative_decoding(reference, rejected_tokens, num_speculative_tokens, max_new_tokens):
+    """
+    Replays greedy static speculative decoding with a draft model that only disagrees with the target model when the
+    target token is in `rejected_tokens`, returns the expected statistics and the accepted tokens and verification
+    rounds of every row.
+    """
+    batch_size = reference.shape[0]
+    num_generated = [1] * batch_size
+    accepted_per_row = [0] * batch_size
+    rounds_per_row = [0] * batch_size
+    num_rounds = 0
+    num_sequence_rounds = 0
+    while any(n < max_new_tokens for n in num_generated):
+        num_rounds += 1
+        for i in range(batch_size):
+            if num_generated[i] >= max_new_tokens:
+                continue
+            num_accepted = 0
+            while (
+                num_accepted < num_speculative_tokens
+                and reference[i, num_generated[i] + num_accepted].item() not in rejected_tokens
+            ):
+                num_accepted += 1
+            accepted_per_row[i] += num_accepted
+            rounds_per_row[i] += 1
+            num_sequence_rounds += 1
+            num_generated[i] += min(num_accepted + 1, max_new_tokens - num_generated[i])
+    num_accepted_tokens = sum(accepted_per_row)
+    stats = {
+        "num_speculative_tokens": num_speculative_tokens,
+        "num_rounds": num_rounds,
+        "num_drafted_tokens": num_sequence_rounds * num_speculative_tokens,
+        "num_accepted_tokens": num_accepted_tokens,
+        "acceptance_rate": num_accepted_tokens / (num_sequence_rounds * num_speculative_tokens),
+        "mean_tokens_per_round": (num_accepted_tokens + num_sequence_rounds) / num_sequence_rounds,
+    }
+    return stats, accepted_per_row, rounds_per_row
+
+
+def test_static_speculative_decoding_matches_greedy_generation():
+    num_speculative_tokens = 3
+    max_new_tokens = 12
+    input_ids = torch.tensor([[5, 6, 7, 8], [20, 21, 22, 23]])
+    target = tiny_llama()
+    # The target tokens the last round may verify past `max_new_tokens` are needed to replay it
+    reference = generate_greedy(target, input_ids, max_new_tokens + num_speculative_tokens)
+
+    # Swapping two rows of the LM head makes the draft model disagree with the target model only on these two tokens:
+    # one the first sequence generates but not the second, and one neither generates
+    first_only = set(reference[0, 1:max_new_tokens].tolist()) - set(reference[1].tolist())
+    unused = set(range(target.config.vocab_size)) - set(reference.flatten().tolist())
+    assert first_only and unused
+    rejected_tokens = (min(first_only), min(unused))
+    draft = copy.deepcopy(target)
+    with torch.no_grad():
+        draft.lm_head.weight[list(rejected_tokens)] = draft.lm_head.weight[list(reversed(rejected_tokens))].clone()
+
+    output = generate_greedy(
+        target,
+        input_ids,
+        max_new_tokens,
+        assistant_model=draft,
+        static_speculative_decoding=True,
+        num_assistant_tokens=num_speculative_tokens,
+    )
+
+    assert torch.equal(output, reference[:, :max_new_tokens])
+    expected_stats, accepted_per_row, rounds_per_row = simulate_greedy_speculative_decoding(
+        reference, rejected_tokens, num_speculative_tokens, max_new_tokens
+    )
+    # The first sequence rejects some draft tokens while the second one accepts all of them
+    assert accepted_per_row[0] < num_speculative_tokens * rounds_per_row[0]
+    assert accepted_per_row[1] == num_speculative_tokens * rounds_per_row[1]
+    assert target.speculative_decoding_stats.to_dict() == expected_stats
@@ -0,0 +1,136 @@
+# coding=utf-8
+# Copyright 2025 HuggingFace Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+import torch
+
+from optimum.habana.transformers.generation.streamers import (
+    GaudiTextIteratorStreamer,
+    GaudiTokenIteratorStreamer,
+    IncrementalDetokenizer,
+)
+
+
+EOS = 0
+PAD = 1
+
+
+class ByteTokenizer:
+    """Decodes like a SentencePiece tokenizer: "▁" is a space, except at the start of the text."""
+
+    pad_token_id = PAD
+    eos_token_id = EOS
+
+    def __init__(self):
+        self.vocab = [b"</s>", b"<pad>", "▁Hello".encode(), b",", "▁w".encode(), b"orld", "▁caf".encode()]
+        # "é" is split in two byte tokens
+        self.vocab += [bytes([b]) for b in "é".encode()] + [b"!"]
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        special = {EOS, PAD} if skip_special_tokens else set()
+        data = b"".join(self.vocab[i] for i in token_ids if i not in special)
+        return data.decode("utf-8", errors="replace").replace("▁", " ").removeprefix(" ")
+
+
+def collect(streamer, steps):
+    for step in steps:
+        streamer.put(torch.tensor(step))
+    streamer.end()
+    return list(streamer)
+
+
+def test_incremental_detokenizer_matches_full_decode():
+    tokenizer = ByteTokenizer()
+    token_ids = [2, 3, 4, 5, 6, 7, 8, 9, 2]
+    detokenizer = IncrementalDetokenizer(tokenizer, num_context_tokens=2)
+
+    texts = [detokenizer.add_tokens([token_id]) for token_id in token_ids]
+
+    assert "".join(texts) + detokenizer.flush() == tokenizer.decode(token_ids)
+    # The first byte of "é" is held back
+    assert texts[5] == ""
+    assert texts[6] == "é"
+
+
+def test_incremental_detokenizer_uses_the_prompt_as_context():
+    tokenizer = ByteTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer, prompt_ids=[2, 3])
+
+    # Not the start of the text, the space is kept
+    assert detokenizer.add_tokens([4, 5]) == " world"
+
+
+@pytest.mark.parametrize("sync_interval", [1, 2, 5])
+def test_token_streamer_batches_host_copies(monkeypatch, sync_interval):
+    num_copies = []
+    cat = torch.cat
+
+    def counting_cat(*args, **kwargs):
+        num_copies.append(1)
+        return cat(*args, **kwargs)
+
+    monkeypatch.setattr(torch, "cat", counting_cat)
+    streamer = GaudiTokenIteratorStreamer(eos_token_id=EOS, sync_interval=sync_interval)
+    prompt = [[2, 3], [PAD, 2]]
+    steps = [[4, 6], [5, 7], [EOS, 8], [PAD, 9], [PAD, 10]]
+
+    outputs = collect(streamer, [prompt] + steps)
+
+    # The first step is sent right away, then every `sync_interval` steps
+    assert len(num_copies) == len(outputs) == 1 + -(-(len(steps) - 1) // sync_interval)
+    assert outputs[0] == [[4], [6]]
+    tokens = [sum((output[i] for output in outputs), []) for i in range(2)]
+    assert tokens == [[4, 5, EOS], [6, 7, 8, 9, 10]]
+
+
+def test_token_streamer_multiple_tokens_per_step_and_prompt():
+    streamer = GaudiTokenIteratorStreamer(skip_prompt=False, eos_token_id=[EOS], sync_interval=1)
+
+    outputs = collect(streamer, [[[2, 3]], [[4, EOS, 5]], [[6]]])
+
+    assert outputs == [[[2, 3]], [[4, EOS]], [[]]]
+
+
+def test_token_streamer_drops_masked_tokens():
+    # Without EOS, a sequence stopped by another stopping criterion only produces padding
+    streamer = GaudiTokenIteratorStreamer(sync_interval=2)
+    streamer.put(torch.tensor([[2], [3]]))
+    streamer.put(torch.tensor([4, 6]), unfinished_sequences=torch.tensor([1, 1]))
+    streamer.put(torch.tensor([PAD, 7]), unfinished_sequences=torch.tensor([0, 1]))
+    # A mask per token, e.g. the accepted tokens of a speculative decoding round
+    streamer.put(torch.tensor([[PAD, PAD], [8, PAD]]), unfinished_sequences=torch.tensor([[0, 0], [1, 0]]))
+    streamer.end()
+
+    outputs = list(streamer)
+
+    assert outputs == [[[4], [6]], [[], [7, 8]]]
+
+
+def test_text_streamer_async_iteration():
+    tokenizer = ByteTokenizer()
+    streamer = GaudiTextIteratorStreamer(tokenizer, sync_interval=2, skip_special_tokens=True)
+    prompt = [[PAD, 2, 3]]
+    steps = [[4], [5], [6], [7], [8], [9], [EOS], [PAD]]
+    for step in [prompt] + steps:
+        streamer.put(torch.tensor(step))
+    streamer.end()
+
+    async def consume():
+        return [texts async for texts in streamer]
+
+    texts = asyncio.run(consume())
+    assert "".join(t[0] for t in texts) == " world café!"
@@ -20,6 +20,7 @@ import random
 import re
 import subprocess
 import tempfile
+import threading
 import unittest
 from functools import partial
 from itertools import product
@@ -88,6 +89,7 @@ from transformers.utils.import_utils import check_torch_load_is_safe
 
 from optimum.habana import GaudiConfig, GaudiTrainingArguments
 from optimum.habana.accelerate import GaudiAccelerator
+from optimum.habana.transformers.trainer_utils import AsyncCheckpointWriter
 from optimum.habana.utils import set_seed
 
 
@@ -692,6 +694,26 @@ class GaudiTrainerIntegrationPrerunTest(TestCasePlus, GaudiTrainerIntegrationCom
             trainer.train()
             self.check_trained_model(trainer.model, alternate_seed=True)
 
+    def test_dataloader_prefetch_batches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Prefetching does not change the training, including the last steps of gradient accumulation
+            trainer = get_regression_trainer(
+                output_dir=tmpdir, learning_rate=0.1, dataloader_prefetch_batches=2, logging_steps=5
+            )
+            trainer.train()
+            self.check_trained_model(trainer.model)
+            self.assertTrue(all("data_wait_time" in log for log in trainer.state.log_history if "loss" in log))
+
+            trainer = get_regression_trainer(
+                output_dir=tmpdir, learning_rate=0.1, gradient_accumulation_steps=3, dataloader_prefetch_batches=3
+            )
+            trainer.train()
+            a, b = trainer.model.a, trainer.model.b
+            trainer = get_regression_trainer(output_dir=tmpdir, learning_rate=0.1, gradient_accumulation_steps=3)
+            trainer.train()
+            torch.testing.assert_close(a, trainer.model.a)
+            torch.testing.assert_close(b, trainer.model.b)
+
     def test_trainer_with_datasets(self):
         import datasets
 
@@ -1556,6 +1578,48 @@ class GaudiTrainerIntegrationTest(TestCasePlus, GaudiTrainerIntegrationCommon):
         new_eval_dataset = RegressionDataset(length=128)
         self.assertEqual(len(trainer.get_eval_dataloader(new_eval_dataset)), 128 // (32))
 
+    def test_train_dataloader_with_length_buckets(self):
+        def pad_to_longest(features):
+            max_length = max(len(feature["input_ids"]) for feature in features)
+            return {
+                name: torch.tensor(
+                    [feature[name] + [value] * (max_length - len(feature[name])) for feature in features]
+                )
+                for name, value in (("input_ids", 0), ("labels", -100))
+            }
+
+        train_dataset = [{"input_ids": [1] * n, "labels": [1] * n} for n in range(1, 101)]
+        config = GPT2Config(vocab_size=100, n_positions=128, n_embd=32, n_layer=3, n_head=4)
+        args = GaudiTrainingArguments(
+            self.get_auto_remove_tmp_dir(),
+            use_habana=True,
+            use_lazy_mode=True,
+            per_device_train_batch_size=8,
+            num_length_buckets=4,
+            report_to="none",
+        )
+        trainer = GaudiTrainer(
+            GPT2LMHeadModel(config),
+            get_gaudi_config(),
+            args,
+            train_dataset=train_dataset,
+            data_collator=pad_to_longest,
+        )
+
+        # The buckets hold 26, 25, 25 and 24 samples
+        train_dataloader = trainer.get_train_dataloader()
+        self.assertEqual(len(train_dataloader), 4 + 4 + 4 + 3)
+        seen_lengths = set()
+        for batch in train_dataloader:
+            self.assertEqual(batch["input_ids"].shape[0], 8)
+            self.assertIn(batch["input_ids"].shape[1], [26, 51, 76, 100])
+            self.assertEqual(batch["labels"].shape, batch["input_ids"].shape)
+            self.assertTrue(torch.equal(batch["labels"] == -100, batch["input_ids"] == 0))
+            seen_lengths.update(batch["input_ids"].sum(dim=1).tolist())
+        self.assertEqual(seen_lengths, set(range(1, 101)))
+
+        trainer.train()
+
     # tests that we do not require dataloader to have a .dataset attribute
     def test_dataloader_without_dataset(self):
         train_dataset = RegressionDataset(length=128)
@@ -2027,6 +2091,52 @@ class GaudiTrainerIntegrationTest(TestCasePlus, GaudiTrainerIntegrationCommon):
         trainer.train()
         self.check_saved_checkpoints(tmp_dir, 5, int(self.n_epochs * 64 / self.batch_size), False)
 
+    def test_async_save_checkpoints(self):
+        tmp_dir = self.get_auto_remove_tmp_dir()
+        kwargs = {"output_dir": tmp_dir, "train_len": 128, "save_steps": 5, "learning_rate": 0.1}
+        trainer = get_regression_trainer(async_save=True, **kwargs)
+        trainer.gaudi_config.use_fused_clip_norm = False
+        trainer.train()
+        (a, b) = trainer.model.a.item(), trainer.model.b.item()
+        self.check_saved_checkpoints(tmp_dir, 5, int(self.n_epochs * 128 / self.batch_size))
+        self.assertFalse([name for name in os.listdir(tmp_dir) if name.startswith("tmp-")])
+
+        # Checkpoints written in the background are the same as the synchronous ones
+        trainer = get_regression_trainer(**kwargs)
+        trainer.gaudi_config.use_fused_clip_norm = False
+        trainer.train(resume_from_checkpoint=os.path.join(tmp_dir, "checkpoint-15"))
+        self.assertEqual(a, trainer.model.a.item())
+        self.assertEqual(b, trainer.model.b.item())
+
+        # Older checkpoints are rotated once the new ones are written
+        tmp_dir = self.get_auto_remove_tmp_dir()
+        trainer = get_regression_trainer(output_dir=tmp_dir, save_steps=5, save_total_limit=2, async_save=True)
+        trainer.train()
+        self.assertEqual(sorted(os.listdir(tmp_dir)), ["checkpoint-20", "checkpoint-24"])
+
+    def test_async_checkpoint_writer_replaces_checkpoints(self):
+        tmp_dir = self.get_auto_remove_tmp_dir()
+        output_dir = os.path.join(tmp_dir, "checkpoint-5")
+        writer = AsyncCheckpointWriter()
+        done_threads = []
+
+        def write(content):
+            def write_fn(staging_dir):
+                with open(os.path.join(staging_dir, "state.txt"), "w") as f:
+                    f.write(content)
+
+            return write_fn
+
+        for content in ["first", "second"]:
+            writer.submit(write(content), output_dir, on_done=lambda: done_threads.append(threading.current_thread()))
+            writer.shutdown()
+            with open(os.path.join(output_dir, "state.txt")) as f:
+                self.assertEqual(f.read(), content)
+
+        # The previous checkpoint is replaced and `on_done` runs on the calling thread
+        self.assertEqual(os.listdir(tmp_dir), ["checkpoint-5"])
+        self.assertEqual(done_threads, [threading.current_thread()] * 2)
+
     @require_safetensors
     def test_safe_checkpoints(self):
         for save_safetensors in [True, False]: